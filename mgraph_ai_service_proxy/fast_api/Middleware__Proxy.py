@@ -0,0 +1,46 @@
+import time
+from starlette.datastructures                                           import Headers
+from starlette.responses                                                import Response
+from starlette.types                                                    import ASGIApp, Message, Receive, Scope, Send
+from osbot_utils.type_safe.primitives.safe_str.identifiers.Random_Guid  import Random_Guid
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy               import Service__Proxy
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Limits       import Proxy_Error__Content_Too_Large
+
+HEADER__REQUEST_ID = b'x-request-id'                                            # sent back to the client, with the id the proxy request was logged / traced with
+
+
+class Middleware__Proxy:                                                        # Pure ASGI middleware: timing, request ids and the early body size check (receive and send are used as they are, so streamed responses go straight through)
+    def __init__(self, app           : ASGIApp              ,
+                       proxy_service : Service__Proxy = None
+                 ):
+        self.app           = app
+        self.proxy_service = proxy_service or Service__Proxy().setup()
+
+    async def __call__(self, scope   : Scope  ,
+                             receive : Receive,
+                             send    : Send
+                        ) -> None:
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        request_id           = Random_Guid()
+        state                = scope.setdefault('state', {})                    # (what request.state reads)
+        state['started'   ]  = time.perf_counter()                              # end-to-end latency starts here
+        state['request_id']  = request_id
+        try:
+            self.proxy_service.check_request_size(Headers(scope=scope))         # reject before anything reads the body (which the routes only do when they need it)
+        except Proxy_Error__Content_Too_Large as error:
+            response = Response(content=str(error), status_code=error.status_code)
+            return await response(scope, receive, self.with_request_id(send, request_id))
+
+        await self.app(scope, receive, self.with_request_id(send, request_id))
+
+    def with_request_id(self, send       : Send       ,                        # send, adding the request id to the response headers
+                              request_id : Random_Guid
+                         ) -> Send:
+        request_id_header = (HEADER__REQUEST_ID, str(request_id).encode('latin-1'))
+        async def send_with_request_id(message: Message) -> None:
+            if message['type'] == 'http.response.start':
+                message['headers'] = [*message.get('headers', []), request_id_header]
+            await send(message)
+        return send_with_request_id
@@ -1,19 +1,30 @@
+import time
+import types
 from typing                                                             import Dict
+from urllib.parse                                                       import urlsplit
 from fastapi import Request, Response, Body
+from starlette.background                                               import BackgroundTask
+from starlette.responses                                                import StreamingResponse
 from osbot_fast_api.api.routes.Fast_API__Routes                         import Fast_API__Routes
 from osbot_utils.type_safe.primitives.safe_str.identifiers.Random_Guid  import Random_Guid
 from osbot_utils.type_safe.primitives.safe_str.web.Safe_Str__IP_Address import Safe_Str__IP_Address
-from mgraph_ai_service_proxy.schemas.Schema__Proxy__Request             import Schema__Proxy__Request
-from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Host          import Safe_Str__Http__Host
-from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Method        import Safe_Str__Http__Method
+from mgraph_ai_service_proxy.schemas.Enum__Proxy__Engine                import Enum__Proxy__Engine
+from mgraph_ai_service_proxy.schemas.Proxy__Request                     import Proxy__Request
 from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Path          import Safe_Str__Http__Path
 from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Query_String  import Safe_Str__Http__Query_String
 from mgraph_ai_service_proxy.service.proxy.Service__Proxy               import Service__Proxy
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Breaker      import Proxy_Error__Circuit_Open
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Intern       import safe_str_cache
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Limits       import Proxy_Error__Content_Too_Large
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Metrics      import OPENMETRICS__CONTENT_TYPE
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Upload       import BODY_METHODS
 
 TAG__ROUTES_PROXY = '/'
 
 ROUTES_PATHS__PROXY   = [ '/{path:path}'  ,
-                          '/proxy/stats'  ]
+                          '/proxy/stats'  ,
+                          '/proxy/metrics',
+                          '/proxy/pools'  ]
 
 class Routes__Proxy(Fast_API__Routes):                                         # FastAPI routes for proxy functionality
     tag            : str           = TAG__ROUTES_PROXY
@@ -50,33 +61,177 @@ class Routes__Proxy(Fast_API__Routes):                                         #
                 pass
         return None
 
-    def proxy_request(self, request: Request                ,       # Main proxy endpoint
+    def build_proxy_request(self, request     : Request      ,                  # Convert the FastAPI request into a Proxy__Request (validated here, once: see Proxy__Request.schema for the Type_Safe version)
+                                  path        : str          ,
+                                  body        : bytes        ,
+                                  body_stream = None
+                             ) -> Proxy__Request:
+        query_string = request.scope.get('query_string')
+        return Proxy__Request( method       = safe_str_cache.method(request.method)                                            ,
+                               path         = Safe_Str__Http__Path (path)                                                      ,     # (not interned: every URL is different)
+                               host         = safe_str_cache.host  (request.headers.get('host', ''))                           ,
+                               headers      = self.proxy_service.filter_service.filter_incoming_headers(request.headers.raw)   ,
+                               body         = body                                                                             ,
+                               body_stream  = body_stream                                                                      ,
+                               query_string = Safe_Str__Http__Query_String(query_string.decode('latin-1')) if query_string else '',
+                               client_ip    = self.get_client_ip(request)                                                      ,
+                               use_https    = request.scope.get('scheme') == 'https'                                           ,
+                               request_id   = getattr(request.state, 'request_id', None) or Random_Guid()                      )     # (set by Middleware__Proxy)
+
+    def proxy_request(self, request: Request                ,       # Main proxy endpoint (sync engine, runs on the threadpool)
                             path   : str                    ,       # Path parameter from URL
                        ) -> Response:
-        client_ip = self.get_client_ip(request)
-
-        body = getattr(request.state, 'body', None)         # get body from middleware
-
-        # Build proxy request from FastAPI request          # todo: there is too much happening below, refact this to an helper method that converts Request into Schema__Proxy__Request
-        proxy_request = Schema__Proxy__Request( method       = Safe_Str__Http__Method(request.method)                   ,
-                                                path         = Safe_Str__Http__Path  (path)                             ,
-                                                host         = Safe_Str__Http__Host  (request.headers.get('host', ''))  ,
-                                                headers      = dict(request.headers)                                    ,
-                                                body         = body      ,# request.body() if request.method in ["POST", "PUT", "PATCH"] else None,
-                                                query_string = Safe_Str__Http__Query_String(str(request.url.query)) if request.url.query else None,
-                                                client_ip    = client_ip                                ,
-                                                use_https    = request.url.scheme == 'https'            ,
-                                                request_id   = Random_Guid()
-        )
-
-        proxy_response = self.proxy_service.execute_request(proxy_request)      # Execute proxy request
-
-        return Response(content     = proxy_response.content      ,             # Return FastAPI response
-                        status_code = proxy_response.status_code  ,
-                        headers     = proxy_response.headers      )
-
-    def proxy__stats(self) -> Dict[str, int]:                                   # Get proxy statistics
-        return self.proxy_service.stats_service.get_stats()
+        started       = self.started(request)                                   # end-to-end latency
+        body          = None
+        body_stream   = None
+        stats         = self.proxy_service.stats_service
+        stats.record_in_flight(1)                                               # (until record_total)
+        try:
+            if self.stream_upload(request):                                     # pipe the body from the client as upstream asks for it
+                self.proxy_service.check_request_size(request.headers)
+                body_stream = stats.count_bytes(self.proxy_service.limit_upload(self.proxy_service.upload_service.stream_body(request)), 'total_bytes_in')
+            elif self.buffer_upload(request):                                   # read only now, and only when the body is forwarded (waiting here while the event loop reads it)
+                self.proxy_service.check_request_size(request.headers)
+                body = self.proxy_service.read_body(request.stream()) or None
+            if body:
+                stats.record_bytes('total_bytes_in', len(body))
+            proxy_request = self.build_proxy_request(request, path, body, body_stream)
+
+            if self.proxy_service.config.stream_responses:                      # Stream upstream body straight to the client
+                return self.proxy_request__stream(proxy_request, request, started)
+
+            proxy_response = self.proxy_service.execute_request(proxy_request)  # Execute proxy request
+        except Proxy_Error__Content_Too_Large as error:                         # 413 for the client's body, 502 for upstream's
+            return self.record_total(request, started, self.content_too_large(error))
+        except Proxy_Error__Circuit_Open as error:                              # 503 straight away: upstream is failing
+            return self.record_total(request, started, self.circuit_open(error))
+        except Exception:
+            stats.record_in_flight(-1)
+            raise
+
+        return self.record_total(request, started, Response(content     = proxy_response.content      ,     # Return FastAPI response
+                                                            status_code = proxy_response.status_code  ,
+                                                            headers     = proxy_response.headers      ))
+
+    async def proxy_request__async(self, request: Request   ,       # Main proxy endpoint (asyncio engine, runs on the event loop)
+                                         path   : str       ,       # Path parameter from URL
+                                    ) -> Response:
+        started       = self.started(request)
+        body          = None
+        body_stream   = None
+        stats         = self.proxy_service.stats_service
+        stats.record_in_flight(1)
+        try:
+            if self.stream_upload(request):
+                self.proxy_service.check_request_size(request.headers)
+                body_stream = stats.count_bytes__async(self.proxy_service.limit_upload__async(request.stream()), 'total_bytes_in')  # httpx pulls from the client as it sends upstream
+            elif self.buffer_upload(request):
+                self.proxy_service.check_request_size(request.headers)
+                body = await self.proxy_service.read_body__async(request.stream()) or None
+            if body:
+                stats.record_bytes('total_bytes_in', len(body))
+            proxy_request = self.build_proxy_request(request, path, body, body_stream)
+
+            if self.proxy_service.config.stream_responses:
+                proxy_response = await self.proxy_service.execute_request__async_stream(proxy_request)
+                content        = self.stream_body__async(proxy_response.content, request, started)
+                return StreamingResponse(content     = content                    ,
+                                         status_code = proxy_response.status_code ,
+                                         headers     = proxy_response.headers     ,
+                                         background  = BackgroundTask(content.aclose))             # (the client went away before the end)
+
+            proxy_response = await self.proxy_service.execute_request__async(proxy_request)
+        except Proxy_Error__Content_Too_Large as error:
+            return self.record_total(request, started, self.content_too_large(error))
+        except Proxy_Error__Circuit_Open as error:
+            return self.record_total(request, started, self.circuit_open(error))
+        except Exception:
+            stats.record_in_flight(-1)
+            raise
+
+        return self.record_total(request, started, Response(content     = proxy_response.content      ,
+                                                            status_code = proxy_response.status_code  ,
+                                                            headers     = proxy_response.headers      ))
+
+    def content_too_large(self, error: Proxy_Error__Content_Too_Large) -> Response:    # Body over config.max_content_size (mid-stream responses can't be turned into this, they are aborted instead)
+        return Response(content     = str(error)        ,
+                        status_code = error.status_code )
+
+    def circuit_open(self, error: Proxy_Error__Circuit_Open) -> Response:       # Target host's circuit breaker is open (Retry-After: when it lets a probe through)
+        return Response(content     = str(error)                              ,
+                        status_code = error.status_code                       ,
+                        headers     = {'Retry-After': str(error.retry_after)} )
+
+    def started(self, request: Request) -> float:                               # When the request arrived (Middleware__Proxy's time, when it is there)
+        return getattr(request.state, 'started', None) or time.perf_counter()
+
+    def buffer_upload(self, request: Request) -> bool:                          # Should this request's body be read into memory before proxying?
+        return self.proxy_service.upload_service.buffer_body(self.proxy_service.config, request.method, request.headers)
+
+    def stream_upload(self, request: Request) -> bool:                          # Should this request's body be streamed to upstream (instead of buffered)?
+        config = self.proxy_service.config
+        if config.stream_uploads is False or request.method not in BODY_METHODS:
+            return False
+        return self.proxy_service.upload_service.buffer_body(config, request.method, request.headers) is False
+
+    def proxy_request__stream(self, proxy_request : Proxy__Request         ,
+                                    request       : Request                ,
+                                    started       : float                                       # when the request arrived
+                               ) -> StreamingResponse:
+        proxy_response = self.proxy_service.execute_request__stream(proxy_request)
+        content        = self.stream_body(proxy_response.content, request, started)
+        return StreamingResponse(content     = content                    ,
+                                 status_code = proxy_response.status_code ,
+                                 headers     = proxy_response.headers     ,
+                                 background  = BackgroundTask(content.close))                       # (the client went away before the end)
+
+    def upstream_host(self, request: Request) -> str:                          # Host the end-to-end latency is counted under: the upstream's, like the other latencies (in full-URL mode, the one in the path)
+        path = request.path_params.get('path', '')
+        if path.startswith('http://') or path.startswith('https://'):
+            return urlsplit(path).netloc
+        return request.headers.get('host', '')
+
+    def record_total(self, request  : Request  ,                               # Record the end-to-end latency (and bytes sent) of a response that is ready to send, which ends the request
+                           started  : float    ,
+                           response : Response                                  # (None for streamed responses, counted as they are sent)
+                      ) -> Response:
+        stats = self.proxy_service.stats_service
+        stats.record_latency('total', self.upstream_host(request), time.perf_counter() - started)
+        stats.record_in_flight(-1)
+        if response is not None:
+            stats.record_bytes('total_bytes_out', len(response.body))
+        return response
+
+    def stream_body(self, chunks  : types.GeneratorType,                       # Upstream's body as it is sent to the client, then (also when it is cut short: upstream error, response limit, client gone) release upstream and record the end-to-end latency
+                          request : Request            ,
+                          started : float
+                     ) -> types.GeneratorType:
+        try:
+            yield from self.proxy_service.stats_service.count_bytes(chunks, 'total_bytes_out')
+        finally:                                                                # (Starlette skips the background task when the body raises)
+            chunks.close()
+            self.record_total(request, started, None)
+
+    async def stream_body__async(self, chunks  : types.AsyncGeneratorType,     # Async version of stream_body (asyncio engine)
+                                       request : Request                 ,
+                                       started : float
+                                  ) -> types.AsyncGeneratorType:
+        try:
+            async for chunk in self.proxy_service.stats_service.count_bytes__async(chunks, 'total_bytes_out'):
+                yield chunk
+        finally:
+            await chunks.aclose()
+            self.record_total(request, started, None)
+
+    def proxy__stats(self) -> Dict[str, object]:                                # Get proxy statistics (plus each upstream host's circuit breaker)
+        return self.proxy_service.get_stats()
+
+    def proxy__metrics(self) -> Response:                                       # Get proxy statistics in the OpenMetrics text format (for Prometheus scrapes)
+        return Response(content    = self.proxy_service.get_metrics(),
+                        media_type = OPENMETRICS__CONTENT_TYPE        )
+
+    def proxy__pools(self) -> Dict[str, Dict[str, int]]:                        # Get each upstream connection pool's usage (idle, active, waiting, created, discarded)
+        return self.proxy_service.pools_service.get_pools()
 
 
 
@@ -90,5 +245,11 @@ class Routes__Proxy(Fast_API__Routes):                                         #
         return self
 
     def setup_routes(self):
-        self.add_route_any(self.proxy_request, "/{path:path}")                # Catch-all route for proxy
-        self.add_route_get(self.proxy__stats  )                                # Stats endpoint
\ No newline at end of file
+        self.add_route_get(self.proxy__stats  )                                # Stats endpoint
+        self.add_route_get(self.proxy__metrics)                                # Metrics endpoint (before the catch-all, which would otherwise proxy it)
+        self.add_route_get(self.proxy__pools  )                                # Connection pools endpoint
+        if self.proxy_service.config.engine == Enum__Proxy__Engine.asyncio:
+            self.proxy_service.check_async_engine()                           # (fail at startup, not on every request)
+            self.add_route_any(self.proxy_request__async, "/{path:path}")     # Catch-all route for proxy (on the event loop)
+        else:
+            self.add_route_any(self.proxy_request       , "/{path:path}")     # Catch-all route for proxy (on the threadpool)
\ No newline at end of file
@@ -0,0 +1,8 @@
+from enum import Enum
+
+
+class Enum__Proxy__Balance__Policy(Enum):                                    # How an upstream group picks the backend of each call
+    round_robin       : str = 'round_robin'                                  # each backend in turn
+    least_outstanding : str = 'least_outstanding'                            # the backend with the fewest calls in flight
+    ewma              : str = 'ewma'                                         # power of two choices: the better of two random backends, by latency EWMA x calls in flight
+    consistent_hash   : str = 'consistent_hash'                              # the same key always goes to the same backend (while it is healthy), e.g. for cache locality
@@ -0,0 +1,7 @@
+from enum import Enum
+
+
+class Enum__Proxy__Breaker__State(Enum):                                     # State of an upstream host's circuit breaker
+    closed    : str = 'closed'                                               # requests go upstream (failures are counted)
+    open      : str = 'open'                                                 # requests fail fast with a 503, until breaker_open_time has passed
+    half_open : str = 'half_open'                                            # a single probe request goes upstream: its outcome closes or re-opens the breaker
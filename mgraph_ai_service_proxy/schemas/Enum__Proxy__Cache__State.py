@@ -0,0 +1,8 @@
+from enum import Enum
+
+
+class Enum__Proxy__Cache__State(Enum):                                       # What a cache lookup found
+    miss    : str = 'miss'                                                   # nothing stored for this request (or nothing usable any more)
+    fresh   : str = 'fresh'                                                  # served as it is
+    stale   : str = 'stale'                                                  # served as it is, and refreshed in the background (stale-while-revalidate)
+    expired : str = 'expired'                                                # upstream must be asked (conditionally, when it has validators); still served if upstream fails (stale-if-error)
@@ -0,0 +1,6 @@
+from enum import Enum
+
+
+class Enum__Proxy__Engine(Enum):                                             # Engine used to execute upstream requests
+    sync    : str = 'sync'                                                   # requests.Session per thread (route runs on the threadpool)
+    asyncio : str = 'asyncio'                                                # httpx.AsyncClient per event loop (route runs on the event loop)
@@ -0,0 +1,38 @@
+from typing                                                                     import Dict
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Request                     import Schema__Proxy__Request
+
+PROXY_REQUEST__FIELDS = ('method', 'path', 'host', 'headers', 'body', 'body_stream', 'query_string', 'client_ip', 'use_https', 'request_id')
+
+
+class Proxy__Request:                                                                   # Hot-path version of Schema__Proxy__Request: plain attributes, no Type_Safe checks (values are validated once, at the edge)
+    __slots__ = PROXY_REQUEST__FIELDS                                                   # (same attributes as Schema__Proxy__Request, so the services take either)
+
+    def __init__(self, method       = None ,                                            # Safe_Str__Http__Method
+                       path         = ''   ,                                            # Safe_Str__Http__Path
+                       host         = ''   ,                                            # Safe_Str__Http__Host
+                       headers      = None ,                                            # Dict[str, str], sanitised (see Service__Proxy__Filter.filter_headers)
+                       body         = None ,                                            # bytes
+                       body_stream  = None ,                                            # (async) generator with the client's body
+                       query_string = ''   ,                                            # Safe_Str__Http__Query_String
+                       client_ip    = ''   ,                                            # Safe_Str__IP_Address
+                       use_https    = True ,
+                       request_id   = None                                              # Random_Guid
+                 ):
+        self.method       = method
+        self.path         = path
+        self.host         = host
+        self.headers      = {} if headers is None else headers
+        self.body         = body
+        self.body_stream  = body_stream
+        self.query_string = query_string
+        self.client_ip    = client_ip
+        self.use_https    = use_https
+        self.request_id   = request_id
+
+    @classmethod
+    def from_schema(cls, schema: Schema__Proxy__Request) -> 'Proxy__Request':          # Hot-path copy of a (validated) schema
+        return cls(**{name: getattr(schema, name) for name in PROXY_REQUEST__FIELDS if name != 'headers'},
+                   headers = {str(name): str(value) for name, value in schema.headers.items()})
+
+    def schema(self) -> Schema__Proxy__Request:                                         # Type_Safe version (for debug endpoints and tests: it is not built on the hot path)
+        return Schema__Proxy__Request(**{name: getattr(self, name) for name in PROXY_REQUEST__FIELDS})
@@ -0,0 +1,20 @@
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Response                    import Schema__Proxy__Response
+
+PROXY_RESPONSE__FIELDS = ('status_code', 'headers', 'content', 'target_url')
+
+
+class Proxy__Response:                                                                  # Hot-path version of Schema__Proxy__Response: plain attributes, no Type_Safe checks (headers were sanitised by the filter)
+    __slots__ = PROXY_RESPONSE__FIELDS
+
+    def __init__(self, status_code = 0    ,                                             # HTTP status code
+                       headers     = None ,                                             # Dict[str, str], sanitised (see Service__Proxy__Filter.filter_headers)
+                       content     = b''  ,                                             # Response content
+                       target_url  = None                                               # Safe_Str__Url
+                 ):
+        self.status_code = status_code
+        self.headers     = {} if headers is None else headers
+        self.content     = content
+        self.target_url  = target_url
+
+    def schema(self) -> Schema__Proxy__Response:                                        # Type_Safe version (for debug endpoints and tests: it is not built on the hot path)
+        return Schema__Proxy__Response(**{name: getattr(self, name) for name in PROXY_RESPONSE__FIELDS})
@@ -0,0 +1,19 @@
+from mgraph_ai_service_proxy.schemas.Proxy__Response                            import PROXY_RESPONSE__FIELDS
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Response__Stream            import Schema__Proxy__Response__Stream
+
+
+class Proxy__Response__Stream:                                                          # Hot-path version of Schema__Proxy__Response__Stream: plain attributes, no Type_Safe checks
+    __slots__ = PROXY_RESPONSE__FIELDS
+
+    def __init__(self, status_code = 0    ,                                             # HTTP status code
+                       headers     = None ,                                             # Dict[str, str], sanitised (see Service__Proxy__Filter.filter_headers)
+                       content     = None ,                                             # (async) generator yielding the body in chunks (closing it releases the upstream connection)
+                       target_url  = None                                               # Safe_Str__Url
+                 ):
+        self.status_code = status_code
+        self.headers     = {} if headers is None else headers
+        self.content     = content
+        self.target_url  = target_url
+
+    def schema(self) -> Schema__Proxy__Response__Stream:                                # Type_Safe version (for debug endpoints and tests: it is not built on the hot path)
+        return Schema__Proxy__Response__Stream(**{name: getattr(self, name) for name in PROXY_RESPONSE__FIELDS})
@@ -0,0 +1,17 @@
+from osbot_utils.type_safe.Type_Safe                                    import Type_Safe
+
+
+class Schema__Proxy__Cache__Entry(Type_Safe):                                       # Upstream response held by the proxy cache (plain types, since hits read it on the hot path)
+    key                    : tuple                                                  # (method + target url, values of the request headers named in Vary)
+    status_code            : int                                                    # HTTP status code
+    headers                : dict                                                   # Response headers, as sent to the client
+    content                : bytes                                                  # Response body, as sent to the client
+    stored_at              : float                                                  # When it was stored, or last revalidated (time.time())
+    initial_age            : float                                                  # Age it already had when it arrived (Age header, or time since its Date)
+    lifetime               : float                                                  # Freshness lifetime in seconds (s-maxage, max-age or Expires; 0 when it must always be revalidated)
+    size                   : int                                                    # Bytes counted against config.cache_max_size
+    etag                   : str                                                    # Validators (ETag / Last-Modified), used to revalidate it with upstream once stale
+    last_modified          : str
+    stale_while_revalidate : float                                                  # Seconds past its lifetime it may still be served while it is refreshed in the background
+    stale_if_error         : float                                                  # Seconds past its lifetime it may still be served when upstream fails
+    digest                 : str                                                    # sha256 of the body when it is held by the disk tier (content is then empty)
@@ -1,15 +1,52 @@
-from osbot_utils.type_safe.Type_Safe                        import Type_Safe
-from osbot_utils.type_safe.primitives.safe_float.Safe_Float import Safe_Float
-from osbot_utils.type_safe.primitives.safe_uint.Safe_UInt   import Safe_UInt
+from typing                                                          import Dict
+from osbot_utils.type_safe.Type_Safe                                 import Type_Safe
+from osbot_utils.type_safe.primitives.safe_float.Safe_Float          import Safe_Float
+from osbot_utils.type_safe.primitives.safe_uint.Safe_UInt            import Safe_UInt
+from mgraph_ai_service_proxy.schemas.Enum__Proxy__Engine             import Enum__Proxy__Engine
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Upstream__Group  import Schema__Proxy__Upstream__Group
 
 
-class Schema__Proxy__Config(Type_Safe):                                      # Configuration for proxy service
-    pool_connections : Safe_UInt   = Safe_UInt (10 )                         # Connection pool size
-    pool_max_size    : Safe_UInt   = Safe_UInt (100)                         # Max pool size
-    retry_count      : Safe_UInt   = Safe_UInt (3  )                         # Number of retries
-    retry_backoff    : Safe_Float  = Safe_Float(0.3)                         # Backoff factor for retries
-    connect_timeout  : Safe_UInt   = Safe_UInt (5  )                         # Connection timeout in seconds
-    read_timeout     : Safe_UInt   = Safe_UInt (25 )                         # Read timeout in seconds
-    verify_ssl       : bool        = False                                   # SSL verification (disable for dev)
-    max_content_size : Safe_UInt   = Safe_UInt(104857600)                    # Max content size (100MB)
-
+class Schema__Proxy__Config(Type_Safe):                                                          # Configuration for proxy service
+    pool_connections    : Safe_UInt           = Safe_UInt (10 )                                  # Connection pool size
+    pool_max_size       : Safe_UInt           = Safe_UInt (100)                                  # Max pool size
+    retry_count         : Safe_UInt           = Safe_UInt (3  )                                  # Number of retries
+    retry_backoff       : Safe_Float          = Safe_Float(0.3)                                  # Backoff factor for retries
+    connect_timeout     : Safe_UInt           = Safe_UInt (5  )                                  # Connection timeout in seconds
+    read_timeout        : Safe_UInt           = Safe_UInt (25 )                                  # Read timeout in seconds
+    verify_ssl          : bool                = False                                            # SSL verification (disable for dev)
+    max_content_size    : Safe_UInt           = Safe_UInt(104857600)                             # Max content size (100MB)
+    stream_responses    : bool                = False                                            # Stream upstream bodies to the client (instead of buffering them)
+    stream_chunk_size   : Safe_UInt           = Safe_UInt(65536)                                 # Chunk size (64KB) used when streaming bodies
+    engine              : Enum__Proxy__Engine = Enum__Proxy__Engine.sync                         # Upstream engine (sync: threadpool + requests, asyncio: event loop + httpx)
+    stream_uploads      : bool                = False                                            # Pipe request bodies to upstream as they arrive (instead of buffering them)
+    upload_buffer_size  : Safe_UInt           = Safe_UInt(1048576)                               # Bodies up to this size (1MB) are still buffered, so that retries can replay them
+    decode_content      : bool                = True                                             # Decompress upstream bodies (False: pass them through with their Content-Encoding/Content-Length, unless the cache may keep them)
+    compress_responses  : bool                = False                                            # Compress responses for clients that accept it (gzip, plus br/zstd when installed)
+    compression_level   : Safe_UInt           = Safe_UInt(6)                                     # Compression level (capped at each encoder's maximum: gzip 9, br 11, zstd 22)
+    compress_min_size   : Safe_UInt           = Safe_UInt(1024)                                  # Bodies smaller than this (1KB) are sent uncompressed
+    cache_responses     : bool                = False                                            # Serve repeated GETs from an in-memory RFC 9111 cache (honours Cache-Control, Expires and Vary)
+    cache_max_size      : Safe_UInt           = Safe_UInt(67108864)                              # Total bytes (64MB) held by the cache (least recently used entries go first)
+    cache_entry_limit   : Safe_UInt           = Safe_UInt(8388608)                               # Responses bigger than this (8MB) are not cached
+    coalesce_requests   : bool                = False                                            # Share one upstream call between identical GETs that arrive while it is in flight
+    coalesce_timeout    : Safe_UInt           = Safe_UInt(30)                                    # Seconds a coalesced request waits for the shared call before making its own
+    cache_disk          : bool                = False                                            # Keep bodies over the cache's memory limits in an on-disk tier (memory-mapped, and kept across restarts)
+    cache_disk_path     : str                 = '/tmp/mgraph_ai_service_proxy/cache'             # Directory of the disk tier (content-addressed bodies plus an index file)
+    cache_disk_max_size : Safe_UInt           = Safe_UInt(1073741824)                            # Total bytes (1GB) of bodies on disk (least recently used ones go first)
+    pool_idle_timeout   : Safe_UInt           = Safe_UInt(60)                                    # Seconds a pooled upstream connection can stay idle before it is closed
+    pool_max_sockets    : Safe_UInt           = Safe_UInt(512)                                   # Upstream sockets open at once, over every host (0: no cap)
+    pool_host_max_size  : Dict[str, int]                                                         # Per-host pool_max_size overrides, by 'host:port' or 'host'
+    pool_max_hosts      : Safe_UInt           = Safe_UInt(1024)                                  # Upstream hosts with a connection pool at once (past it, the least recently used host's pool is closed)
+    dns_cache           : bool                = False                                            # Cache upstream DNS lookups (sync engine), shared by every thread
+    dns_cache_ttl       : Safe_UInt           = Safe_UInt(60)                                    # Seconds a lookup is cached (hot hosts are looked up again in the background before it expires)
+    dns_negative_ttl    : Safe_UInt           = Safe_UInt(5)                                     # Seconds a failed lookup is cached
+    circuit_breaker     : bool                = False                                            # Fail fast (503) for upstream hosts whose calls keep failing, instead of waiting on their timeouts
+    breaker_error_rate  : Safe_Float          = Safe_Float(0.5)                                  # Share of a host's calls failing (connection errors and timeouts) that opens its breaker
+    breaker_min_calls   : Safe_UInt           = Safe_UInt(10)                                    # Calls a host needs within breaker_window before its failure rate counts
+    breaker_window      : Safe_UInt           = Safe_UInt(10)                                    # Seconds of calls the failure rate is computed over
+    breaker_open_time   : Safe_UInt           = Safe_UInt(30)                                    # Seconds an open breaker fails fast before letting a single probe request through
+    retry_budget        : Safe_Float          = Safe_Float(0.1)                                  # Retries a host may get, as a share of its requests (token bucket: idempotent requests only)
+    retry_after_max     : Safe_UInt           = Safe_UInt(10)                                    # Longest Retry-After (seconds) worth waiting for before retrying (longer: upstream's response is passed on)
+    hedge_requests      : bool                = False                                            # Send a second, identical GET/HEAD/OPTIONS when upstream is slower than its p95 to answer (the first response wins)
+    hedge_delay         : Safe_UInt           = Safe_UInt(100)                                   # Milliseconds to wait before hedging, until a host has enough samples for its p95 response-headers time
+    hedge_budget        : Safe_Float          = Safe_Float(0.1)                                  # Hedges a host may get, as a share of its hedgeable requests (token bucket)
+    upstream_groups     : Dict[str, Schema__Proxy__Upstream__Group]                              # Logical hosts (e.g. 'api', as the request's host) load balanced over several backends
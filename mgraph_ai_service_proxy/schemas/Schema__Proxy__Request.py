@@ -1,4 +1,5 @@
-from typing                                                                     import Dict
+import types
+from typing                                                                     import Dict, Union
 from osbot_utils.type_safe.Type_Safe                                            import Type_Safe
 from osbot_utils.type_safe.primitives.safe_str.identifiers.Random_Guid          import Random_Guid
 from osbot_utils.type_safe.primitives.safe_str.web.Safe_Str__IP_Address         import Safe_Str__IP_Address
@@ -16,6 +17,7 @@ class Schema__Proxy__Request(Type_Safe):
     host         : Safe_Str__Http__Host                                                 # Target host (optional if full URL in path)
     headers      : Dict[Safe_Str__Http__Header_Name, Safe_Str__Http__Header_Value]      # Request headers with safe types
     body         : bytes                        = None                                  # Request body for POST/PUT
+    body_stream  : Union[types.GeneratorType, types.AsyncGeneratorType] = None          # Request body streamed from the client (used instead of body)
     query_string : Safe_Str__Http__Query_String                                         # Query parameters
     client_ip    : Safe_Str__IP_Address                                                 # Client IP address
     use_https    : bool                         = True                                  # Use HTTPS for target
@@ -0,0 +1,12 @@
+from typing                                                         import List
+from osbot_utils.type_safe.Type_Safe                                import Type_Safe
+from osbot_utils.type_safe.primitives.safe_uint.Safe_UInt           import Safe_UInt
+from mgraph_ai_service_proxy.schemas.Enum__Proxy__Balance__Policy   import Enum__Proxy__Balance__Policy
+
+
+class Schema__Proxy__Upstream__Group(Type_Safe):                                                 # A logical upstream host, served by several backends
+    backends     : List[str]                                                                     # 'host:port' of each backend
+    policy       : Enum__Proxy__Balance__Policy = Enum__Proxy__Balance__Policy.round_robin       # how each call picks its backend
+    hash_header  : str                          = ''                                             # consistent_hash key: this request header ('': the request's path and query)
+    eject_errors : Safe_UInt                    = Safe_UInt(5)                                   # failed calls in a row (connection errors, timeouts and 5xx) that take a backend out of rotation
+    eject_time   : Safe_UInt                    = Safe_UInt(30)                                  # seconds an ejected backend stays out of rotation
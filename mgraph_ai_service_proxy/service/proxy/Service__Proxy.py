@@ -1,47 +1,130 @@
+import anyio.from_thread
+import asyncio
 import requests
 import threading
-from urllib.parse                                                   import urlunparse
-from osbot_utils.type_safe.Type_Safe                                import Type_Safe
-from osbot_utils.type_safe.primitives.safe_str.web.Safe_Str__Url    import Safe_Str__Url
-from mgraph_ai_service_proxy.schemas.Schema__Proxy__Config          import Schema__Proxy__Config
-from mgraph_ai_service_proxy.schemas.Schema__Proxy__Request         import Schema__Proxy__Request
-from mgraph_ai_service_proxy.schemas.Schema__Proxy__Response        import Schema__Proxy__Response
-from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Filter   import Service__Proxy__Filter
-from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Stats    import Service__Proxy__Stats
+import time
+import types
+import urllib3
+import weakref
+from typing                                                             import Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse                                                       import urlsplit, urlunparse
+from osbot_utils.type_safe.Type_Safe                                    import Type_Safe
+from osbot_utils.type_safe.primitives.safe_str.web.Safe_Str__Url        import Safe_Str__Url
+from mgraph_ai_service_proxy.schemas.Enum__Proxy__Cache__State          import Enum__Proxy__Cache__State
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Cache__Entry        import Schema__Proxy__Cache__Entry
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Config              import Schema__Proxy__Config
+from mgraph_ai_service_proxy.schemas.Proxy__Request                     import Proxy__Request
+from mgraph_ai_service_proxy.schemas.Proxy__Response                    import Proxy__Response
+from mgraph_ai_service_proxy.schemas.Proxy__Response__Stream            import Proxy__Response__Stream
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Balancer     import Service__Proxy__Balancer
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Breaker      import Service__Proxy__Breaker
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Cache        import Service__Proxy__Cache, STALE_IF_ERROR__STATUS_CODES
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Coalesce     import Service__Proxy__Coalesce, COALESCE__METHODS
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Compression  import Service__Proxy__Compression
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Filter       import Service__Proxy__Filter
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Hedge        import Service__Proxy__Hedge, first_call_aborted
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Limits       import Service__Proxy__Limits, Proxy_Error__Content_Too_Large
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Metrics      import Service__Proxy__Metrics
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Pools        import Service__Proxy__Pools
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Retry        import RETRY__STATUS_CODES
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Stats        import Service__Proxy__Stats
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Upload       import Service__Proxy__Upload
 
-thread_local = threading.local()                                                # Thread-local storage for session pooling
+IDENTITY__HEADERS = {'Accept-Encoding': 'identity'}                             # default for upstream requests whose body is passed through undecoded
+
+async_clients = weakref.WeakKeyDictionary()                                     # One httpx.AsyncClient (i.e. connection pool) per event loop, shared by all in-flight requests
+refresh_tasks = set()                                                           # Background cache refreshes on the event loop (which only keeps weak references to its tasks)
 
 class Service__Proxy(Type_Safe):                                                # Core proxy service for forwarding HTTP requests
-    config         : Schema__Proxy__Config                                      # Proxy configuration settings
-    stats_service  : Service__Proxy__Stats                                      # Statistics tracking service
-    filter_service : Service__Proxy__Filter                                     # Header and content filtering
+    config              : Schema__Proxy__Config                                 # Proxy configuration settings
+    stats_service       : Service__Proxy__Stats                                 # Statistics tracking service
+    filter_service      : Service__Proxy__Filter                                # Header and content filtering
+    upload_service      : Service__Proxy__Upload                                # Buffered vs streamed request bodies
+    limits_service      : Service__Proxy__Limits                                # Body size limits (config.max_content_size)
+    compression_service : Service__Proxy__Compression                           # Response compression (config.compress_responses)
+    cache_service       : Service__Proxy__Cache                                 # Response cache (config.cache_responses)
+    coalesce_service    : Service__Proxy__Coalesce                              # Single-flight upstream calls (config.coalesce_requests)
+    metrics_service     : Service__Proxy__Metrics                               # OpenMetrics rendering of the stats (/proxy/metrics)
+    pools_service       : Service__Proxy__Pools                                 # Upstream connection pools of the sync engine (per-host limits, idle eviction, socket cap)
+    breaker_service     : Service__Proxy__Breaker                               # Circuit breaker per upstream host (config.circuit_breaker)
+    hedge_service       : Service__Proxy__Hedge                                 # Hedged upstream calls for slow safe requests (config.hedge_requests)
+    balancer_service    : Service__Proxy__Balancer                              # Load balancing over the backends of upstream groups (config.upstream_groups)
     
     def setup(self) -> 'Service__Proxy':                                        # Initialize proxy service
-        self.config          = Schema__Proxy__Config()
-        self.stats_service   = Service__Proxy__Stats()
-        self.filter_service  = Service__Proxy__Filter()
+        self.config              = Schema__Proxy__Config()
+        self.stats_service       = Service__Proxy__Stats()
+        self.filter_service      = Service__Proxy__Filter()
+        self.limits_service      = Service__Proxy__Limits()
+        self.compression_service = Service__Proxy__Compression()
+        self.cache_service       = Service__Proxy__Cache()
+        self.coalesce_service    = Service__Proxy__Coalesce()
+        self.metrics_service     = Service__Proxy__Metrics()
+        self.pools_service       = Service__Proxy__Pools()
+        self.upload_service      = Service__Proxy__Upload(retry_service=self.pools_service.retry_service)  # (only retryable requests get their small bodies buffered)
+        self.breaker_service     = Service__Proxy__Breaker()
+        self.hedge_service       = Service__Proxy__Hedge()
+        self.balancer_service    = Service__Proxy__Balancer()
         return self
 
-    # todo: see if need this pooling since this is running inside lambda
-    def get_session(self) -> requests.Session:                               # Get thread-local requests session for pooling
-        if not hasattr(thread_local, "session"):
-            thread_local.session = requests.Session()
-            adapter = requests.adapters.HTTPAdapter(pool_connections = self.config.pool_connections      ,
-                                                    pool_maxsize     = self.config.pool_max_size        ,
-                                                    max_retries      = requests.adapters.Retry(
-                                                        total            = self.config.retry_count       ,
-                                                        backoff_factor   = self.config.retry_backoff    ,
-                                                        status_forcelist = [502, 503, 504]
-                                                    )
-            )
-            thread_local.session.mount("http://" , adapter)
-            thread_local.session.mount("https://", adapter)
-            thread_local.session.timeout = (self.config.connect_timeout, self.config.read_timeout)
-        return thread_local.session
-    
+    def get_session(self, retries: bool = True) -> requests.Session:          # This thread's requests session, on the process-wide connection pools
+        return self.pools_service.session(self.config, retries)
+
+    def check_async_engine(self) -> None:                                       # Raise when the asyncio engine can't run (httpx is not installed)
+        try:
+            import httpx                                                        # noqa: F401
+        except ImportError as error:
+            raise ImportError("config.engine is 'asyncio', which needs the httpx package (pip install httpx)") from error
+
+    def get_async_client(self) -> 'httpx.AsyncClient':                         # Get the event loop's shared async client (used by the asyncio engine)
+        import httpx                                                            # optional dependency, only needed when config.engine is asyncio
+
+        loop   = asyncio.get_running_loop()
+        client = async_clients.get(loop)
+        if client is None:
+            limits    = httpx.Limits          (max_connections           = int(self.config.pool_max_sockets) or None,   # (httpx pools have no per-host limits: only the socket cap applies)
+                                               max_keepalive_connections = int(self.config.pool_connections)        ,
+                                               keepalive_expiry          = float(self.config.pool_idle_timeout)     )
+            timeout   = httpx.Timeout         (float(self.config.read_timeout)                              ,
+                                               connect                   = float(self.config.connect_timeout))
+            transport = httpx.AsyncHTTPTransport(retries                 = 0                                ,     # (retries are made by send_request__async, like the sync engine's)
+                                                 verify                  = self.config.verify_ssl           ,
+                                                 limits                  = limits                           )
+            client    = httpx.AsyncClient     (transport                 = transport                        ,
+                                               timeout                   = timeout                          ,
+                                               follow_redirects          = False                            )
+            async_clients[loop] = client
+        return client
+
+    async def close_async_client(self) -> None:                                 # Close the current event loop's async client (and its pooled connections)
+        client = async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
 
+    def pool_usage(self) -> Dict[str, int]:                                     # Pooled upstream connections by state, over every host's pool and every event loop's client
+        usage = {'idle': 0, 'in_use': 0}
+        for pool in self.pools_service.get_pools().values():
+            usage['idle'  ] += pool['idle'  ]
+            usage['in_use'] += pool['active']
+        for client in list(async_clients.values()):
+            pool = getattr(getattr(client, '_transport', None), '_pool', None)   # httpcore's connection pool (private, so read defensively)
+            for connection in list(getattr(pool, 'connections', [])):
+                usage['idle' if connection.is_idle() else 'in_use'] += 1
+        return usage
 
-    def build_target_url(self, request: Schema__Proxy__Request) -> Safe_Str__Url:
+    def get_metrics(self) -> str:                                               # Stats, latency, cache, pool usage, DNS cache, circuit breakers, hedges and upstream groups in the OpenMetrics text format
+        return self.metrics_service.render(self.stats_service, self.cache_service, self.pool_usage(), self.pools_service.get_pools(),
+                                           self.pools_service.dns_service.get_stats(), self.breaker_service.get_states(self.config),
+                                           self.hedge_service.get_stats(), self.balancer_service.get_states(self.config))
+
+    def get_stats(self) -> Dict[str, object]:                                   # Stats, plus the state of each upstream host's circuit breaker, the hedged calls and each upstream group's backends
+        stats              = self.stats_service.get_stats()
+        stats['breakers' ] = self.breaker_service.get_states(self.config)
+        stats['hedges'   ] = self.hedge_service.get_stats()
+        stats['upstreams'] = self.balancer_service.get_states(self.config)
+        return stats
+
+
+    def build_target_url(self, request: Proxy__Request) -> Safe_Str__Url:
         if request.path.startswith('http://') or request.path.startswith('https://'):               # If path is already a full URL, just return it
             return Safe_Str__Url(request.path)
 
@@ -60,40 +143,738 @@ class Service__Proxy(Type_Safe):
 
         return Safe_Str__Url(target_url)
     
-    def execute_request(self, request: Schema__Proxy__Request) -> Schema__Proxy__Response:  # Execute proxied request
-        target_url      = self.build_target_url(request)
-        filtered_headers = self.filter_service.filter_request_headers(request.headers)
-        
-        # Add forwarding headers
-        filtered_headers.update({ 'X-Forwarded-For'   : request.client_ip                       ,
-                                  'X-Forwarded-Proto' : 'https' if request.use_https else 'http',
-                                  'X-Forwarded-Host'  : request.host or ''                      })
-        
-        session = self.get_session()
-        
+    def execute_request(self, request: Proxy__Request) -> Proxy__Response:                  # Execute proxied request
+        target_url   = self.build_target_url(request)
+        entry, state = self.cache_lookup(request, target_url)
+        if state is Enum__Proxy__Cache__State.fresh:                                       # fresh copy in the cache: upstream is not called at all
+            return self.cache_response(request, target_url, entry)
+        if state is Enum__Proxy__Cache__State.stale:                                       # stale-while-revalidate: answer now, refresh in the background
+            self.cache_refresh(request, target_url, entry)
+            return self.cache_response(request, target_url, entry)
+        try:
+            return self.coalesce(request, target_url, lambda: self.fetch(request, target_url, entry))
+        except ValueError as error:
+            if self.cache_stale_if_error(request, entry, error=error) is False:
+                raise
+            return self.cache_response(request, target_url, entry)
+
+    def execute_request__stream(self, request: Proxy__Request                              # Execute proxied request, streaming the response body
+                                 ) -> Proxy__Response__Stream:
+        target_url   = self.build_target_url(request)
+        entry, state = self.cache_lookup(request, target_url)
+        if state is Enum__Proxy__Cache__State.fresh:
+            return self.cache_response__stream(request, target_url, entry)
+        if state is Enum__Proxy__Cache__State.stale:
+            self.cache_refresh(request, target_url, entry)
+            return self.cache_response__stream(request, target_url, entry)
+        try:
+            return self.fetch__stream(request, target_url, entry)
+        except ValueError as error:                                                         # (only until the body starts streaming: after that the headers are gone)
+            if self.cache_stale_if_error(request, entry, error=error) is False:
+                raise
+            return self.cache_response__stream(request, target_url, entry)
+
+    async def execute_request__async(self, request: Proxy__Request                         # Execute proxied request on the event loop (asyncio engine)
+                                      ) -> Proxy__Response:
+        target_url   = self.build_target_url(request)
+        entry, state = self.cache_lookup(request, target_url)
+        if state is Enum__Proxy__Cache__State.fresh:
+            return self.cache_response(request, target_url, entry)
+        if state is Enum__Proxy__Cache__State.stale:
+            self.cache_refresh__async(request, target_url, entry)
+            return self.cache_response(request, target_url, entry)
+        try:
+            return await self.coalesce__async(request, target_url, lambda: self.fetch__async(request, target_url, entry))
+        except ValueError as error:
+            if self.cache_stale_if_error(request, entry, error=error) is False:
+                raise
+            return self.cache_response(request, target_url, entry)
+
+    async def execute_request__async_stream(self, request: Proxy__Request                  # Execute proxied request on the event loop, streaming the response body
+                                             ) -> Proxy__Response__Stream:
+        target_url   = self.build_target_url(request)
+        entry, state = self.cache_lookup(request, target_url)
+        if state is Enum__Proxy__Cache__State.fresh:
+            return self.cache_response__stream(request, target_url, entry, is_async=True)
+        if state is Enum__Proxy__Cache__State.stale:
+            self.cache_refresh__async(request, target_url, entry)
+            return self.cache_response__stream(request, target_url, entry, is_async=True)
+        try:
+            return await self.fetch__async_stream(request, target_url, entry)
+        except ValueError as error:
+            if self.cache_stale_if_error(request, entry, error=error) is False:
+                raise
+            return self.cache_response__stream(request, target_url, entry, is_async=True)
+
+    def coalesces(self, request: Proxy__Request) -> bool:                                  # Can this request share an upstream call with identical ones? (buffered responses only: a stream has a single reader)
+        return (self.config.coalesce_requests and request.method in COALESCE__METHODS and
+                not request.body and request.body_stream is None)
+
+    def coalesce(self, request    : Proxy__Request                       ,                  # Run fetch once for all identical requests in flight
+                       target_url : Safe_Str__Url                        ,
+                       fetch      : Callable[[], Proxy__Response]
+                  ) -> Proxy__Response:
+        if self.coalesces(request) is False:
+            return fetch()
+        key              = self.coalesce_service.key(str(request.method), str(target_url), request.headers)
+        response, shared = self.coalesce_service.run(key, fetch, float(self.config.coalesce_timeout))
+        if shared:
+            self.stats_service.record_coalesced(request)
+        return response
+
+    async def coalesce__async(self, request    : Proxy__Request                                  ,    # Async version of coalesce (asyncio engine)
+                                    target_url : Safe_Str__Url                                   ,
+                                    fetch      : Callable[[], Awaitable[Proxy__Response]]
+                               ) -> Proxy__Response:
+        if self.coalesces(request) is False:
+            return await fetch()
+        key              = self.coalesce_service.key(str(request.method), str(target_url), request.headers)
+        response, shared = await self.coalesce_service.run__async(key, fetch, float(self.config.coalesce_timeout))
+        if shared:
+            self.stats_service.record_coalesced(request)
+        return response
+
+    def fetch(self, request    : Proxy__Request                        ,                    # Get the response from upstream (revalidating the cached entry, when there is one)
+                    target_url : Safe_Str__Url                         ,
+                    entry      : Optional[Schema__Proxy__Cache__Entry]
+               ) -> Proxy__Response:
+        started  = time.perf_counter()
+        response = self.send_request(request, target_url, self.cache_service.validators(entry))
+        cached   = self.cache_revalidated(request, entry, response.status_code, dict(response.headers))
+        if cached is not None:                                                              # upstream says our stale copy is still current (304) or is failing (stale-if-error): no body to transfer
+            response.close()
+            return self.cache_response(request, target_url, cached)
+
+        try:
+            self.check_response_size(request, target_url, response.headers)
+            chunks  = self.upstream_chunks(request, response)
+            content = b''.join(self.limit_response(request, target_url, chunks))
+            self.stats_service.record_latency('upstream', self.upstream_host(target_url), time.perf_counter() - started)
+        except (requests.Timeout, requests.ConnectionError) as error:
+            raise self.upstream_error(request, target_url, error, is_timeout=isinstance(error, requests.Timeout))
+        finally:
+            response.close()                                                                # back to the pool when fully read, dropped when aborted
+
+        response_headers = self.filter_service.filter_response_headers(response.headers, passthrough=not self.decode_content(request))
+        content          = self.compress_content(request, response.status_code, response_headers, content)
+        self.cache_store(request, target_url, response.status_code, response_headers, content)
+
+        # Update stats
+        self.stats_service.record_request(request, response.status_code, self.upstream_host(target_url))
+
+        return Proxy__Response( status_code = response.status_code ,
+                                headers     = response_headers     ,
+                                content     = content              ,
+                                target_url  = target_url           )
+
+    def fetch__stream(self, request    : Proxy__Request                        ,            # Streamed version of fetch
+                            target_url : Safe_Str__Url                         ,
+                            entry      : Optional[Schema__Proxy__Cache__Entry]
+                       ) -> Proxy__Response__Stream:
+        started  = time.perf_counter()
+        response = self.send_request(request, target_url, self.cache_service.validators(entry))
+        cached   = self.cache_revalidated(request, entry, response.status_code, dict(response.headers))
+        if cached is not None:
+            response.close()
+            return self.cache_response__stream(request, target_url, cached)
+        try:
+            self.check_response_size(request, target_url, response.headers)               # still time to send a 502 (nothing has gone to the client yet)
+        except Proxy_Error__Content_Too_Large:
+            response.close()
+            raise
+
+        response_headers = self.filter_service.filter_response_headers(response.headers, passthrough=not self.decode_content(request))
+        content          = self.compress_stream(request, response.status_code, response_headers, response.headers,
+                                                self.stream_content(request, target_url, response, started))
+        content          = self.cache_stream  (request, target_url, response.status_code, response_headers, content)
+
+        self.stats_service.record_request(request, response.status_code, self.upstream_host(target_url))
+
+        return Proxy__Response__Stream( status_code = response.status_code ,
+                                        headers     = response_headers     ,
+                                        content     = content              ,
+                                        target_url  = target_url           )
+
+    async def fetch__async(self, request    : Proxy__Request                        ,       # Async version of fetch (asyncio engine)
+                                 target_url : Safe_Str__Url                         ,
+                                 entry      : Optional[Schema__Proxy__Cache__Entry]
+                            ) -> Proxy__Response:
+        import httpx
+
+        started  = time.perf_counter()
+        response = await self.send_request__async(request, target_url, self.cache_service.validators(entry))
+        cached   = self.cache_revalidated(request, entry, response.status_code, self.async_response_headers(response))
+        if cached is not None:
+            await response.aclose()
+            return self.cache_response(request, target_url, cached)
+        try:
+            self.check_response_size(request, target_url, response.headers)
+            chunks  = self.upstream_chunks__async(request, response)
+            content = b''.join([chunk async for chunk in self.limit_response__async(request, target_url, chunks)])
+            self.stats_service.record_latency('upstream', self.upstream_host(target_url), time.perf_counter() - started)
+        except httpx.TransportError as error:
+            raise self.upstream_error(request, target_url, error, is_timeout=isinstance(error, httpx.TimeoutException))
+        finally:
+            await response.aclose()
+
+        response_headers = self.filter_service.filter_response_headers(response.headers.raw, passthrough=not self.decode_content(request))
+        content          = self.compress_content(request, response.status_code, response_headers, content)
+        self.cache_store(request, target_url, response.status_code, response_headers, content)
+
+        self.stats_service.record_request(request, response.status_code, self.upstream_host(target_url))
+
+        return Proxy__Response( status_code = response.status_code ,
+                                headers     = response_headers     ,
+                                content     = content              ,
+                                target_url  = target_url           )
+
+    async def fetch__async_stream(self, request    : Proxy__Request                        ,    # Async version of fetch__stream (asyncio engine)
+                                        target_url : Safe_Str__Url                         ,
+                                        entry      : Optional[Schema__Proxy__Cache__Entry]
+                                   ) -> Proxy__Response__Stream:
+        started  = time.perf_counter()
+        response = await self.send_request__async(request, target_url, self.cache_service.validators(entry))
+        cached   = self.cache_revalidated(request, entry, response.status_code, self.async_response_headers(response))
+        if cached is not None:
+            await response.aclose()
+            return self.cache_response__stream(request, target_url, cached, is_async=True)
+        try:
+            self.check_response_size(request, target_url, response.headers)
+        except Proxy_Error__Content_Too_Large:
+            await response.aclose()
+            raise
+
+        response_headers = self.filter_service.filter_response_headers(response.headers.raw, passthrough=not self.decode_content(request))
+        content          = self.compress_stream__async(request, response.status_code, response_headers, response.headers,
+                                                       self.stream_content__async(request, target_url, response, started))
+        content          = self.cache_stream__async  (request, target_url, response.status_code, response_headers, content)
+
+        self.stats_service.record_request(request, response.status_code, self.upstream_host(target_url))
+
+        return Proxy__Response__Stream( status_code = response.status_code ,
+                                        headers     = response_headers     ,
+                                        content     = content              ,
+                                        target_url  = target_url           )
+
+    def cache_lookup(self, request    : Proxy__Request         ,                            # (cached response, its state) for this request ((None, miss) when caching is off)
+                           target_url : Safe_Str__Url
+                      ) -> Tuple[Optional[Schema__Proxy__Cache__Entry], Enum__Proxy__Cache__State]:
+        if self.config.cache_responses is False:
+            return None, Enum__Proxy__Cache__State.miss
+        if self.config.cache_disk:
+            self.cache_service.open_disk(str(self.config.cache_disk_path), int(self.config.cache_max_size), int(self.config.cache_disk_max_size))
+        entry, state = self.cache_service.lookup(str(request.method), str(target_url), request.headers)
+        if state is Enum__Proxy__Cache__State.fresh:
+            self.stats_service.record_cache_hit(request)
+        elif state is Enum__Proxy__Cache__State.stale:
+            self.stats_service.record_cache_stale(request)
+        return entry, state
+
+    def cache_revalidated(self, request     : Proxy__Request                       ,           # Cached entry to answer with instead of upstream's response: refreshed by a 304, or standing in for a 5xx
+                                entry       : Optional[Schema__Proxy__Cache__Entry],           # (None when there was no entry, or upstream sent a new response)
+                                status_code : int                                  ,
+                                headers     : Dict[str, str]
+                           ) -> Optional[Schema__Proxy__Cache__Entry]:
+        if entry is None:
+            return None
+        if status_code == 304 and self.cache_service.validators(entry):                    # (without validators of its own, the cache forwarded the client's: that 304 is the client's answer, not the entry's)
+            headers = self.filter_service.filter_response_headers(headers)
+            self.stats_service.record_cache_revalidated(request)
+            return self.cache_service.refresh(entry, headers, int(self.config.cache_max_size))
+        if self.cache_stale_if_error(request, entry, status_code=status_code):
+            return entry
+        return None
+
+    def cache_stale_if_error(self, request     : Proxy__Request                       ,        # Can the cached entry stand in for this upstream failure? (stale-if-error)
+                                   entry       : Optional[Schema__Proxy__Cache__Entry],
+                                   error       : Exception = None                     ,        # "Bad gateway" / "Gateway timeout" from upstream_error
+                                   status_code : int       = 0                                 # or a 5xx from upstream
+                              ) -> bool:
+        if entry is None or isinstance(error, Proxy_Error__Content_Too_Large):
+            return False
+        if error is None and status_code not in STALE_IF_ERROR__STATUS_CODES:
+            return False
+        if self.cache_service.stale_if_error(entry) is False:
+            return False
+        self.stats_service.record_cache_stale(request)
+        return True
+
+    def cache_refresh(self, request    : Proxy__Request             ,                        # Refresh a stale entry on a background thread (one refresh per entry at a time)
+                            target_url : Safe_Str__Url              ,
+                            entry      : Schema__Proxy__Cache__Entry
+                       ) -> None:
+        if self.cache_service.start_refresh(entry.key):
+            threading.Thread(target=self.refresh, args=(request, target_url, entry), daemon=True).start()
+
+    def refresh(self, request    : Proxy__Request             ,
+                      target_url : Safe_Str__Url              ,
+                      entry      : Schema__Proxy__Cache__Entry
+                 ) -> None:
+        try:
+            self.fetch(request, target_url, entry)                                          # stores (or refreshes) the entry on the way
+        except ValueError:                                                                  # already recorded: the stale copy is served until its windows run out
+            pass
+        finally:
+            self.cache_service.end_refresh(entry.key)
+
+    def cache_refresh__async(self, request    : Proxy__Request             ,                 # Async version of cache_refresh (a task on the event loop)
+                                   target_url : Safe_Str__Url              ,
+                                   entry      : Schema__Proxy__Cache__Entry
+                              ) -> None:
+        if self.cache_service.start_refresh(entry.key):
+            task = asyncio.get_running_loop().create_task(self.refresh__async(request, target_url, entry))
+            refresh_tasks.add(task)
+            task.add_done_callback(refresh_tasks.discard)
+
+    async def refresh__async(self, request    : Proxy__Request             ,
+                                   target_url : Safe_Str__Url              ,
+                                   entry      : Schema__Proxy__Cache__Entry
+                              ) -> None:
+        try:
+            await self.fetch__async(request, target_url, entry)
+        except ValueError:
+            pass
+        finally:
+            self.cache_service.end_refresh(entry.key)
+
+    def cache_hit(self, request : Proxy__Request             ,                               # (status code, headers, send its body?) for a cached response
+                        entry   : Schema__Proxy__Cache__Entry
+                   ) -> Tuple[int, Dict[str, str], bool]:
+        headers = self.cache_service.response_headers(entry)
+        if self.cache_service.not_modified(entry, request.headers):                         # the client already has it: answer its own validators with a 304
+            return 304, self.filter_service.filter_not_modified_headers(headers), False
+        return entry.status_code, headers, True
+
+    def cache_response(self, request    : Proxy__Request             ,                       # Response served from the cache
+                             target_url : Safe_Str__Url              ,
+                             entry      : Schema__Proxy__Cache__Entry
+                        ) -> Proxy__Response:
+        status_code, headers, send_body = self.cache_hit(request, entry)
+        content                         = self.cache_service.content(entry) if send_body else b''
+        return Proxy__Response( status_code = status_code ,
+                                headers     = headers     ,
+                                content     = content     ,
+                                target_url  = target_url  )
+
+    def cache_response__stream(self, request    : Proxy__Request              ,              # Streamed response served from the cache
+                                     target_url : Safe_Str__Url               ,
+                                     entry      : Schema__Proxy__Cache__Entry ,
+                                     is_async   : bool = False                               # async generator for the asyncio engine
+                                ) -> Proxy__Response__Stream:
+        status_code, headers, send_body = self.cache_hit(request, entry)
+        chunk_size                      = int(self.config.stream_chunk_size)
+        if is_async:
+            chunks = self.cache_service.chunks__async(entry, chunk_size) if send_body else self.cache_service.memory_chunks__async(b'')
+        else:
+            chunks = self.cache_service.chunks       (entry, chunk_size) if send_body else self.cache_service.memory_chunks       (b'')
+        return Proxy__Response__Stream( status_code = status_code ,
+                                        headers     = headers     ,
+                                        content     = chunks      ,
+                                        target_url  = target_url  )
+
+    def cache_store(self, request     : Proxy__Request         ,                            # Keep the response (as sent to the client) when the cache and its headers allow it
+                          target_url  : Safe_Str__Url          ,
+                          status_code : int                    ,
+                          headers     : Dict[str, str]         ,
+                          content     : bytes
+                     ) -> None:
+        if self.config.cache_responses:
+            self.cache_service.store(method           = str(request.method)              ,
+                                     target_url       = str(target_url)                  ,
+                                     request_headers  = request.headers                  ,
+                                     status_code      = status_code                      ,
+                                     response_headers = headers                          ,
+                                     content          = content                          ,
+                                     max_size         = int(self.config.cache_max_size   ),
+                                     entry_limit      = int(self.config.cache_entry_limit),
+                                     disk_max_size    = self.cache_disk_max_size()       )
+
+    def cache_disk_max_size(self) -> int:                                                   # Bytes of bodies the disk tier may hold (0 when it is off)
+        return int(self.config.cache_disk_max_size) if self.config.cache_disk else 0
+
+    def cache_tee_limit(self) -> int:                                                       # Biggest streamed body worth collecting for the cache
+        return max(int(self.config.cache_entry_limit), self.cache_disk_max_size())
+
+    def cache_stream(self, request     : Proxy__Request         ,                           # Streamed body, stored in the cache once it was fully sent
+                           target_url  : Safe_Str__Url          ,
+                           status_code : int                    ,
+                           headers     : Dict[str, str]         ,
+                           chunks      : types.GeneratorType
+                      ) -> types.GeneratorType:
+        if self.config.cache_responses is False or request.method != 'GET':
+            return chunks
+        on_complete = lambda content: self.cache_store(request, target_url, status_code, headers, content)
+        return self.cache_service.tee(chunks, self.cache_tee_limit(), on_complete)
+
+    def cache_stream__async(self, request     : Proxy__Request          ,                   # Async version of cache_stream (asyncio engine)
+                                  target_url  : Safe_Str__Url           ,
+                                  status_code : int                     ,
+                                  headers     : Dict[str, str]          ,
+                                  chunks      : types.AsyncGeneratorType
+                             ) -> types.AsyncGeneratorType:
+        if self.config.cache_responses is False or request.method != 'GET':
+            return chunks
+        on_complete = lambda content: self.cache_store(request, target_url, status_code, headers, content)
+        return self.cache_service.tee__async(chunks, self.cache_tee_limit(), on_complete)
+
+    def request_headers(self, request    : Proxy__Request         ,                         # Headers to send upstream (filtered, plus forwarding headers)
+                              validators : Dict[str, str] = None                            # the cache's conditional headers, when revalidating a stale entry
+                         ) -> Dict[str, str]:
+        filter_service  = self.filter_service
+        skip_headers    = filter_service.REQUEST_SKIP_HEADERS__REVALIDATE if validators else filter_service.REQUEST_SKIP_HEADERS     # the cache's validators replace the client's
+        extra_headers   = { 'X-Forwarded-For'   : request.client_ip or ''                 ,     # forwarding headers
+                            'X-Forwarded-Proto' : 'https' if request.use_https else 'http',
+                            'X-Forwarded-Host'  : request.host or ''                      }
+        default_headers = None
+        if validators:
+            extra_headers.update(validators)
+        if self.decode_content(request) is False:
+            default_headers = IDENTITY__HEADERS                                             # otherwise requests/httpx ask for gzip on behalf of a client that may not support it
+        return filter_service.filter_headers(request.headers.items(), skip_headers, extra_headers, default_headers)   # (one pass: filtering, sanitising, and the headers added)
+
+    def async_response_headers(self, response: 'httpx.Response') -> Dict[str, str]:        # httpx headers as a dict, keeping the upstream casing (like requests does)
+        headers = {}
+        for raw_name, raw_value in response.headers.raw:
+            name, value = raw_name.decode('latin-1'), raw_value.decode('latin-1')
+            headers[name] = f'{headers[name]}, {value}' if name in headers else value
+        return headers
+
+    async def send_request__async(self, request    : Proxy__Request         ,              # Send request upstream via the shared async client (body is not read yet), hedged when config.hedge_requests allows it
+                                        target_url : Safe_Str__Url          ,
+                                        validators : Dict[str, str] = None
+                                   ) -> 'httpx.Response':
+        self.breaker_check(request, target_url)
+        call = lambda: self.upstream_call__async(request, target_url, validators)
+        if self.hedge_service.hedgeable(self.config, request) is False:
+            return await call()
+        host = self.upstream_host(target_url)                                               # (hedge delays and budgets are per upstream host)
+        return await self.hedge_service.race__async(self.config, host, self.hedge_service.delay(self.config, self.stats_service.latency, host), call)
+
+    async def upstream_call__async(self, request    : Proxy__Request         ,             # One upstream call (with its retries) via the shared async client, to one of the backends when the host is an upstream group
+                                         target_url : Safe_Str__Url          ,
+                                         validators : Dict[str, str] = None
+                                    ) -> 'httpx.Response':
+        import httpx
+
+        route            = self.balancer_service.route(self.config, str(target_url), request.headers)  # (group, backend, backend url)
+        client           = self.get_async_client()
+        headers          = self.request_headers(request, validators)
+        content          = request.body
+        if request.body_stream is not None:                                                 # stream the client body straight into the upstream request
+            content        = request.body_stream
+            content_length = self.upload_service.content_length(request.headers)
+            if content_length is not None:                                                  # keep the client's length (httpx would otherwise use chunked encoding)
+                headers['Content-Length'] = str(content_length)
+        timings          = {}
+        upstream_request = client.build_request(method     = str(request.method)                                           ,
+                                                url        = route[2] if route else str(target_url)                        ,
+                                                headers    = headers                                                       ,
+                                                content    = content                                                       ,
+                                                extensions = {'trace': self.stats_service.latency.connect_trace(timings)} )
+        retry_service    = self.pools_service.retry_service
+        host             = self.upstream_host(target_url)                                  # (retry budgets are per upstream host)
+        retries          = self.retryable(request)
+        attempt          = 0                                                                # retries made
+        wait             = 0.0
+        failed           = True                                                             # (for the backend's health, when routed)
+        called           = time.perf_counter()
+        retry_service.deposit(self.config, host)
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    response = await client.send(upstream_request, stream=True)
+                except httpx.TransportError as error:
+                    wait = retry_service.delay(self.config, host, attempt, wait) if retries else None
+                    if wait is None:
+                        self.breaker_record(target_url, failed=True)
+                        raise self.upstream_error(request, target_url, error, is_timeout=isinstance(error, httpx.TimeoutException))
+                else:
+                    if retries is False or response.status_code not in RETRY__STATUS_CODES:
+                        wait = None
+                    else:
+                        retry_after = retry_service.retry_after(response.headers.get('Retry-After'))
+                        wait        = retry_service.delay(self.config, host, attempt, wait, retry_after)
+                    if wait is None:
+                        self.record_send_latency(target_url, started, timings.get('connect'))
+                        self.breaker_record(target_url, failed=False)
+                        failed = response.status_code >= 500
+                        return response
+                    await response.aclose()
+                await asyncio.sleep(wait)
+                attempt += 1
+        except Proxy_Error__Content_Too_Large:                                              # raised by limit_upload__async while sending the body
+            self.stats_service.record_oversized(request)
+            failed = False                                                                  # (the client's fault, not the backend's)
+            raise
+        finally:
+            self.stats_service.record_retries(request, attempt)
+            if route:
+                self.balancer_service.release(self.config, route, time.perf_counter() - called, failed)
+
+    def send_request(self, request    : Proxy__Request         ,                            # Send request upstream (body is not read yet), hedged when config.hedge_requests allows it
+                           target_url : Safe_Str__Url          ,
+                           validators : Dict[str, str] = None                               # the cache's conditional headers, when revalidating a stale entry
+                      ) -> requests.Response:
+        self.breaker_check(request, target_url)
+        filtered_headers = self.request_headers(request, validators)
+        call             = lambda: self.upstream_call(request, target_url, filtered_headers)
+        if self.hedge_service.hedgeable(self.config, request) is False:
+            return call()
+        host = self.upstream_host(target_url)                                               # (hedge delays and budgets are per upstream host)
+        return self.hedge_service.race(self.config, host, self.hedge_service.delay(self.config, self.stats_service.latency, host), call)
+
+    def upstream_call(self, request          : Proxy__Request         ,                     # One upstream call (with its retries) on this thread's session, to one of the backends when the host is an upstream group
+                            target_url       : Safe_Str__Url          ,
+                            filtered_headers : Dict[str, str]
+                       ) -> requests.Response:
+        route         = self.balancer_service.route(self.config, str(target_url), request.headers)     # (group, backend, backend url)
+        failed        = True                                                                # (for the backend's health, when routed)
+        session       = self.get_session(retries = self.retryable(request))
+        retry_service = self.pools_service.retry_service
+        host          = self.upstream_host(target_url)                                      # (retry budgets are per upstream host)
+        latency       = self.stats_service.latency
+        retry_service.deposit(self.config, host)
+        retry_service.start(host)
+        latency.start_connect_timing()
+        started       = time.perf_counter()
         try:
             response = session.request( method          = request.method         ,
-                                        url             = str(target_url)        ,
+                                        url             = route[2] if route else str(target_url),
                                         headers         = filtered_headers       ,
-                                        data            = request.body           ,
+                                        data            = self.upload_service.upstream_body(request),
                                         allow_redirects = False                  ,
                                         stream          = True                   ,
+                                        timeout         = session.timeout        ,     # (connect, read): without it requests waits on a dead upstream forever
                                         verify          = self.config.verify_ssl )
-            
-            response_headers = self.filter_service.filter_response_headers(dict(response.headers))
-            
-            # Update stats
-            self.stats_service.record_request(request, response.status_code)
-            
-            return Schema__Proxy__Response( status_code = response.status_code ,
-                                            headers     = response_headers     ,
-                                            content     = response.content     ,
-                                            target_url  = target_url           )
-            
-        except requests.Timeout:
+            self.record_send_latency(target_url, started, latency.connect_time())
+            self.breaker_record(target_url, failed=False)
+            failed = response.status_code >= 500
+            return response
+        except (requests.Timeout, requests.ConnectionError, urllib3.exceptions.PoolError) as error:     # (requests lets urllib3's EmptyPoolError through: the host's pool stayed full for pool_timeout)
+            if first_call_aborted():                                                        # its hedge answered first (see Service__Proxy__Hedge.race): not the upstream's fault
+                failed = False
+                raise
+            self.breaker_record(target_url, failed=True)
+            raise self.upstream_error(request, target_url, error, is_timeout=isinstance(error, (requests.Timeout, urllib3.exceptions.EmptyPoolError)))
+        except Proxy_Error__Content_Too_Large:                                              # raised by limit_upload while sending the body (urllib3 drops the upstream connection)
+            self.stats_service.record_oversized(request)
+            failed = False                                                                  # (the client's fault, not the backend's)
+            raise
+        finally:
+            self.stats_service.record_retries(request, retry_service.retries())
+            if route:
+                self.balancer_service.release(self.config, route, time.perf_counter() - started, failed)
+
+    def retryable(self, request: Proxy__Request) -> bool:                                  # May a failed upstream call of this request be made again? (a replayable body, and an idempotent method or an Idempotency-Key)
+        return request.body_stream is None and self.pools_service.retry_service.retryable(str(request.method), request.headers)
+
+    def breaker_check(self, request    : Proxy__Request         ,                           # Fail fast (503) when the upstream host's circuit breaker is open
+                            target_url : Safe_Str__Url
+                       ) -> None:
+        if self.config.circuit_breaker is False:
+            return
+        host = self.upstream_host(target_url)
+        if self.breaker_service.allow(self.config, host) is False:
+            self.stats_service.record_rejected(request)
+            raise self.breaker_service.error__circuit_open(target_url, self.breaker_service.retry_after(self.config, host))
+
+    def breaker_record(self, target_url : Safe_Str__Url,                                    # Count an upstream call's outcome in its host's circuit breaker
+                             failed     : bool
+                        ) -> None:
+        if self.config.circuit_breaker:
+            self.breaker_service.record(self.config, self.upstream_host(target_url), failed)
+
+    def upstream_host(self, target_url: Safe_Str__Url) -> str:                              # 'host[:port]' a request is sent to (not the client's Host header, which is the proxy's own in full-URL mode)
+        return urlsplit(str(target_url)).netloc
+
+    def record_send_latency(self, target_url      : Safe_Str__Url          ,                # Record how long upstream took to send its headers (and to open a new connection, when one was needed)
+                                  started         : float                  ,
+                                  connect_seconds : Optional[float]
+                             ) -> None:
+        host = self.upstream_host(target_url)
+        if connect_seconds is not None:
+            self.stats_service.record_latency('connect', host, connect_seconds)
+        self.stats_service.record_latency('ttfb', host, time.perf_counter() - started)
+
+    def check_request_size(self, headers: Dict[str, str]) -> None:                         # Reject a client body whose Content-Length is over max_content_size (before reading any of it)
+        max_size = int(self.config.max_content_size)
+        if self.limits_service.exceeds(max_size, self.upload_service.content_length(headers)):
+            self.stats_service.record_oversized(None)
+            raise self.limits_service.error__request_too_large(max_size)
+
+    def check_response_size(self, request    : Proxy__Request         ,                     # Reject an upstream body whose Content-Length is over max_content_size (before reading any of it)
+                                  target_url : Safe_Str__Url          ,
+                                  headers
+                             ) -> None:
+        max_size = int(self.config.max_content_size)
+        if self.limits_service.exceeds(max_size, self.upload_service.content_length(headers)):
+            self.stats_service.record_oversized(request)
+            raise self.limits_service.error__response_too_large(max_size, target_url)
+
+    async def read_body__async(self, chunks) -> bytes:                                     # Read a whole client body, rejecting it once it goes over max_content_size
+        try:
+            return await self.limits_service.read_body__async(chunks, int(self.config.max_content_size))
+        except Proxy_Error__Content_Too_Large:
+            self.stats_service.record_oversized(None)
+            raise
+
+    def read_body(self, chunks) -> bytes:                                                   # Sync version of read_body__async (for the threadpool: the body is read on the event loop, while this worker waits)
+        return anyio.from_thread.run(self.read_body__async, chunks)
+
+    def limit_upload(self, chunks) -> types.GeneratorType:                                 # Client body chunks, aborting once they go over max_content_size
+        max_size = int(self.config.max_content_size)
+        return self.limits_service.limit_chunks(chunks, max_size, self.limits_service.error__request_too_large(max_size))
+
+    def limit_upload__async(self, chunks) -> types.AsyncGeneratorType:                     # Async version of limit_upload (asyncio engine)
+        max_size = int(self.config.max_content_size)
+        return self.limits_service.limit_chunks__async(chunks, max_size, self.limits_service.error__request_too_large(max_size))
+
+    def limit_response(self, request    : Proxy__Request         ,                          # Upstream body chunks, aborting once they go over max_content_size (for bodies without a Content-Length, or that lie about it)
+                             target_url : Safe_Str__Url          ,
+                             chunks
+                        ) -> types.GeneratorType:
+        max_size = int(self.config.max_content_size)
+        try:
+            yield from self.limits_service.limit_chunks(chunks, max_size, self.limits_service.error__response_too_large(max_size, target_url))
+        except Proxy_Error__Content_Too_Large:
+            self.stats_service.record_oversized(request)
+            raise
+
+    async def limit_response__async(self, request    : Proxy__Request         ,             # Async version of limit_response (asyncio engine)
+                                          target_url : Safe_Str__Url          ,
+                                          chunks
+                                     ) -> types.AsyncGeneratorType:
+        max_size = int(self.config.max_content_size)
+        try:
+            async for chunk in self.limits_service.limit_chunks__async(chunks, max_size, self.limits_service.error__response_too_large(max_size, target_url)):
+                yield chunk
+        except Proxy_Error__Content_Too_Large:
+            self.stats_service.record_oversized(request)
+            raise
+
+    def response_encoding(self, request        : Proxy__Request         ,              # Encoding to compress this response with (None: send it as it is)
+                                status_code    : int                    ,
+                                headers        : Dict[str, str]         ,
+                                content_length : Optional[int]
+                           ) -> Optional[str]:
+        if self.config.compress_responses is False or request.method == 'HEAD':
+            return None
+        compression_service = self.compression_service
+        encoding            = compression_service.negotiate(compression_service.header(request.headers, 'accept-encoding'))
+        if encoding and compression_service.compressible(status_code, headers, content_length, int(self.config.compress_min_size)):
+            return encoding
+        return None
+
+    def compress_content(self, request     : Proxy__Request         ,                       # Compress a buffered body (headers are updated in place)
+                               status_code : int                    ,
+                               headers     : Dict[str, str]         ,
+                               content     : bytes
+                          ) -> bytes:
+        encoding = self.response_encoding(request, status_code, headers, len(content))
+        if encoding is None:
+            return content
+        self.compression_service.update_headers(headers, encoding)
+        return self.compression_service.compress(content, encoding, int(self.config.compression_level))
+
+    def compress_stream(self, request          : Proxy__Request         ,                    # Compress a streamed body (headers are updated in place)
+                              status_code      : int                    ,
+                              headers          : Dict[str, str]         ,
+                              upstream_headers                          ,                   # for the upstream Content-Length (when there is one)
+                              chunks           : types.GeneratorType
+                         ) -> types.GeneratorType:
+        encoding = self.response_encoding(request, status_code, headers, self.upload_service.content_length(upstream_headers))
+        if encoding is None:
+            return chunks
+        self.compression_service.update_headers(headers, encoding)
+        return self.compression_service.compress_chunks(chunks, encoding, int(self.config.compression_level))
+
+    def compress_stream__async(self, request          : Proxy__Request         ,             # Async version of compress_stream (asyncio engine)
+                                     status_code      : int                    ,
+                                     headers          : Dict[str, str]         ,
+                                     upstream_headers                          ,
+                                     chunks           : types.AsyncGeneratorType
+                                ) -> types.AsyncGeneratorType:
+        encoding = self.response_encoding(request, status_code, headers, self.upload_service.content_length(upstream_headers))
+        if encoding is None:
+            return chunks
+        self.compression_service.update_headers(headers, encoding)
+        return self.compression_service.compress_chunks__async(chunks, encoding, int(self.config.compression_level))
+
+    def decode_content(self, request: Proxy__Request) -> bool:                             # Does this response body need decompressing? (when configured, or when the cache may keep it: one stored encoding can't suit every client)
+        if self.config.decode_content:
+            return True
+        return self.config.cache_responses and request.method == 'GET'
+
+    def upstream_chunks(self, request  : Proxy__Request         ,                          # Upstream body chunks: decoded, or exactly as sent (passthrough)
+                              response : requests.Response
+                         ):
+        chunk_size = int(self.config.stream_chunk_size)
+        if self.decode_content(request):
+            return response.iter_content(chunk_size=chunk_size)
+        return self.raw_content(response, chunk_size)
+
+    def raw_content(self, response   : requests.Response ,                                 # Upstream body without decoding, mapping urllib3 errors the same way iter_content does
+                          chunk_size : int
+                     ) -> types.GeneratorType:
+        try:
+            yield from response.raw.stream(chunk_size, decode_content=False)
+        except urllib3.exceptions.ProtocolError as error:
+            raise requests.exceptions.ChunkedEncodingError(error)
+        except urllib3.exceptions.ReadTimeoutError as error:
+            raise requests.ConnectionError(error)
+
+    def upstream_chunks__async(self, request  : Proxy__Request         ,                   # Async version of upstream_chunks (asyncio engine)
+                                     response : 'httpx.Response'
+                                ):
+        chunk_size = int(self.config.stream_chunk_size)
+        if self.decode_content(request):
+            return response.aiter_bytes(chunk_size=chunk_size)
+        return response.aiter_raw(chunk_size=chunk_size)
+
+    def upstream_error(self, request    : Proxy__Request         ,                          # Record an upstream failure and map it into the proxy error
+                             target_url : Safe_Str__Url          ,
+                             error      : Exception              ,
+                             is_timeout : bool
+                        ) -> ValueError:
+        if is_timeout:
             self.stats_service.record_timeout(request)
-            raise ValueError(f"Gateway timeout for {target_url}")
-        except requests.ConnectionError as e:
+            return ValueError(f"Gateway timeout for {target_url}")
+        self.stats_service.record_error(request)
+        return ValueError(f"Bad gateway - cannot connect to {target_url}: {str(error)}")
+
+    def stream_content(self, request    : Proxy__Request         ,                         # Yield upstream body in fixed size chunks
+                             target_url : Safe_Str__Url          ,
+                             response   : requests.Response ,
+                             started    : float                                             # when the upstream call started (for its latency)
+                        ) -> types.GeneratorType:                                          # connection goes back to the pool when done, or when the generator is closed (client disconnect)
+        chunks = self.upstream_chunks(request, response)
+        try:
+            for chunk in self.limit_response(request, target_url, chunks):                       # going over the limit aborts the stream (and the upstream connection)
+                if chunk:
+                    yield chunk
+            self.stats_service.record_latency('upstream', self.upstream_host(target_url), time.perf_counter() - started)
+        except requests.RequestException:                                                   # headers are already sent, so all we can do is record it and abort the stream
             self.stats_service.record_error(request)
-            raise ValueError(f"Bad gateway - cannot connect to {target_url}: {str(e)}")
+            raise
+        finally:
+            response.close()
 
+    async def stream_content__async(self, request    : Proxy__Request         ,             # Async version of stream_content (asyncio engine)
+                                          target_url : Safe_Str__Url          ,
+                                          response   : 'httpx.Response'       ,
+                                          started    : float
+                                     ) -> types.AsyncGeneratorType:
+        import httpx
+
+        chunks = self.upstream_chunks__async(request, response)
+        try:
+            async for chunk in self.limit_response__async(request, target_url, chunks):
+                if chunk:
+                    yield chunk
+            self.stats_service.record_latency('upstream', self.upstream_host(target_url), time.perf_counter() - started)
+        except httpx.TransportError:
+            self.stats_service.record_error(request)
+            raise
+        finally:
+            await response.aclose()
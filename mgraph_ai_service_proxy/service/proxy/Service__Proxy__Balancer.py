@@ -0,0 +1,163 @@
+import hashlib
+import random
+import threading
+import time
+from bisect                                                             import bisect
+from typing                                                             import Dict, Optional, Tuple
+from urllib.parse                                                       import urlsplit, urlunsplit
+from osbot_utils.type_safe.Type_Safe                                    import Type_Safe
+from mgraph_ai_service_proxy.schemas.Enum__Proxy__Balance__Policy       import Enum__Proxy__Balance__Policy
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Config              import Schema__Proxy__Config
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Upstream__Group     import Schema__Proxy__Upstream__Group
+
+BALANCER__EWMA_DECAY    = 0.3                                                   # weight of each new latency in a backend's EWMA
+BALANCER__RING_REPLICAS = 100                                                   # points of each backend on the consistent-hash ring (the more, the more even the spread)
+
+
+def ring_hash(key: str) -> int:                                                 # Stable 64-bit hash (Python's hash() changes between processes)
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+class Service__Proxy__Balancer__Backend(Type_Safe):                             # One backend of an upstream group: its calls, latency and health
+    outstanding   : int                                                         # calls in flight (until upstream's headers arrive)
+    calls         : int
+    failures      : int                                                         # connection errors, timeouts and 5xx responses
+    errors        : int                                                         # failed calls in a row (eject_errors of them eject it)
+    ewma          : float                                                       # latency EWMA of its successful calls (seconds, 0 until the first one)
+    ejected_until : float                                                       # monotonic time it comes back into rotation
+    ejections     : int                                                         # times it was ejected
+
+
+class Service__Proxy__Balancer(Type_Safe):                                      # Load balancing over the backends of upstream groups (config.upstream_groups), with passive health ejection
+    lock     : threading.Condition                                              # guards backends, turns and rings
+    backends : dict                                                             # (group, 'host:port') -> Service__Proxy__Balancer__Backend
+    turns    : dict                                                             # group -> next turn (round_robin, and where least_outstanding starts looking)
+    rings    : dict                                                             # group -> (its backends, sorted ring hashes, backend index of each hash)
+
+    def now(self) -> float:
+        return time.monotonic()
+
+    def route(self, config     : Schema__Proxy__Config,                         # (group, backend, url to call) when the URL's host is an upstream group (None otherwise): the call counts as in flight until release
+                    target_url : str                  ,
+                    headers    : Dict[str, str]       ,
+                    now        : float = None
+               ) -> Optional[Tuple[str, str, str]]:
+        groups = config.upstream_groups
+        if not groups:
+            return None
+        parts = urlsplit(target_url)
+        group = groups.get(parts.netloc)
+        if group is None or not group.backends:
+            return None
+        key     = self.hash_key(group, parts, headers) if group.policy is Enum__Proxy__Balance__Policy.consistent_hash else None
+        backend = self.pick(parts.netloc, group, key, self.now() if now is None else now)
+        return parts.netloc, backend, urlunsplit(parts._replace(netloc=backend))
+
+    def hash_key(self, group   : Schema__Proxy__Upstream__Group,                # consistent_hash key of a request: its hash_header (or its path and query)
+                       parts   : tuple                         ,
+                       headers : Dict[str, str]
+                  ) -> str:
+        if group.hash_header:
+            name = group.hash_header.lower()
+            for header, value in headers.items():
+                if header.lower() == name:
+                    return value
+        return f'{parts.path}?{parts.query}'
+
+    def pick(self, name  : str                           ,                      # Backend for a call to a group, by its policy (ejected backends are skipped, unless they all are)
+                   group : Schema__Proxy__Upstream__Group,
+                   key   : Optional[str]                 ,
+                   now   : float
+              ) -> str:
+        names = tuple(group.backends)
+        with self.lock:
+            states = [self.backend(name, backend) for backend in names]
+            live   = [index for index, state in enumerate(states) if state.ejected_until <= now] or list(range(len(names)))
+            policy = group.policy
+            if policy is Enum__Proxy__Balance__Policy.consistent_hash:
+                index = self.ring_pick(name, names, key, set(live))
+            elif policy is Enum__Proxy__Balance__Policy.ewma and len(live) > 1:
+                index = min(random.sample(live, 2), key=lambda index: states[index].ewma * (states[index].outstanding + 1))
+            else:
+                turn             = self.turns.get(name, 0)
+                self.turns[name] = turn + 1
+                live             = live[turn % len(live):] + live[:turn % len(live)]        # (each backend in turn, also to break least_outstanding's ties)
+                index            = live[0]
+                if policy is Enum__Proxy__Balance__Policy.least_outstanding:
+                    index = min(live, key=lambda index: states[index].outstanding)
+            state              = states[index]
+            state.outstanding += 1
+            state.calls       += 1
+            return names[index]
+
+    def ring_pick(self, name  : str            ,                                # Backend owning the key on the group's hash ring (the next live one clockwise, when it is ejected)
+                        names : Tuple[str, ...],
+                        key   : str            ,
+                        live  : set
+                   ) -> int:
+        ring = self.rings.get(name)
+        if ring is None or ring[0] != names:
+            points = sorted((ring_hash(f'{backend}#{replica}'), index) for index, backend in enumerate(names) for replica in range(BALANCER__RING_REPLICAS))
+            ring   = self.rings[name] = (names, [point[0] for point in points], [point[1] for point in points])
+        hashes, nodes = ring[1], ring[2]
+        start         = bisect(hashes, ring_hash(key))
+        for offset in range(len(nodes)):
+            index = nodes[(start + offset) % len(nodes)]
+            if index in live:
+                return index
+        return nodes[start % len(nodes)]
+
+    def release(self, config  : Schema__Proxy__Config  ,                        # A routed call is done (upstream's headers arrived, or it failed): update the backend's latency and health
+                      route   : Tuple[str, str, str]   ,
+                      seconds : float                  ,
+                      failed  : bool                   ,
+                      now     : float = None
+                 ) -> None:
+        name, backend, _ = route
+        group            = config.upstream_groups.get(name)
+        now              = self.now() if now is None else now
+        with self.lock:
+            state             = self.backend(name, backend)
+            state.outstanding = max(0, state.outstanding - 1)
+            if failed is False:
+                state.errors = 0
+                state.ewma   = seconds if state.ewma == 0 else state.ewma + BALANCER__EWMA_DECAY * (seconds - state.ewma)
+                return
+            state.failures += 1
+            state.errors   += 1
+            if group is not None and state.errors >= int(group.eject_errors) and state.ejected_until <= now:
+                state.ejected_until  = now + int(group.eject_time)
+                state.ejections     += 1
+                state.errors         = 0
+
+    def backend(self, name    : str,                                            # (caller holds the lock)
+                      backend : str
+                 ) -> Service__Proxy__Balancer__Backend:
+        state = self.backends.get((name, backend))
+        if state is None:
+            state = self.backends[(name, backend)] = Service__Proxy__Balancer__Backend()
+        return state
+
+    def get_states(self, config : Schema__Proxy__Config,                        # group -> backend -> calls in flight, calls, failures, latency EWMA and ejection
+                         now    : float = None
+                    ) -> Dict[str, Dict[str, Dict[str, object]]]:
+        now    = self.now() if now is None else now
+        states = {}
+        with self.lock:
+            for name, group in sorted(config.upstream_groups.items()):
+                states[name] = {}
+                for backend in group.backends:
+                    state                  = self.backend(name, backend)
+                    states[name][backend]  = dict(outstanding = state.outstanding                 ,
+                                                  calls       = state.calls                       ,
+                                                  failures    = state.failures                    ,
+                                                  ewma_ms     = round(state.ewma * 1000, 3)       ,
+                                                  ejected     = state.ejected_until > now         ,
+                                                  ejections   = state.ejections                   )
+        return states
+
+    def reset(self) -> None:
+        with self.lock:
+            self.backends.clear()
+            self.turns   .clear()
+            self.rings   .clear()
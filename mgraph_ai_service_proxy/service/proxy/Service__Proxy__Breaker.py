@@ -0,0 +1,136 @@
+import math
+import threading
+import time
+from typing                                                             import Dict
+from osbot_utils.type_safe.Type_Safe                                    import Type_Safe
+from osbot_utils.type_safe.primitives.safe_str.web.Safe_Str__Url        import Safe_Str__Url
+from mgraph_ai_service_proxy.schemas.Enum__Proxy__Breaker__State        import Enum__Proxy__Breaker__State
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Config              import Schema__Proxy__Config
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Rates        import Service__Proxy__Rates__Ring
+
+HTTP_STATUS__SERVICE_UNAVAILABLE = 503                                          # breaker open: upstream is not called
+BREAKER__HOSTS_LIMIT             = 1024                                         # hosts with a breaker (past it, closed breakers are dropped oldest first)
+
+
+class Proxy_Error__Circuit_Open(ValueError):                                    # The target host's breaker is open
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.status_code = HTTP_STATUS__SERVICE_UNAVAILABLE
+        self.retry_after = retry_after                                          # seconds until the next probe (for the Retry-After header)
+
+
+class Service__Proxy__Breaker__Host(Type_Safe):                                 # One host's breaker: its state, plus per-second counts of its upstream calls and failures
+    state     : Enum__Proxy__Breaker__State = Enum__Proxy__Breaker__State.closed
+    calls     : Service__Proxy__Rates__Ring = None                              # upstream calls (while closed)
+    failures  : Service__Proxy__Rates__Ring = None                              # connection errors and timeouts among them
+    opened_at : float                                                           # when it last opened (or its probe started, when half open), monotonic
+    opened    : int                                                             # times it opened
+
+    def setup(self) -> 'Service__Proxy__Breaker__Host':
+        self.calls    = Service__Proxy__Rates__Ring().setup()
+        self.failures = Service__Proxy__Rates__Ring().setup()
+        return self
+
+
+class Service__Proxy__Breaker(Type_Safe):                                       # Circuit breaker per upstream host: opens on a high failure rate, fails fast while open, then lets single probes through
+    lock  : threading.Condition                                                 # guards hosts and their breakers (held for a few array writes per call)
+    hosts : dict                                                                # host -> Service__Proxy__Breaker__Host
+
+    def now(self) -> float:
+        return time.monotonic()
+
+    def allow(self, config : Schema__Proxy__Config,                             # May a request go to this host? (while half open: only the probe, or a new one once breaker_open_time passed without an answer)
+                    host   : str                  ,
+                    now    : float = None
+               ) -> bool:
+        breaker = self.hosts.get(host)
+        if breaker is None or breaker.state is Enum__Proxy__Breaker__State.closed:
+            return True
+        now = self.now() if now is None else now
+        with self.lock:
+            if breaker.state is Enum__Proxy__Breaker__State.closed:             # (closed by a probe meanwhile)
+                return True
+            if now - breaker.opened_at < int(config.breaker_open_time):
+                return False
+            breaker.state     = Enum__Proxy__Breaker__State.half_open           # this request is the probe
+            breaker.opened_at = now
+            return True
+
+    def retry_after(self, config : Schema__Proxy__Config,                       # Seconds until the host's breaker lets a probe through
+                          host   : str                  ,
+                          now    : float = None
+                     ) -> int:
+        breaker = self.hosts.get(host)
+        if breaker is None:
+            return 0
+        now = self.now() if now is None else now
+        return max(1, math.ceil(breaker.opened_at + int(config.breaker_open_time) - now))
+
+    def record(self, config : Schema__Proxy__Config,                            # Count an upstream call's outcome (failed: connection error or timeout)
+                     host   : str                  ,
+                     failed : bool                 ,
+                     now    : float = None
+                ) -> None:
+        breaker = self.hosts.get(host) or self.add_host(host)
+        now     = self.now() if now is None else now
+        second  = int(now)
+        with self.lock:
+            if breaker.state is Enum__Proxy__Breaker__State.half_open:          # the probe's answer
+                if failed:
+                    self.open(breaker, now)
+                else:
+                    breaker.state = Enum__Proxy__Breaker__State.closed
+                    breaker.setup()                                             # (failures from before the breaker opened don't count any more)
+                return
+            if breaker.state is Enum__Proxy__Breaker__State.open:               # (calls that were already in flight when it opened)
+                return
+            breaker.calls.add(second, 1)
+            if failed is False:
+                return
+            breaker.failures.add(second, 1)
+            window   = int(config.breaker_window)
+            calls    = breaker.calls   .total(second + 1, window)               # (this second included)
+            failures = breaker.failures.total(second + 1, window)
+            if calls >= int(config.breaker_min_calls) and failures >= calls * float(config.breaker_error_rate):
+                self.open(breaker, now)
+
+    def open(self, breaker : Service__Proxy__Breaker__Host,                     # (caller holds the lock)
+                   now     : float
+              ) -> None:
+        breaker.state      = Enum__Proxy__Breaker__State.open
+        breaker.opened_at  = now
+        breaker.opened    += 1
+
+    def add_host(self, host: str) -> Service__Proxy__Breaker__Host:
+        with self.lock:
+            breaker = self.hosts.get(host)
+            if breaker is None:
+                if len(self.hosts) >= BREAKER__HOSTS_LIMIT:
+                    for name, other in list(self.hosts.items()):
+                        if other.state is Enum__Proxy__Breaker__State.closed:
+                            del self.hosts[name]
+                            break
+                breaker = self.hosts[host] = Service__Proxy__Breaker__Host().setup()
+            return breaker
+
+    def error__circuit_open(self, target_url  : Safe_Str__Url,
+                                  retry_after : int
+                             ) -> Proxy_Error__Circuit_Open:
+        return Proxy_Error__Circuit_Open(f"Service unavailable - upstream for {target_url} is failing, retry in {retry_after}s", retry_after)
+
+    def get_states(self, config: Schema__Proxy__Config) -> Dict[str, Dict[str, object]]:   # host -> state, times opened and failure rate over breaker_window
+        second = int(self.now())
+        window = int(config.breaker_window)
+        states = {}
+        with self.lock:
+            for host, breaker in sorted(self.hosts.items()):
+                calls        = breaker.calls   .total(second + 1, window)
+                failures     = breaker.failures.total(second + 1, window)
+                states[host] = dict(state      = breaker.state.value                          ,
+                                    opened     = breaker.opened                               ,
+                                    error_rate = round(failures / calls, 4) if calls else 0.0 )
+        return states
+
+    def reset(self) -> None:
+        with self.lock:
+            self.hosts.clear()
@@ -0,0 +1,34 @@
+import threading
+from typing                                                         import Dict
+from osbot_utils.type_safe.Type_Safe                                import Type_Safe
+
+BUDGET__BURST       = 10.0                                                      # tokens each host starts with (and can save up to), so quiet hosts still get some
+BUDGET__HOSTS_LIMIT = 1024                                                      # hosts with a budget of their own (least recently used go first)
+
+
+class Service__Proxy__Budget(Type_Safe):                                        # Token bucket per upstream host: each request adds a share of a token, each extra upstream call (retry, hedge) takes a whole one
+    lock      : threading.Condition                                             # guards tokens and exhausted
+    tokens    : dict                                                            # host -> tokens left
+    exhausted : int                                                             # extra calls denied (the host's budget was spent)
+
+    def deposit(self, host   : str  ,                                           # A request to a host: adds amount (e.g. 0.1, to allow one extra call per 10 requests)
+                      amount : float
+                 ) -> None:
+        with self.lock:
+            tokens = self.tokens.pop(host, BUDGET__BURST)                       # (re-inserted: most recently used go last)
+            self.tokens[host] = min(BUDGET__BURST, round(tokens + amount, 6))   # (rounded: ten 0.1 deposits make a whole token)
+            if len(self.tokens) > BUDGET__HOSTS_LIMIT:
+                del self.tokens[next(iter(self.tokens))]
+
+    def withdraw(self, host: str) -> bool:                                      # Take a token for an extra call (False when the host's budget is spent)
+        with self.lock:
+            tokens = self.tokens.get(host, BUDGET__BURST)
+            if tokens < 1:
+                self.exhausted += 1
+                return False
+            self.tokens[host] = tokens - 1
+            return True
+
+    def get_budgets(self) -> Dict[str, float]:                                  # host -> tokens left
+        with self.lock:
+            return {host: round(tokens, 2) for host, tokens in sorted(self.tokens.items())}
@@ -0,0 +1,515 @@
+import threading
+import time
+import types
+from collections                                                        import OrderedDict
+from email.utils                                                        import parsedate_to_datetime
+from typing                                                             import Callable, Dict, Iterator, Optional, Tuple
+from osbot_utils.type_safe.Type_Safe                                    import Type_Safe
+from mgraph_ai_service_proxy.schemas.Enum__Proxy__Cache__State          import Enum__Proxy__Cache__State
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Cache__Entry        import Schema__Proxy__Cache__Entry
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Cache__Disk  import Service__Proxy__Cache__Disk
+
+CACHEABLE__METHODS      = ('GET',)
+CACHEABLE__STATUS_CODES = (200, 203, 204, 300, 301, 308, 404, 405, 410, 414, 501)   # RFC 9110 "heuristically cacheable" codes (minus 206, we don't store ranges)
+PURGE__INTERVAL         = 10                                                    # seconds between sweeps for stale entries (which are otherwise only dropped when looked up or evicted)
+NOT_MODIFIED__SKIP_HEADERS = ('content-length', 'content-encoding', 'content-type', 'age')   # never taken from a 304 (they describe the stored body, not the 304's)
+NO_STALE__DIRECTIVES       = {'no-cache', 'must-revalidate', 'proxy-revalidate', 's-maxage'}   # responses that must never be served stale (RFC 9111 4.2.4)
+STALE_IF_ERROR__STATUS_CODES = (500, 502, 503, 504)                                     # upstream failures a stale copy may stand in for (RFC 5861)
+DISK__FLUSH_INTERVAL    = 1.0                                                   # seconds between saves of the disk tier's index (changes in between are saved together, a crash loses at most this much)
+
+
+class Service__Proxy__Cache(Type_Safe):                                         # In-memory RFC 9111 shared cache: LRU bounded by bytes, stale entries kept only while they can be revalidated or served stale
+    lock     : threading.Condition                                              # guards entries, variants and size (hits and stores come from many threads)
+    entries  : OrderedDict                                                      # key -> Schema__Proxy__Cache__Entry, least recently used first
+    variants : dict                                                             # primary key -> (request header names in the response's Vary, number of entries stored for it)
+    size     : int                                                              # total bytes held
+    purged_at: float                                                            # last sweep for stale entries
+    refreshing: set                                                             # keys of the entries being refreshed in the background (so each is refreshed once)
+    disk     : Service__Proxy__Cache__Disk                                      # bodies too big for memory (config.cache_disk), the entries above keep only their headers
+    flusher  : threading.Thread = None                                          # saves the disk tier's index every DISK__FLUSH_INTERVAL (once the disk tier is open)
+
+    # ---- Cache-Control / header parsing ----
+
+    def cache_control(self, value: Optional[str]) -> Dict[str, Optional[str]]:  # 'max-age=60, private' -> {'max-age': '60', 'private': None}
+        directives = {}
+        if value:
+            for item in value.split(','):
+                name, _, argument = item.partition('=')
+                name = name.strip().lower()
+                if name:
+                    directives[name] = argument.strip().strip('"') if argument else None
+        return directives
+
+    def seconds(self, value: Optional[str]) -> Optional[int]:                   # delta-seconds argument (None when missing or invalid)
+        try:
+            return max(0, int(value))
+        except (TypeError, ValueError):
+            return None
+
+    def http_date(self, value: Optional[str]) -> Optional[float]:               # HTTP-date as a timestamp (None when missing or invalid)
+        if not value:
+            return None
+        try:
+            return parsedate_to_datetime(value).timestamp()
+        except (TypeError, ValueError, IndexError):
+            return None
+
+    def lower_headers(self, headers: Dict[str, str]) -> Dict[str, str]:
+        return {str(name).lower(): str(value) for name, value in headers.items()}
+
+    def primary_key(self, method: str, target_url: str) -> str:
+        return f'{method} {target_url}'
+
+    def vary_key(self, primary_key     : str           ,                        # Full key: the primary key plus the values of the headers the response varies on
+                       names           : tuple         ,
+                       request_headers : Dict[str, str]                         # (lower case names)
+                  ) -> tuple:
+        return (primary_key, tuple(' '.join(request_headers.get(name, '').split()) for name in names))
+
+    # ---- freshness ----
+
+    def freshness_lifetime(self, directives : Dict[str, Optional[str]],        # Explicit freshness lifetime in seconds (None when upstream gave none)
+                                 headers    : Dict[str, str]           ,        # (lower case names)
+                                 now        : float
+                            ) -> Optional[float]:
+        for name in ('s-maxage', 'max-age'):                                    # s-maxage wins, since we are a shared cache
+            if name in directives:
+                return self.seconds(directives[name]) or 0
+        if 'expires' in headers:
+            expires = self.http_date(headers['expires'])
+            if expires is None:                                                 # invalid Expires means already expired
+                return 0
+            date = self.http_date(headers.get('date')) or now
+            return max(0.0, expires - date)
+        return None
+
+    def initial_age(self, headers : Dict[str, str],                             # Age the response already had when it reached us
+                          now     : float
+                     ) -> float:
+        age_value    = self.seconds(headers.get('age')) or 0
+        date         = self.http_date(headers.get('date'))
+        apparent_age = max(0.0, now - date) if date else 0.0
+        return max(float(age_value), apparent_age)
+
+    def current_age(self, entry : Schema__Proxy__Cache__Entry,
+                          now   : float
+                     ) -> float:
+        return entry.initial_age + max(0.0, now - entry.stored_at)
+
+    def is_fresh(self, entry     : Schema__Proxy__Cache__Entry  ,               # Can this entry be used for a request with these Cache-Control directives?
+                       directives: Dict[str, Optional[str]]     ,
+                       now       : float
+                  ) -> bool:
+        age       = self.current_age(entry, now)
+        remaining = entry.lifetime - age
+        if 'max-age' in directives and age > (self.seconds(directives['max-age']) or 0):
+            return False
+        if 'min-fresh' in directives and remaining < (self.seconds(directives['min-fresh']) or 0):
+            return False
+        return remaining > 0
+
+    def staleness(self, entry : Schema__Proxy__Cache__Entry,                    # Seconds past its freshness lifetime (negative while fresh)
+                        now   : float
+                   ) -> float:
+        return self.current_age(entry, now) - entry.lifetime
+
+    def keep(self, entry : Schema__Proxy__Cache__Entry,                         # Is this entry still any use? (fresh, can be revalidated, or may still be served stale)
+                   now   : float
+              ) -> bool:
+        if self.has_validators(entry):
+            return True
+        return self.staleness(entry, now) < max(entry.stale_while_revalidate, entry.stale_if_error, 0.0)
+
+    def stale_if_error(self, entry : Schema__Proxy__Cache__Entry,               # May this entry stand in for a failed upstream call?
+                             now   : float = None
+                        ) -> bool:
+        return entry.stale_if_error > 0 and self.staleness(entry, now or time.time()) < entry.stale_if_error
+
+    def entry_fields(self, headers : Dict[str, str],                            # Freshness and validators of a response (lower case header names), as Schema__Proxy__Cache__Entry fields
+                           now     : float
+                      ) -> Dict:
+        directives = self.cache_control(headers.get('cache-control'))
+        lifetime   = self.freshness_lifetime(directives, headers, now) or 0    # no heuristic freshness: without an explicit lifetime it is stale from the start
+        if 'no-cache' in directives:                                            # may be stored, but must be revalidated on every use
+            lifetime = 0
+        stale_while_revalidate = stale_if_error = 0
+        if not (NO_STALE__DIRECTIVES & directives.keys()):
+            stale_while_revalidate = self.seconds(directives.get('stale-while-revalidate')) or 0
+            stale_if_error         = self.seconds(directives.get('stale-if-error'        )) or 0
+        return dict(lifetime               = lifetime                          ,
+                    initial_age            = self.initial_age(headers, now)    ,
+                    etag                   = headers.get('etag'         , '')  ,
+                    last_modified          = headers.get('last-modified', '')  ,
+                    stale_while_revalidate = stale_while_revalidate            ,
+                    stale_if_error         = stale_if_error                    )
+
+    def request_bypasses_cache(self, directives : Dict[str, Optional[str]],     # Client asked for an end-to-end reload?
+                                     headers    : Dict[str, str]                # (lower case names)
+                                ) -> bool:
+        if 'no-cache' in directives or 'no-store' in directives:
+            return True
+        if not directives and 'no-cache' in headers.get('pragma', '').lower():  # Pragma only counts when there is no Cache-Control
+            return True
+        return False
+
+    # ---- lookup / store ----
+
+    def lookup(self, method          : str           ,                          # (stored response, its state) for this request ((None, miss) when there is none)
+                     target_url      : str           ,
+                     request_headers : Dict[str, str],
+                     now             : float = None
+                ) -> Tuple[Optional[Schema__Proxy__Cache__Entry], Enum__Proxy__Cache__State]:
+        if method not in CACHEABLE__METHODS:
+            return None, Enum__Proxy__Cache__State.miss
+        now             = now or time.time()
+        request_headers = self.lower_headers(request_headers)
+        directives      = self.cache_control(request_headers.get('cache-control'))
+        if self.request_bypasses_cache(directives, request_headers):
+            return None, Enum__Proxy__Cache__State.miss
+        primary_key = self.primary_key(method, target_url)
+        with self.lock:
+            variant = self.variants.get(primary_key)
+            if variant is None:
+                return None, Enum__Proxy__Cache__State.miss
+            key   = self.vary_key(primary_key, variant[0], request_headers)
+            entry = self.entries.get(key)
+            if entry is None:
+                return None, Enum__Proxy__Cache__State.miss
+            if self.is_fresh(entry, directives, now):
+                self.touch(entry)
+                return entry, Enum__Proxy__Cache__State.fresh
+            if self.keep(entry, now) is False:                                  # past its lifetime and of no other use
+                self.remove(key)
+                return None, Enum__Proxy__Cache__State.miss
+            self.touch(entry)
+            if 0 <= self.staleness(entry, now) < entry.stale_while_revalidate and not directives:    # (a client with its own freshness limits gets a current response)
+                return entry, Enum__Proxy__Cache__State.stale
+            return entry, Enum__Proxy__Cache__State.expired
+
+    def storable(self, method            : str                      ,           # May this response be stored by a shared cache?
+                       status_code       : int                      ,
+                       request_headers   : Dict[str, str]           ,           # (lower case names)
+                       response_headers  : Dict[str, str]           ,           # (lower case names)
+                       directives        : Dict[str, Optional[str]]
+                  ) -> bool:
+        if method not in CACHEABLE__METHODS or status_code not in CACHEABLE__STATUS_CODES:
+            return False
+        if {'no-store', 'private'} & directives.keys():
+            return False
+        if 'no-store' in self.cache_control(request_headers.get('cache-control')):
+            return False
+        if 'authorization' in request_headers and not ({'public', 's-maxage', 'must-revalidate'} & directives.keys()):
+            return False
+        if 'set-cookie' in response_headers:                                    # never hand one client's cookies to another
+            return False
+        return response_headers.get('vary', '').strip() != '*'
+
+    def store(self, method           : str           ,                          # Store a response when RFC 9111 allows it (returns the entry, or None when not stored)
+                    target_url       : str           ,
+                    request_headers  : Dict[str, str],
+                    status_code      : int           ,
+                    response_headers : Dict[str, str],
+                    content          : bytes         ,
+                    max_size         : int           ,                          # config.cache_max_size
+                    entry_limit      : int           ,                          # config.cache_entry_limit
+                    disk_max_size    : int   = 0     ,                          # config.cache_disk_max_size (bodies over the limits above go to disk, when it is open)
+                    now              : float = None
+               ) -> Optional[Schema__Proxy__Cache__Entry]:
+        headers_size = sum(len(str(name)) + len(str(value)) for name, value in response_headers.items())
+        size         = len(content) + headers_size
+        on_disk      = size > entry_limit or size > max_size
+        if on_disk and not (self.disk.path and content and len(content) <= disk_max_size and headers_size <= max_size):
+            return None
+        now              = now or time.time()
+        request_headers  = self.lower_headers(request_headers )
+        lower_headers    = self.lower_headers(response_headers)
+        directives       = self.cache_control(lower_headers.get('cache-control'))
+        if self.storable(method, status_code, request_headers, lower_headers, directives) is False:
+            return None
+        primary_key = self.primary_key(method, target_url)
+        names       = tuple(sorted({name.strip().lower() for name in lower_headers.get('vary', '').split(',') if name.strip()}))
+        key         = self.vary_key(primary_key, names, request_headers)
+        entry       = Schema__Proxy__Cache__Entry(key         = key                                                          ,
+                                                  status_code = status_code                                                  ,
+                                                  headers     = {str(name): str(value) for name, value in response_headers.items()},
+                                                  content     = b'' if on_disk else content                                  ,
+                                                  stored_at   = now                                                          ,
+                                                  size        = headers_size if on_disk else size                            ,
+                                                  **self.entry_fields(lower_headers, now)                                    )
+        if self.keep(entry, now) is False:                                      # already stale, with nothing to revalidate it with (and no stale windows)
+            return None
+        if on_disk:
+            entry.digest = self.disk.write_body(content)                        # (outside the lock: the file only appears once complete)
+        with self.lock:
+            self.insert(entry, names)
+            if on_disk:
+                if self.disk.add(entry, names, len(content)) is False:
+                    self.remove(key)
+                    return None
+                for old_key in self.disk.evict(disk_max_size):
+                    if old_key in self.entries:
+                        self.remove(old_key)
+            self.evict(max_size)
+            if now - self.purged_at > PURGE__INTERVAL:
+                self.purge(now)
+        return entry
+
+    def insert(self, entry : Schema__Proxy__Cache__Entry,                       # Add an entry, replacing the one with its key (caller holds the lock)
+                     names : tuple                                              # request header names in its Vary
+                ) -> None:
+        primary_key = entry.key[0]
+        variant     = self.variants.get(primary_key)
+        if variant and variant[0] != names:                                     # Vary changed upstream: the old variants can't be matched any more (rare, so a scan is fine)
+            for old_key in [old_key for old_key in self.entries if old_key[0] == primary_key]:
+                self.remove(old_key)
+        if entry.key in self.entries:
+            self.remove(entry.key)
+        count                      = self.variants.get(primary_key, (names, 0))[1]
+        self.variants[primary_key] = (names, count + 1)
+        self.entries [entry.key  ] = entry
+        self.size                 += entry.size
+
+    def touch(self, entry: Schema__Proxy__Cache__Entry) -> None:                # Mark an entry (and its body on disk) as recently used (caller holds the lock)
+        self.entries.move_to_end(entry.key)
+        if entry.digest:
+            self.disk.touch(entry.digest)
+
+    def remove(self, key: tuple) -> None:                                       # (caller holds the lock)
+        entry        = self.entries.pop(key)
+        self.size   -= entry.size
+        if entry.digest:
+            self.disk.drop(key)
+        names, count = self.variants[key[0]]
+        if count > 1:
+            self.variants[key[0]] = (names, count - 1)
+        else:
+            del self.variants[key[0]]
+
+    def evict(self, max_size: int) -> None:                                     # Drop least recently used entries until we fit (caller holds the lock)
+        while self.size > max_size and self.entries:
+            self.remove(next(iter(self.entries)))
+
+    def purge(self, now: float) -> None:                                        # Drop every stale entry that is of no more use (caller holds the lock)
+        self.purged_at = now
+        for key in [key for key, entry in self.entries.items() if self.is_fresh(entry, {}, now) is False and self.keep(entry, now) is False]:
+            self.remove(key)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.variants.clear()
+            self.size = 0
+            self.disk.clear()
+        self.flush_disk()
+
+    def response_headers(self, entry : Schema__Proxy__Cache__Entry,             # Headers for a hit (the stored ones plus its current Age)
+                               now   : float = None
+                          ) -> Dict[str, str]:
+        headers = {name: value for name, value in entry.headers.items() if name.lower() != 'age'}
+        headers['Age'] = str(int(self.current_age(entry, now or time.time())))
+        return headers
+
+    # ---- conditional requests ----
+
+    def has_validators(self, entry: Schema__Proxy__Cache__Entry) -> bool:
+        return bool(entry.etag or entry.last_modified)
+
+    def validators(self, entry: Optional[Schema__Proxy__Cache__Entry]) -> Dict[str, str]:    # Conditional headers that ask upstream whether our stored copy is still current
+        validators = {}
+        if entry is not None:
+            if entry.etag:
+                validators['If-None-Match'    ] = entry.etag
+            if entry.last_modified:
+                validators['If-Modified-Since'] = entry.last_modified
+        return validators
+
+    def refresh(self, entry            : Schema__Proxy__Cache__Entry,           # Freshen a stored response with the headers of upstream's 304 (RFC 9111 4.3.4), keeping its body
+                      response_headers : Dict[str, str]             ,
+                      max_size         : int                        ,
+                      now              : float = None
+                 ) -> Schema__Proxy__Cache__Entry:
+        now     = now or time.time()
+        headers = dict(entry.headers)
+        names   = {name.lower(): name for name in headers}
+        for name, value in response_headers.items():
+            name, value = str(name), str(value)
+            lower_name  = name.lower()
+            if lower_name in NOT_MODIFIED__SKIP_HEADERS:
+                continue
+            if lower_name == 'etag' and headers.get(names.get('etag'), '') == f'W/{value}':   # we weakened it when compressing (and still send the compressed body)
+                continue
+            headers.pop(names.get(lower_name), None)
+            headers[name]     = value
+            names[lower_name] = name
+        fields    = self.entry_fields(self.lower_headers(headers), now)
+        fields['initial_age'] = self.initial_age(self.lower_headers(response_headers), now)     # (the 304's own Age / Date, not the stored ones)
+        size      = len(entry.content) + sum(len(name) + len(value) for name, value in headers.items())
+        refreshed = Schema__Proxy__Cache__Entry(key         = entry.key         ,
+                                                status_code = entry.status_code ,
+                                                headers     = headers           ,
+                                                content     = entry.content     ,
+                                                stored_at   = now               ,
+                                                size        = size              ,
+                                                digest      = entry.digest      ,
+                                                **fields                        )
+        with self.lock:
+            if self.entries.get(entry.key) is entry:                            # (unless it was evicted or replaced meanwhile)
+                self.entries[entry.key]  = refreshed
+                self.size               += size - entry.size
+                self.touch(refreshed)
+                if entry.digest and self.disk.add(refreshed, self.variants[entry.key[0]][0], self.disk.bodies.get(entry.digest, 0)) is False:
+                    self.remove(entry.key)
+                self.evict(max_size)
+        return refreshed
+
+    def not_modified(self, entry           : Schema__Proxy__Cache__Entry,       # Do the client's own validators match this entry? (then a 304 is all it needs)
+                           request_headers : Dict[str, str]
+                      ) -> bool:
+        if_none_match     = None
+        if_modified_since = None
+        for name, value in request_headers.items():
+            name = str(name).lower()
+            if name == 'if-none-match':
+                if_none_match = str(value)
+            elif name == 'if-modified-since':
+                if_modified_since = str(value)
+        if if_none_match is not None:                                           # If-None-Match wins over If-Modified-Since (RFC 9110 13.2.2)
+            if if_none_match.strip() == '*':
+                return True
+            if not entry.etag:
+                return False
+            etag = self.weak_tag(entry.etag)
+            return any(self.weak_tag(tag) == etag for tag in if_none_match.split(','))
+        if if_modified_since is not None and entry.status_code == 200:
+            last_modified = self.http_date(entry.last_modified)
+            since         = self.http_date(if_modified_since)
+            return last_modified is not None and since is not None and last_modified <= since
+        return False
+
+    def weak_tag(self, etag: str) -> str:                                       # Opaque tag for a weak comparison ('W/"abc"' and '"abc"' match)
+        etag = etag.strip()
+        return etag[2:] if etag.startswith('W/') else etag
+
+    # ---- background refreshes ----
+
+    def start_refresh(self, key: tuple) -> bool:                                # Claim the background refresh of an entry (False when one is already running)
+        with self.lock:
+            if key in self.refreshing:
+                return False
+            self.refreshing.add(key)
+            return True
+
+    def end_refresh(self, key: tuple) -> None:
+        with self.lock:
+            self.refreshing.discard(key)
+
+    # ---- disk tier ----
+
+    def open_disk(self, path          : str,                                    # Use the disk tier in path, taking over the entries a previous run left there (warm restart)
+                        max_size      : int,                                    # config.cache_max_size
+                        disk_max_size : int,                                    # config.cache_disk_max_size
+                        now           : float = None
+                   ) -> None:
+        if self.disk.path == path:                                              # (checked again under the lock, this is the hot path)
+            return
+        now = now or time.time()
+        with self.lock:
+            if self.disk.path == path:
+                return
+            self.disk.flush(now)                                                # the index we leave behind stays usable
+            for key in [key for key, entry in self.entries.items() if entry.digest]:
+                self.remove(key)
+            for entry, names in self.disk.open(path):
+                variant = self.variants.get(entry.key[0])
+                if entry.key in self.entries or (variant and variant[0] != names) or self.keep(entry, now) is False:
+                    self.disk.drop(entry.key)
+                    continue
+                self.insert(entry, names)
+            for key in self.disk.evict(disk_max_size):
+                if key in self.entries:
+                    self.remove(key)
+            self.evict(max_size)
+            self.disk.flush(now)                                                # (opening is rare: saved right away)
+            if self.flusher is None:
+                self.flusher = threading.Thread(target=self.run_flushes, name='proxy-cache-flusher', daemon=True)
+                self.flusher.start()
+
+    def flush_disk(self, now: float = None) -> None:                            # Save the disk tier's changes: a snapshot taken under the lock, written once it is released (hits never wait on the disk)
+        with self.lock:
+            snapshot = self.disk.snapshot(now)
+        self.disk.save_index(snapshot)
+
+    def run_flushes(self) -> None:
+        while True:
+            time.sleep(DISK__FLUSH_INTERVAL)
+            try:
+                self.flush_disk()
+            except OSError:                                                     # (folder gone or full: tried again next time)
+                pass
+
+    def content(self, entry: Schema__Proxy__Cache__Entry) -> bytes:            # Body of an entry (read from disk when it is held there)
+        if entry.digest:
+            return self.disk.read(entry.digest)
+        return entry.content
+
+    def chunks(self, entry      : Schema__Proxy__Cache__Entry,                  # Body of an entry as a stream (memoryview slices of an mmap when it is on disk)
+                     chunk_size : int
+                ) -> types.GeneratorType:
+        if entry.digest:
+            return self.disk.chunks(entry.digest, chunk_size)
+        return self.memory_chunks(entry.content)
+
+    def chunks__async(self, entry      : Schema__Proxy__Cache__Entry,           # Async version of chunks (asyncio engine)
+                            chunk_size : int
+                       ) -> types.AsyncGeneratorType:
+        if entry.digest:
+            return self.disk.chunks__async(entry.digest, chunk_size)
+        return self.memory_chunks__async(entry.content)
+
+    def memory_chunks(self, content: bytes) -> types.GeneratorType:             # Body held in memory as a (single chunk) stream
+        if content:
+            yield content
+
+    async def memory_chunks__async(self, content: bytes) -> types.AsyncGeneratorType:
+        if content:
+            yield content
+
+    # ---- streamed responses ----
+
+    def tee(self, chunks      : Iterator[bytes]         ,                       # Pass a streamed body through, handing it to on_complete when it was read to the end (and is not too big)
+                  entry_limit : int                     ,
+                  on_complete : Callable[[bytes], None]
+             ) -> types.GeneratorType:
+        parts, size = [], 0
+        try:
+            for chunk in chunks:
+                if parts is not None:
+                    size += len(chunk)
+                    if size > entry_limit:
+                        parts = None                                            # too big to cache, but keep streaming it
+                    else:
+                        parts.append(chunk)
+                yield chunk
+        finally:
+            chunks.close()
+        if parts is not None:
+            on_complete(b''.join(parts))
+
+    async def tee__async(self, chunks      ,                                    # Async version of tee (asyncio engine)
+                               entry_limit : int                     ,
+                               on_complete : Callable[[bytes], None]
+                          ) -> types.AsyncGeneratorType:
+        parts, size = [], 0
+        try:
+            async for chunk in chunks:
+                if parts is not None:
+                    size += len(chunk)
+                    if size > entry_limit:
+                        parts = None
+                    else:
+                        parts.append(chunk)
+                yield chunk
+        finally:
+            await chunks.aclose()
+        if parts is not None:
+            on_complete(b''.join(parts))
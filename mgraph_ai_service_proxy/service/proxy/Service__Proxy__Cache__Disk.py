@@ -0,0 +1,232 @@
+import hashlib
+import json
+import mmap
+import os
+import threading
+import time
+import types
+from collections                                                    import OrderedDict
+from typing                                                         import Dict, List, Optional, Tuple
+from osbot_utils.type_safe.Type_Safe                                import Type_Safe
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Cache__Entry    import Schema__Proxy__Cache__Entry
+
+INDEX__FILE_NAME  = 'index.json'
+INDEX__VERSION    = 1
+OBJECTS__FOLDER   = 'objects'
+TEMP__SUFFIX      = '.tmp'
+RETIRE__GRACE     = 60                                                          # seconds a body no entry uses is kept, so a hit that just looked it up can still open it
+RECORD__FIELDS    = ('status_code', 'headers', 'stored_at', 'initial_age', 'lifetime', 'size', 'etag', 'last_modified',
+                     'stale_while_revalidate', 'stale_if_error', 'digest')          # entry fields kept in the index (all but key and content)
+
+
+class Service__Proxy__Cache__Disk(Type_Safe):                                   # On-disk tier of the proxy cache: bodies too big for memory, as content-addressed (sha256) files read via mmap
+    path    : str                                                               # directory in use ('' until opened)
+    bodies  : OrderedDict                                                       # digest -> size in bytes, least recently used first
+    records : dict                                                              # entry key -> index record (the entry's fields, minus its body)
+    size    : int                                                               # total bytes of the bodies on disk
+    retired : dict                                                              # digest -> when its last entry went (deleted RETIRE__GRACE seconds later)
+    dirty   : bool                                                              # index changed since its last snapshot
+    saving  : threading.Condition                                               # one index write at a time
+    copies  : int                                                               # index snapshots taken
+    saved   : int                                                               # newest snapshot written (older ones that come late are skipped)
+
+    # ---- files ----
+
+    def index_path(self) -> str:
+        return os.path.join(self.path, INDEX__FILE_NAME)
+
+    def body_path(self, digest: str) -> str:                                    # objects/ab/abcdef... (two levels, so no folder gets too big)
+        return os.path.join(self.path, OBJECTS__FOLDER, digest[:2], digest)
+
+    def write_file(self, target  : str  ,                                       # Crash-safe write: a temp file next to the target, renamed over it once complete
+                         content : bytes
+                    ) -> None:
+        temp = f'{target}.{os.getpid()}.{threading.get_ident()}{TEMP__SUFFIX}'
+        with open(temp, 'wb') as file:
+            file.write(content)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp, target)                                                # atomic: readers see the old file or the new one, never half of one
+
+    def write_body(self, content: bytes) -> str:                                # Store a body (once per distinct content) and return its digest (no lock needed: the file only appears when complete)
+        digest = hashlib.sha256(content).hexdigest()
+        target = self.body_path(digest)
+        if not os.path.isfile(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            self.write_file(target, content)
+        return digest
+
+    def delete_file(self, target: str) -> None:
+        try:
+            os.remove(target)
+        except FileNotFoundError:
+            pass
+
+    # ---- index ----
+
+    def open(self, path: str) -> List[Tuple[Schema__Proxy__Cache__Entry, tuple]]:   # Load the index left in path (warm restart), returning (entry, vary names) for every body still on disk
+        self.path, self.bodies, self.records, self.retired, self.size, self.dirty = path, OrderedDict(), {}, {}, 0, False
+        os.makedirs(os.path.join(path, OBJECTS__FOLDER), exist_ok=True)
+        index  = self.load_index()
+        for digest, size in index.get('bodies', []):
+            if os.path.isfile(self.body_path(digest)):
+                self.bodies[digest] = size
+                self.size          += size
+        loaded = []
+        for record in index.get('records', []):
+            entry, names = self.entry(record)
+            if entry.digest in self.bodies:
+                self.records[entry.key] = record
+                loaded.append((entry, names))
+        self.remove_orphans()
+        return loaded
+
+    def load_index(self) -> Dict:                                               # ({} when missing, from another version, or unreadable)
+        try:
+            with open(self.index_path()) as file:
+                index = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        return index if index.get('version') == INDEX__VERSION else {}
+
+    def snapshot(self, now: float = None) -> Optional[Tuple[int, str, Dict]]:  # Delete unused bodies, and copy the index if it changed: (number, file, index) for save_index (caller holds the cache lock, nothing is written here)
+        if not (self.path and (self.dirty or self.retired)):
+            return None
+        self.remove_unreferenced(now or time.time(), RETIRE__GRACE)             # (only now: a body dropped with one entry may have been re-added with another)
+        if self.dirty is False:
+            return None
+        self.dirty   = False
+        self.copies += 1
+        return self.copies, self.index_path(), {'version': INDEX__VERSION                                      ,
+                                                'bodies' : [[digest, size] for digest, size in self.bodies.items()],
+                                                'records': list(self.records.values())                         }   # (records are replaced, never changed)
+
+    def save_index(self, snapshot: Optional[Tuple[int, str, Dict]]) -> None:   # Write an index snapshot (after the cache lock was released: encoding and fsync are the slow part)
+        if snapshot is None:
+            return
+        number, target, index = snapshot
+        content               = json.dumps(index).encode()
+        with self.saving:
+            if number > self.saved:
+                self.write_file(target, content)
+                self.saved = number
+
+    def flush(self, now: float = None) -> None:                                 # Delete unused bodies and save the index, if anything changed (snapshot and save in one go)
+        self.save_index(self.snapshot(now))
+
+    def remove_unreferenced(self, now   : float,                                # Delete the bodies no entry has used for grace seconds
+                                  grace : float
+                             ) -> None:
+        referenced = {record['digest'] for record in self.records.values()}
+        for digest in list(self.retired):
+            if digest in referenced or digest not in self.bodies:
+                del self.retired[digest]
+        for digest in [digest for digest in self.bodies if digest not in referenced]:
+            retired_at = self.retired.setdefault(digest, now)
+            if now - retired_at >= grace:
+                self.retired.pop(digest)
+                self.remove_body(digest)
+
+    def remove_orphans(self) -> None:                                           # Delete temp files and bodies the index doesn't know about (left by a crash mid-write)
+        self.remove_unreferenced(time.time(), 0)                                # (nothing is reading them yet)
+        for folder, _, file_names in os.walk(os.path.join(self.path, OBJECTS__FOLDER)):
+            for file_name in file_names:
+                if file_name not in self.bodies:
+                    self.delete_file(os.path.join(folder, file_name))
+
+    # ---- records (caller holds the cache lock) ----
+
+    def record(self, entry : Schema__Proxy__Cache__Entry,                       # Index record for an entry whose body is on disk
+                     names : tuple
+                ) -> Dict:
+        record          = {name: getattr(entry, name) for name in RECORD__FIELDS}
+        record['key'  ] = [entry.key[0], list(entry.key[1])]
+        record['names'] = list(names)
+        return record
+
+    def entry(self, record: Dict) -> Tuple[Schema__Proxy__Cache__Entry, tuple]:    # (entry, vary names) from an index record
+        entry = Schema__Proxy__Cache__Entry(key = (record['key'][0], tuple(record['key'][1])),
+                                            **{name: record[name] for name in RECORD__FIELDS})
+        return entry, tuple(record['names'])
+
+    def add(self, entry : Schema__Proxy__Cache__Entry,                          # Track an entry whose body was written with write_body (False when that body is gone already)
+                  names : tuple                      ,
+                  size  : int                                                   # body size
+             ) -> bool:
+        if not os.path.isfile(self.body_path(entry.digest)):                    # (an identical body, unused until now, was deleted by a flush meanwhile)
+            return False
+        if entry.digest not in self.bodies:
+            self.bodies[entry.digest] = size
+            self.size                += size
+        self.bodies.move_to_end(entry.digest)
+        self.records[entry.key] = self.record(entry, names)
+        self.dirty              = True
+        return True
+
+    def drop(self, key: tuple) -> None:                                         # Forget an entry (its body goes once no entry has used it for RETIRE__GRACE seconds)
+        if self.records.pop(key, None) is not None:
+            self.dirty = True
+
+    def remove_body(self, digest: str) -> None:
+        size = self.bodies.pop(digest, None)
+        if size is not None:
+            self.size -= size
+            self.dirty = True
+        self.delete_file(self.body_path(digest))
+
+    def evict(self, max_size: int) -> List[tuple]:                              # Drop least recently used bodies until we fit, returning the keys of the entries that went with them
+        evicted = []
+        while self.size > max_size and self.bodies:
+            digest = next(iter(self.bodies))
+            keys   = [key for key, record in self.records.items() if record['digest'] == digest]
+            for key in keys:
+                del self.records[key]
+            self.remove_body(digest)
+            evicted += keys
+        return evicted
+
+    def clear(self) -> None:                                                    # Forget every entry (their bodies go like dropped ones)
+        if self.records:
+            self.records.clear()
+            self.dirty = True
+
+    def touch(self, digest: str) -> None:                                       # Mark a body as recently used
+        if digest in self.bodies:
+            self.bodies.move_to_end(digest)
+
+    # ---- reads ----
+
+    def read(self, digest: str) -> bytes:                                       # Whole body (one copy, out of the page cache)
+        with open(self.body_path(digest), 'rb') as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped[:]
+
+    def chunks(self, digest     : str,                                          # Body as memoryview slices of an mmap: nothing is copied until the server writes them out
+                     chunk_size : int
+                ) -> types.GeneratorType:
+        with open(self.body_path(digest), 'rb') as file:                        # (opened before the first chunk is asked for, so a body evicted meanwhile is still readable)
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.mapped_chunks(mapped, chunk_size)
+
+    def mapped_chunks(self, mapped     : mmap.mmap,
+                            chunk_size : int
+                       ) -> types.GeneratorType:
+        try:
+            view = memoryview(mapped)
+            for offset in range(0, len(view), chunk_size):
+                yield view[offset:offset + chunk_size]
+        finally:
+            try:
+                mapped.close()
+            except BufferError:                                                 # slices still held by the reader: closed when they are garbage collected
+                pass
+
+    async def chunks__async(self, digest     : str,                             # Async version of chunks (asyncio engine)
+                                  chunk_size : int
+                             ) -> types.AsyncGeneratorType:
+        chunks = self.chunks(digest, chunk_size)
+        try:
+            for chunk in chunks:
+                yield chunk
+        finally:
+            chunks.close()
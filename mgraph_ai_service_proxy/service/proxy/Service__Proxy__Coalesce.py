@@ -0,0 +1,87 @@
+import asyncio
+import threading
+from typing                                                     import Any, Awaitable, Callable, Dict, Tuple
+from osbot_utils.type_safe.Type_Safe                            import Type_Safe
+
+COALESCE__METHODS         = ('GET', 'HEAD')                                     # safe methods without a body: one response fits every identical request
+COALESCE__IGNORED_HEADERS = { 'user-agent', 'referer', 'x-request-id'      ,    # differ per client, but don't change what upstream sends back
+                              'x-correlation-id', 'x-amzn-trace-id'        ,
+                              'traceparent', 'tracestate'                  }
+
+
+class Service__Proxy__Coalesce__Flight(Type_Safe):                              # One upstream call in flight (threads), shared by the identical requests that arrive meanwhile
+    done     : threading.Event                                                  # set once the leader has a response (or an error)
+    response : object      = None
+    error    : Exception   = None
+    waiters  : int                                                              # requests waiting for it (besides the leader)
+
+
+class Service__Proxy__Coalesce(Type_Safe):                                      # Single-flight: only one upstream call per key at a time, every waiter gets its result
+    lock           : threading.Condition                                        # guards both flight tables (threads, and event loops on other threads)
+    flights        : dict                                                       # key -> Service__Proxy__Coalesce__Flight
+    flights__async : dict                                                       # (event loop id, key) -> asyncio.Future
+
+    def key(self, method     : str           ,                                  # Requests with the same key get the same upstream response
+                  target_url : str           ,
+                  headers    : Dict[str, str]
+             ) -> tuple:
+        return (method, target_url, tuple(sorted((str(name).lower(), str(value)) for name, value in headers.items()
+                                                 if str(name).lower() not in COALESCE__IGNORED_HEADERS)))
+
+    def run(self, key     : tuple            ,                                  # (fetch's result, was it shared): the first caller fetches, the others wait for it
+                  fetch   : Callable[[], Any],
+                  timeout : float                                               # waiters give up after this long, and fetch on their own
+             ) -> Tuple[Any, bool]:
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Service__Proxy__Coalesce__Flight()
+            else:
+                flight.waiters += 1
+        if leader:
+            try:
+                flight.response = fetch()
+                return flight.response, False
+            except Exception as error:                                          # fanned out to every waiter
+                flight.error = error
+                raise
+            finally:
+                with self.lock:
+                    del self.flights[key]
+                flight.done.set()
+        if flight.done.wait(timeout) and (flight.response is not None or flight.error is not None):
+            if flight.error is not None:
+                raise flight.error
+            return flight.response, True
+        return fetch(), False                                                   # leader too slow (or gone): don't wait any longer
+
+    async def run__async(self, key     : tuple                      ,           # Async version of run (asyncio engine)
+                               fetch   : Callable[[], Awaitable[Any]],
+                               timeout : float
+                          ) -> Tuple[Any, bool]:
+        loop = asyncio.get_running_loop()
+        key  = (id(loop), key)                                                  # futures can only be awaited on their own loop
+        with self.lock:
+            future = self.flights__async.get(key)
+            leader = future is None
+            if leader:
+                future = self.flights__async[key] = loop.create_future()
+        if leader:
+            try:
+                response = await fetch()
+                future.set_result(response)
+                return response, False
+            except Exception as error:
+                future.set_exception(error)
+                future.exception()                                              # (marks it as retrieved, for when there were no waiters)
+                raise
+            finally:
+                with self.lock:
+                    del self.flights__async[key]
+                if not future.done():                                           # leader was cancelled: waiters fetch on their own
+                    future.cancel()
+        done, _ = await asyncio.wait({future}, timeout=timeout)                 # (unlike wait_for, this doesn't cancel the shared future on timeout)
+        if done and not future.cancelled():
+            return future.result(), True
+        return await fetch(), False
@@ -0,0 +1,150 @@
+import types
+import zlib
+from typing                                                     import AsyncIterator, Callable, Dict, Iterator, Optional, Tuple
+from osbot_utils.type_safe.Type_Safe                            import Type_Safe
+
+try:                                                                            # optional encoders, only offered when installed
+    import brotli
+except ImportError:                                                             # pragma: no cover
+    brotli = None
+try:
+    import zstandard
+except ImportError:                                                             # pragma: no cover
+    zstandard = None
+
+ENCODINGS__SUPPORTED = tuple(encoding for encoding, module in (('br'  , brotli   ),       # in order of preference (when the client rates them equally)
+                                                               ('zstd', zstandard),
+                                                               ('gzip', zlib     )) if module)
+
+COMPRESSIBLE__MIME_TYPES = { 'application/json'      , 'application/javascript', 'application/x-javascript',      # besides text/*, *+json and *+xml
+                             'application/xml'       , 'application/wasm'      , 'application/graphql-response+json',
+                             'image/svg+xml'         , 'image/x-icon'          , 'font/ttf', 'font/otf'           }
+
+NOT_COMPRESSIBLE__MIME_TYPES = { 'text/event-stream' }                          # events must reach the client as they happen
+
+NO_BODY__STATUS_CODES = (204, 304)
+PARTIAL__STATUS_CODES = (206, )                                                 # a byte range of the body as upstream encoded it (Content-Range counts those bytes)
+
+
+class Service__Proxy__Compression(Type_Safe):                                   # Compress responses for clients that accept it (gzip, plus br/zstd when installed)
+
+    def header(self, headers : Dict[str, str],                                  # Case-insensitive header lookup
+                     name    : str
+                ) -> Optional[str]:
+        for key, value in headers.items():
+            if key.lower() == name:
+                return value
+        return None
+
+    def negotiate(self, accept_encoding: Optional[str]) -> Optional[str]:       # Best encoding we support from the client's Accept-Encoding (None: send as is)
+        if not accept_encoding:
+            return None
+        qualities = {}
+        for item in accept_encoding.split(','):
+            name, _, params = item.partition(';')
+            name            = name.strip().lower()
+            quality         = 1.0
+            params          = params.strip().replace(' ', '')
+            if params.startswith('q='):
+                try:
+                    quality = float(params[2:])
+                except ValueError:
+                    quality = 0.0
+            qualities['gzip' if name == 'x-gzip' else name] = quality
+        best_encoding, best_quality = None, 0.0
+        for encoding in ENCODINGS__SUPPORTED:
+            quality = qualities.get(encoding, qualities.get('*', 0.0))
+            if quality > best_quality:                                          # q=0 means "not acceptable"
+                best_encoding, best_quality = encoding, quality
+        return best_encoding
+
+    def compressible(self, status_code    : int           ,                     # Is this response worth compressing?
+                           headers        : Dict[str, str],
+                           content_length : Optional[int] ,                     # None when unknown (e.g. streamed), which is compressed
+                           min_size       : int
+                      ) -> bool:
+        if status_code in NO_BODY__STATUS_CODES or status_code in PARTIAL__STATUS_CODES:
+            return False
+        if self.header(headers, 'content-encoding'):                            # already compressed (e.g. decode_content=False)
+            return False
+        if self.header(headers, 'content-range'):
+            return False
+        if 'no-transform' in (self.header(headers, 'cache-control') or '').lower(): # RFC 9110 7.7: a proxy must not transform the content
+            return False
+        if content_length is not None and content_length < min_size:           # tiny bodies get bigger, not smaller
+            return False
+        content_type = (self.header(headers, 'content-type') or '').split(';')[0].strip().lower()
+        if content_type in NOT_COMPRESSIBLE__MIME_TYPES:
+            return False
+        return (content_type.startswith('text/')            or
+                content_type in COMPRESSIBLE__MIME_TYPES    or
+                content_type.endswith('+json')              or
+                content_type.endswith('+xml'))
+
+    def update_headers(self, headers  : Dict[str, str],                         # Describe the compressed body (in place)
+                             encoding : str
+                        ) -> Dict[str, str]:
+        vary = None
+        for key in list(headers):
+            name = key.lower()
+            if name == 'content-length':                                        # no longer valid (the server sets the new one, or uses chunked)
+                del headers[key]
+            elif name == 'etag' and headers[key].startswith('"'):               # a different representation, so at most a weak match
+                headers[key] = f'W/{headers[key]}'
+            elif name == 'vary':
+                vary = key
+        headers['Content-Encoding'] = encoding
+        if vary is None:
+            headers['Vary'] = 'Accept-Encoding'
+        elif headers[vary].strip() != '*' and 'accept-encoding' not in headers[vary].lower():
+            headers[vary] = f'{headers[vary]}, Accept-Encoding'
+        return headers
+
+    def compress(self, content  : bytes,                                        # Compress a whole body
+                       encoding : str  ,
+                       level    : int
+                  ) -> bytes:
+        if encoding == 'br':
+            return brotli.compress(content, quality=min(level, 11))
+        if encoding == 'zstd':
+            return zstandard.ZstdCompressor(level=min(level, 22)).compress(content)
+        compressor = zlib.compressobj(min(level, 9), zlib.DEFLATED, 31)         # wbits=31: gzip container
+        return compressor.compress(content) + compressor.flush()
+
+    def compressor(self, encoding : str,                                        # (compress_chunk, finish) functions for a streamed body
+                         level    : int
+                    ) -> Tuple[Callable[[bytes], bytes], Callable[[], bytes]]:  # each compressed chunk is flushed, so the client can decode it as soon as it arrives
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=min(level, 11))
+            return (lambda chunk: compressor.process(chunk) + compressor.flush()), compressor.finish
+        if encoding == 'zstd':
+            compressor = zstandard.ZstdCompressor(level=min(level, 22)).compressobj()
+            return (lambda chunk: compressor.compress(chunk) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)), compressor.flush
+        compressor = zlib.compressobj(min(level, 9), zlib.DEFLATED, 31)
+        return (lambda chunk: compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)), compressor.flush
+
+    def compress_chunks(self, chunks   : Iterator[bytes],                       # Compress a streamed body, chunk by chunk
+                              encoding : str            ,
+                              level    : int
+                         ) -> types.GeneratorType:
+        compress_chunk, finish = self.compressor(encoding, level)
+        try:
+            for chunk in chunks:
+                if chunk:
+                    yield compress_chunk(chunk)
+            yield finish()
+        finally:
+            chunks.close()                                                      # releases upstream when the client goes away mid-stream
+
+    async def compress_chunks__async(self, chunks   : AsyncIterator[bytes],     # Async version of compress_chunks (asyncio engine)
+                                           encoding : str                 ,
+                                           level    : int
+                                      ) -> types.AsyncGeneratorType:
+        compress_chunk, finish = self.compressor(encoding, level)
+        try:
+            async for chunk in chunks:
+                if chunk:
+                    yield compress_chunk(chunk)
+            yield finish()
+        finally:
+            await chunks.aclose()
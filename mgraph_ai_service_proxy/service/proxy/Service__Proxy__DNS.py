@@ -0,0 +1,133 @@
+import socket
+import threading
+import time
+from typing                                                         import Callable, Dict, List, Optional, Tuple
+from urllib3.util.connection                                        import allowed_gai_family, _set_socket_options
+from urllib3.util.timeout                                           import _DEFAULT_TIMEOUT
+from osbot_utils.type_safe.Type_Safe                                import Type_Safe
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Config          import Schema__Proxy__Config
+
+DNS__HOSTS_LIMIT   = 1024                                                       # lookups kept (least recently used go first, so a flood of hosts can't grow it)
+DNS__REFRESH_AHEAD = 0.8                                                        # share of a lookup's TTL after which a hit resolves it again in the background (so hot hosts never wait on a miss)
+DNS__STATS         = ('hits', 'misses', 'negative_hits', 'refreshes', 'errors')
+
+
+class Service__Proxy__DNS(Type_Safe):                                           # getaddrinfo cache shared by every thread: TTL, negative caching (failed lookups) and refresh-ahead of hot hosts
+    resolver      : Callable = None                                             # getaddrinfo compatible (None: socket.getaddrinfo), e.g. a stub resolver in tests
+    lock          : threading.Condition                                         # guards entries, refreshing and the counters
+    entries       : dict                                                        # (host, port, family) -> (expires, refresh_at, addresses or the socket.gaierror of the lookup)
+    refreshing    : set                                                         # keys being resolved again in the background
+    hits          : int
+    misses        : int
+    negative_hits : int                                                         # failed lookups answered from the cache
+    refreshes     : int                                                         # background lookups started by refresh-ahead
+    errors        : int                                                         # lookups that failed (cached for config.dns_negative_ttl)
+
+    def lookup(self, host   : str,                                              # getaddrinfo(host, port, family, SOCK_STREAM), straight from the resolver
+                     port   : int,
+                     family : int
+                ) -> List[Tuple]:
+        resolver = self.resolver or socket.getaddrinfo
+        return list(resolver(host, port, family, socket.SOCK_STREAM))
+
+    def resolve(self, config : Schema__Proxy__Config,                           # Addresses of a host (raises socket.gaierror, also when a cached lookup failed)
+                      host   : str                  ,
+                      port   : int                  ,
+                      family : int = 0
+                 ) -> List[Tuple]:
+        key     = (host, port, family)
+        now     = time.monotonic()
+        refresh = False
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or now >= entry[0]:
+                self.misses += 1
+                result       = None
+            else:
+                self.entries[key] = self.entries.pop(key)                       # (most recently used go last)
+                expires, refresh_at, result = entry
+                if isinstance(result, socket.gaierror):
+                    self.negative_hits += 1
+                    raise socket.gaierror(*result.args)                         # (a new exception per caller: tracebacks are per raise)
+                self.hits += 1
+                if now >= refresh_at and key not in self.refreshing:
+                    self.refreshing.add(key)
+                    self.refreshes += 1
+                    refresh = True
+        if result is None:
+            result = self.store(config, key)
+            if isinstance(result, socket.gaierror):
+                raise result
+        elif refresh:
+            threading.Thread(target=self.refresh, args=(config, key), daemon=True).start()
+        return result
+
+    def store(self, config : Schema__Proxy__Config,                             # Look a key up and cache the outcome (addresses for config.dns_cache_ttl, errors for config.dns_negative_ttl)
+                    key    : Tuple
+               ):
+        try:
+            result = self.lookup(*key)
+            ttl    = int(config.dns_cache_ttl)
+        except socket.gaierror as error:
+            result = error
+            ttl    = int(config.dns_negative_ttl)
+        now = time.monotonic()
+        with self.lock:
+            if isinstance(result, socket.gaierror):
+                self.errors += 1
+                entry = self.entries.get(key)
+                if entry is not None and now < entry[0] and not isinstance(entry[2], socket.gaierror):
+                    return entry[2]                                             # (a failed refresh keeps the addresses until they expire)
+            self.entries.pop(key, None)
+            self.entries[key] = (now + ttl, now + ttl * DNS__REFRESH_AHEAD, result)
+            while len(self.entries) > DNS__HOSTS_LIMIT:
+                del self.entries[next(iter(self.entries))]
+        return result
+
+    def refresh(self, config : Schema__Proxy__Config,                           # Background lookup of a hot key (refresh-ahead)
+                      key    : Tuple
+                 ) -> None:
+        try:
+            self.store(config, key)
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+    def create_connection(self, config         : Schema__Proxy__Config,         # urllib3.util.connection.create_connection, with the addresses from the cache
+                                address        : Tuple[str, int]      ,
+                                timeout        = _DEFAULT_TIMEOUT     ,
+                                source_address : Optional[Tuple]      = None,
+                                socket_options : Optional[List]       = None
+                           ) -> socket.socket:
+        host, port = address
+        if host.startswith('['):
+            host = host.strip('[]')
+        error = None
+        for family, socket_type, proto, canonical_name, socket_address in self.resolve(config, host, port, allowed_gai_family()):
+            sock = None
+            try:
+                sock = socket.socket(family, socket_type, proto)
+                _set_socket_options(sock, socket_options)
+                if timeout is not _DEFAULT_TIMEOUT:
+                    sock.settimeout(timeout)
+                if source_address:
+                    sock.bind(source_address)
+                sock.connect(socket_address)
+                return sock
+            except OSError as exception:
+                error = exception
+                if sock is not None:
+                    sock.close()
+        if error is not None:
+            raise error
+        raise OSError('getaddrinfo returns an empty list')
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def get_stats(self) -> Dict[str, int]:                                      # DNS__STATS, plus the lookups held
+        with self.lock:
+            stats = {name: getattr(self, name) for name in DNS__STATS}
+            stats['entries'] = len(self.entries)
+        return stats
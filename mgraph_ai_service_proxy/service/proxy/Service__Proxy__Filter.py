@@ -1,5 +1,13 @@
-from typing                                      import Dict
-from osbot_utils.type_safe.Type_Safe             import Type_Safe
+from typing                                                             import Dict, Iterable, Set, Tuple, Union
+from osbot_utils.type_safe.Type_Safe                                    import Type_Safe
+from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Header_Value  import TYPE_SAFE_STR__HTTP__HEADER_VALUE__REGEX, TYPE_SAFE_STR__HTTP__HEADER_VALUE__MAX_LENGTH
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Intern       import safe_str_cache
+
+HEADER_NAMES__LIMIT = 4096                                                      # distinct header names kept per precompiled filter (it starts again when full, so odd names can't grow it forever)
+HEADER__DROP        = False                                                     # precompiled filter: header to leave out (skipped or invalid name)
+HEADER__CONNECTION  = True                                                      # precompiled filter: the Connection header (left out, along with the headers it names)
+
+Raw_Headers = Iterable[Tuple[Union[bytes, str], Union[bytes, str]]]             # (name, value) pairs: an ASGI / httpx raw header list, or dict items
 
 
 class Service__Proxy__Filter(Type_Safe):                                      # Filter headers and content for security
@@ -19,25 +27,125 @@ class Service__Proxy__Filter(Type_Safe):                                      #
         'content-length'
     }
 
+    RESPONSE_ENCODING_HEADERS = {'content-encoding', 'content-length'}          # Only valid for the body exactly as upstream sent it
+
+    RESPONSE_SKIP_HEADERS__PASSTHROUGH = RESPONSE_SKIP_HEADERS - RESPONSE_ENCODING_HEADERS     # Headers to remove from responses passed through undecoded
+
+    CONDITIONAL_REQUEST_HEADERS = {'if-none-match', 'if-modified-since'}        # Replaced by the cache's own validators when it revalidates an entry
+
+    NOT_MODIFIED_HEADERS = {                                                  # Headers kept on a 304 (RFC 9110 15.4.5)
+        'cache-control', 'content-location', 'date', 'etag'     ,
+        'expires', 'last-modified', 'vary', 'age'
+    }
+
+    REQUEST_SKIP_HEADERS__REVALIDATE = REQUEST_SKIP_HEADERS | CONDITIONAL_REQUEST_HEADERS     # Headers to remove from requests that revalidate a cached entry
+
+    REQUEST_SKIP_HEADERS__EDGE = set()                                          # Headers to remove when a request comes in (none: the names and values are only validated, hop-by-hop headers go when it is sent upstream)
+
+    HEADER_LOOKUPS = {}                                                         # id(skip set) -> (skip set, {raw header name (bytes or str): name to keep, HEADER__DROP or HEADER__CONNECTION}) (shared by every instance)
+
     def filter_request_headers(self, headers: Dict[str, str]
                                 ) -> Dict[str, str]:                        # Filter request headers
-        filtered_headers: Dict[str, str] = {}                                   # Build a new dictionary with only the headers we want to keep
+        return self.filter_headers(headers.items(), self.REQUEST_SKIP_HEADERS)     # keeps the original casing
 
-        for key, value in headers.items():
-            lowercase_key = key.lower()  # normalize for comparison
-            if lowercase_key not in self.REQUEST_SKIP_HEADERS:
-                filtered_headers[key] = value  # preserve original casing
+    def filter_incoming_headers(self, headers: Raw_Headers                 # a raw header list (e.g. the ASGI scope's headers)
+                                 ) -> Dict[str, str]:                       # Validate the client's headers once, as the request comes in
+        return self.filter_headers(headers, self.REQUEST_SKIP_HEADERS__EDGE)
 
-        return filtered_headers
-
-    def filter_response_headers(self, headers: Dict[str, str]
+    def filter_response_headers(self, headers     : Union[Dict[str, str], Raw_Headers],     # a mapping (e.g. requests' headers), or a raw header list (e.g. httpx's headers.raw)
+                                      passthrough : bool = False        # body is forwarded undecoded, so keep its encoding headers
                                  ) -> Dict[str, str]:                   # Filter response headers
-        filtered_headers: Dict[str, str] = {}
+        skip_headers = self.RESPONSE_SKIP_HEADERS__PASSTHROUGH if passthrough else self.RESPONSE_SKIP_HEADERS
+        return self.filter_headers(headers.items() if hasattr(headers, 'items') else headers, skip_headers)
+
+    def header_lookup(self, skip_headers: Set[str]                         # Precompiled filter for a skip set: raw header name -> name to keep, HEADER__DROP or HEADER__CONNECTION
+                       ) -> Dict:
+        lookup = self.HEADER_LOOKUPS.get(id(skip_headers))
+        if lookup is None:
+            lookup = self.HEADER_LOOKUPS[id(skip_headers)] = (skip_headers, {})  # (holding on to the set, so its id is never reused)
+        return lookup[1]
+
+    def valid_header_name(self, name: str) -> bool:                        # Is this a Safe_Str__Http__Header_Name as it is? (validated once per process, via the shared interning cache)
+        try:
+            return safe_str_cache.header_name(name) == name
+        except ValueError:                                                  # empty, or over the max length
+            return False
+
+    def header_name(self, lookup       : Dict    ,                         # Add a header name to a precompiled filter
+                          skip_headers : Set[str],
+                          raw_name     : Union[bytes, str]
+                     ) -> Union[str, bool]:
+        name = (raw_name.decode('latin-1') if type(raw_name) is bytes else str(raw_name)).strip()
+        if self.valid_header_name(name) is False:
+            result = HEADER__DROP
+        elif name.lower() == 'connection':
+            result = HEADER__CONNECTION
+        elif name.lower() in skip_headers:
+            result = HEADER__DROP
+        else:
+            result = name
+        if len(lookup) >= HEADER_NAMES__LIMIT:
+            lookup.clear()
+        lookup[raw_name] = result
+        return result
+
+    def connection_tokens(self, lookup       : Dict    ,                   # Header names listed in a Connection value that the skip set doesn't already drop (added to the precompiled filter)
+                                skip_headers : Set[str],
+                                connection   : Union[bytes, str]
+                           ) -> Set[str]:
+        tokens = {token.strip().lower() for token in self.header_value(connection).split(',')} - skip_headers
+        if len(lookup) >= HEADER_NAMES__LIMIT:
+            lookup.clear()
+        lookup[(HEADER__CONNECTION, connection)] = tokens                   # ('keep-alive' and 'close' are the usual values, so this is nearly always an empty set)
+        return tokens
 
-        for key, value in headers.items():                              # Normalize the header key to lowercase for comparison
-            lowercase_key = key.lower()
-            if lowercase_key not in self.RESPONSE_SKIP_HEADERS:         # Only keep the header if it's not in the skip list
-                filtered_headers[key] = value
+    def header_value(self, raw_value: Union[bytes, str]                    # Header value, sanitised like Safe_Str__Http__Header_Value (control characters replaced, whitespace trimmed)
+                      ) -> str:
+        value = (raw_value.decode('latin-1') if type(raw_value) is bytes else raw_value).strip()
+        return TYPE_SAFE_STR__HTTP__HEADER_VALUE__REGEX.sub('_', value)
 
-        return filtered_headers
+    def filter_headers(self, headers         : Raw_Headers           ,     # Single pass over the headers: drop skip_headers, hop-by-hop headers named in Connection, and invalid names / values
+                             skip_headers    : Set[str]              ,     # (lowercase, one of the class constants: each gets its own precompiled lookup)
+                             extra_headers   : Dict[str, str] = None ,     # added after filtering (e.g. forwarding headers)
+                             default_headers : Dict[str, str] = None       # added when not already there (e.g. Accept-Encoding)
+                        ) -> Dict[str, str]:                               # (keeping the original casing of the names)
+        lookup     = self.header_lookup(skip_headers)
+        filtered   = {}
+        connection = None
+        for raw_name, raw_value in headers:
+            name = lookup.get(raw_name)
+            if name is None:
+                name = self.header_name(lookup, skip_headers, raw_name)
+            if name is HEADER__DROP:
+                continue
+            if name is HEADER__CONNECTION:
+                connection = raw_value                                      # ('connection' is a hop-by-hop header itself, so it is never kept)
+                continue
+            value = raw_value.decode('latin-1') if type(raw_value) is bytes else raw_value
+            if value.isprintable() is False:                                # (fast path: no control characters; whitespace around values was already trimmed by the HTTP parser)
+                value = self.header_value(value)
+            if name in filtered:                                            # repeated header: joined with ', '
+                value = f'{filtered[name]}, {value}'
+            if len(value) <= TYPE_SAFE_STR__HTTP__HEADER_VALUE__MAX_LENGTH:
+                filtered[name] = value
+        if connection:                                                      # hop-by-hop headers the sender listed in Connection (RFC 9110 7.6.1)
+            tokens = lookup.get((HEADER__CONNECTION, connection))
+            if tokens is None:
+                tokens = self.connection_tokens(lookup, skip_headers, connection)
+            if tokens:
+                for name in [name for name in filtered if name.lower() in tokens]:
+                    del filtered[name]
+        if default_headers:
+            for name, value in default_headers.items():
+                lowercase = name.lower()
+                if lowercase in filtered or name in filtered:               # (fast path: ASGI header names are already lowercase)
+                    continue
+                if all(key.lower() != lowercase for key in filtered):
+                    filtered[name] = value
+        if extra_headers:
+            filtered.update(extra_headers)
+        return filtered
 
+    def filter_not_modified_headers(self, headers: Dict[str, str]
+                                     ) -> Dict[str, str]:               # Headers for a 304 sent in place of a stored response
+        return {key: value for key, value in headers.items() if key.lower() in self.NOT_MODIFIED_HEADERS}
@@ -0,0 +1,241 @@
+import asyncio
+import heapq
+import itertools
+import socket
+import threading
+import time
+from concurrent.futures                                             import Future, ThreadPoolExecutor
+from typing                                                         import Any, Awaitable, Callable, Dict, List
+from osbot_utils.type_safe.Type_Safe                                import Type_Safe
+from mgraph_ai_service_proxy.schemas.Proxy__Request                 import Proxy__Request
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Config          import Schema__Proxy__Config
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Budget   import Service__Proxy__Budget
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Latency  import Service__Proxy__Latency
+
+HEDGE__METHODS       = frozenset(('GET', 'HEAD', 'OPTIONS'))                    # safe methods: a second copy changes nothing upstream
+HEDGE__PERCENTILE    = 95                                                       # a host's ttfb percentile used as its hedge delay
+HEDGE__MIN_SAMPLES   = 20                                                       # ttfb recordings a host needs before its percentile is trusted (config.hedge_delay until then)
+HEDGE__DELAY_REFRESH = 1.0                                                      # seconds a host's hedge delay is kept before being read again from its histogram
+HEDGE__HOSTS_LIMIT   = 1024                                                     # hosts with a hedge delay kept (least recently computed go first)
+HEDGE__THREADS       = 64                                                       # sync engine: threads running the hedges (first calls run on the request's thread)
+HEDGE__STATS         = ('hedged', 'wins', 'losses')
+HEDGE__TIMER_ORDER   = itertools.count()                                        # (ties between timers due at the same time)
+
+hedge_races = threading.local()                                                 # the hedged request whose first call this thread is making (sync engine): its upstream connection registers there
+
+
+class Hedge__Race:                                                              # One hedged request (sync engine): the first call runs on the request's thread, the hedge on the hedging threads
+    __slots__ = ('lock', 'done', 'hedge', 'won', 'connection')
+
+    def __init__(self):
+        self.lock       = threading.Lock()                                      # guards the other attributes
+        self.done       = False                                                 # the first call is over (no hedge from now on)
+        self.hedge      = None                                                  # Future of the hedge, once sent
+        self.won        = False                                                 # the hedge answered first (the first call is aborted)
+        self.connection = None                                                  # upstream connection the first call is waiting on for response headers
+
+    def wait_on(self, connection) -> None:                                      # (called by the first call's connection before waiting for the response headers, and with None after)
+        with self.lock:
+            self.connection = connection
+
+    def abort(self) -> bool:                                                    # The hedge answered first: unblock the first call by shutting its connection down (False: the first call answered already)
+        with self.lock:
+            if self.done:
+                return False
+            self.won   = True
+            connection = self.connection
+            if connection is not None and connection.sock is not None:
+                try:
+                    connection.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:                                                 # (already closed)
+                    pass
+        return True
+
+
+def first_call_aborted() -> bool:                                               # Is this thread's upstream call the first call of a race its hedge won? (not a failure: no retries, no error counted)
+    race = getattr(hedge_races, 'race', None)
+    return race is not None and race.won
+
+
+class Service__Proxy__Hedge(Type_Safe):                                         # Hedged requests: a second, identical upstream call for safe requests slower than their host's p95, first answer wins
+    budget   : Service__Proxy__Budget                                           # hedge tokens per host (each hedgeable request adds config.hedge_budget, each hedge takes one)
+    lock     : threading.Condition                                              # guards delays, executor, timers and the counters
+    delays   : dict                                                             # host -> (monotonic expiry, seconds to wait before hedging)
+    executor : ThreadPoolExecutor = None                                        # runs the hedges (sync engine)
+    timers   : list                                                             # heap of [monotonic due time, order, callback] (sync engine: a cancelled timer's callback is None)
+    timer    : threading.Thread   = None                                        # runs the timers' callbacks once they are due
+    hedged   : int                                                              # second calls sent
+    wins     : int                                                              # hedges that answered first
+    losses   : int                                                              # hedges the first call beat
+
+    def hedgeable(self, config  : Schema__Proxy__Config,                        # Can this request be sent twice at once? (a safe method, with no streamed body)
+                        request : Proxy__Request
+                   ) -> bool:
+        return config.hedge_requests and request.body_stream is None and str(request.method) in HEDGE__METHODS
+
+    def delay(self, config  : Schema__Proxy__Config  ,                          # Seconds to wait for a host's response headers before hedging: its p95 ttfb (config.hedge_delay until it has enough samples)
+                    latency : Service__Proxy__Latency,
+                    host    : str                    ,
+                    now     : float = None
+               ) -> float:
+        now   = time.monotonic() if now is None else now
+        entry = self.delays.get(host)
+        if entry is not None and now < entry[0]:
+            return entry[1]
+        seconds = latency.percentile('ttfb', host, HEDGE__PERCENTILE, HEDGE__MIN_SAMPLES)
+        if seconds is None:
+            seconds = int(config.hedge_delay) / 1000
+        with self.lock:
+            self.delays.pop(host, None)
+            self.delays[host] = (now + HEDGE__DELAY_REFRESH, seconds)
+            if len(self.delays) > HEDGE__HOSTS_LIMIT:
+                del self.delays[next(iter(self.delays))]
+        return seconds
+
+    def submit(self, call: Callable) -> Future:                                 # Run an upstream call on the hedging threads
+        if self.executor is None:
+            with self.lock:
+                if self.executor is None:
+                    self.executor = ThreadPoolExecutor(max_workers=HEDGE__THREADS, thread_name_prefix='proxy-hedge')
+        return self.executor.submit(call)
+
+    def schedule(self, delay    : float   ,                                     # Call callback (on the timer thread) once delay seconds passed, unless the timer returned is cancelled before
+                       callback : Callable
+                  ) -> list:
+        timer = [time.monotonic() + delay, next(HEDGE__TIMER_ORDER), callback]
+        with self.lock:
+            if self.timer is None:
+                self.timer = threading.Thread(target=self.run_timers, name='proxy-hedge-timer', daemon=True)
+                self.timer.start()
+            heapq.heappush(self.timers, timer)
+            if self.timers[0] is timer:                                         # (sooner than the one the timer thread waits for)
+                self.lock.notify()
+        return timer
+
+    def cancel(self, timer: list) -> None:                                      # (left in the heap until it is due)
+        timer[2] = None
+
+    def run_timers(self) -> None:
+        while True:
+            with self.lock:
+                while not self.timers or self.timers[0][0] > time.monotonic():
+                    self.lock.wait(self.timers[0][0] - time.monotonic() if self.timers else None)
+                callback = heapq.heappop(self.timers)[2]
+            if callback is not None:
+                callback()
+
+    def race(self, config : Schema__Proxy__Config,                              # call()'s response: called again (on the hedging threads) once delay passed without one, budget allowing, the first to answer wins
+                   host   : str                  ,
+                   delay  : float                ,
+                   call   : Callable[[], Any]                                   # one upstream call, returning a requests.Response
+              ) -> Any:
+        self.budget.deposit(host, float(config.hedge_budget))
+        race  = Hedge__Race()
+        timer = self.schedule(delay, lambda: self.send_hedge(host, race, call))
+        error = None
+        hedge_races.race = race
+        try:
+            response = call()                                                   # (the first call runs on this thread)
+        except Exception as exception:                                          # (an aborted first call fails too)
+            response, error = None, exception
+        finally:
+            hedge_races.race = None
+            self.cancel(timer)
+        with race.lock:
+            race.done = True
+            hedge     = race.hedge
+            won       = race.won
+        if hedge is None:                                                       # not hedged
+            if error is not None:
+                raise error
+            return response
+        if won is False and error is not None:                                  # the first call failed: the hedge can still answer
+            won = hedge.exception() is None
+        if won:
+            if response is not None:
+                response.close()
+            self.count('wins')
+            return hedge.result()
+        if hedge.cancel() is False:                                             # (already running: its response is closed once it arrives)
+            hedge.add_done_callback(self.discard)
+        self.count('losses')
+        if error is not None:                                                   # both failed: the first call's error
+            raise error
+        return response
+
+    def send_hedge(self, host : str       ,                                     # (timer callback) Send the hedge when the first call is still waiting and the host's budget allows it
+                         race : Hedge__Race,
+                         call : Callable[[], Any]
+                    ) -> None:
+        with race.lock:
+            if race.done or self.budget.withdraw(host) is False:
+                return
+            race.hedge = self.submit(call)
+        self.count('hedged')
+        race.hedge.add_done_callback(lambda hedge: self.hedge_done(race, hedge))
+
+    def hedge_done(self, race  : Hedge__Race,                                   # A hedge that answered first aborts the first call (race() then returns the hedge's response)
+                         hedge : Future
+                    ) -> None:
+        if hedge.cancelled() is False and hedge.exception() is None:
+            race.abort()
+
+    def winner(self, calls     : List                ,                          # The call that won the race so far (None: wait for the other one)
+                     done      : set                 ,
+                     pending   : set                 ,
+                     exception : Callable[[Any], Any]
+                ):
+        for call in calls:                                                      # (a tie goes to the first call)
+            if call in done and exception(call) is None:
+                return call
+        if not pending:                                                         # both failed: the first call's error
+            return calls[0]
+        return None
+
+    def discard(self, future: Future) -> None:                                  # Close the losing call's response, releasing its connection
+        if future.cancelled() is False and future.exception() is None:
+            future.result().close()
+
+    async def race__async(self, config : Schema__Proxy__Config   ,              # Async version of race (asyncio engine): the loser is cancelled (or its response closed, when it answered too)
+                                host   : str                     ,
+                                delay  : float                   ,
+                                call   : Callable[[], Awaitable]                # one upstream call, returning an httpx.Response
+                           ) -> Any:
+        self.budget.deposit(host, float(config.hedge_budget))
+        primary = asyncio.ensure_future(call())
+        hedge   = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or self.budget.withdraw(host) is False:
+                return await primary
+            hedge   = asyncio.ensure_future(call())
+            pending = {primary, hedge}
+            self.count('hedged')
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner        = self.winner([primary, hedge], done, pending, lambda task: task.exception())
+                if winner is not None:
+                    loser = hedge if winner is primary else primary
+                    loser.cancel()
+                    loser.add_done_callback(self.discard__async)
+                    self.count('wins' if winner is hedge else 'losses')
+                    return winner.result()
+        except asyncio.CancelledError:                                          # (the client went away: so do both calls)
+            for task in (primary, hedge):
+                if task is not None:
+                    task.cancel()
+            raise
+
+    def discard__async(self, task: asyncio.Task) -> None:                       # Close the losing call's response, when it arrived before being cancelled
+        if task.cancelled() is False and task.exception() is None:
+            asyncio.ensure_future(task.result().aclose())
+
+    def count(self, name: str) -> None:
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def get_stats(self) -> Dict[str, int]:                                      # HEDGE__STATS, plus the hedges the budgets denied
+        with self.lock:
+            stats = {name: getattr(self, name) for name in HEDGE__STATS}
+        stats['exhausted'] = self.budget.exhausted
+        return stats
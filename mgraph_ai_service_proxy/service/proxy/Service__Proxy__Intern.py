@@ -0,0 +1,45 @@
+import functools
+from typing                                                             import Dict, Type
+from osbot_utils.type_safe.Type_Safe                                    import Type_Safe
+from osbot_utils.type_safe.primitives.safe_str.Safe_Str                 import Safe_Str
+from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Header_Name   import Safe_Str__Http__Header_Name
+from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Host          import Safe_Str__Http__Host
+from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Method        import Safe_Str__Http__Method
+
+INTERN__LIMIT = 1024                                                            # values kept per Safe_Str type (least recently used go first, so attacker-controlled values can't grow it)
+
+
+class Service__Proxy__Intern(Type_Safe):                                        # Validated Safe_Str instances of the raw strings seen most recently (the same header names, hosts and methods come up on every request)
+    limit  : int = INTERN__LIMIT
+    caches : dict                                                               # Safe_Str type -> its constructor, behind a bounded LRU cache (one per type, so a flood of hosts can't evict the header names)
+
+    def safe_str(self, safe_type : Type[Safe_Str],                              # Validated safe_type(raw), built once per raw value (invalid values raise ValueError every time: errors are not cached)
+                       raw       : str
+                  ) -> Safe_Str:
+        cache = self.caches.get(safe_type)
+        if cache is None:
+            cache = self.caches[safe_type] = functools.lru_cache(maxsize=self.limit)(safe_type)     # (lru_cache is thread safe)
+        return cache(raw)
+
+    def header_name(self, raw: str) -> Safe_Str__Http__Header_Name:
+        return self.safe_str(Safe_Str__Http__Header_Name, raw)
+
+    def host(self, raw: str) -> Safe_Str__Http__Host:
+        return self.safe_str(Safe_Str__Http__Host, raw)
+
+    def method(self, raw: str) -> Safe_Str__Http__Method:
+        return self.safe_str(Safe_Str__Http__Method, raw)
+
+    def clear(self) -> None:
+        for cache in self.caches.values():
+            cache.cache_clear()
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:                           # Safe_Str type name -> hits, misses and values held
+        stats = {}
+        for safe_type, cache in self.caches.items():
+            info                      = cache.cache_info()
+            stats[safe_type.__name__] = dict(hits = info.hits, misses = info.misses, size = info.currsize)
+        return stats
+
+
+safe_str_cache = Service__Proxy__Intern()                                       # shared by the routes and the header filter (the values are the same for the whole process)
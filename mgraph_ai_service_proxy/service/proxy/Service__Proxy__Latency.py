@@ -0,0 +1,228 @@
+import threading
+import time
+import urllib3
+from array                                                      import array
+from typing                                                     import Callable, Dict, Optional, Tuple
+from osbot_utils.type_safe.Type_Safe                            import Type_Safe
+
+SUB_BUCKET__BITS     = 5                                                        # 32 linear sub-buckets per power of two: values are kept within 1/32 (~3%)
+SUB_BUCKETS          = 1 << SUB_BUCKET__BITS
+LINEAR__BUCKETS      = SUB_BUCKETS * 2                                          # 0..63µs are counted exactly
+MAX__SHIFT           = 30                                                       # largest value tracked: ~2^36µs (19 hours), anything above lands in the last bucket
+BUCKETS              = LINEAR__BUCKETS + MAX__SHIFT * SUB_BUCKETS
+LATENCY__METRICS     = ('connect', 'ttfb', 'upstream', 'total')                 # new upstream connection, upstream headers, upstream body read, whole proxied request
+LATENCY__PERCENTILES = (50, 90, 95, 99, 99.9)
+LATENCY__ALL_HOSTS   = '*'                                                      # every host merged
+HOSTS__LIMIT         = 256                                                      # hosts with their own histograms (the others are merged into 'other')
+
+connect_times = threading.local()                                              # seconds the last new upstream connection of this thread took to open (sync engine)
+
+
+class Service__Proxy__Latency__Histogram(Type_Safe):                            # HDR-style log-linear histogram of durations (µs): fixed memory, O(1) recording with no allocation
+    counts : array = None                                                       # count per bucket
+    totals : array = None                                                       # [sum, max, count] of the recorded values
+
+    def setup(self) -> 'Service__Proxy__Latency__Histogram':
+        self.counts = array('q', bytes(8 * BUCKETS))
+        self.totals = array('q', bytes(8 * 3))
+        return self
+
+    def index(self, value: int) -> int:                                         # Bucket of a value
+        if value < LINEAR__BUCKETS:
+            return max(value, 0)
+        shift = value.bit_length() - SUB_BUCKET__BITS - 1                       # (>= 1) the value's top SUB_BUCKET__BITS + 1 bits pick its sub-bucket
+        if shift > MAX__SHIFT:
+            return BUCKETS - 1
+        return LINEAR__BUCKETS + (shift - 1) * SUB_BUCKETS + (value >> shift) - SUB_BUCKETS
+
+    def value_at(self, index: int) -> int:                                      # Highest value counted in a bucket
+        if index < LINEAR__BUCKETS:
+            return index
+        shift, offset = divmod(index - LINEAR__BUCKETS, SUB_BUCKETS)
+        return ((SUB_BUCKETS + offset + 1) << (shift + 1)) - 1
+
+    def record(self, value: int) -> None:                                       # Count a duration in µs (caller serializes recordings to the same histogram)
+        self.counts[self.index(value)] += 1
+        totals     = self.totals
+        totals[0] += value
+        totals[2] += 1
+        if value > totals[1]:
+            totals[1] = value
+
+    def count(self) -> int:
+        return self.totals[2]
+
+    def percentile(self, percentile: float) -> int:                             # Value (µs) that percentile% of the recorded ones are at or below (0 when empty)
+        count = self.count()
+        if count == 0:
+            return 0
+        target = max(1, -(-count * percentile // 100))                          # (ceil)
+        seen   = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return min(self.value_at(index), self.totals[1])
+        return self.totals[1]
+
+    def merge(self, other: 'Service__Proxy__Latency__Histogram') -> 'Service__Proxy__Latency__Histogram':   # Add another histogram's counts to this one
+        for index, bucket_count in enumerate(other.counts):
+            if bucket_count:
+                self.counts[index] += bucket_count
+        self.totals[0] += other.totals[0]
+        self.totals[1]  = max(self.totals[1], other.totals[1])
+        self.totals[2] += other.totals[2]
+        return self
+
+    def copy(self) -> 'Service__Proxy__Latency__Histogram':
+        return Service__Proxy__Latency__Histogram(counts=array('q', self.counts), totals=array('q', self.totals))
+
+    def reset(self) -> None:
+        self.counts[:] = array('q', bytes(8 * BUCKETS))
+        self.totals[:] = array('q', bytes(8 * 3))
+
+    def summary(self) -> Dict[str, float]:                                      # Count, mean, max and percentiles (in ms)
+        count   = self.count()
+        summary = {'count'  : count                                                    ,
+                   'mean_ms': round(self.totals[0] / count / 1000, 3) if count else 0.0,
+                   'max_ms' : round(self.totals[1] / 1000, 3)                          }
+        for percentile in LATENCY__PERCENTILES:
+            summary[f'p{percentile}_ms'] = round(self.percentile(percentile) / 1000, 3)
+        return summary
+
+
+class Service__Proxy__Latency(Type_Safe):                                       # Latency histograms per metric and target host
+    lock       : threading.Condition                                            # guards hosts, histograms and the shards' layout (not their counts)
+    shards     : dict                                                           # thread id -> metric -> host -> Service__Proxy__Latency__Histogram, recorded into by that thread only (merged on read)
+    hosts      : dict                                                           # metric -> hosts with their own histograms
+    histograms : dict                                                           # (metric, host) -> Service__Proxy__Latency__Histogram merged in (snapshots and merges)
+
+    def record(self, metric  : str  ,                                           # Count a duration (one of LATENCY__METRICS)
+                     host    : str  ,
+                     seconds : float
+                ) -> None:
+        shard     = self.shards.get(threading.get_ident())
+        metrics   = shard.get(metric) if shard is not None else None
+        histogram = metrics.get(host) if metrics is not None else None
+        if histogram is None:
+            histogram = self.histogram(metric, host)
+        histogram.record(int(seconds * 1_000_000))
+
+    def histogram(self, metric : str ,                                          # This thread's histogram for a (metric, host) it has no histogram for yet (past the hosts limit: its 'other' one, looked up on each recording)
+                        host   : str
+                   ) -> Service__Proxy__Latency__Histogram:
+        with self.lock:
+            hosts = self.hosts.setdefault(metric, set())
+            if host not in hosts:
+                if sum(len(metric_hosts) for metric_hosts in self.hosts.values()) >= HOSTS__LIMIT * len(LATENCY__METRICS):
+                    host = 'other'
+                else:
+                    hosts.add(host)
+            metrics   = self.shards.setdefault(threading.get_ident(), {}).setdefault(metric, {})   # (a thread id is only reused once its thread is gone)
+            histogram = metrics.get(host)
+            if histogram is None:
+                histogram = metrics[host] = Service__Proxy__Latency__Histogram().setup()
+            return histogram
+
+    def merged(self) -> Dict[tuple, Service__Proxy__Latency__Histogram]:      # (metric, host) -> copy of every thread's histograms added up (caller holds the lock)
+        merged = {key: histogram.copy() for key, histogram in self.histograms.items()}
+        for shard in self.shards.values():
+            for metric, metrics in shard.items():
+                for host, histogram in metrics.items():
+                    key = (metric, host)
+                    if key in merged:
+                        merged[key].merge(histogram)
+                    else:
+                        merged[key] = histogram.copy()
+        return merged
+
+    def percentile(self, metric     : str      ,                                # Seconds that percentile% of a host's recordings are at or below (None with fewer than min_count of them)
+                         host       : str      ,
+                         percentile : float    ,
+                         min_count  : int = 1
+                    ) -> Optional[float]:
+        with self.lock:
+            parts = [shard[metric][host] for shard in self.shards.values() if host in shard.get(metric, ())]
+            if (metric, host) in self.histograms:
+                parts.append(self.histograms[(metric, host)])
+            if not parts or sum(part.count() for part in parts) < min_count:
+                return None
+            histogram = parts[0].copy()
+            for part in parts[1:]:
+                histogram.merge(part)
+            return histogram.percentile(percentile) / 1_000_000
+
+    def snapshot(self) -> 'Service__Proxy__Latency':                            # Copy of every histogram (e.g. to compare with a later window)
+        with self.lock:
+            return Service__Proxy__Latency(histograms=self.merged())
+
+    def arrays(self) -> Dict[tuple, Tuple[array, array]]:                      # (metric, host) -> copies of (counts, totals) (cheap enough for every metrics scrape)
+        with self.lock:
+            return {key: (histogram.counts, histogram.totals) for key, histogram in self.merged().items()}
+
+    def merge(self, other: 'Service__Proxy__Latency') -> 'Service__Proxy__Latency':    # Add another set of histograms to this one
+        for key, histogram in other.snapshot().histograms.items():
+            with self.lock:
+                if key in self.histograms:
+                    self.histograms[key].merge(histogram)
+                else:
+                    self.histograms[key] = histogram
+        return self
+
+    def reset(self) -> None:                                                    # (recordings made while resetting may be lost)
+        with self.lock:
+            self.shards    .clear()
+            self.hosts     .clear()
+            self.histograms.clear()
+
+    def get_latency(self) -> Dict[str, Dict[str, Dict[str, float]]]:           # host -> metric -> summary (plus LATENCY__ALL_HOSTS, every host merged)
+        histograms = self.snapshot().histograms
+        merged     = {}
+        latency    = {}
+        for (metric, host), histogram in sorted(histograms.items(), key=lambda item: (item[0][1], LATENCY__METRICS.index(item[0][0]))):
+            latency.setdefault(host, {})[metric] = histogram.summary()
+            merged.setdefault(metric, Service__Proxy__Latency__Histogram().setup()).merge(histogram)
+        if merged:
+            latency[LATENCY__ALL_HOSTS] = {metric: merged[metric].summary() for metric in LATENCY__METRICS if metric in merged}
+        return latency
+
+    # ---- connect times ----
+
+    def start_connect_timing(self) -> None:                                     # Forget this thread's last connect time (before sending a request with the sync engine)
+        connect_times.seconds = None
+
+    def connect_time(self) -> Optional[float]:                                  # Seconds the request just sent took to open a new connection (None when it reused a pooled one)
+        return getattr(connect_times, 'seconds', None)
+
+    def connect_trace(self, timings: Dict[str, float]) -> Callable:             # httpx trace extension that puts the connect time (TCP + TLS) in timings['connect'] (asyncio engine)
+        async def trace(event_name: str, info: dict) -> None:
+            if event_name == 'connection.connect_tcp.started':
+                timings['started'] = time.perf_counter()
+            elif event_name in ('connection.connect_tcp.complete', 'connection.start_tls.complete'):
+                timings['connect'] = time.perf_counter() - timings['started']
+        return trace
+
+
+class Timed__HTTP_Connection(urllib3.connection.HTTPConnection):                # urllib3 connection that records how long it took to open (in connect_times)
+    def connect(self) -> None:
+        started = time.perf_counter()
+        super().connect()
+        connect_times.seconds = time.perf_counter() - started
+
+
+class Timed__HTTPS_Connection(urllib3.connection.HTTPSConnection):              # (includes the TLS handshake)
+    def connect(self) -> None:
+        started = time.perf_counter()
+        super().connect()
+        connect_times.seconds = time.perf_counter() - started
+
+
+class Timed__HTTP_Connection_Pool(urllib3.HTTPConnectionPool):
+    ConnectionCls = Timed__HTTP_Connection
+
+
+class Timed__HTTPS_Connection_Pool(urllib3.HTTPSConnectionPool):
+    ConnectionCls = Timed__HTTPS_Connection
+
+
+TIMED__POOL_CLASSES = {'http' : Timed__HTTP_Connection_Pool ,                   # for urllib3's PoolManager.pool_classes_by_scheme
+                       'https': Timed__HTTPS_Connection_Pool}
@@ -0,0 +1,57 @@
+import types
+from typing                                                         import AsyncIterator, Iterator, Optional
+from osbot_utils.type_safe.Type_Safe                                import Type_Safe
+from osbot_utils.type_safe.primitives.safe_str.web.Safe_Str__Url    import Safe_Str__Url
+
+HTTP_STATUS__PAYLOAD_TOO_LARGE = 413                                            # client sent too much
+HTTP_STATUS__BAD_GATEWAY       = 502                                            # upstream sent too much
+
+
+class Proxy_Error__Content_Too_Large(ValueError):                               # A body crossed config.max_content_size
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code                                          # status to return to the client (413 or 502)
+
+
+class Service__Proxy__Limits(Type_Safe):                                        # Enforce config.max_content_size on request and response bodies (0 means no limit)
+
+    def error__request_too_large(self, max_size: int) -> Proxy_Error__Content_Too_Large:
+        return Proxy_Error__Content_Too_Large(f"Payload too large - request body is over the {max_size} bytes limit", HTTP_STATUS__PAYLOAD_TOO_LARGE)
+
+    def error__response_too_large(self, max_size   : int          ,
+                                        target_url : Safe_Str__Url
+                                   ) -> Proxy_Error__Content_Too_Large:
+        return Proxy_Error__Content_Too_Large(f"Bad gateway - response from {target_url} is over the {max_size} bytes limit", HTTP_STATUS__BAD_GATEWAY)
+
+    def exceeds(self, max_size : int          ,                                 # Is this (declared or counted) size over the limit?
+                      size     : Optional[int]
+                 ) -> bool:
+        return bool(max_size) and size is not None and size > max_size
+
+    def limit_chunks(self, chunks   : Iterator[bytes]                ,           # Pass chunks through, raising the moment the total crosses max_size
+                           max_size : int                            ,
+                           error    : Proxy_Error__Content_Too_Large
+                      ) -> types.GeneratorType:
+        total = 0
+        for chunk in chunks:
+            total += len(chunk)
+            if self.exceeds(max_size, total):
+                raise error
+            yield chunk
+
+    async def limit_chunks__async(self, chunks   : AsyncIterator[bytes]           ,     # Async version of limit_chunks
+                                        max_size : int                            ,
+                                        error    : Proxy_Error__Content_Too_Large
+                                   ) -> types.AsyncGeneratorType:
+        total = 0
+        async for chunk in chunks:
+            total += len(chunk)
+            if self.exceeds(max_size, total):
+                raise error
+            yield chunk
+
+    async def read_body__async(self, chunks   : AsyncIterator[bytes] ,           # Read a whole body, but never more than max_size of it
+                                     max_size : int
+                                ) -> bytes:
+        body = [chunk async for chunk in self.limit_chunks__async(chunks, max_size, self.error__request_too_large(max_size))]
+        return b''.join(body)
@@ -0,0 +1,234 @@
+from array                                                          import array
+from typing                                                         import Dict, List
+from osbot_utils.type_safe.Type_Safe                                import Type_Safe
+from mgraph_ai_service_proxy.schemas.Enum__Proxy__Breaker__State    import Enum__Proxy__Breaker__State
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Cache    import Service__Proxy__Cache
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Latency  import Service__Proxy__Latency__Histogram, BUCKETS
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Stats    import Service__Proxy__Stats
+
+OPENMETRICS__CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+METRICS__COUNTERS         = (('total_requests'   , 'proxy_upstream_responses', 'Responses received from upstream'                          , ''     ),
+                             ('total_errors'     , 'proxy_upstream_errors'   , 'Upstream connection errors'                                , ''     ),
+                             ('total_timeouts'   , 'proxy_upstream_timeouts' , 'Upstream timeouts'                                         , ''     ),
+                             ('total_oversized'  , 'proxy_oversized_bodies'  , 'Bodies rejected for being over max_content_size'           , ''     ),
+                             ('total_cache_hits' , 'proxy_cache_hits'        , 'Responses served fresh from the cache'                     , ''     ),
+                             ('total_revalidated', 'proxy_cache_revalidated' , 'Stale cached responses upstream confirmed as current (304)', ''     ),
+                             ('total_stale_hits' , 'proxy_cache_stale_hits'  , 'Stale cached responses served'                             , ''     ),
+                             ('total_coalesced'  , 'proxy_coalesced_requests', 'Requests that shared an identical request\'s upstream call', ''     ),
+                             ('total_rejected'   , 'proxy_rejected_requests' , 'Requests failed fast by an open circuit breaker'           , ''     ),
+                             ('total_retries'    , 'proxy_upstream_retries'  , 'Upstream calls made again (retries, not first attempts)'   , ''     ),
+                             ('total_bytes_in'   , 'proxy_received_bytes'    , 'Bytes of request bodies received from clients'             , 'bytes'),
+                             ('total_bytes_out'  , 'proxy_sent_bytes'        , 'Bytes of response bodies sent to clients'                  , 'bytes'))
+METRICS__BREAKDOWNS       = (('by_status', 'proxy_upstream_responses_by_status', 'status_class', 'Responses received from upstream, by status class' ),
+                             ('by_method', 'proxy_upstream_responses_by_method', 'method'      , 'Responses received from upstream, by request method'),
+                             ('by_host'  , 'proxy_upstream_responses_by_host'  , 'host'        , 'Responses received from upstream, by target host'   ))
+METRICS__GAUGES           = (('proxy_in_flight_requests'  , 'Requests being handled right now'                         , ''     ),
+                             ('proxy_cache_hit_ratio'     , 'Share of responses served from the cache (fresh or stale)', ''     ),
+                             ('proxy_cache_entries'       , 'Responses held by the cache'                              , ''     ),
+                             ('proxy_cache_memory_bytes'  , 'Bytes held by the cache in memory'                        , 'bytes'),
+                             ('proxy_cache_disk_bytes'    , 'Bytes of bodies held by the cache on disk'                , 'bytes'),
+                             ('proxy_upstream_connections', 'Pooled upstream connections, by state'                    , ''     ))
+METRICS__POOLS            = (('idle'     , 'proxy_upstream_pool_idle'     , 'gauge'  , 'Idle connections in each upstream pool'                             ),
+                             ('active'   , 'proxy_upstream_pool_active'   , 'gauge'  , 'Connections of each upstream pool serving a request'               ),
+                             ('waiting'  , 'proxy_upstream_pool_waiting'  , 'gauge'  , 'Requests waiting for one of the connections of each upstream pool'),
+                             ('created'  , 'proxy_upstream_pool_created'  , 'counter', 'Connections opened by each upstream pool'                         ),
+                             ('discarded', 'proxy_upstream_pool_discarded', 'counter', 'Connections closed by each upstream pool (idle, dropped or capped)' ))
+METRICS__DNS              = (('hits'         , 'proxy_dns_hits'         , 'counter', 'Upstream DNS lookups answered from the cache'           ),
+                             ('misses'       , 'proxy_dns_misses'       , 'counter', 'Upstream DNS lookups sent to the resolver'              ),
+                             ('negative_hits', 'proxy_dns_negative_hits', 'counter', 'Failed upstream DNS lookups answered from the cache'    ),
+                             ('refreshes'    , 'proxy_dns_refreshes'    , 'counter', 'Cached DNS lookups of hot hosts refreshed in background'),
+                             ('errors'       , 'proxy_dns_errors'       , 'counter', 'Upstream DNS lookups that failed'                       ),
+                             ('entries'      , 'proxy_dns_entries'      , 'gauge'  , 'Upstream DNS lookups held by the cache'                 ))
+METRICS__HEDGES           = (('hedged'       , 'proxy_upstream_hedges'       , 'counter', 'Second upstream calls sent for slow safe requests'      ),
+                             ('wins'         , 'proxy_upstream_hedge_wins'   , 'counter', 'Hedges that answered before the first call'             ),
+                             ('losses'       , 'proxy_upstream_hedge_losses' , 'counter', 'Hedges the first call answered before'                  ),
+                             ('exhausted'    , 'proxy_upstream_hedges_denied', 'counter', 'Hedges not sent because the host\'s hedge budget was spent'))
+METRICS__BACKENDS         = (('outstanding', 'proxy_upstream_backend_outstanding', 'gauge'  , 'Calls in flight to each backend of an upstream group'       ),
+                             ('calls'      , 'proxy_upstream_backend_calls'      , 'counter', 'Calls routed to each backend of an upstream group'          ),
+                             ('failures'   , 'proxy_upstream_backend_failures'   , 'counter', 'Failed calls (errors, timeouts and 5xx) of each backend'    ),
+                             ('ejected'    , 'proxy_upstream_backend_ejected'    , 'gauge'  , 'Backends out of rotation after failing (1 while ejected)'   ),
+                             ('ejections'  , 'proxy_upstream_backend_ejections'  , 'counter', 'Times each backend was ejected'                             ))
+METRICS__HOSTS_LIMIT      = 50                                                  # by_host series rendered (the hosts with the most responses: the others are summed into host="other")
+METRICS__LABELS_LIMIT     = 4096                                                # escaped label pairs kept (oldest dropped first)
+METRICS__BREAKER          = ('proxy_upstream_breaker_state', 'Circuit breaker state of each upstream host (1 for its current state)')
+METRICS__LATENCY          = (('connect' , 'proxy_upstream_connect_seconds', 'Time to open a new upstream connection'          ),
+                             ('ttfb'    , 'proxy_upstream_ttfb_seconds'   , 'Time until upstream sent its response headers'   ),
+                             ('upstream', 'proxy_upstream_seconds'        , 'Time until the upstream body was read to the end'),
+                             ('total'   , 'proxy_request_seconds'         , 'End-to-end time of proxied requests'             ))
+METRICS__LATENCY_BOUNDS   = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)   # le buckets (seconds)
+METRICS__BUCKET_ENDS      = tuple(sum(1 for index in range(BUCKETS) if Service__Proxy__Latency__Histogram().value_at(index) <= bound * 1_000_000)
+                                  for bound in METRICS__LATENCY_BOUNDS)          # histogram buckets that fall at or below each bound (computed once)
+
+
+def family_header(name        : str,                                            # A metric family's TYPE, UNIT and HELP lines
+                  metric_type : str,
+                  help        : str,
+                  unit        : str = ''
+                 ) -> str:
+    lines = [f'# TYPE {name} {metric_type}']
+    if unit:
+        lines.append(f'# UNIT {name} {unit}')
+    lines.append(f'# HELP {name} {help}')
+    return '\n'.join(lines)
+
+METRICS__HEADERS = {**{name: family_header(name, 'counter'  , help, unit     ) for total, name, help, unit  in METRICS__COUNTERS  },     # (formatted once, not on every scrape)
+                    **{name: family_header(name, 'counter'  , help           ) for group, name, label, help in METRICS__BREAKDOWNS},
+                    **{name: family_header(name, 'gauge'    , help, unit     ) for name, help, unit         in METRICS__GAUGES    },
+                    **{name: family_header(name, kind       , help           ) for state, name, kind, help  in METRICS__POOLS     },
+                    **{name: family_header(name, kind       , help           ) for stat, name, kind, help   in METRICS__DNS       },
+                    **{name: family_header(name, kind       , help           ) for stat, name, kind, help   in METRICS__HEDGES    },
+                    **{name: family_header(name, kind       , help           ) for stat, name, kind, help   in METRICS__BACKENDS  },
+                    METRICS__BREAKER[0]: family_header(METRICS__BREAKER[0], 'gauge', METRICS__BREAKER[1])                                    ,
+                    **{name: family_header(name, 'histogram', help, 'seconds') for metric, name, help       in METRICS__LATENCY   }}
+
+
+class Service__Proxy__Metrics(Type_Safe):                                       # OpenMetrics text for /proxy/metrics, built from copies of the stats (so scrapes never block request recording)
+    labels   : dict                                                             # (label name, value) -> 'name="escaped value"' (hosts and methods repeat on every scrape, up to METRICS__LABELS_LIMIT of them)
+    rendered : dict                                                             # (metric, host) -> (count, its histogram's samples): only histograms with new recordings are formatted again
+
+    def label(self, name  : str,                                                # Label pair, escaped as OpenMetrics wants it
+                    value : str
+               ) -> str:
+        key  = (name, value)
+        text = self.labels.get(key)
+        if text is None:
+            escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            text    = f'{name}="{escaped}"'
+            if len(self.labels) >= METRICS__LABELS_LIMIT:
+                del self.labels[next(iter(self.labels))]
+            self.labels[key] = text
+        return text
+
+    def render(self, stats    : Service__Proxy__Stats           ,               # Every metric, in the OpenMetrics text format
+                     cache    : Service__Proxy__Cache           ,
+                     pools    : Dict[str, int]                  ,               # upstream connections by state (idle / in_use)
+                     hosts    : Dict[str, Dict[str, int]] = None,               # each upstream pool's usage (Service__Proxy__Pools.get_pools)
+                     dns      : Dict[str, int]            = None,               # DNS cache stats (Service__Proxy__DNS.get_stats)
+                     breakers : Dict[str, Dict]           = None,               # circuit breaker of each upstream host (Service__Proxy__Breaker.get_states)
+                     hedges   : Dict[str, int]            = None,               # hedged upstream calls (Service__Proxy__Hedge.get_stats)
+                     groups   : Dict[str, Dict]           = None                # backends of each upstream group (Service__Proxy__Balancer.get_states)
+                ) -> str:
+        totals     = stats.totals()
+        breakdowns = sorted((key, count) for key, count in totals.items() if type(key) is tuple)
+        lines      = []
+        for total, name, help, unit in METRICS__COUNTERS:
+            lines.append(METRICS__HEADERS[name])
+            lines.append(f'{name}_total {totals.get(total, 0)}')
+        for group, name, label, help in METRICS__BREAKDOWNS:
+            lines.append(METRICS__HEADERS[name])
+            counts = [(value, count) for (key_group, value), count in breakdowns if key_group == group]
+            if group == 'by_host':                                              # (upstream hosts: in full-URL mode, any host a client asks for)
+                counts = self.top_hosts(counts)
+            for value, count in counts:
+                lines.append(f'{name}_total{{{self.label(label, value)}}} {count}')
+        self.render_gauges (lines, totals, cache, pools)
+        self.render_pools  (lines, hosts or {})
+        self.render_stats  (lines, METRICS__DNS   , dns    or {})
+        self.render_stats  (lines, METRICS__HEDGES, hedges or {})
+        self.render_breakers(lines, breakers or {})
+        self.render_backends(lines, groups   or {})
+        self.render_latency(lines, stats)
+        lines.append('# EOF\n')
+        return '\n'.join(lines)
+
+    def top_hosts(self, counts: List[tuple]) -> List[tuple]:                    # The METRICS__HOSTS_LIMIT hosts with the most responses (sorted by host), the others summed into 'other'
+        if len(counts) <= METRICS__HOSTS_LIMIT:
+            return counts
+        ranked = sorted(counts, key=lambda item: (-item[1], item[0]))
+        top    = dict(ranked[:METRICS__HOSTS_LIMIT])
+        top['other'] = top.get('other', 0) + sum(count for host, count in ranked[METRICS__HOSTS_LIMIT:])
+        return sorted(top.items())
+
+    def render_gauges(self, lines  : List[str]            ,
+                            totals : Dict                 ,
+                            cache  : Service__Proxy__Cache,
+                            pools  : Dict[str, int]
+                       ) -> None:
+        served_from_cache = totals.get('total_cache_hits', 0) + totals.get('total_stale_hits', 0)
+        responses         = served_from_cache + totals.get('total_requests', 0)
+        values            = {'proxy_in_flight_requests': totals.get('in_flight', 0)                         ,
+                             'proxy_cache_hit_ratio'   : served_from_cache / responses if responses else 0.0,
+                             'proxy_cache_entries'     : len(cache.entries)                                 ,
+                             'proxy_cache_memory_bytes': cache.size                                         ,
+                             'proxy_cache_disk_bytes'  : cache.disk.size                                    }
+        for name, value in values.items():
+            lines.append(METRICS__HEADERS[name])
+            lines.append(f'{name} {value}')
+        lines.append(METRICS__HEADERS['proxy_upstream_connections'])
+        for state, count in pools.items():
+            lines.append(f'proxy_upstream_connections{{{self.label("state", state)}}} {count}')
+
+    def render_pools(self, lines : List[str]                ,
+                           hosts : Dict[str, Dict[str, int]]
+                      ) -> None:
+        for state, name, kind, help in METRICS__POOLS:
+            suffix = '_total' if kind == 'counter' else ''
+            lines.append(METRICS__HEADERS[name])
+            for pool, usage in hosts.items():
+                lines.append(f'{name}{suffix}{{{self.label("pool", pool)}}} {usage.get(state, 0)}')
+
+    def render_stats(self, lines    : List[str]     ,                          # A service's counters and gauges (e.g. METRICS__DNS)
+                           families : tuple         ,
+                           stats    : Dict[str, int]
+                      ) -> None:
+        for stat, name, kind, help in families:
+            suffix = '_total' if kind == 'counter' else ''
+            lines.append(METRICS__HEADERS[name])
+            lines.append(f'{name}{suffix} {stats.get(stat, 0)}')
+
+    def render_breakers(self, lines    : List[str]      ,
+                              breakers : Dict[str, Dict]
+                         ) -> None:
+        name = METRICS__BREAKER[0]
+        lines.append(METRICS__HEADERS[name])
+        for host, breaker in breakers.items():
+            host_label = self.label('host', host)
+            for state in Enum__Proxy__Breaker__State:
+                lines.append(f'{name}{{{host_label},{self.label("state", state.value)}}} {int(breaker["state"] == state.value)}')
+
+    def render_backends(self, lines  : List[str]      ,
+                              groups : Dict[str, Dict]
+                         ) -> None:
+        for stat, name, kind, help in METRICS__BACKENDS:
+            suffix = '_total' if kind == 'counter' else ''
+            lines.append(METRICS__HEADERS[name])
+            for group, backends in groups.items():
+                group_label = self.label('group', group)
+                for backend, state in backends.items():
+                    lines.append(f'{name}{suffix}{{{group_label},{self.label("backend", backend)}}} {int(state[stat])}')
+
+    def render_latency(self, lines : List[str]            ,
+                             stats : Service__Proxy__Stats
+                        ) -> None:
+        arrays   = stats.latency.arrays()
+        keys     = sorted(arrays)
+        rendered = self.rendered
+        for metric, name, help in METRICS__LATENCY:
+            lines.append(METRICS__HEADERS[name])
+            for key in keys:
+                if key[0] != metric:
+                    continue
+                counts, totals = arrays[key]
+                cached         = rendered.get(key)
+                if cached is None or cached[0] != totals[2]:
+                    cached = rendered[key] = (totals[2], self.histogram_samples(name, self.label('host', key[1]), counts, totals))
+                lines.append(cached[1])
+        for key in [key for key in rendered if key not in arrays]:             # (histograms dropped by a stats reset)
+            del rendered[key]
+
+    def histogram_samples(self, name   : str  ,                                 # A histogram's samples: cumulative le buckets, count and sum (in seconds)
+                                labels : str  ,
+                                counts : array,
+                                totals : array
+                           ) -> str:
+        lines      = []
+        cumulative = 0
+        start      = 0
+        for bound, end in zip(METRICS__LATENCY_BOUNDS, METRICS__BUCKET_ENDS):
+            cumulative += sum(counts[start:end])
+            start       = end
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {totals[2]}')
+        lines.append(f'{name}_count{{{labels}}} {totals[2]}'               )
+        lines.append(f'{name}_sum{{{labels}}} {totals[0] / 1_000_000}'     )
+        return '\n'.join(lines)
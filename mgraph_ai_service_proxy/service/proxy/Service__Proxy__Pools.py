@@ -0,0 +1,324 @@
+import socket
+import sys
+import threading
+import time
+import requests
+import urllib3
+from typing                                                         import Dict, List, Optional
+from urllib3.exceptions                                             import ConnectTimeoutError, NameResolutionError, NewConnectionError
+from osbot_utils.type_safe.Type_Safe                                import Type_Safe
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Config          import Schema__Proxy__Config
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__DNS      import Service__Proxy__DNS
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Hedge    import hedge_races
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Retry    import Service__Proxy__Retry
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Latency  import Timed__HTTP_Connection, Timed__HTTPS_Connection, Timed__HTTP_Connection_Pool, Timed__HTTPS_Connection_Pool
+
+POOLS__SWEEP_INTERVAL = 1.0                                                     # seconds between sweeps for connections idle for longer than config.pool_idle_timeout
+POOL__STATES          = ('idle', 'active', 'waiting', 'created', 'discarded')   # per-pool metrics (the last two are counters)
+
+
+class Pooled__Connection__Mixin:                                                # Connection counted against the process-wide socket cap while it is open (from connect to close)
+    pool       = None                                                           # its Pooled__Pool (set when it is created)
+    counted    = False                                                          # holding one of the cap's sockets
+    idle_since = 0.0                                                            # when it went back to its pool (monotonic)
+
+    def connect(self) -> None:
+        self.pool.socket_opened()                                               # (waits for a socket when the cap is reached)
+        self.counted = True
+        try:
+            super().connect()
+        except BaseException:
+            self.close()
+            raise
+
+    def _new_conn(self) -> socket.socket:                                       # urllib3's _new_conn, with the addresses from the DNS cache (config.dns_cache)
+        pools_service = self.pool.pools_service
+        config        = pools_service.config
+        if config.dns_cache is False:
+            return super()._new_conn()
+        try:
+            sock = pools_service.dns_service.create_connection(config, (self._dns_host, self.port), self.timeout,
+                                                               source_address = self.source_address,
+                                                               socket_options = self.socket_options)
+        except socket.gaierror as error:
+            raise NameResolutionError(self.host, self, error) from error
+        except socket.timeout as error:
+            raise ConnectTimeoutError(self, f'Connection to {self.host} timed out. (connect timeout={self.timeout})') from error
+        except OSError as error:
+            raise NewConnectionError(self, f'Failed to establish a new connection: {error}') from error
+        sys.audit('http.client.connect', self, self.host, self.port)
+        return sock
+
+    def getresponse(self):                                                      # (the first call of a hedged request can be aborted while it waits for the response headers)
+        race = getattr(hedge_races, 'race', None)
+        if race is None:
+            return super().getresponse()
+        race.wait_on(self)
+        try:
+            return super().getresponse()
+        finally:
+            race.wait_on(None)
+
+    def close(self) -> None:
+        super().close()
+        self.idle_since = 0.0
+        if self.counted:
+            self.counted = False
+            self.pool.socket_closed()
+
+
+class Pooled__HTTP_Connection (Pooled__Connection__Mixin, Timed__HTTP_Connection ): pass
+class Pooled__HTTPS_Connection(Pooled__Connection__Mixin, Timed__HTTPS_Connection): pass
+
+
+class Pooled__Pool__Mixin:                                                      # urllib3 pool that waits for a connection instead of opening (and then discarding) extra ones, and keeps per-pool metrics
+    pools_service = None                                                        # Service__Proxy__Pools that created it
+    created       = 0                                                           # sockets opened
+    discarded     = 0                                                           # sockets closed (idle eviction, dropped by upstream, 'Connection: close', ...)
+    waiting       = 0                                                           # threads waiting for one of the pool's connections right now
+
+    def _new_conn(self):
+        connection      = super()._new_conn()
+        connection.pool = self
+        return connection
+
+    def _get_conn(self, timeout: Optional[float] = None):
+        pools_service = self.pools_service
+        pools_service.sweep()
+        if timeout is None:
+            timeout = pools_service.pool_timeout()                              # (requests doesn't pass one, and blocking pools would wait forever)
+        queue = self.pool
+        if queue is not None and queue.empty():                                 # every connection is checked out: this thread waits for one
+            with pools_service.lock:
+                self.waiting += 1
+            try:
+                connection = super()._get_conn(timeout)
+            finally:
+                with pools_service.lock:
+                    self.waiting -= 1
+        else:
+            connection = super()._get_conn(timeout)
+        if connection.idle_since and time.monotonic() - connection.idle_since > pools_service.idle_timeout():
+            connection.close()                                                  # idle for too long (upstream may have dropped it): reconnect
+        return connection
+
+    def _put_conn(self, connection) -> None:
+        if connection is not None:
+            connection.idle_since = time.monotonic()
+        super()._put_conn(connection)
+
+    def socket_opened(self) -> None:
+        self.pools_service.open_socket()
+        with self.pools_service.lock:
+            self.created += 1
+
+    def socket_closed(self) -> None:
+        with self.pools_service.lock:
+            self.discarded += 1
+        self.pools_service.close_socket()
+
+    def idle_connections(self) -> List:                                         # (oldest first)
+        queue = self.pool
+        if queue is None:
+            return []
+        with queue.mutex:
+            return sorted((connection for connection in queue.queue if connection is not None and connection.sock is not None), key=lambda connection: connection.idle_since)
+
+    def evict(self, connections: List) -> int:                                  # Take these idle connections out of the pool and close them (the ones still idle)
+        queue   = self.pool
+        evicted = []
+        if queue is not None:
+            with queue.mutex:
+                for index, connection in enumerate(queue.queue):
+                    if connection is not None and connection in connections:
+                        queue.queue[index] = None                               # (the pool opens a new one when it needs it)
+                        evicted.append(connection)
+        for connection in evicted:                                              # closed outside the queue's lock (closing takes the pools lock)
+            connection.close()
+        return len(evicted)
+
+    def usage(self) -> Dict[str, int]:                                          # POOL__STATES
+        queue  = self.pool
+        idle   = 0
+        active = 0
+        if queue is not None:
+            with queue.mutex:
+                idle   = sum(1 for connection in queue.queue if connection is not None and connection.sock is not None)    # (the queue is pre-filled with None placeholders, and keeps connections upstream closed until they are reopened)
+                active = queue.maxsize - len(queue.queue)                                   # (taken out of the queue while serving a request)
+        return dict(idle = idle, active = active, waiting = self.waiting, created = self.created, discarded = self.discarded)
+
+
+class Pooled__HTTP_Connection_Pool (Pooled__Pool__Mixin, Timed__HTTP_Connection_Pool ): ConnectionCls = Pooled__HTTP_Connection
+class Pooled__HTTPS_Connection_Pool(Pooled__Pool__Mixin, Timed__HTTPS_Connection_Pool): ConnectionCls = Pooled__HTTPS_Connection
+
+POOLED__POOL_CLASSES = {'http' : Pooled__HTTP_Connection_Pool ,
+                        'https': Pooled__HTTPS_Connection_Pool}
+
+
+class Pooled__Pool_Manager(urllib3.PoolManager):                                # Pool manager that sizes each host's pool (config.pool_host_max_size overrides) and registers it for the metrics
+    def __init__(self, pools_service, **kwargs):
+        super().__init__(**kwargs)
+        self.pools_service          = pools_service
+        self.pool_classes_by_scheme = POOLED__POOL_CLASSES
+
+    def _new_pool(self, scheme, host, port, request_context=None):
+        request_context            = dict(self.connection_pool_kw if request_context is None else request_context)
+        request_context['maxsize'] = self.pools_service.host_max_size(host, port)
+        request_context['block'  ] = True                                       # wait for a connection (up to pool_timeout) instead of opening one that gets discarded
+        pool                       = super()._new_pool(scheme, host, port, request_context)
+        pool.pools_service         = self.pools_service
+        self.pools_service.add_pool(pool)
+        return pool
+
+
+class Pooled__HTTP_Adapter(requests.adapters.HTTPAdapter):                     # requests adapter on the shared Pooled__Pool_Manager (its own max_retries are passed to urllib3 on each request)
+    def __init__(self, pools_service, **kwargs):
+        self.pools_service = pools_service
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        self._pool_connections = connections
+        self._pool_maxsize     = maxsize
+        self._pool_block       = block
+        self.poolmanager       = self.pools_service.pool_manager(maxsize, block, **pool_kwargs)
+
+    def close(self) -> None:                                                    # (the pool manager is shared: Service__Proxy__Pools.close clears it)
+        pass
+
+
+class Service__Proxy__Pools(Type_Safe):                                         # Process-wide upstream connection pools (sync engine): one pool per host shared by every thread, idle eviction and a cap on open sockets
+    config        : Schema__Proxy__Config                                       # the proxy's config (the one its last session was asked with)
+    dns_service   : Service__Proxy__DNS                                         # upstream DNS lookups (config.dns_cache)
+    retry_service : Service__Proxy__Retry                                       # which failed calls are sent again, and when (shared with the asyncio engine)
+    lock          : threading.Condition                                         # guards sockets, pools, adapters and the pool counters (waited on when the socket cap is reached)
+    sockets       : int                                                         # upstream sockets open right now, over every pool
+    pools         : list                                                        # every Pooled__Pool created (closed ones are dropped by the sweeps)
+    adapters      : dict                                                        # retries (bool) -> Pooled__HTTP_Adapter, shared by every thread's session
+    manager       : Pooled__Pool_Manager = None                                 # the pools of both adapters: one per host, with and without retries
+    sessions      : threading.local                                             # each thread's requests sessions (a Session's cookies and settings are not thread safe)
+    last_sweep    : float
+
+    def pool_timeout(self) -> float:                                            # seconds to wait for a pooled connection (or for a socket, when the cap is reached)
+        return float(self.config.connect_timeout)
+
+    def idle_timeout(self) -> float:
+        return float(self.config.pool_idle_timeout)
+
+    def host_max_size(self, host : str,                                         # Connections kept for a host (config.pool_host_max_size overrides, by 'host:port' or 'host')
+                            port : int
+                       ) -> int:
+        overrides = self.config.pool_host_max_size
+        for key in (f'{host}:{port}', host):
+            if key in overrides:
+                return int(overrides[key])
+        return int(self.config.pool_max_size)
+
+    def pool_manager(self, maxsize : int  ,                                     # The pool manager every adapter uses (up to config.pool_max_hosts pools, least recently used closed first)
+                           block   : bool ,
+                           **pool_kwargs
+                      ) -> Pooled__Pool_Manager:
+        with self.lock:
+            if self.manager is None:
+                self.manager = Pooled__Pool_Manager(self, num_pools=int(self.config.pool_max_hosts), maxsize=maxsize, block=block, **pool_kwargs)
+            return self.manager
+
+    def adapter(self, retries: bool = True) -> Pooled__HTTP_Adapter:            # The shared adapter for requests with or without retries (both on the same pools: retries are applied per request)
+        with self.lock:
+            adapter = self.adapters.get(retries)
+            if adapter is None:
+                config  = self.config
+                adapter = self.adapters[retries] = Pooled__HTTP_Adapter(self,
+                                                                        pool_connections = int(config.pool_connections)  ,
+                                                                        pool_maxsize     = int(config.pool_max_size)     ,
+                                                                        max_retries      = self.retry_service.urllib3_retry(config, retries))
+            return adapter
+
+    def session(self, config  : Schema__Proxy__Config ,                         # This thread's session on the shared adapter
+                      retries : bool = True
+                 ) -> requests.Session:
+        self.config = config
+        name        = 'session' if retries else 'session__no_retries'          # streamed uploads can't be replayed (nor non-idempotent requests resent), so they get a session without retries
+        session     = getattr(self.sessions, name, None)
+        if session is None:
+            adapter = self.adapter(retries)
+            session = requests.Session()
+            session.mount('http://' , adapter)
+            session.mount('https://', adapter)
+            session.timeout = (self.config.connect_timeout, self.config.read_timeout)
+            setattr(self.sessions, name, session)
+        return session
+
+    def add_pool(self, pool: Pooled__Pool__Mixin) -> None:
+        with self.lock:
+            self.pools.append(pool)
+
+    def open_socket(self) -> None:                                              # Take one of the cap's sockets: closing idle connections of other hosts to make room, or waiting for one (ConnectTimeoutError after pool_timeout)
+        deadline = time.monotonic() + self.pool_timeout()
+        while True:
+            with self.lock:
+                max_sockets = int(self.config.pool_max_sockets)
+                if max_sockets == 0 or self.sockets < max_sockets:
+                    self.sockets += 1
+                    return
+            if self.close_idle(limit=1):                                        # (outside the lock: closing takes it)
+                continue
+            with self.lock:
+                if self.sockets < max_sockets:
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ConnectTimeoutError(None, f'Upstream socket limit reached ({max_sockets} open), no socket freed in {self.pool_timeout()}s')
+                self.lock.wait(remaining)
+
+    def close_socket(self) -> None:
+        with self.lock:
+            self.sockets = max(0, self.sockets - 1)
+            self.lock.notify()
+
+    def live_pools(self) -> List[Pooled__Pool__Mixin]:                          # (dropping the ones the pool managers closed)
+        with self.lock:
+            self.pools[:] = [pool for pool in self.pools if pool.pool is not None]
+            return list(self.pools)
+
+    def close_idle(self, older_than : float = None,                             # Close idle connections (only those idle for longer than older_than seconds, when given), oldest first
+                         limit      : int   = None
+                    ) -> int:
+        now        = time.monotonic()
+        candidates = []
+        for pool in self.live_pools():
+            for connection in pool.idle_connections():
+                if older_than is None or now - connection.idle_since > older_than:
+                    candidates.append((connection.idle_since, id(connection), pool, connection))
+        candidates.sort(key=lambda candidate: candidate[:2])
+        if limit is not None:
+            candidates = candidates[:limit]
+        by_pool = {}
+        for idle_since, key, pool, connection in candidates:
+            by_pool.setdefault(pool, []).append(connection)
+        return sum(pool.evict(connections) for pool, connections in by_pool.items())
+
+    def sweep(self, now: float = None) -> int:                                  # Close connections idle for longer than config.pool_idle_timeout (at most once per POOLS__SWEEP_INTERVAL)
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if now - self.last_sweep < POOLS__SWEEP_INTERVAL:
+                return 0
+            self.last_sweep = now
+        return self.close_idle(older_than=self.idle_timeout())
+
+    def get_pools(self) -> Dict[str, Dict[str, int]]:                          # 'scheme://host:port' -> POOL__STATES (pools of the same host with different settings, e.g. TLS, are added up)
+        usage = {}
+        for pool in self.live_pools():
+            key          = f'{pool.scheme}://{pool.host}:{pool.port}'
+            pool_usage   = pool.usage()
+            totals       = usage.setdefault(key, dict.fromkeys(POOL__STATES, 0))
+            for state in POOL__STATES:
+                totals[state] += pool_usage[state]
+        return dict(sorted(usage.items()))
+
+    def close(self) -> None:                                                    # Close every pool (and its connections)
+        with self.lock:
+            manager = self.manager
+            self.adapters.clear()
+        if manager is not None:
+            manager.clear()                                                     # (it can be used again: new pools are opened as needed)
+        self.sessions = threading.local()
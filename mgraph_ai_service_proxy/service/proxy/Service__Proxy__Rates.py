@@ -0,0 +1,100 @@
+import threading
+import time
+from array                                                      import array
+from typing                                                     import Dict
+from osbot_utils.type_safe.Type_Safe                            import Type_Safe
+
+RATES__SECONDS = 300                                                            # seconds kept per series (the longest window)
+RATES__WINDOWS = (10, 60, 300)                                                  # windows in get_rates (seconds)
+RATES__SERIES  = ('requests', 'errors', 'timeouts', 'bytes_in', 'bytes_out')
+
+
+class Service__Proxy__Rates__Ring(Type_Safe):                                   # Per-second counts of the last RATES__SECONDS seconds: fixed memory, whatever the traffic
+    seconds : array = None                                                      # second each slot is counting (slot = second % RATES__SECONDS)
+    counts  : array = None                                                      # count per slot
+
+    def setup(self) -> 'Service__Proxy__Rates__Ring':
+        self.seconds = array('q', [-1]) * RATES__SECONDS
+        self.counts  = array('q', bytes(8 * RATES__SECONDS))
+        return self
+
+    def add(self, second : int,                                                 # Add to a second's count (reusing its slot once the previous round of seconds has expired)
+                  value  : int
+             ) -> None:
+        slot = second % RATES__SECONDS
+        if self.seconds[slot] != second:
+            self.seconds[slot] = second
+            self.counts [slot] = 0
+        self.counts[slot] += value
+
+    def total(self, second : int,                                               # Sum of the window seconds before this one
+                    window : int
+               ) -> int:
+        total = 0
+        for past in range(second - min(window, RATES__SECONDS), second):
+            slot = past % RATES__SECONDS
+            if self.seconds[slot] == past:
+                total += self.counts[slot]
+        return total
+
+
+class Service__Proxy__Rates(Type_Safe):                                         # Sliding-window rates (requests/s, errors/s, bytes/s, error rate) over the last few minutes: one set of rings per thread, summed when read
+    shards : dict                                                               # thread id -> {series (one of RATES__SERIES): Service__Proxy__Rates__Ring} (only ever written by its own thread, so no locks when recording)
+
+    def now(self) -> int:                                                       # Current second (monotonic, so wall clock changes don't move the windows)
+        return int(time.monotonic())
+
+    def shard(self) -> Dict:                                                    # This thread's rings
+        shard = self.shards.get(threading.get_ident())
+        if shard is None:
+            shard = self.shards.setdefault(threading.get_ident(), {})           # (atomic: a thread id is only reused once its thread is gone)
+        return shard
+
+    def record(self, series : str             ,                                 # Add to this second's count of a series
+                     value  : int   = 1       ,
+                     now    : int   = None
+                ) -> None:
+        second = self.now() if now is None else now
+        shard  = self.shard()
+        ring   = shard.get(series)
+        if ring is None:
+            ring = shard[series] = Service__Proxy__Rates__Ring().setup()
+        ring.add(second, value)
+
+    def total(self, series : str       ,                                        # Count of a series over the last window seconds (the current, partial, second is left out)
+                    window : int       ,
+                    now    : int = None
+               ) -> int:
+        second = self.now() if now is None else now
+        total  = 0
+        for shard in list(self.shards.values()):
+            ring = shard.get(series)
+            if ring is not None:
+                total += ring.total(second, window)                             # (only past seconds are read: the slot its thread is writing is the current one)
+        return total
+
+    def rate(self, series : str       ,                                         # Per-second rate of a series over the last window seconds
+                   window : int       ,
+                   now    : int = None
+              ) -> float:
+        return self.total(series, window, now) / window
+
+    def error_rate(self, window : int       ,                                   # Share of upstream calls that failed (connection errors and timeouts) over the last window seconds
+                         now    : int = None
+                    ) -> float:
+        second   = self.now() if now is None else now
+        failures = self.total('errors', window, second) + self.total('timeouts', window, second)
+        calls    = self.total('requests', window, second) + failures
+        return failures / calls if calls else 0.0
+
+    def reset(self) -> None:                                                    # (counts made while resetting may be lost)
+        self.shards.clear()
+
+    def get_rates(self, now: int = None) -> Dict[str, Dict[str, float]]:        # window ('10s', '60s', '300s') -> per-second rates and error rate
+        second = self.now() if now is None else now
+        rates  = {}
+        for window in RATES__WINDOWS:
+            window_rates = {f'{series}_per_second': round(self.rate(series, window, second), 3) for series in RATES__SERIES}
+            window_rates['error_rate'] = round(self.error_rate(window, second), 4)
+            rates[f'{window}s'] = window_rates
+        return rates
@@ -0,0 +1,116 @@
+import random
+import threading
+import time
+from email.utils                                                    import parsedate_to_datetime
+from typing                                                         import Dict, Optional
+from urllib3.exceptions                                             import MaxRetryError, ResponseError
+from urllib3.util.retry                                             import Retry
+from osbot_utils.type_safe.Type_Safe                                import Type_Safe
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Config          import Schema__Proxy__Config
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Budget   import Service__Proxy__Budget
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Hedge    import first_call_aborted
+
+RETRY__METHODS            = frozenset(('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE', 'TRACE'))   # idempotent: sending them twice does no harm
+RETRY__IDEMPOTENCY_HEADER = 'idempotency-key'                                   # lets clients mark other requests (e.g. a POST) as safe to send again
+RETRY__STATUS_CODES       = frozenset((429, 502, 503, 504))                     # upstream answers worth another try
+RETRY__BACKOFF_MAX        = 10.0                                                # longest wait between two attempts (seconds)
+
+
+class Service__Proxy__Retry(Type_Safe):                                         # Retries of idempotent requests: decorrelated jitter, Retry-After, and a token bucket per host that caps retries to a share of its traffic
+    budget    : Service__Proxy__Budget                                          # retry tokens per host (each first attempt adds config.retry_budget, each retry takes one)
+    attempts  : threading.local                                                 # host and retries of the request this thread is sending (sync engine)
+
+    def retryable(self, method  : str           ,                               # Can this request be sent again? (idempotent method, or an Idempotency-Key)
+                        headers : Dict[str, str]
+                   ) -> bool:
+        if method in RETRY__METHODS:
+            return True
+        return any(name.lower() == RETRY__IDEMPOTENCY_HEADER for name in headers)
+
+    def deposit(self, config : Schema__Proxy__Config,                           # A first attempt to a host: adds config.retry_budget tokens to its budget
+                      host   : str
+                 ) -> None:
+        self.budget.deposit(host, float(config.retry_budget))
+
+    def retry_after(self, value: Optional[str]) -> Optional[float]:             # Retry-After (seconds or an HTTP-date) as seconds from now (None when missing or invalid)
+        if not value:
+            return None
+        value = value.strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def backoff(self, config   : Schema__Proxy__Config,                         # Decorrelated jitter: random between the base (config.retry_backoff) and 3x the previous wait, capped
+                      previous : float
+                 ) -> float:
+        base = float(config.retry_backoff)
+        return min(RETRY__BACKOFF_MAX, random.uniform(base, max(base, previous * 3)))
+
+    def delay(self, config      : Schema__Proxy__Config,                        # Seconds to wait before retrying (None: don't retry, and take the failure or response as it is)
+                    host        : str                  ,
+                    attempt     : int                  ,                        # retries made so far
+                    previous    : float                ,                        # the last wait (0 before the first retry)
+                    retry_after : Optional[float] = None
+               ) -> Optional[float]:
+        if attempt >= int(config.retry_count):
+            return None
+        if retry_after is not None and retry_after > int(config.retry_after_max):   # upstream wants a longer break than it's worth holding the client for
+            return None
+        if self.budget.withdraw(host) is False:
+            return None
+        return retry_after if retry_after is not None else self.backoff(config, previous)
+
+    def start(self, host: str) -> None:                                         # This thread is about to send a request to host (sync engine)
+        self.attempts.host    = host
+        self.attempts.retries = 0
+
+    def retried(self) -> None:                                                  # This thread's request is being sent again
+        self.attempts.retries = getattr(self.attempts, 'retries', 0) + 1
+
+    def retries(self) -> int:                                                   # Retries made by this thread's last request
+        return getattr(self.attempts, 'retries', 0)
+
+    def urllib3_retry(self, config  : Schema__Proxy__Config,                    # urllib3 Retry for the sync engine's adapters (retries=False: never retry)
+                            retries : bool = True
+                       ) -> 'Proxy__Retry':
+        retry               = Proxy__Retry(total            = int(config.retry_count) if retries else 0,
+                                           status_forcelist = RETRY__STATUS_CODES                      ,
+                                           allowed_methods  = None                                     ,   # (every method: only retryable requests get a session with retries)
+                                           raise_on_status  = False                                    )   # out of retries: pass upstream's last response on
+        retry.retry_service = self
+        retry.config        = config
+        return retry
+
+
+class Proxy__Retry(Retry):                                                      # urllib3 Retry that asks Service__Proxy__Retry whether (and how long to wait before) each retry
+    retry_service : Service__Proxy__Retry = None
+    config        : Schema__Proxy__Config = None
+    wait          : float                 = 0.0                                 # seconds before the next attempt (decided by increment)
+
+    def new(self, **kwargs) -> 'Proxy__Retry':
+        retry               = super().new(**kwargs)
+        retry.retry_service = self.retry_service
+        retry.config        = self.config
+        retry.wait          = self.wait
+        return retry
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None) -> 'Proxy__Retry':
+        if first_call_aborted():                                                # (its hedge answered: nothing to retry)
+            raise MaxRetryError(_pool, url, error or ResponseError('hedge answered first'))
+        retry         = super().increment(method, url, response, error, _pool, _stacktrace)    # (raises MaxRetryError once config.retry_count is used up)
+        retry_service = self.retry_service
+        host          = getattr(retry_service.attempts, 'host', None) or f'{_pool.host}:{_pool.port}'
+        retry_after   = retry_service.retry_after(response.headers.get('Retry-After')) if response is not None else None
+        wait          = retry_service.delay(self.config, host, len(self.history), self.wait, retry_after)
+        if wait is None:
+            raise MaxRetryError(_pool, url, error or ResponseError('retry budget exhausted'))
+        retry_service.retried()
+        retry.wait = wait
+        return retry
+
+    def sleep(self, response=None) -> None:                                     # (Retry-After is already in wait)
+        if self.wait > 0:
+            time.sleep(self.wait)
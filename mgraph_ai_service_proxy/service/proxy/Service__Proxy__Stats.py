@@ -1,29 +1,163 @@
-from typing                                                 import Dict
-from osbot_utils.type_safe.Type_Safe                        import Type_Safe
-from osbot_utils.type_safe.primitives.safe_uint.Safe_UInt   import Safe_UInt
-from mgraph_ai_service_proxy.schemas.Schema__Proxy__Request import Schema__Proxy__Request
+import threading
+import types
+from typing                                                         import AsyncIterator, Dict, Iterator, List
+from osbot_utils.type_safe.Type_Safe                                import Type_Safe
+from mgraph_ai_service_proxy.schemas.Proxy__Request                 import Proxy__Request
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Latency  import Service__Proxy__Latency
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Rates    import Service__Proxy__Rates
 
+STATS__TOTALS     = ('total_requests'  , 'total_errors'     , 'total_timeouts'  , 'total_oversized',
+                     'total_cache_hits', 'total_revalidated', 'total_stale_hits', 'total_coalesced',
+                     'total_rejected'  , 'total_retries'    , 'total_bytes_in'  , 'total_bytes_out' )
+STATS__GROUPS     = ('by_status', 'by_method', 'by_host')                       # breakdowns of total_requests
+STATUS__CLASSES   = {1: '1xx', 2: '2xx', 3: '3xx', 4: '4xx', 5: '5xx'}
+SHARD__KEYS_LIMIT = 10000                                                       # breakdown counters per shard: past it, new methods / hosts are counted as 'other' (bounds memory with many hosts)
+RATES__BYTES      = {'total_bytes_in': 'bytes_in', 'total_bytes_out': 'bytes_out'}   # byte counter -> its rates series
 
-class Service__Proxy__Stats(Type_Safe):                                       # Statistics tracking for proxy requests
-    total_requests  : Safe_UInt                                               # Total number of requests processed
-    total_errors    : Safe_UInt                                               # Total number of errors
-    total_timeouts  : Safe_UInt                                               # Total number of timeouts
 
-    def record_request(self, request  : Schema__Proxy__Request        ,       # Record successful request
-                             status_code : int                                 # HTTP status code
+class Service__Proxy__Stats(Type_Safe):                                       # Statistics tracking for proxy requests: one shard of plain counters per thread, summed when read
+    shards  : dict                                                             # thread id -> {counter: count} (only ever written by its own thread, so no locks and no Type_Safe checks when counting)
+    latency : Service__Proxy__Latency                                          # latency histograms per target host
+    rates   : Service__Proxy__Rates                                            # per-second counts of the last few minutes (for requests/s, errors/s, bytes/s)
+
+    def shard(self) -> Dict:                                                   # This thread's counters
+        shard = self.shards.get(threading.get_ident())
+        if shard is None:
+            shard = self.shards.setdefault(threading.get_ident(), {})           # (atomic: a thread id is only reused once its thread is gone)
+        return shard
+
+    def count(self, shard : Dict ,                                             # Add one to a counter (only the (group, name) breakdowns are folded into 'other', never the totals)
+                    key          ) -> None:
+        if type(key) is tuple and key not in shard and len(shard) >= SHARD__KEYS_LIMIT:
+            key = (key[0], 'other')
+        shard[key] = shard.get(key, 0) + 1
+
+    def record_request(self, request     : Proxy__Request      ,               # Record successful request
+                             status_code : int                 ,               # HTTP status code
+                             host        : str          = None                 # upstream host the request was sent to (see Service__Proxy.upstream_host), the request's Host header when not given
+                       ) -> None:
+        shard = self.shard()
+        self.count(shard, 'total_requests')
+        self.count(shard, ('by_status', STATUS__CLASSES.get(status_code // 100, 'other')))
+        self.count(shard, ('by_method', str(request.method)                             ))
+        self.count(shard, ('by_host'  , str(request.host) if host is None else host     ))
+        self.rates.record('requests')
+
+    def record_error(self, request: Proxy__Request            ) -> None:          # Record connection error
+        self.count(self.shard(), 'total_errors')
+        self.rates.record('errors')
+
+    def record_timeout(self, request: Proxy__Request          ) -> None:          # Record timeout error
+        self.count(self.shard(), 'total_timeouts')
+        self.rates.record('timeouts')
+
+    def record_oversized(self, request: Proxy__Request        ) -> None:          # Record request or response body over the size limit
+        self.count(self.shard(), 'total_oversized')
+
+    def record_cache_hit(self, request: Proxy__Request        ) -> None:          # Record response served from the cache
+        self.count(self.shard(), 'total_cache_hits')
+
+    def record_cache_revalidated(self, request: Proxy__Request) -> None:          # Record stale cached response refreshed by a 304
+        self.count(self.shard(), 'total_revalidated')
+
+    def record_cache_stale(self, request: Proxy__Request      ) -> None:          # Record stale cached response served
+        self.count(self.shard(), 'total_stale_hits')
+
+    def record_coalesced(self, request: Proxy__Request        ) -> None:          # Record request answered by an identical one's upstream call
+        self.count(self.shard(), 'total_coalesced')
+
+    def record_rejected(self, request: Proxy__Request         ) -> None:          # Record request failed fast by its host's open circuit breaker
+        self.count(self.shard(), 'total_rejected')
+
+    def record_retries(self, request : Proxy__Request,                         # Record upstream calls made again for a request (not counted as requests of their own)
+                             count   : int
+                        ) -> None:
+        if count:
+            shard = self.shard()
+            shard['total_retries'] = shard.get('total_retries', 0) + count
+
+    def record_bytes(self, name : str,                                         # Add to a byte counter (total_bytes_in: client bodies, total_bytes_out: bodies sent to clients)
+                           size : int
+                     ) -> None:
+        shard       = self.shard()
+        shard[name] = shard.get(name, 0) + size
+        self.rates.record(RATES__BYTES[name], size)
+
+    def count_bytes(self, chunks : Iterator[bytes],                            # Pass a streamed body through, adding each chunk to a byte counter
+                          name   : str
+                     ) -> types.GeneratorType:
+        for chunk in chunks:
+            self.record_bytes(name, len(chunk))
+            yield chunk
+
+    async def count_bytes__async(self, chunks : AsyncIterator[bytes],          # Async version of count_bytes (asyncio engine)
+                                       name   : str
+                                  ) -> types.AsyncGeneratorType:
+        async for chunk in chunks:
+            self.record_bytes(name, len(chunk))
+            yield chunk
+
+    def record_in_flight(self, delta: int) -> None:                            # A request started (+1) or finished (-1) (possibly on different threads: only the sum over the shards counts)
+        shard              = self.shard()
+        shard['in_flight'] = shard.get('in_flight', 0) + delta
+
+    def record_latency(self, metric  : str                   ,                # Record a duration (connect, ttfb, upstream or total)
+                             host    : str                   ,
+                             seconds : float
                        ) -> None:
-        self.total_requests = Safe_UInt(self.total_requests + 1)
+        self.latency.record(metric, host, seconds)
 
-    def record_error(self, request: Schema__Proxy__Request            ) -> None:  # Record connection error
-        self.total_errors = Safe_UInt(self.total_errors + 1)
+    def reset(self) -> None:                                                   # Start every counter again from zero (counts made while resetting may be lost)
+        self.shards.clear()
+        self.latency.reset()
+        self.rates.reset()
 
-    def record_timeout(self, request: Schema__Proxy__Request          ) -> None:  # Record timeout error
-        self.total_timeouts = Safe_UInt(self.total_timeouts + 1)
+    def snapshots(self) -> List[Dict]:                                         # Copy of every shard (each copy is atomic, so counting threads are never blocked)
+        return [shard.copy() for shard in list(self.shards.values())]
 
-    def get_stats(self) -> Dict[str, int]:                                    # Get current statistics
-        return { 'total_requests' : self.total_requests  ,
-                 'total_errors'   : self.total_errors    ,
-                 'total_timeouts' : self.total_timeouts  }
+    def total(self, name: str) -> int:                                         # One counter, summed over the shards
+        return sum(snapshot.get(name, 0) for snapshot in self.snapshots())
 
+    @property
+    def total_requests   (self) -> int: return self.total('total_requests'   )   # Total number of requests processed
+    @property
+    def total_errors     (self) -> int: return self.total('total_errors'     )   # Total number of errors
+    @property
+    def total_timeouts   (self) -> int: return self.total('total_timeouts'   )   # Total number of timeouts
+    @property
+    def total_oversized  (self) -> int: return self.total('total_oversized'  )   # Total number of bodies rejected for being over max_content_size
+    @property
+    def total_cache_hits (self) -> int: return self.total('total_cache_hits' )   # Total number of responses served from the cache (without going upstream)
+    @property
+    def total_revalidated(self) -> int: return self.total('total_revalidated')   # Total number of stale cached responses upstream confirmed as current (304)
+    @property
+    def total_stale_hits (self) -> int: return self.total('total_stale_hits' )   # Total number of stale cached responses served (stale-while-revalidate / stale-if-error)
+    @property
+    def total_coalesced  (self) -> int: return self.total('total_coalesced'  )   # Total number of requests that shared another request's upstream call
+    @property
+    def total_rejected   (self) -> int: return self.total('total_rejected'   )   # Total number of requests failed fast by an open circuit breaker
+    @property
+    def total_retries    (self) -> int: return self.total('total_retries'    )   # Total number of upstream calls that were retries (first attempts are in total_requests)
+    @property
+    def total_bytes_in   (self) -> int: return self.total('total_bytes_in'   )   # Total bytes of request bodies received from clients
+    @property
+    def total_bytes_out  (self) -> int: return self.total('total_bytes_out'  )   # Total bytes of response bodies sent to clients
+    @property
+    def in_flight        (self) -> int: return self.total('in_flight'        )   # Requests being handled right now
 
+    def totals(self) -> Dict:                                                  # Every counter, summed over the shards
+        totals = {}
+        for snapshot in self.snapshots():
+            for key, value in snapshot.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
 
+    def get_stats(self) -> Dict[str, object]:                                 # Get current statistics (totals, requests by status class, method and host, latency percentiles and recent rates)
+        totals = self.totals()
+        stats  = {name : totals.get(name, 0) for name in STATS__TOTALS}
+        stats['in_flight'] = totals.get('in_flight', 0)
+        for group in STATS__GROUPS:
+            stats[group] = dict(sorted((key[1], value) for key, value in totals.items() if type(key) is tuple and key[0] == group))
+        stats['latency'] = self.latency.get_latency()
+        stats['rates'  ] = self.rates.get_rates()
+        return stats
@@ -0,0 +1,66 @@
+import types
+import anyio.from_thread
+from typing                                                     import Dict, Optional
+from starlette.requests                                         import Request
+from osbot_utils.type_safe.Type_Safe                            import Type_Safe
+from osbot_utils.type_safe.primitives.safe_uint.Safe_UInt       import Safe_UInt
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Config      import Schema__Proxy__Config
+from mgraph_ai_service_proxy.schemas.Proxy__Request             import Proxy__Request
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Retry import Service__Proxy__Retry
+
+BODY_METHODS = ('POST', 'PUT', 'PATCH')                                         # Methods whose body is forwarded upstream
+
+
+class Service__Proxy__Upload__Stream(Type_Safe):                                # Client body stream with a known size (so requests sends Content-Length instead of chunked)
+    chunks : types.GeneratorType = None                                         # Body chunks, pulled from the client as upstream consumes them
+    length : Safe_UInt                                                          # Content-Length sent by the client
+
+    def __iter__(self):
+        return self.chunks
+
+    def __len__(self):
+        return int(self.length)
+
+
+class Service__Proxy__Upload(Type_Safe):                                        # Decide how request bodies reach upstream (buffered vs streamed)
+    retry_service : Service__Proxy__Retry                                       # which requests may be sent again (only those need a replayable body)
+
+    def content_length(self, headers: Dict[str, str]) -> Optional[int]:         # Content-Length sent by the client (None when missing or invalid)
+        for name, value in headers.items():
+            if name.lower() == 'content-length':
+                try:
+                    return int(value)
+                except ValueError:
+                    return None
+        return None
+
+    def buffer_body(self, config  : Schema__Proxy__Config ,                     # Should the body be read into memory before proxying?
+                          method  : str                   ,
+                          headers : Dict[str, str]
+                     ) -> bool:
+        if method not in BODY_METHODS:
+            return False
+        if config.stream_uploads is False:                                      # streaming disabled: always buffer (original behaviour)
+            return True
+        if config.retry_count == 0 or self.retry_service.retryable(method, headers) is False:    # only retries need a replayable body (and a POST without an Idempotency-Key is never retried)
+            return False
+        length = self.content_length(headers)
+        return length is not None and length <= config.upload_buffer_size       # small bodies only (unknown size is always streamed)
+
+    def stream_body(self, request: Request) -> types.GeneratorType:              # Pull the client body chunk by chunk from the event loop (for use in the threadpool)
+        chunks = request.stream().__aiter__()                                   # each next() blocks this worker until the client sends more, which is the backpressure
+        while True:
+            try:
+                chunk = anyio.from_thread.run(chunks.__anext__)
+            except StopAsyncIteration:
+                return
+            if chunk:
+                yield chunk
+
+    def upstream_body(self, request: Proxy__Request):                           # What to hand to requests as the body: bytes, a sized stream or a (chunked) generator
+        if request.body_stream is None:
+            return request.body
+        length = self.content_length(request.headers)
+        if length is None:
+            return request.body_stream
+        return Service__Proxy__Upload__Stream(chunks=request.body_stream, length=length)
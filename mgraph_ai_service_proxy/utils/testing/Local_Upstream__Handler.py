@@ -1,13 +1,16 @@
+import gzip
 import json
 import time
 from http.server                                                        import BaseHTTPRequestHandler
-from urllib.parse                                                       import urlparse
+from urllib.parse                                                       import parse_qs, urlparse
 from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Path          import Safe_Str__Http__Path
 from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Query_String  import Safe_Str__Http__Query_String
 
 DEFAULT__DELAY__MS = 10
 
 class Local_Upstream__Handler(BaseHTTPRequestHandler):                                      # Mock upstream server for proxy testing
+    cached_calls = 0                                                                        # times /cached was hit (to tell cache hits from upstream calls)
+    error_calls  = 0                                                                        # times /error/503 was hit (to count retries)
 
     def log_message(self, format, *args):                                               # Suppress default logging
         pass
@@ -25,16 +28,24 @@ class Local_Upstream__Handler(BaseHTTPRequestHandler):
             self._handle_echo(path, query)
         elif path == '/echo/headers':
             self._handle_echo_headers()
+        elif str(path).startswith('/keep-alive'):
+            self._handle_keep_alive(path)
         elif str(path).startswith('/delay'):
             self._handle_delay(path)
         elif path == '/timeout':
             self._handle_timeout()
         elif path == '/error/500':
             self._handle_error_500()
+        elif path == '/error/503':
+            self._handle_error_503(query)
         elif path == '/large':
             self._handle_large_response()
         elif path == '/redirect':
             self._handle_redirect()
+        elif path == '/gzip':
+            self._handle_gzip()
+        elif path == '/cached':
+            self._handle_cached(query)
         else:
             self._handle_not_found()
 
@@ -45,6 +56,8 @@ class Local_Upstream__Handler(BaseHTTPRequestHandler):
             self._handle_echo_post()
         elif path == '/validate':
             self._handle_validate_post()
+        elif path == '/error/503':
+            self._handle_error_503(query)
         else:
             self._handle_not_found()
 
@@ -164,6 +177,23 @@ class Local_Upstream__Handler(BaseHTTPRequestHandler):
         response = {'delayed_ms': delay_ms}
         self.wfile.write(json.dumps(response).encode())
 
+    def _handle_keep_alive(self, path):                                                # Response that leaves the connection open for the next request (optional delay, e.g. /keep-alive/100)
+        delay_ms = 0
+        try:
+            delay_ms = int(str(path).split('/')[-1])
+        except ValueError:
+            pass
+
+        time.sleep(delay_ms / 1000.0)
+
+        body = json.dumps({'delayed_ms': delay_ms}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type'  , 'application/json')
+        self.send_header('Content-Length', str(len(body))    )
+        self.send_header('Connection'    , 'keep-alive'      )                          # (also keeps this handler reading requests from the connection)
+        self.end_headers()
+        self.wfile.write(body)
+
     def _handle_timeout(self):                                                         # Simulate timeout (never responds)
         time.sleep(30)                                                                 # Sleep longer than any reasonable timeout
 
@@ -175,6 +205,18 @@ class Local_Upstream__Handler(BaseHTTPRequestHandler):
         response = {'error': 'Internal Server Error', 'details': 'Simulated error'}
         self.wfile.write(json.dumps(response).encode())
 
+    def _handle_error_503(self, query):                                                # Return 503 error (with the Retry-After given in the query, e.g. ?retry-after=1)
+        Local_Upstream__Handler.error_calls += 1
+        params = {name: values[0] for name, values in parse_qs(str(query)).items()}
+        body   = json.dumps({'error': 'Service Unavailable', 'call': Local_Upstream__Handler.error_calls}).encode()
+        self.send_response(503)
+        self.send_header('Content-Type'  , 'application/json')
+        self.send_header('Content-Length', str(len(body))    )
+        if 'retry-after' in params:
+            self.send_header('Retry-After', params['retry-after'])
+        self.end_headers()
+        self.wfile.write(body)
+
     def _handle_large_response(self):                                                  # Return large response for testing
         self.send_response(200)
         self.send_header('Content-Type', 'application/json')
@@ -183,6 +225,37 @@ class Local_Upstream__Handler(BaseHTTPRequestHandler):
         large_data = {'data': 'x' * (1024 * 1024)}                                    # 1MB of data
         self.wfile.write(json.dumps(large_data).encode())
 
+    def _handle_gzip(self):                                                             # Return a gzip encoded response (whatever the Accept-Encoding)
+        body = gzip.compress(json.dumps({'gzipped': True, 'data': 'x' * 10000}).encode())
+        self.send_response(200)
+        self.send_header('Content-Type'    , 'application/json')
+        self.send_header('Content-Encoding', 'gzip'            )
+        self.send_header('Content-Length'  , str(len(body))    )
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle_cached(self, query):                                                    # Response with the caching headers given in the query (e.g. ?cache-control=max-age%3D60&vary=Accept-Language&etag=%22v1%22)
+        Local_Upstream__Handler.cached_calls += 1
+        params       = {name: values[0] for name, values in parse_qs(str(query)).items()}
+        if 'delay' in params:                                                               # seconds (e.g. to have identical requests in flight together)
+            time.sleep(float(params['delay']))
+        etag         = params.get('etag')                                                   # validators: conditional requests that match them get a 304
+        not_modified = ((etag and etag in self.headers.get('If-None-Match', '')) or
+                        ('last-modified' in params and self.headers.get('If-Modified-Since') == params['last-modified']))
+        self.send_response(304 if not_modified else int(params.get('status', 200)))
+        if not not_modified:
+            self.send_header('Content-Type', 'application/json')
+        for name in ('cache-control', 'expires', 'vary', 'set-cookie', 'etag', 'last-modified', 'age'):
+            if name in params:
+                self.send_header(name.title(), params[name])
+        self.end_headers()
+        if not_modified:
+            return
+
+        response = {'call'           : Local_Upstream__Handler.cached_calls   ,
+                    'accept-language': self.headers.get('Accept-Language', '')}
+        self.wfile.write(json.dumps(response).encode())
+
     def _handle_redirect(self):                                                        # Return redirect response
         self.send_response(302)
         self.send_header('Location', '/echo')
@@ -1,5 +1,5 @@
 import threading
-from http.server                                                    import HTTPServer
+from http.server                                                    import HTTPServer, ThreadingHTTPServer
 from time                                                           import sleep
 from osbot_utils.type_safe.Type_Safe                                import Type_Safe
 from osbot_utils.type_safe.primitives.safe_str.web.Safe_Str__Url    import Safe_Str__Url
@@ -9,6 +9,9 @@ from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Host      import Safe_
 from mgraph_ai_service_proxy.utils.testing.Local_Upstream__Handler  import Local_Upstream__Handler
 
 
+class Local_Upstream__HTTP_Server(ThreadingHTTPServer):       # one thread per request, so that concurrent (and slow) requests don't block each other
+    request_queue_size = 128                                  # default listen backlog (5) is too small for the concurrency tests
+
 class Local_Upstream__Server(Type_Safe):                       # Wrapper for managing mock server lifecycle
     server       : HTTPServer              = None            # HTTP server instance
     thread       : threading.Thread        = None            # Server thread
@@ -18,7 +21,7 @@ class Local_Upstream__Server(Type_Safe):                       # Wrapper for man
 
     def start(self) -> 'Local_Upstream__Server':               # Start the mock server
         self.port          = Safe_UInt(random_port())
-        self.server        = HTTPServer((str(self.host), int(self.port)), Local_Upstream__Handler)
+        self.server        = Local_Upstream__HTTP_Server((str(self.host), int(self.port)), Local_Upstream__Handler)
         self.thread        = threading.Thread(target=self.server.serve_forever)
         self.thread.daemon = True
         self.thread.start()
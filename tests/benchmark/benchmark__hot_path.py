@@ -0,0 +1,84 @@
+# Microbenchmarks of the proxy's hot path, before and after each optimisation (wall-clock timings are too noisy for the unit tests)
+# run with: python -m tests.benchmark.benchmark__hot_path
+import timeit
+from starlette.requests                                             import Request
+from osbot_utils.type_safe.primitives.safe_str.web.Safe_Str__Url    import Safe_Str__Url
+from mgraph_ai_service_proxy.fast_api.routes.Routes__Proxy          import Routes__Proxy
+from mgraph_ai_service_proxy.schemas.Proxy__Response                import Proxy__Response
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Response        import Schema__Proxy__Response
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Filter   import Service__Proxy__Filter
+
+BENCHMARK__NUMBER = 2000                                                        # calls per timing
+BENCHMARK__REPEAT = 5                                                           # timings per benchmark (the fastest one is kept)
+
+RAW_HEADERS = [(b'Content-Type' , b'text/html; charset=utf-8'     ), (b'Content-Length', b'1234'            ),
+               (b'Date'         , b'Mon, 01 Jan 2024 00:00:00 GMT'), (b'Server'        , b'nginx'           ),
+               (b'Cache-Control', b'max-age=60'                   ), (b'ETag'          , b'"abc"'           ),
+               (b'Connection'   , b'keep-alive'                   ), (b'Keep-Alive'    , b'timeout=5'       ),
+               (b'Vary'         , b'Accept-Encoding'              ), (b'X-Request-Id'  , b'123-456'         ),
+               (b'Set-Cookie'   , b'a=b'                          ), (b'Strict-Transport-Security', b'max-age=1')]
+
+
+def seconds_per_call(call) -> float:
+    return min(timeit.repeat(call, number=BENCHMARK__NUMBER, repeat=BENCHMARK__REPEAT)) / BENCHMARK__NUMBER
+
+
+def benchmark__filter_headers():                                                # One pass over a raw header list vs decoding it into a dict and then filtering (the previous pipeline)
+    filter_service = Service__Proxy__Filter()
+    def two_passes():
+        headers = {}
+        for raw_name, raw_value in RAW_HEADERS:
+            name, value   = raw_name.decode('latin-1'), raw_value.decode('latin-1')
+            headers[name] = f'{headers[name]}, {value}' if name in headers else value
+        return {name: value for name, value in headers.items() if name.lower() not in filter_service.RESPONSE_SKIP_HEADERS}
+    def one_pass():
+        return filter_service.filter_response_headers(RAW_HEADERS)
+    return seconds_per_call(two_passes), seconds_per_call(one_pass)             # (while also sanitising values and honouring Connection)
+
+
+def benchmark__proxy_request():                                                 # Edge conversion of a client request: the Type_Safe schema vs the __slots__ Proxy__Request (measured: about 460us vs 45us)
+    routes = Routes__Proxy()
+    scope  = {'type'        : 'http'                                     ,
+              'method'      : 'GET'                                      ,
+              'path'        : '/api/items'                               ,
+              'query_string': b'page=2'                                  ,
+              'scheme'      : 'http'                                     ,
+              'server'      : ('proxy', 80)                              ,
+              'client'      : ('10.0.0.1', 1234)                         ,
+              'headers'     : [(b'host'           , b'example.com'      ),
+                               (b'user-agent'     , b'Mozilla/5.0'      ),
+                               (b'accept'         , b'text/html'        ),
+                               (b'accept-encoding', b'gzip, deflate, br'),
+                               (b'cookie'         , b'session=abc123'   ),
+                               (b'connection'     , b'keep-alive'       )]}
+    def before():
+        return routes.build_proxy_request(Request(scope), 'api/items', None).schema()
+    def after():
+        return routes.build_proxy_request(Request(scope), 'api/items', None)
+    return seconds_per_call(before), seconds_per_call(after)
+
+
+def benchmark__proxy_response():                                                # Building a response: the Type_Safe schema vs the __slots__ Proxy__Response (measured: about 150us vs 2us)
+    headers    = {'Content-Type' : 'text/html; charset=utf-8'      ,
+                  'Date'         : 'Mon, 01 Jan 2024 00:00:00 GMT' ,
+                  'Cache-Control': 'max-age=60'                    ,
+                  'ETag'         : '"abc"'                         }
+    target_url = Safe_Str__Url('https://example.com/api')
+    def before():
+        return Schema__Proxy__Response(status_code=200, headers=dict(headers), content=b'{}', target_url=target_url)
+    def after():
+        return Proxy__Response        (status_code=200, headers=dict(headers), content=b'{}', target_url=target_url)
+    return seconds_per_call(before), seconds_per_call(after)
+
+
+BENCHMARKS = [benchmark__filter_headers, benchmark__proxy_request, benchmark__proxy_response]
+
+
+def main():
+    for benchmark in BENCHMARKS:
+        before, after = benchmark()
+        print(f'{benchmark.__name__:40} before: {before * 1e6:9.2f}us   after: {after * 1e6:9.2f}us   ({before / after:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
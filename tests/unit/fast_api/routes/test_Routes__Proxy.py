@@ -1,6 +1,18 @@
-from unittest                                               import TestCase
-from osbot_fast_api.api.Fast_API                            import Fast_API
-from mgraph_ai_service_proxy.fast_api.routes.Routes__Proxy import Routes__Proxy, ROUTES_PATHS__PROXY
+import inspect
+import pytest
+import sys
+from unittest                                                       import TestCase
+from unittest.mock                                                  import patch
+from fastapi                                                        import FastAPI
+from osbot_fast_api.api.Fast_API                                    import Fast_API
+from starlette.requests                                             import Request
+from starlette.testclient                                           import TestClient
+from mgraph_ai_service_proxy.fast_api.Middleware__Proxy              import Middleware__Proxy
+from mgraph_ai_service_proxy.fast_api.routes.Routes__Proxy          import Routes__Proxy, ROUTES_PATHS__PROXY
+from mgraph_ai_service_proxy.schemas.Enum__Proxy__Engine            import Enum__Proxy__Engine
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Upstream__Group import Schema__Proxy__Upstream__Group
+from mgraph_ai_service_proxy.utils.testing.Local_Upstream__Handler  import Local_Upstream__Handler
+from mgraph_ai_service_proxy.utils.testing.Local_Upstream__Server   import Local_Upstream__Server
 
 
 class test_Routes__Proxy(TestCase):
@@ -14,4 +26,325 @@ class test_Routes__Proxy(TestCase):
         with Fast_API() as _:
             _.add_routes(Routes__Proxy)
 
-            assert _.routes_paths() == sorted(ROUTES_PATHS__PROXY)
\ No newline at end of file
+            assert _.routes_paths() == sorted(ROUTES_PATHS__PROXY)
+
+    def test_upstream_host(self):                                               # Test the end-to-end latency is counted under the upstream host (the one in the path, in full-URL mode)
+        def request(path):
+            return Request({'type': 'http', 'headers': [(b'host', b'proxy.local')], 'path_params': {'path': path}})
+        assert self.routes_proxy.upstream_host(request('api/items'               )) == 'proxy.local'
+        assert self.routes_proxy.upstream_host(request('https://a.com:8443/items')) == 'a.com:8443'
+
+    def test_proxy_request__stream(self):                                       # Test streaming mode end-to-end through the catch-all route
+        upstream = Local_Upstream__Server().start()
+        try:
+            app    = FastAPI()
+            routes = Routes__Proxy(app=app)
+            routes.proxy_service.config.stream_responses = True
+            routes.setup()
+
+            with TestClient(app) as client:
+                response = client.get(f'http://localhost:{upstream.port}/large')
+
+                assert response.status_code == 200
+                assert 'content-length' not in response.headers                     # body was streamed (so no length known up front)
+                assert len(response.json()['data']) == 1024 * 1024
+
+            latency = routes.proxy_service.stats_service.latency.get_latency()[f'localhost:{upstream.port}']
+            assert list(latency)                          == ['connect', 'ttfb', 'upstream', 'total']   # total recorded once the stream was sent
+            assert latency['total']['count']              == 1
+            assert latency['total']['p50_ms'] >= latency['ttfb']['p50_ms']
+        finally:
+            upstream.stop()
+
+    def test_proxy__metrics(self):                                              # Test the OpenMetrics endpoint, after requests with bodies in and out
+        upstream = Local_Upstream__Server().start()
+        try:
+            app    = FastAPI()
+            routes = Routes__Proxy(app=app)
+            routes.setup()
+            app.add_middleware(Middleware__Proxy, proxy_service=routes.proxy_service)
+
+            with TestClient(app) as client:
+                response = client.post(f'http://localhost:{upstream.port}/echo/post', content=b'x' * 100)
+                assert response.status_code == 201
+                response = client.get(f'http://localhost:{upstream.port}/keep-alive')         # (upstream closes the connection after the echo)
+                assert response.status_code == 200
+                pools    = client.get('/proxy/pools').json()
+                response = client.get('/proxy/metrics')
+
+            stats = routes.proxy_service.stats_service
+            lines = response.text.splitlines()
+            assert response.headers['content-type'].startswith('application/openmetrics-text; version=1.0.0')
+            assert response.text.endswith('# EOF\n')
+            assert stats.in_flight                            == 0                      # back to zero once the response was ready
+            assert stats.total_bytes_in                       == 100
+            assert stats.total_bytes_out                      >  100                    # (the echo wraps the body in json)
+            assert f'proxy_sent_bytes_total {stats.total_bytes_out}'                    in lines
+            assert 'proxy_upstream_connections{state="idle"} 1'                         in lines   # the connection went back to the pool
+            assert f'proxy_upstream_pool_created_total{{pool="http://localhost:{upstream.port}"}} 2'   in lines
+            assert f'proxy_upstream_pool_discarded_total{{pool="http://localhost:{upstream.port}"}} 1' in lines
+            assert f'proxy_request_seconds_count{{host="localhost:{upstream.port}"}} 2' in lines
+            assert pools == {f'http://localhost:{upstream.port}': dict(idle=1, active=0, waiting=0, created=2, discarded=1)}
+        finally:
+            upstream.stop()
+
+    def test_proxy_request__body(self):                                         # Test the sync route reads the body itself, only for methods that forward one (no middleware needed)
+        upstream = Local_Upstream__Server().start()
+        try:
+            app    = FastAPI()
+            routes = Routes__Proxy(app=app)
+            routes.setup()
+
+            with TestClient(app) as client:
+                response = client.post(f'http://localhost:{upstream.port}/echo/post', content=b'abc')
+                assert response.status_code      == 201
+                assert response.json()['body']   == 'abc'
+                assert 'x-request-id'            not in response.headers    # (added by Middleware__Proxy)
+            assert routes.proxy_service.stats_service.total_bytes_in == 3
+        finally:
+            upstream.stop()
+
+    def test_proxy_request__async_engine(self):                                # Test the asyncio engine registers an async catch-all route
+        upstream = Local_Upstream__Server().start()
+        try:
+            app    = FastAPI()
+            routes = Routes__Proxy(app=app)
+            routes.proxy_service.config.engine = Enum__Proxy__Engine.asyncio
+            routes.setup()
+
+            catch_all = [route for route in app.routes if route.path == '/{path:path}'][0]
+            assert catch_all.endpoint == routes.proxy_request__async
+            assert inspect.iscoroutinefunction(catch_all.endpoint)
+
+            with TestClient(app) as client:
+                response = client.post(f'http://localhost:{upstream.port}/echo/post', json={'an': 'answer'})
+                assert response.status_code == 201
+                assert response.json()['body'] == '{"an":"answer"}'
+
+                routes.proxy_service.config.stream_responses = True
+                response = client.get(f'http://localhost:{upstream.port}/large')
+                assert response.status_code == 200
+                assert 'content-length' not in response.headers
+                assert len(response.json()['data']) == 1024 * 1024
+
+            latency = routes.proxy_service.stats_service.latency.get_latency()[f'localhost:{upstream.port}']
+            assert list(latency)             == ['connect', 'ttfb', 'upstream', 'total']                # connect time from httpx's trace extension
+            assert latency['total']['count'] == 2
+        finally:
+            upstream.stop()
+
+    def test_setup_routes__async_engine_without_httpx(self):                    # Test the asyncio engine fails at startup when httpx is missing (instead of a 500 on every request)
+        routes = Routes__Proxy(app=FastAPI())
+        routes.proxy_service.config.engine = Enum__Proxy__Engine.asyncio
+        with patch.dict(sys.modules, {'httpx': None}):
+            with pytest.raises(ImportError, match="needs the httpx package"):
+                routes.setup()
+
+    def test_proxy_request__stream_uploads(self):                               # Test large uploads are piped to upstream (sync and asyncio engines)
+        upstream = Local_Upstream__Server().start()
+        try:
+            for engine in Enum__Proxy__Engine:
+                app    = FastAPI()
+                routes = Routes__Proxy(app=app)
+                routes.proxy_service.config.engine             = engine
+                routes.proxy_service.config.stream_uploads     = True
+                routes.proxy_service.config.upload_buffer_size = 1024
+                routes.setup()
+                app.add_middleware(Middleware__Proxy, proxy_service=routes.proxy_service)
+
+                large_body = b'x' * (2 * 1024 * 1024)
+                with TestClient(app) as client:
+                    response = client.post(f'http://localhost:{upstream.port}/echo/post', content=large_body, headers={'Content-Type': 'text/plain'})
+                    assert response.status_code      == 201
+                    assert response.json()['length'] == len(large_body)                     # Content-Length was forwarded
+                    assert response.json()['body'  ] == large_body.decode()
+
+                    response = client.post(f'http://localhost:{upstream.port}/echo/post', content=b'small', headers={'Content-Type': 'text/plain'})
+                    assert response.json()['body'  ] == 'small'                             # small body (streamed too: a POST without an Idempotency-Key is never retried)
+        finally:
+            upstream.stop()
+
+    def test_proxy_request__max_content_size(self):                             # Test bodies over the limit get 413 (client) or 502 (upstream), on both engines
+        upstream = Local_Upstream__Server().start()
+        try:
+            for engine in Enum__Proxy__Engine:
+                for stream_uploads in (False, True):
+                    app    = FastAPI()
+                    routes = Routes__Proxy(app=app)
+                    routes.proxy_service.config.engine           = engine
+                    routes.proxy_service.config.stream_uploads   = stream_uploads
+                    routes.proxy_service.config.max_content_size = 1000
+                    routes.setup()
+                    app.add_middleware(Middleware__Proxy, proxy_service=routes.proxy_service)
+
+                    url = f'http://localhost:{upstream.port}'
+                    with TestClient(app) as client:
+                        response = client.post(f'{url}/echo/post', content=b'x' * 100)
+                        assert response.status_code == 201
+
+                        response = client.post(f'{url}/echo/post', content=b'x' * 1001)         # Content-Length over the limit
+                        assert response.status_code == 413
+                        assert response.text        == 'Payload too large - request body is over the 1000 bytes limit'
+
+                        response = client.post(f'{url}/echo/post', content=iter([b'x' * 600, b'x' * 600]))     # chunked (no Content-Length), counted while reading
+                        assert response.status_code == 413
+
+                        response = client.get(f'{url}/large')                                  # upstream's Content-Length over the limit
+                        assert response.status_code == 502
+                        assert response.text        == f'Bad gateway - response from {url}/large is over the 1000 bytes limit'
+
+                    assert routes.proxy_service.stats_service.total_oversized == 3
+        finally:
+            upstream.stop()
+
+    def test_proxy_request__stream_aborted(self):                               # Test a streamed response cut short (over the limit mid-stream) still ends the request: in-flight gauge and total latency (both engines)
+        upstream = Local_Upstream__Server().start()
+        try:
+            for engine in Enum__Proxy__Engine:
+                app    = FastAPI()
+                routes = Routes__Proxy(app=app)
+                routes.proxy_service.config.engine           = engine
+                routes.proxy_service.config.stream_responses = True
+                routes.proxy_service.config.max_content_size = 100_000
+                routes.setup()
+
+                with TestClient(app, raise_server_exceptions=False) as client:
+                    response = client.get(f'http://localhost:{upstream.port}/large')
+                    assert len(response.content) < 1024 * 1024                                  # (aborted)
+
+                stats = routes.proxy_service.stats_service
+                assert stats.in_flight                                                          == 0
+                assert stats.latency.get_latency()[f'localhost:{upstream.port}']['total']['count'] == 1
+        finally:
+            upstream.stop()
+
+    def test_proxy_request__compress_responses(self):                          # Test responses are compressed for clients that accept it (both engines, buffered and streamed)
+        upstream = Local_Upstream__Server().start()
+        try:
+            for engine in Enum__Proxy__Engine:
+                for stream_responses in (False, True):
+                    app    = FastAPI()
+                    routes = Routes__Proxy(app=app)
+                    routes.proxy_service.config.engine             = engine
+                    routes.proxy_service.config.stream_responses   = stream_responses
+                    routes.proxy_service.config.compress_responses = True
+                    routes.setup()
+
+                    url = f'http://localhost:{upstream.port}'
+                    with TestClient(app) as client:
+                        response = client.get(f'{url}/large', headers={'Accept-Encoding': 'gzip'})
+                        assert response.status_code                 == 200
+                        assert response.headers['content-encoding'] == 'gzip'
+                        assert response.headers['vary']             == 'Accept-Encoding'
+                        assert response.num_bytes_downloaded        <  10_000                      # 1MB of json on the wire as a few KB
+                        assert len(response.json()['data'])         == 1024 * 1024                 # (TestClient decodes it)
+
+                        response = client.get(f'{url}/large', headers={'Accept-Encoding': 'identity'})
+                        assert 'content-encoding' not in response.headers
+                        assert response.num_bytes_downloaded        >  1024 * 1024
+
+                        if stream_responses is False:                                               # (streamed bodies without a Content-Length are always compressed)
+                            response = client.get(f'{url}/echo', headers={'Accept-Encoding': 'gzip'})
+                            assert 'content-encoding' not in response.headers                       # too small to be worth it
+        finally:
+            upstream.stop()
+
+    def test_proxy_request__circuit_breaker(self):                             # Test a failing host gets fast 503s once its breaker opened (both engines), with the breakers in the stats
+        for engine in Enum__Proxy__Engine:
+            app    = FastAPI()
+            routes = Routes__Proxy(app=app)
+            routes.proxy_service.config.engine            = engine
+            routes.proxy_service.config.circuit_breaker   = True
+            routes.proxy_service.config.breaker_min_calls = 2
+            routes.proxy_service.config.retry_count       = 0
+            routes.setup()
+
+            with TestClient(app, raise_server_exceptions=False) as client:
+                for _ in range(2):
+                    assert client.get('http://localhost:1/echo').status_code == 500      # connection refused (the proxy's "Bad gateway" error)
+                response = client.get('http://localhost:1/echo')
+                assert response.status_code            == 503
+                assert response.headers['retry-after'] == '30'
+                assert response.text                   == 'Service unavailable - upstream for http://localhost:1/echo is failing, retry in 30s'
+                stats = client.get('/proxy/stats').json()
+
+            assert stats['total_rejected']           == 1
+            assert stats['total_errors']             == 2
+            assert stats['breakers']['localhost:1']  == dict(state='open', opened=1, error_rate=1.0)
+
+    def test_proxy_request__retries(self):                                     # Test only idempotent requests (or ones with an Idempotency-Key) are retried (both engines), honouring Retry-After, with retries in the stats
+        upstream = Local_Upstream__Server().start()
+        try:
+            for engine in Enum__Proxy__Engine:
+                app    = FastAPI()
+                routes = Routes__Proxy(app=app)
+                routes.proxy_service.config.engine        = engine
+                routes.proxy_service.config.retry_backoff = 0
+                routes.setup()
+                url    = f'http://localhost:{upstream.port}/error/503'
+
+                def calls(method, path='', **kwargs):                           # upstream calls made by one request
+                    before   = Local_Upstream__Handler.error_calls
+                    response = client.request(method, url + path, **kwargs)
+                    assert response.status_code == 503                          # (upstream's last answer, once retries ran out)
+                    assert response.json()['call'] == Local_Upstream__Handler.error_calls
+                    return Local_Upstream__Handler.error_calls - before
+
+                with TestClient(app) as client:
+                    assert calls('GET'                                                 ) == 4     # first attempt + retry_count
+                    assert calls('POST'                                                ) == 1     # not idempotent
+                    assert calls('POST', headers={'Idempotency-Key': 'a1'}             ) == 4
+                    assert calls('GET' , '?retry-after=0'                              ) == 4
+                    assert calls('GET' , '?retry-after=60'                             ) == 1     # over retry_after_max
+                    stats = client.get('/proxy/stats').json()
+
+                assert stats['total_requests'] == 5
+                assert stats['total_retries' ] == 9
+        finally:
+            upstream.stop()
+
+    def test_proxy_request__hedges(self):                                      # Test a slow GET is hedged once hedge_delay passed (both engines), with the outcome in the stats and metrics
+        upstream = Local_Upstream__Server().start()
+        try:
+            for engine in Enum__Proxy__Engine:
+                app    = FastAPI()
+                routes = Routes__Proxy(app=app)
+                routes.proxy_service.config.engine         = engine
+                routes.proxy_service.config.hedge_requests = True
+                routes.proxy_service.config.hedge_delay    = 50
+                routes.setup()
+
+                with TestClient(app) as client:
+                    assert client.get (f'http://localhost:{upstream.port}/delay/300').status_code == 200
+                    assert client.post(f'http://localhost:{upstream.port}/echo/post', content=b'x').status_code == 201   # (not a safe method)
+                    hedges  = client.get('/proxy/stats'  ).json()['hedges']
+                    metrics = client.get('/proxy/metrics').text
+
+                assert hedges['hedged']                     == 1
+                assert hedges['wins'] + hedges['losses']    == 1
+                assert 'proxy_upstream_hedges_total 1'      in metrics
+        finally:
+            upstream.stop()
+
+    def test_proxy_request__upstream_groups(self):                              # Test requests to an upstream group are balanced over its backends (both engines), a dead one being ejected
+        upstream = Local_Upstream__Server().start()
+        try:
+            for engine in Enum__Proxy__Engine:
+                app    = FastAPI()
+                routes = Routes__Proxy(app=app)
+                routes.proxy_service.config.engine                 = engine
+                routes.proxy_service.config.retry_count            = 0
+                routes.proxy_service.config.upstream_groups['api'] = Schema__Proxy__Upstream__Group(backends     = ['localhost:1', f'localhost:{upstream.port}'],
+                                                                                                    eject_errors = 1                                            )
+                routes.setup()
+
+                with TestClient(app, raise_server_exceptions=False) as client:
+                    status_codes = [client.get('http://api/echo').status_code for _ in range(3)]
+                    backends     = client.get('/proxy/stats').json()['upstreams']['api']
+
+                assert status_codes                                            == [500, 200, 200]   # connection refused, then round robin skips the ejected backend
+                assert backends['localhost:1']['ejected']                      is True
+                assert backends[f'localhost:{upstream.port}']['calls']         == 2
+        finally:
+            upstream.stop()
+
@@ -0,0 +1,76 @@
+import asyncio
+from unittest                                                           import TestCase
+from fastapi                                                            import FastAPI, Request
+from starlette.testclient                                               import TestClient
+from mgraph_ai_service_proxy.fast_api.Middleware__Proxy                 import Middleware__Proxy
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy               import Service__Proxy
+
+
+class test_Middleware__Proxy(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.proxy_service = Service__Proxy().setup()
+        cls.proxy_service.config.max_content_size = 1000
+        cls.app           = FastAPI()
+
+        @cls.app.post('/state')
+        async def state(request: Request):
+            return dict(started    = type(request.state.started).__name__ ,
+                        request_id = str(request.state.request_id)        )
+
+        cls.app.add_middleware(Middleware__Proxy, proxy_service=cls.proxy_service)
+        cls.client = TestClient(cls.app)
+
+    def run_async(self, coroutine):                                           # (on a loop of its own: asyncio.run would leave this thread without a current loop, which mangum's tests need)
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+    def test__init__(self):                                                   # Test it wraps an ASGI app (with its own proxy service when none is given)
+        _ = Middleware__Proxy(app=self.app)
+        assert _.app                 is self.app
+        assert type(_.proxy_service) is Service__Proxy
+
+    def test__call__(self):                                                   # Test request id and arrival time are in request.state, and the id goes back to the client
+        response = self.client.post('/state', content=b'abc')
+        assert response.status_code                  == 200
+        assert response.json()['started']            == 'float'
+        assert response.json()['request_id']         == response.headers['x-request-id']
+        assert self.client.post('/state').headers['x-request-id'] != response.headers['x-request-id']
+
+    def test__call__content_too_large(self):                                  # Test bodies declared over max_content_size get a 413 before the route runs
+        response = self.client.post('/state', content=b'x' * 1001)
+        assert response.status_code              == 413
+        assert response.text                     == 'Payload too large - request body is over the 1000 bytes limit'
+        assert 'x-request-id'                    in response.headers
+
+    def test__call__streaming(self):                                          # Test messages go straight through: no reading of the body, no buffering of the response
+        received = []
+        sent     = []
+        async def app(scope, receive, send):                                  # streams two chunks without ever calling receive
+            await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+            await send({'type': 'http.response.body' , 'body': b'one', 'more_body': True })
+            assert len(sent) == 2                                             # (already passed on)
+            await send({'type': 'http.response.body' , 'body': b'two', 'more_body': False})
+        async def receive():
+            received.append(True)
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        async def send(message):
+            sent.append(message)
+        scope = {'type': 'http', 'method': 'POST', 'path': '/', 'headers': [(b'content-length', b'10')]}
+        self.run_async(Middleware__Proxy(app=app, proxy_service=self.proxy_service)(scope, receive, send))
+        assert received                                 == []
+        assert [message.get('body') for message in sent] == [None, b'one', b'two']
+        assert sent[0]['headers'][0][0]                 == b'x-request-id'
+        assert type(scope['state']['started'])          is float
+
+    def test__call__not_http(self):                                           # Test lifespan (and websocket) scopes are passed on untouched
+        calls = []
+        async def app(scope, receive, send):
+            calls.append(scope)
+        scope = {'type': 'lifespan'}
+        self.run_async(Middleware__Proxy(app=app, proxy_service=self.proxy_service)(scope, None, None))
+        assert calls == [{'type': 'lifespan'}]
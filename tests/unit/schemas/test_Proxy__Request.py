@@ -0,0 +1,66 @@
+from unittest                                                                   import TestCase
+from starlette.requests                                                         import Request
+from osbot_utils.type_safe.primitives.safe_str.identifiers.Random_Guid          import Random_Guid
+from mgraph_ai_service_proxy.fast_api.routes.Routes__Proxy                      import Routes__Proxy
+from mgraph_ai_service_proxy.schemas.Proxy__Request                             import Proxy__Request, PROXY_REQUEST__FIELDS
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Request                     import Schema__Proxy__Request
+from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Header_Name           import Safe_Str__Http__Header_Name
+from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Method                import Safe_Str__Http__Method
+from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Path                  import Safe_Str__Http__Path
+
+
+class test_Proxy__Request(TestCase):
+
+    def test__init__(self):                                                   # Test defaults (same values as Schema__Proxy__Request's)
+        _ = Proxy__Request()
+        assert {name: getattr(_, name) for name in PROXY_REQUEST__FIELDS} == dict(method       = None ,
+                                                                                  path         = ''   ,
+                                                                                  host         = ''   ,
+                                                                                  headers      = {}   ,
+                                                                                  body         = None ,
+                                                                                  body_stream  = None ,
+                                                                                  query_string = ''   ,
+                                                                                  client_ip    = ''   ,
+                                                                                  use_https    = True ,
+                                                                                  request_id   = None )
+        assert not hasattr(_, '__dict__')                                     # __slots__ only
+        assert PROXY_REQUEST__FIELDS == tuple(Schema__Proxy__Request.__annotations__)
+
+    def test_schema(self):                                                    # Test the Type_Safe version, built when asked for
+        request_id = Random_Guid()
+        _          = Proxy__Request(method     = Safe_Str__Http__Method('POST'),
+                                    path       = Safe_Str__Http__Path  ('/api'),
+                                    host       = 'example.com'                 ,
+                                    headers    = {'Content-Type': 'text/plain'},
+                                    body       = b'abc'                        ,
+                                    client_ip  = '10.0.0.1'                    ,
+                                    request_id = request_id                    )
+        schema = _.schema()
+        assert type(schema)                                         is Schema__Proxy__Request
+        assert schema.method                                        == 'POST'
+        assert schema.host                                          == 'example.com'
+        assert schema.body                                          == b'abc'
+        assert schema.client_ip                                     == '10.0.0.1'
+        assert schema.request_id                                    == request_id
+        assert schema.headers[Safe_Str__Http__Header_Name('Content-Type')] == 'text/plain'
+
+        copy = Proxy__Request.from_schema(schema)                             # and back again
+        assert type(copy)           is Proxy__Request
+        assert copy.headers         == {'Content-Type': 'text/plain'}         # (plain str names and values)
+        assert copy.method          == 'POST'
+        assert copy.request_id      == request_id
+
+    def test__slots(self):                                                    # Test the edge conversion builds the plain __slots__ version, not a Type_Safe schema (timings: tests/benchmark/benchmark__hot_path.py)
+        scope   = {'type'        : 'http'                                     ,
+                   'method'      : 'GET'                                      ,
+                   'path'        : '/api/items'                               ,
+                   'query_string': b'page=2'                                  ,
+                   'scheme'      : 'http'                                     ,
+                   'server'      : ('proxy', 80)                              ,
+                   'client'      : ('10.0.0.1', 1234)                         ,
+                   'headers'     : [(b'host', b'example.com')]                }
+        request = Routes__Proxy().build_proxy_request(Request(scope), 'api/items', None)
+        assert type(request)                 is Proxy__Request
+        assert Proxy__Request.__slots__      == PROXY_REQUEST__FIELDS
+        assert hasattr(request, '__dict__')  is False
+        assert request.host                  == 'example.com'
@@ -0,0 +1,52 @@
+from unittest                                                                   import TestCase
+from osbot_utils.type_safe.primitives.safe_str.web.Safe_Str__Url                import Safe_Str__Url
+from osbot_utils.type_safe.primitives.safe_uint.Safe_UInt                       import Safe_UInt
+from osbot_utils.type_safe.Type_Safe                                            import Type_Safe
+from mgraph_ai_service_proxy.schemas.Proxy__Response                            import Proxy__Response, PROXY_RESPONSE__FIELDS
+from mgraph_ai_service_proxy.schemas.Proxy__Response__Stream                    import Proxy__Response__Stream
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Response                    import Schema__Proxy__Response
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Response__Stream            import Schema__Proxy__Response__Stream
+from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Header_Name           import Safe_Str__Http__Header_Name
+
+
+class test_Proxy__Response(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.headers    = {'Content-Type' : 'text/html; charset=utf-8'      ,
+                          'Date'         : 'Mon, 01 Jan 2024 00:00:00 GMT' ,
+                          'Cache-Control': 'max-age=60'                    ,
+                          'ETag'         : '"abc"'                         }
+        cls.target_url = Safe_Str__Url('https://example.com/api')
+
+    def test__init__(self):                                                   # Test defaults (same values as Schema__Proxy__Response's)
+        _ = Proxy__Response()
+        assert (_.status_code, _.headers, _.content, _.target_url) == (0, {}, b'', None)
+        assert not hasattr(_, '__dict__')
+
+    def test_schema(self):                                                    # Test the Type_Safe version, built when asked for
+        _      = Proxy__Response(status_code=200, headers=dict(self.headers), content=b'<html>', target_url=self.target_url)
+        schema = _.schema()
+        assert type(schema)             is Schema__Proxy__Response
+        assert type(schema.status_code) is Safe_UInt
+        assert schema.status_code       == 200
+        assert schema.content           == b'<html>'
+        assert schema.target_url        == self.target_url
+        assert schema.headers[Safe_Str__Http__Header_Name('ETag')] == '"abc"'
+
+    def test_schema__stream(self):                                            # Test the streamed version
+        def chunks():
+            yield b'abc'
+        _      = Proxy__Response__Stream(status_code=200, headers=dict(self.headers), content=chunks(), target_url=self.target_url)
+        schema = _.schema()
+        assert type(schema)          is Schema__Proxy__Response__Stream
+        assert schema.status_code    == 200
+        assert list(schema.content)  == [b'abc']
+        assert Proxy__Response__Stream().content is None
+
+    def test__slots(self):                                                    # Test both versions are plain __slots__ classes, not Type_Safe schemas (timings: tests/benchmark/benchmark__hot_path.py)
+        for response_class in (Proxy__Response, Proxy__Response__Stream):
+            _ = response_class(status_code=200, headers=dict(self.headers), target_url=self.target_url)
+            assert response_class.__slots__    == PROXY_RESPONSE__FIELDS
+            assert hasattr(_, '__dict__')      is False
+            assert Type_Safe not in type(_).__mro__
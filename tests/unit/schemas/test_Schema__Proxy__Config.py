@@ -15,14 +15,49 @@ class test_Schema__Proxy__Config(TestCase):
             assert base_classes(_) == [Type_Safe, object]
 
             # Verify all defaults with .obj()
-            assert _.obj() == __(pool_connections = 10        ,
-                                 pool_max_size    = 100       ,
-                                 retry_count      = 3         ,
-                                 retry_backoff    = 0.3       ,
-                                 connect_timeout  = 5         ,
-                                 read_timeout     = 25        ,
-                                 verify_ssl       = False     ,
-                                 max_content_size = 104857600 )
+            assert _.obj() == __(pool_connections    = 10                                   ,
+                                 pool_max_size       = 100                                  ,
+                                 retry_count         = 3                                    ,
+                                 retry_backoff       = 0.3                                  ,
+                                 connect_timeout     = 5                                    ,
+                                 read_timeout        = 25                                   ,
+                                 verify_ssl          = False                                ,
+                                 max_content_size    = 104857600                            ,
+                                 stream_responses    = False                                ,
+                                 stream_chunk_size   = 65536                                ,
+                                 engine              = 'sync'                               ,
+                                 stream_uploads      = False                                ,
+                                 upload_buffer_size  = 1048576                              ,
+                                 decode_content      = True                                 ,
+                                 compress_responses  = False                                ,
+                                 compression_level   = 6                                    ,
+                                 compress_min_size   = 1024                                 ,
+                                 cache_responses     = False                                ,
+                                 cache_max_size      = 67108864                             ,
+                                 cache_entry_limit   = 8388608                              ,
+                                 coalesce_requests   = False                                ,
+                                 coalesce_timeout    = 30                                   ,
+                                 cache_disk          = False                                ,
+                                 cache_disk_path     = '/tmp/mgraph_ai_service_proxy/cache' ,
+                                 cache_disk_max_size = 1073741824                           ,
+                                 pool_idle_timeout   = 60                                   ,
+                                 pool_max_sockets    = 512                                  ,
+                                 pool_host_max_size  = __()                                 ,
+                                 pool_max_hosts      = 1024                                 ,
+                                 dns_cache           = False                                ,
+                                 dns_cache_ttl       = 60                                   ,
+                                 dns_negative_ttl    = 5                                    ,
+                                 circuit_breaker     = False                                ,
+                                 breaker_error_rate  = 0.5                                  ,
+                                 breaker_min_calls   = 10                                   ,
+                                 breaker_window      = 10                                   ,
+                                 breaker_open_time   = 30                                   ,
+                                 retry_budget        = 0.1                                  ,
+                                 retry_after_max     = 10                                   ,
+                                 hedge_requests      = False                                ,
+                                 hedge_delay         = 100                                  ,
+                                 hedge_budget        = 0.1                                  ,
+                                 upstream_groups     = __()                                 )
 
     def test__init__with_custom_values(self):                                # Test custom configuration
         with Schema__Proxy__Config(pool_connections = 20      ,
@@ -86,14 +121,49 @@ class test_Schema__Proxy__Config(TestCase):
             json_data = original.json()
 
             # Verify JSON structure
-            assert json_data == {'pool_connections' : 30                     ,
-                               'pool_max_size'    : 100                      ,
-                               'retry_count'      : 3                        ,
-                               'retry_backoff'    : 0.5                      ,
-                               'connect_timeout'  : 5                        ,
-                               'read_timeout'     : 25                       ,
-                               'verify_ssl'       : True                     ,
-                               'max_content_size' : 104857600                }
+            assert json_data == {'pool_connections'    : 30                                   ,
+                                 'pool_max_size'       : 100                                  ,
+                                 'retry_count'         : 3                                    ,
+                                 'retry_backoff'       : 0.5                                  ,
+                                 'connect_timeout'     : 5                                    ,
+                                 'read_timeout'        : 25                                   ,
+                                 'verify_ssl'          : True                                 ,
+                                 'max_content_size'    : 104857600                            ,
+                                 'stream_responses'    : False                                ,
+                                 'stream_chunk_size'   : 65536                                ,
+                                 'engine'              : 'sync'                               ,
+                                 'stream_uploads'      : False                                ,
+                                 'upload_buffer_size'  : 1048576                              ,
+                                 'decode_content'      : True                                 ,
+                                 'compress_responses'  : False                                ,
+                                 'compression_level'   : 6                                    ,
+                                 'compress_min_size'   : 1024                                 ,
+                                 'cache_responses'     : False                                ,
+                                 'cache_max_size'      : 67108864                             ,
+                                 'cache_entry_limit'   : 8388608                              ,
+                                 'coalesce_requests'   : False                                ,
+                                 'coalesce_timeout'    : 30                                   ,
+                                 'cache_disk'          : False                                ,
+                                 'cache_disk_path'     : '/tmp/mgraph_ai_service_proxy/cache' ,
+                                 'cache_disk_max_size' : 1073741824                           ,
+                                 'pool_idle_timeout'   : 60                                   ,
+                                 'pool_max_sockets'    : 512                                  ,
+                                 'pool_host_max_size'  : {}                                   ,
+                                 'pool_max_hosts'      : 1024                                 ,
+                                 'dns_cache'           : False                                ,
+                                 'dns_cache_ttl'       : 60                                   ,
+                                 'dns_negative_ttl'    : 5                                    ,
+                                 'circuit_breaker'     : False                                ,
+                                 'breaker_error_rate'  : 0.5                                  ,
+                                 'breaker_min_calls'   : 10                                   ,
+                                 'breaker_window'      : 10                                   ,
+                                 'breaker_open_time'   : 30                                   ,
+                                 'retry_budget'        : 0.1                                  ,
+                                 'retry_after_max'     : 10                                   ,
+                                 'hedge_requests'      : False                                ,
+                                 'hedge_delay'         : 100                                  ,
+                                 'hedge_budget'        : 0.1                                  ,
+                                 'upstream_groups'     : {}                                   }
 
             # Round-trip
             with Schema__Proxy__Config.from_json(json_data) as restored:
@@ -26,6 +26,7 @@ class test_Schema__Proxy__Request(TestCase):
                                  host         = ''       ,
                                  headers      = __()     ,                  # Empty dict as __
                                  body         = None     ,
+                                 body_stream  = None     ,
                                  query_string = ''       ,
                                  client_ip    = ''       ,
                                  use_https    = True     ,                  # Default to HTTPS
@@ -128,6 +129,7 @@ class test_Schema__Proxy__Request(TestCase):
             with Schema__Proxy__Request.from_json(json_data) as restored:
                 assert restored.json() == original.json()
                 assert restored.json() == { 'body'        : None,
+                                            'body_stream' : None,
                                             'client_ip'   : '10.0.0.1',
                                             'headers'     : {Safe_Str__Http__Header_Name('X_Custom'): 'value'},
                                             'host'        : 'api.test.com',
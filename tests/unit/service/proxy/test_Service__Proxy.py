@@ -2,15 +2,21 @@ import re
 import pytest
 import requests
 import threading
+import types
+import urllib3
 from unittest                                                           import TestCase
 from unittest.mock                                                      import Mock, patch
 from osbot_utils.testing.__                                             import __
 from osbot_utils.type_safe.primitives.safe_str.web.Safe_Str__IP_Address import Safe_Str__IP_Address
 from osbot_utils.type_safe.primitives.safe_str.web.Safe_Str__Url        import Safe_Str__Url
 from osbot_utils.utils.Objects                                          import base_classes
+from mgraph_ai_service_proxy.schemas.Proxy__Response                    import Proxy__Response
+from mgraph_ai_service_proxy.schemas.Proxy__Response__Stream            import Proxy__Response__Stream
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Cache__Entry        import Schema__Proxy__Cache__Entry
 from mgraph_ai_service_proxy.schemas.Schema__Proxy__Config              import Schema__Proxy__Config
 from mgraph_ai_service_proxy.schemas.Schema__Proxy__Request             import Schema__Proxy__Request
 from mgraph_ai_service_proxy.schemas.Schema__Proxy__Response            import Schema__Proxy__Response
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Response__Stream    import Schema__Proxy__Response__Stream
 from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Header_Name   import Safe_Str__Http__Header_Name
 from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Host          import Safe_Str__Http__Host
 from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Method        import Safe_Str__Http__Method
@@ -18,6 +24,8 @@ from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Path          import S
 from mgraph_ai_service_proxy.service.proxy.Service__Proxy               import Service__Proxy
 from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Stats        import Service__Proxy__Stats
 from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Filter       import Service__Proxy__Filter
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Breaker      import Proxy_Error__Circuit_Open
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Limits       import Proxy_Error__Content_Too_Large
 from osbot_utils.type_safe.Type_Safe                                    import Type_Safe
 from osbot_utils.type_safe.primitives.safe_str.identifiers.Random_Guid  import Random_Guid
 
@@ -61,16 +69,52 @@ class test_Service__Proxy(TestCase):
             assert type(_.config)         is Schema__Proxy__Config
             assert type(_.stats_service)  is Service__Proxy__Stats
             assert type(_.filter_service) is Service__Proxy__Filter
+            assert _.upload_service.retry_service is _.pools_service.retry_service   # (one retry policy)
 
             # Verify config defaults with .obj()
-            assert _.config.obj() == __(pool_connections = 10        ,
-                                        pool_max_size    = 100       ,
-                                        retry_count      = 3         ,
-                                        retry_backoff    = 0.3       ,
-                                        connect_timeout  = 5         ,
-                                        read_timeout     = 25        ,
-                                        verify_ssl       = False     ,
-                                        max_content_size = 104857600 )
+            assert _.config.obj() == __(pool_connections    = 10                                   ,
+                                        pool_max_size       = 100                                  ,
+                                        retry_count         = 3                                    ,
+                                        retry_backoff       = 0.3                                  ,
+                                        connect_timeout     = 5                                    ,
+                                        read_timeout        = 25                                   ,
+                                        verify_ssl          = False                                ,
+                                        max_content_size    = 104857600                            ,
+                                        stream_responses    = False                                ,
+                                        stream_chunk_size   = 65536                                ,
+                                        engine              = 'sync'                               ,
+                                        stream_uploads      = False                                ,
+                                        upload_buffer_size  = 1048576                              ,
+                                        decode_content      = True                                 ,
+                                        compress_responses  = False                                ,
+                                        compression_level   = 6                                    ,
+                                        compress_min_size   = 1024                                 ,
+                                        cache_responses     = False                                ,
+                                        cache_max_size      = 67108864                             ,
+                                        cache_entry_limit   = 8388608                              ,
+                                        coalesce_requests   = False                                ,
+                                        coalesce_timeout    = 30                                   ,
+                                        cache_disk          = False                                ,
+                                        cache_disk_path     = '/tmp/mgraph_ai_service_proxy/cache' ,
+                                        cache_disk_max_size = 1073741824                           ,
+                                        pool_idle_timeout   = 60                                   ,
+                                        pool_max_sockets    = 512                                  ,
+                                        pool_host_max_size  = __()                                 ,
+                                        pool_max_hosts      = 1024                                 ,
+                                        dns_cache           = False                                ,
+                                        dns_cache_ttl       = 60                                   ,
+                                        dns_negative_ttl    = 5                                    ,
+                                        circuit_breaker     = False                                ,
+                                        breaker_error_rate  = 0.5                                  ,
+                                        breaker_min_calls   = 10                                   ,
+                                        breaker_window      = 10                                   ,
+                                        breaker_open_time   = 30                                   ,
+                                        retry_budget        = 0.1                                  ,
+                                        retry_after_max     = 10                                   ,
+                                        hedge_requests      = False                                ,
+                                        hedge_delay         = 100                                  ,
+                                        hedge_budget        = 0.1                                  ,
+                                        upstream_groups     = __()                                 )
 
     def test_get_session(self):                                              # Test thread-local session pooling
         with self.service as _:
@@ -167,16 +211,18 @@ class test_Service__Proxy(TestCase):
         mock_response = Mock()
         mock_response.status_code = 200
         mock_response.headers = {"Content-Type": "application/json"}
-        mock_response.content = b'{"success": true}'
+        mock_response.iter_content = Mock(return_value=iter([b'{"success": ', b'true}']))
         mock_request.return_value = mock_response
 
         with self.service as _:
             response = _.execute_request(self.test_request_simple)
 
-            assert type(response) is Schema__Proxy__Response
+            assert type(response)          is Proxy__Response                  # hot-path response (no Type_Safe conversion) ...
+            assert type(response.schema()) is Schema__Proxy__Response          # ... converted when asked for
             assert response.status_code                        == 200
             assert response.content                            == b'{"success": true}'
-            assert Safe_Str__Http__Header_Name("Content-Type") in response.headers
+            assert "Content-Type"                              in response.headers
+            assert Safe_Str__Http__Header_Name("Content-Type") in response.schema().headers
             assert type(response.target_url) is Safe_Str__Url
 
             mock_request.assert_called_once()                               # Verify request was made with correct parameters
@@ -189,7 +235,7 @@ class test_Service__Proxy(TestCase):
         mock_response = Mock()
         mock_response.status_code = 201
         mock_response.headers = {"Location": "/api/users/123"}
-        mock_response.content = b'{"id": "123"}'
+        mock_response.iter_content = Mock(return_value=iter([b'{"id": "123"}']))
         mock_request.return_value = mock_response
 
         with self.service as _:
@@ -207,7 +253,7 @@ class test_Service__Proxy(TestCase):
         mock_response = Mock()
         mock_response.status_code = 200
         mock_response.headers = {}
-        mock_response.content = b''
+        mock_response.iter_content = Mock(return_value=iter([]))
         mock_request.return_value = mock_response
 
         with self.service as _:
@@ -244,21 +290,209 @@ class test_Service__Proxy(TestCase):
             # Verify stats were updated
             assert _.stats_service.total_errors == 1
 
+    @patch('requests.Session.request')
+    def test_execute_request__pool_error(self, mock_request):                # Test a host's pool staying full (urllib3's EmptyPoolError, not wrapped by requests) is a gateway timeout, counted by its breaker
+        mock_request.side_effect = urllib3.exceptions.EmptyPoolError(None, 'Pool reached maximum size and no more connections are allowed.')
+
+        with Service__Proxy().setup() as _:
+            _.config.circuit_breaker = True
+            with pytest.raises(ValueError, match=re.escape("Gateway timeout for https://example.com/api/test")):
+                _.execute_request(self.test_request_simple)
+            mock_request.side_effect = urllib3.exceptions.ClosedPoolError(None, 'Pool is closed.')
+            with pytest.raises(ValueError, match="Bad gateway - cannot connect to"):
+                _.execute_request(self.test_request_simple)
+
+            assert _.stats_service.total_timeouts                            == 1
+            assert _.stats_service.total_errors                              == 1
+            assert _.breaker_service.get_states(_.config)['example.com']['error_rate'] == 1.0
+
+    def test_cache_revalidated(self):                                         # Test only a 304 to the cache's own validators refreshes the entry (one to the client's validators is passed through)
+        with Service__Proxy().setup() as _:
+            entry = Schema__Proxy__Cache__Entry(key=('GET https://example.com/a', ()), status_code=200, headers={'Content-Type': 'text/plain'}, content=b'old', stored_at=1)
+            assert _.cache_revalidated(self.test_request_simple, entry, 304, {'ETag': '"v2"'}) is None
+            assert entry.stored_at                                                                == 1
+            assert _.stats_service.total_revalidated                                              == 0
+
+            entry.etag = '"v1"'
+            assert _.cache_revalidated(self.test_request_simple, entry, 304, {'ETag': '"v1"'}).content == b'old'
+            assert _.stats_service.total_revalidated                                              == 1
+
+    @patch('requests.Session.request')
+    def test_execute_request__breaker_per_upstream(self, mock_request):      # Test full-URL requests (all with the proxy's Host header) get a breaker per upstream host, so one dead origin doesn't fail the others
+        def upstream(method, url, **kwargs):
+            if url.startswith('https://dead.com'):
+                raise requests.ConnectionError('upstream down')
+            return Mock(status_code=200, headers={}, iter_content=Mock(return_value=iter([b'ok'])))
+        mock_request.side_effect = upstream
+
+        def full_url_request(url):
+            return Schema__Proxy__Request(method = Safe_Str__Http__Method("GET"), path = Safe_Str__Http__Path(url), host = Safe_Str__Http__Host("proxy.local"))
+
+        with Service__Proxy().setup() as _:
+            _.config.circuit_breaker   = True
+            _.config.breaker_min_calls = 2
+            _.config.retry_count       = 0
+            for index in range(2):
+                with pytest.raises(ValueError, match="Bad gateway"):
+                    _.execute_request(full_url_request('https://dead.com/a'))
+            with pytest.raises(Proxy_Error__Circuit_Open):
+                _.execute_request(full_url_request('https://dead.com/a'))
+            assert _.execute_request(full_url_request('https://live.com/a')).content == b'ok'
+            assert sorted(_.breaker_service.get_states(_.config))                     == ['dead.com', 'live.com']
+            assert list(_.stats_service.latency.get_latency())                        == ['live.com', '*']    # (latency is per upstream host too)
+            assert sorted(_.pools_service.retry_service.budget.tokens)                == ['dead.com', 'live.com']    # (and so are retry budgets)
+
+    @patch('requests.Session.request')
+    def test_execute_request__hedge_per_upstream(self, mock_request):        # Test hedge delays and budgets are kept per upstream host (not per Host header)
+        mock_request.return_value = Mock(status_code=200, headers={}, iter_content=Mock(return_value=iter([b'ok'])))
+        request = Schema__Proxy__Request(method = Safe_Str__Http__Method("GET"), path = Safe_Str__Http__Path('https://live.com/a'), host = Safe_Str__Http__Host("proxy.local"))
+        with Service__Proxy().setup() as _:
+            _.config.hedge_requests = True
+            assert _.execute_request(request).content     == b'ok'
+            assert list(_.hedge_service.delays)           == ['live.com']
+            assert list(_.hedge_service.budget.tokens)    == ['live.com']
+
+    @patch('requests.Session.request')
+    def test_execute_request__by_host_per_upstream(self, mock_request):       # Test responses are counted by upstream host (in full-URL mode the Host header is the proxy's own)
+        mock_request.side_effect = lambda method, url, **kwargs: Mock(status_code=200, headers={}, iter_content=Mock(return_value=iter([b'ok'])))
+        with Service__Proxy().setup() as _:
+            for url in ('https://a.com/x', 'https://b.com:8443/y', 'https://a.com/z'):
+                _.execute_request(Schema__Proxy__Request(method = Safe_Str__Http__Method("GET"), path = Safe_Str__Http__Path(url), host = Safe_Str__Http__Host("proxy.local")))
+            assert _.stats_service.get_stats()['by_host'] == {'a.com': 2, 'b.com:8443': 1}
+            assert 'proxy_upstream_responses_by_host_total{host="a.com"} 2' in _.get_metrics().splitlines()
+
     @patch('requests.Session.request')
     def test_execute_request__stats_updated(self, mock_request):             # Test statistics tracking
         mock_response             = Mock()
         mock_response.status_code = 404
         mock_response.headers     = {}
-        mock_response.content     = b'Not found'
+        mock_response.iter_content = Mock(side_effect=lambda chunk_size: iter([b'Not found']))
         mock_request.return_value = mock_response
 
         with self.service as _:
-            _.stats_service.total_requests = 0                              # Reset stats
-            _.stats_service.total_errors   = 0
+            _.stats_service.reset()                                          # Reset stats
 
             _.execute_request(self.test_request_simple)                     # Make multiple requests
             _.execute_request(self.test_request_simple)
 
             assert _.stats_service.total_requests == 2
             assert _.stats_service.total_errors   == 0                      # 404 is not connection error
-            assert _.stats_service.total_timeouts == 0
\ No newline at end of file
+            assert _.stats_service.total_timeouts == 0
+
+    @patch('requests.Session.request')
+    def test_execute_request__stream(self, mock_request):                    # Test streamed response execution
+        mock_response              = Mock()
+        mock_response.status_code  = 200
+        mock_response.headers      = {"Content-Type": "application/octet-stream"}
+        mock_response.iter_content = Mock(return_value=iter([b'chunk-1', b'', b'chunk-2']))
+        mock_request.return_value  = mock_response
+
+        with self.service as _:
+            response = _.execute_request__stream(self.test_request_simple)
+
+            assert type(response)          is Proxy__Response__Stream
+            assert type(response.schema()) is Schema__Proxy__Response__Stream
+            assert type(response.content) is types.GeneratorType
+            assert response.status_code  == 200
+            assert response.target_url   == 'https://example.com/api/test'
+            assert mock_response.close.call_count == 0                      # nothing read (or released) yet
+
+            assert list(response.content) == [b'chunk-1', b'chunk-2']       # empty keep-alive chunks are skipped
+            mock_response.iter_content.assert_called_once_with(chunk_size=65536)
+            mock_response.close.assert_called_once()                         # connection released once the body was consumed
+
+            assert mock_request.call_args[1]['stream'] is True
+
+    @patch('requests.Session.request')
+    def test_execute_request__stream__client_disconnect(self, mock_request): # Test connection is released when stream is abandoned
+        mock_response              = Mock()
+        mock_response.status_code  = 200
+        mock_response.headers      = {}
+        mock_response.iter_content = Mock(return_value=iter([b'a', b'b', b'c']))
+        mock_request.return_value  = mock_response
+
+        with self.service as _:
+            response = _.execute_request__stream(self.test_request_simple)
+            assert next(response.content) == b'a'
+            response.content.close()                                         # what the route does when the client goes away
+            mock_response.close.assert_called_once()
+
+    @patch('requests.Session.request')
+    def test_execute_request__max_content_size(self, mock_request):         # Test upstream bodies over the limit are rejected (by Content-Length, or while reading)
+        service = Service__Proxy().setup()
+        service.config.max_content_size = 10
+
+        mock_response              = Mock()
+        mock_response.status_code  = 200
+        mock_response.headers      = {'Content-Length': '11'}
+        mock_request.return_value  = mock_response
+        with pytest.raises(Proxy_Error__Content_Too_Large, match=re.escape('Bad gateway - response from https://example.com/api/test is over the 10 bytes limit')) as raised:
+            service.execute_request(self.test_request_simple)
+        assert raised.value.status_code == 502
+        mock_response.iter_content.assert_not_called()                      # nothing was read
+        mock_response.close.assert_called_once()                            # upstream connection dropped
+
+        mock_response.headers      = {}                                     # e.g. chunked
+        mock_response.iter_content = Mock(return_value=iter([b'123456', b'789012', b'never read']))
+        mock_response.close.reset_mock()
+        with pytest.raises(Proxy_Error__Content_Too_Large):
+            service.execute_request(self.test_request_simple)
+        mock_response.close.assert_called_once()
+
+        mock_response.iter_content = Mock(return_value=iter([b'123456', b'789012']))
+        mock_response.close.reset_mock()
+        response = service.execute_request__stream(self.test_request_simple)
+        assert next(response.content) == b'123456'
+        with pytest.raises(Proxy_Error__Content_Too_Large):                 # headers are already sent, so the stream is aborted
+            next(response.content)
+        mock_response.close.assert_called_once()
+
+        mock_response.headers      = {'Content-Length': '1000'}
+        with pytest.raises(Proxy_Error__Content_Too_Large):                 # streaming can still send a 502 when Content-Length is too big
+            service.execute_request__stream(self.test_request_simple)
+
+        assert service.stats_service.total_oversized == 4
+        assert service.stats_service.total_requests  == 1                   # only the stream that had started
+
+    @patch('requests.Session.request')
+    def test_execute_request__stale_if_error(self, mock_request):           # Test a stale cached copy stands in for upstream 5xx and connection errors
+        service = Service__Proxy().setup()
+        service.config.cache_responses = True
+
+        mock_response              = Mock()
+        mock_response.status_code  = 200
+        mock_response.headers      = {'Cache-Control': 'max-age=0, stale-if-error=60'}
+        mock_response.iter_content = Mock(return_value=iter([b'cached']))
+        mock_request.return_value  = mock_response
+        assert service.execute_request(self.test_request_simple).content == b'cached'
+
+        mock_response.status_code = 503
+        mock_response.close.reset_mock()
+        response = service.execute_request(self.test_request_simple)
+        assert (response.status_code, response.content) == (200, b'cached')
+        mock_response.close.assert_called_once()                            # the 503's body is never read
+
+        mock_request.side_effect = requests.ConnectionError('upstream down')
+        assert service.execute_request(self.test_request_simple).content               == b'cached'
+        assert b''.join(service.execute_request__stream(self.test_request_simple).content) == b'cached'
+        assert service.stats_service.total_stale_hits == 3
+        assert service.stats_service.total_errors     == 2                  # still recorded
+
+        service.cache_service.clear()
+        with pytest.raises(ValueError, match='Bad gateway'):                # nothing to fall back on
+            service.execute_request(self.test_request_simple)
+
+    def test_check_request_size(self):                                       # Test client Content-Length is checked before anything is read
+        service = Service__Proxy().setup()
+        service.config.max_content_size = 10
+        service.check_request_size({'Content-Length': '10'})
+        service.check_request_size({})
+        with pytest.raises(Proxy_Error__Content_Too_Large, match='Payload too large') as raised:
+            service.check_request_size({'content-length': '11'})
+        assert raised.value.status_code              == 413
+        assert service.stats_service.total_oversized == 1
+
+        chunks = service.limit_upload(iter([b'123456', b'789012']))
+        assert next(chunks) == b'123456'
+        with pytest.raises(Proxy_Error__Content_Too_Large, match='Payload too large'):
+            next(chunks)
@@ -0,0 +1,92 @@
+from collections                                                        import Counter
+from unittest                                                           import TestCase
+from osbot_utils.type_safe.Type_Safe                                    import Type_Safe
+from osbot_utils.utils.Objects                                          import base_classes
+from mgraph_ai_service_proxy.schemas.Enum__Proxy__Balance__Policy       import Enum__Proxy__Balance__Policy
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Config              import Schema__Proxy__Config
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Upstream__Group     import Schema__Proxy__Upstream__Group
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Balancer     import Service__Proxy__Balancer
+
+BACKENDS = ['a.internal:8080', 'b.internal:8080', 'c.internal:8080']
+
+
+class test_Service__Proxy__Balancer(TestCase):
+
+    def setUp(self):
+        self.config   = Schema__Proxy__Config()
+        self.balancer = Service__Proxy__Balancer()
+
+    def group(self, policy=Enum__Proxy__Balance__Policy.round_robin, **kwargs) -> Schema__Proxy__Upstream__Group:
+        group = self.config.upstream_groups['api'] = Schema__Proxy__Upstream__Group(backends=BACKENDS, policy=policy, **kwargs)
+        return group
+
+    def route(self, path='/items?page=1', headers=None, now=0):
+        return self.balancer.route(self.config, f'https://api{path}', headers or {}, now=now)
+
+    def backend(self, path='/items?page=1', headers=None, now=0, seconds=0.01, failed=False):   # Route a call, and release it straight away
+        route = self.route(path, headers, now)
+        self.balancer.release(self.config, route, seconds, failed, now=now)
+        return route[1]
+
+    def test__init__(self):                                                   # Test auto-initialization
+        with self.balancer as _:
+            assert base_classes(_) == [Type_Safe, object]
+            assert _.backends      == {}
+            assert _.get_states(self.config) == {}
+
+    def test_route(self):                                                     # Test only hosts that are upstream groups are routed, to one of their backends
+        assert self.route()                                                  is None    # (no groups)
+        self.group()
+        assert self.route()                                                  == ('api', 'a.internal:8080', 'https://a.internal:8080/items?page=1')
+        assert self.balancer.route(self.config, 'https://other.com/a', {})    is None
+        assert self.balancer.get_states(self.config)['api']['a.internal:8080'] == dict(outstanding=1, calls=1, failures=0, ewma_ms=0.0, ejected=False, ejections=0)
+
+    def test_pick__round_robin(self):                                         # Test each backend in turn
+        self.group()
+        assert [self.backend() for _ in range(4)] == BACKENDS + BACKENDS[:1]
+
+    def test_pick__least_outstanding(self):                                   # Test the backend with the fewest calls in flight
+        self.group(Enum__Proxy__Balance__Policy.least_outstanding)
+        routes = [self.route() for _ in range(3)]                             # (one in flight on each)
+        assert [route[1] for route in routes] == BACKENDS
+        self.balancer.release(self.config, routes[1], 0.01, False)
+        assert self.route()[1] == 'b.internal:8080'
+
+    def test_pick__ewma(self):                                                # Test the power of two choices favours the backend with the lower latency
+        self.group(Enum__Proxy__Balance__Policy.ewma)
+        for backend, seconds in zip(BACKENDS, (0.5, 0.01, 0.5)):
+            self.balancer.release(self.config, ('api', backend, ''), seconds, False)
+        picks = Counter()
+        for _ in range(300):
+            route = self.route()
+            picks[route[1]] += 1
+            self.balancer.release(self.config, route, 0.01 if route[1] == 'b.internal:8080' else 0.5, False)
+        assert picks['b.internal:8080'] >= 150                                # (picked whenever it is one of the two: ~2/3 of the time)
+
+    def test_pick__consistent_hash(self):                                     # Test a key always goes to the same backend, moving (alone) when that backend is ejected
+        self.group(Enum__Proxy__Balance__Policy.consistent_hash, hash_header='X-User', eject_errors=1)
+        users    = [f'user-{index}' for index in range(60)]
+        owners   = {user: self.backend(headers={'x-user': user}) for user in users}
+        assert owners                                           == {user: self.backend(headers={'X-User': user}) for user in users}
+        assert set(owners.values())                             == set(BACKENDS)      # (spread over every backend)
+        assert self.backend('/a')                               == self.backend('/a')   # (no header: by path and query)
+        self.backend(headers={'X-User': users[0]}, failed=True)                       # ejects users[0]'s backend
+        moved    = {user: self.backend(headers={'X-User': user}) for user in users}
+        assert {user for user in users if moved[user] != owners[user]} == {user for user in users if owners[user] == owners[users[0]]}
+
+    def test_release__ejection(self):                                         # Test eject_errors failures in a row take a backend out of rotation for eject_time seconds
+        self.group(eject_errors=2, eject_time=30)
+        self.backend(failed=True)                                             # a
+        self.backend()                                                        # b
+        self.backend()                                                        # c
+        self.backend(failed=True)                                             # a: ejected
+        assert [self.backend(now=1) for _ in range(4)]                         == ['b.internal:8080', 'c.internal:8080', 'b.internal:8080', 'c.internal:8080']
+        assert self.balancer.get_states(self.config, now=1)['api']['a.internal:8080'] == dict(outstanding=0, calls=2, failures=2, ewma_ms=0.0, ejected=True, ejections=1)
+        assert 'a.internal:8080' in [self.backend(now=31) for _ in range(3)]  # (back in rotation)
+
+    def test_release__all_ejected(self):                                      # Test a group whose backends are all ejected still routes to them (rather than failing every request)
+        self.group(eject_errors=1)
+        for _ in BACKENDS:
+            self.backend(failed=True)
+        assert all(state['ejected'] for state in self.balancer.get_states(self.config, now=1)['api'].values())
+        assert self.route(now=1)[1] in BACKENDS
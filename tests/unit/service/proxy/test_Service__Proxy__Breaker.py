@@ -0,0 +1,86 @@
+from unittest                                                           import TestCase
+from osbot_utils.type_safe.Type_Safe                                    import Type_Safe
+from osbot_utils.utils.Objects                                          import base_classes
+from mgraph_ai_service_proxy.schemas.Enum__Proxy__Breaker__State        import Enum__Proxy__Breaker__State
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Config              import Schema__Proxy__Config
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Breaker      import Service__Proxy__Breaker, Proxy_Error__Circuit_Open, BREAKER__HOSTS_LIMIT
+
+NOW = 1000.0
+
+
+class test_Service__Proxy__Breaker(TestCase):
+
+    def setUp(self):
+        self.config  = Schema__Proxy__Config(circuit_breaker=True, breaker_min_calls=4, breaker_error_rate=0.5, breaker_window=10, breaker_open_time=30)
+        self.breaker = Service__Proxy__Breaker()
+
+    def record(self, *outcomes, now=NOW):                                     # (True: failed)
+        for failed in outcomes:
+            self.breaker.record(self.config, 'a.com', failed, now=now)
+
+    def state(self, host='a.com'):
+        return self.breaker.hosts[host].state
+
+    def test__init__(self):                                                   # Test auto-initialization
+        with self.breaker as _:
+            assert base_classes(_) == [Type_Safe, object]
+            assert _.hosts         == {}
+            assert _.allow(self.config, 'a.com') is True                      # (hosts never seen are closed)
+
+    def test_record__opens(self):                                             # Test the breaker opens once enough calls failed (within the window)
+        self.record(False, True, False)
+        assert self.state() is Enum__Proxy__Breaker__State.closed             # (under breaker_min_calls)
+        self.record(True)
+        assert self.state() is Enum__Proxy__Breaker__State.open               # 2 of 4 failed
+        assert self.breaker.hosts['a.com'].opened == 1
+
+    def test_record__window(self):                                            # Test failures older than breaker_window don't count
+        self.record(True, True, True, now=NOW - 20)
+        self.record(False, False, False, True)
+        assert self.state() is Enum__Proxy__Breaker__State.closed             # (1 of 4 failed in the window)
+
+    def test_allow(self):                                                     # Test an open breaker fails fast, then lets a single probe through
+        self.record(True, True, True, True)
+        assert self.breaker.allow      (self.config, 'a.com', now=NOW + 10) is False
+        assert self.breaker.retry_after(self.config, 'a.com', now=NOW + 10) == 20
+        assert self.breaker.allow      (self.config, 'b.com', now=NOW + 10) is True              # (other hosts are not affected)
+        assert self.breaker.allow      (self.config, 'a.com', now=NOW + 30) is True              # the probe
+        assert self.state()                                                 is Enum__Proxy__Breaker__State.half_open
+        assert self.breaker.allow      (self.config, 'a.com', now=NOW + 31) is False             # (only one probe at a time)
+        assert self.breaker.allow      (self.config, 'a.com', now=NOW + 61) is True              # (a probe that never answered is replaced)
+
+    def test_record__probe(self):                                             # Test the probe's outcome re-opens or closes the breaker
+        self.record(True, True, True, True)
+        self.breaker.allow(self.config, 'a.com', now=NOW + 30)
+        self.record(True, now=NOW + 31)
+        assert self.state()                                               is Enum__Proxy__Breaker__State.open
+        assert self.breaker.allow(self.config, 'a.com', now=NOW + 40)     is False              # (open for breaker_open_time again)
+        assert self.breaker.allow(self.config, 'a.com', now=NOW + 61)     is True
+        self.record(False, now=NOW + 62)
+        assert self.state()                                               is Enum__Proxy__Breaker__State.closed
+        self.record(True, True, now=NOW + 63)
+        assert self.state()                                               is Enum__Proxy__Breaker__State.closed              # (earlier failures were forgotten)
+        assert self.breaker.hosts['a.com'].opened                         == 2
+
+    def test_add_host__limit(self):                                           # Test closed breakers make room for new hosts (open ones are kept)
+        self.record(True, True, True, True)
+        for index in range(BREAKER__HOSTS_LIMIT):
+            self.breaker.record(self.config, f'host-{index}', False, now=NOW)
+        assert len(self.breaker.hosts)  == BREAKER__HOSTS_LIMIT
+        assert 'a.com'                  in self.breaker.hosts
+        assert 'host-0'                 not in self.breaker.hosts
+
+    def test_error__circuit_open(self):                                       # Test the error carries the 503 and the Retry-After seconds
+        error = self.breaker.error__circuit_open('https://a.com/x', 20)
+        assert type(error)        is Proxy_Error__Circuit_Open
+        assert isinstance(error, ValueError)
+        assert str(error)         == 'Service unavailable - upstream for https://a.com/x is failing, retry in 20s'
+        assert error.status_code  == 503
+        assert error.retry_after  == 20
+
+    def test_get_states(self):                                                # Test each host's state, times opened and recent failure rate
+        self.breaker.record(self.config, 'a.com', True )
+        self.breaker.record(self.config, 'a.com', False)
+        self.breaker.record(self.config, 'b.com', False)
+        assert self.breaker.get_states(self.config) == {'a.com': dict(state='closed', opened=0, error_rate=0.5),
+                                                        'b.com': dict(state='closed', opened=0, error_rate=0.0)}
@@ -0,0 +1,39 @@
+from unittest                                                       import TestCase
+from osbot_utils.type_safe.Type_Safe                                import Type_Safe
+from osbot_utils.utils.Objects                                      import base_classes
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Budget   import Service__Proxy__Budget, BUDGET__BURST, BUDGET__HOSTS_LIMIT
+
+
+class test_Service__Proxy__Budget(TestCase):
+
+    def setUp(self):
+        self.budget = Service__Proxy__Budget()
+
+    def test__init__(self):                                                   # Test auto-initialization
+        with self.budget as _:
+            assert base_classes(_) == [Type_Safe, object]
+            assert _.tokens        == {}
+            assert _.exhausted     == 0
+
+    def test_deposit__withdraw(self):                                         # Test a burst to start with, then a share of a token per request
+        with self.budget as _:
+            for _i in range(int(BUDGET__BURST)):
+                assert _.withdraw('a.com') is True
+            assert _.withdraw('a.com')     is False
+            assert _.withdraw('b.com')     is True                            # (budgets are per host)
+            for _i in range(9):
+                _.deposit('a.com', 0.1)
+            assert _.withdraw('a.com')     is False                           # 0.9 tokens
+            _.deposit('a.com', 0.1)
+            assert _.withdraw('a.com')     is True                            # 1 token: 10% of the requests
+            assert _.exhausted             == 2
+            for _i in range(1000):
+                _.deposit('b.com', 0.1)
+            assert _.get_budgets()         == {'a.com': 0.0, 'b.com': BUDGET__BURST}     # (capped at the burst)
+
+    def test_deposit__hosts_limit(self):                                      # Test least recently used hosts go first
+        with self.budget as _:
+            for index in range(BUDGET__HOSTS_LIMIT + 1):
+                _.deposit(f'host-{index}', 0.1)
+            assert len(_.tokens)    == BUDGET__HOSTS_LIMIT
+            assert 'host-0'     not in _.tokens
@@ -0,0 +1,252 @@
+import os
+import asyncio
+from email.utils                                                    import formatdate
+from unittest                                                       import TestCase
+from osbot_utils.type_safe.Type_Safe                                import Type_Safe
+from osbot_utils.utils.Files                                        import temp_folder, folder_delete_all
+from osbot_utils.utils.Objects                                      import base_classes
+from mgraph_ai_service_proxy.schemas.Enum__Proxy__Cache__State      import Enum__Proxy__Cache__State
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Cache__Entry    import Schema__Proxy__Cache__Entry
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Cache    import Service__Proxy__Cache
+
+URL      = 'https://example.com/api/data'
+NOW      = 1_700_000_000.0
+MAX_SIZE = 10_000
+MISS, FRESH, STALE, EXPIRED = (Enum__Proxy__Cache__State.miss, Enum__Proxy__Cache__State.fresh, Enum__Proxy__Cache__State.stale, Enum__Proxy__Cache__State.expired)
+
+
+class test_Service__Proxy__Cache(TestCase):
+
+    def setUp(self):
+        self.cache = Service__Proxy__Cache()
+
+    def store(self, headers, content=b'body', request_headers=None, status_code=200, now=NOW, method='GET', max_size=MAX_SIZE, disk_max_size=0):
+        return self.cache.store(method, URL, request_headers or {}, status_code, headers, content, max_size=max_size, entry_limit=1000, disk_max_size=disk_max_size, now=now)
+
+    def test__init__(self):                                                   # Test auto-initialization
+        with Service__Proxy__Cache() as _:
+            assert type(_)         is Service__Proxy__Cache
+            assert base_classes(_) == [Type_Safe, object]
+            assert len(_.entries)  == 0
+            assert _.size          == 0
+
+    def test_cache_control(self):                                             # Test Cache-Control parsing
+        with self.cache as _:
+            assert _.cache_control(None                                  ) == {}
+            assert _.cache_control('max-age=60, Private'                 ) == {'max-age': '60', 'private': None}
+            assert _.cache_control('s-maxage="30",no-cache="Set-Cookie"' ) == {'s-maxage': '30', 'no-cache': 'Set-Cookie'}
+
+    def test_freshness_lifetime(self):                                        # Test s-maxage > max-age > Expires
+        with self.cache as _:
+            date = formatdate(NOW, usegmt=True)
+            assert _.freshness_lifetime({'max-age': '60'                 }, {}                                        , NOW) == 60
+            assert _.freshness_lifetime({'max-age': '60', 's-maxage': '5'}, {}                                        , NOW) == 5
+            assert _.freshness_lifetime({'max-age': 'abc'                }, {}                                        , NOW) == 0
+            assert _.freshness_lifetime({}, {'expires': formatdate(NOW + 100, usegmt=True), 'date': date}             , NOW) == 100
+            assert _.freshness_lifetime({}, {'expires': '0'                                             }             , NOW) == 0      # invalid: already expired
+            assert _.freshness_lifetime({}, {}                                                                        , NOW) is None
+
+    def test_store_and_lookup(self):                                          # Test a fresh response is served until it goes stale
+        with self.cache as _:
+            entry = self.store({'Cache-Control': 'max-age=60', 'Content-Type': 'text/plain'})
+            assert type(entry)     is Schema__Proxy__Cache__Entry
+            assert entry.lifetime  == 60
+            assert _.size          == entry.size == len(b'body') + len('Cache-Control' 'max-age=60' 'Content-Type' 'text/plain')
+
+            assert _.lookup('GET' , URL          , {}, now=NOW + 59) == (entry, FRESH)
+            assert _.lookup('HEAD', URL          , {}, now=NOW + 1 ) == (None, MISS)
+            assert _.lookup('GET' , URL + '?a=1' , {}, now=NOW + 1 ) == (None, MISS)
+            assert _.response_headers(entry, now=NOW + 30) == {'Cache-Control': 'max-age=60', 'Content-Type': 'text/plain', 'Age': '30'}
+
+            assert _.lookup('GET' , URL          , {}, now=NOW + 60) == (None, MISS)                          # stale: dropped
+            assert len(_.entries) == 0
+            assert _.size         == 0
+
+    def test_store__age(self):                                                # Test upstream Age / Date count against the lifetime
+        with self.cache as _:
+            assert self.store({'Cache-Control': 'max-age=60', 'Age': '60'}) is None                     # already stale
+            entry = self.store({'Cache-Control': 'max-age=60', 'Date': formatdate(NOW - 20, usegmt=True)})
+            assert entry.initial_age == 20
+            assert _.lookup('GET', URL, {}, now=NOW + 39) == (entry, FRESH)
+            assert _.lookup('GET', URL, {}, now=NOW + 40) == (None, MISS)
+
+    def test_store__not_storable(self):                                       # Test what a shared cache must not store
+        with self.cache as _:
+            assert self.store({'Cache-Control': 'max-age=60, private' }) is None
+            assert self.store({'Cache-Control': 'no-store, max-age=60'}) is None
+            assert self.store({'Cache-Control': 'no-cache, max-age=60'}) is None                        # (all three are kept when they have validators)
+            assert self.store({'Cache-Control': 'max-age=0'           }) is None
+            assert self.store({'Content-Type' : 'text/plain'          }) is None                        # no explicit freshness
+            assert self.store({'Cache-Control': 'max-age=60', 'Vary'      : '*'    }) is None
+            assert self.store({'Cache-Control': 'max-age=60', 'Set-Cookie': 'a=b'  }) is None
+            assert self.store({'Cache-Control': 'max-age=60'}, status_code=500      ) is None
+            assert self.store({'Cache-Control': 'max-age=60'}, method='POST'        ) is None
+            assert self.store({'Cache-Control': 'max-age=60'}, content=b'x' * 1001  ) is None            # over entry_limit
+            assert self.store({'Cache-Control': 'max-age=60'}, request_headers={'Cache-Control': 'no-store'}) is None
+            assert self.store({'Cache-Control': 'max-age=60'          }, request_headers={'Authorization': 'Bearer abc'}) is None
+            assert self.store({'Cache-Control': 'max-age=60, public'  }, request_headers={'Authorization': 'Bearer abc'}) is not None
+            assert self.store({'Cache-Control': 'max-age=60'}, status_code=404      ) is not None
+            assert len(_.entries) == 1
+
+    def test_lookup__request_directives(self):                                # Test client Cache-Control / Pragma
+        with self.cache as _:
+            entry = self.store({'Cache-Control': 'max-age=60'})
+            assert _.lookup('GET', URL, {'Cache-Control': 'no-cache'    }, now=NOW + 10) == (None, MISS)
+            assert _.lookup('GET', URL, {'pragma'       : 'no-cache'    }, now=NOW + 10) == (None, MISS)
+            assert _.lookup('GET', URL, {'Cache-Control': 'max-age=5'   }, now=NOW + 10) == (entry, EXPIRED)  # too old for this client ...
+            assert _.lookup('GET', URL, {'Cache-Control': 'max-age=20'  }, now=NOW + 10) == (entry, FRESH)    # ... but not for this one
+            assert _.lookup('GET', URL, {'Cache-Control': 'min-fresh=55'}, now=NOW + 10) == (entry, EXPIRED)
+            assert _.lookup('GET', URL, {}                                , now=NOW + 10) == (entry, FRESH)
+
+    def test_lookup__vary(self):                                              # Test one entry per value of the headers in Vary
+        with self.cache as _:
+            english = self.store({'Cache-Control': 'max-age=60', 'Vary': 'Accept-Language'}, b'hello', {'Accept-Language': 'en'})
+            french  = self.store({'Cache-Control': 'max-age=60', 'Vary': 'accept-language'}, b'salut', {'accept-language': 'fr'})
+            assert _.lookup('GET', URL, {'Accept-Language': 'en'}, now=NOW) == (english, FRESH)
+            assert _.lookup('GET', URL, {'accept-language': 'fr'}, now=NOW) == (french , FRESH)
+            assert _.lookup('GET', URL, {'Accept-Language': 'de'}, now=NOW) == (None, MISS)
+            assert _.lookup('GET', URL, {}                        , now=NOW) == (None, MISS)
+            assert _.variants == {f'GET {URL}': (('accept-language',), 2)}
+
+            other = self.store({'Cache-Control': 'max-age=60', 'Vary': 'Accept-Encoding'}, b'other', {'Accept-Encoding': 'gzip'})
+            assert list(_.entries.values()) == [other]                                                # Vary changed: old variants dropped
+            assert _.variants == {f'GET {URL}': (('accept-encoding',), 1)}
+
+    def test_evict(self):                                                     # Test least recently used entries go first once over max_size
+        with self.cache as _:
+            for index in range(3):
+                _.store('GET', f'{URL}/{index}', {}, 200, {'Cache-Control': 'max-age=60'}, b'x' * 100, max_size=300, entry_limit=1000, now=NOW)
+            assert len(_.entries) == 2                                                                 # each entry is 100 bytes + 23 of headers
+            assert _.lookup('GET', f'{URL}/0', {}, now=NOW) == (None, MISS)
+            assert _.lookup('GET', f'{URL}/1', {}, now=NOW)[1] is FRESH                               # now the most recently used
+            _.store('GET', f'{URL}/3', {}, 200, {'Cache-Control': 'max-age=60'}, b'x' * 100, max_size=300, entry_limit=1000, now=NOW)
+            assert [key[0] for key in _.entries] == [f'GET {URL}/1', f'GET {URL}/3']
+            assert _.size == 246
+
+    def test_purge(self):                                                     # Test stale entries are swept (not only when looked up)
+        with self.cache as _:
+            self.store({'Cache-Control': 'max-age=5'})
+            _.store('GET', f'{URL}/other', {}, 200, {'Cache-Control': 'max-age=60'}, b'x', max_size=MAX_SIZE, entry_limit=1000, now=NOW + 11)
+            assert [key[0] for key in _.entries] == [f'GET {URL}/other']
+
+            _.clear()
+            assert (_.entries, _.variants, _.size) == ({}, {}, 0)
+
+    def test_revalidation(self):                                              # Test stale entries with validators are kept, and refreshed by a 304
+        with self.cache as _:
+            entry = self.store({'Cache-Control': 'max-age=60', 'ETag': '"v1"', 'Last-Modified': 'Tue, 14 Nov 2023 22:13:20 GMT'})
+            assert _.validators(entry) == {'If-None-Match': '"v1"', 'If-Modified-Since': 'Tue, 14 Nov 2023 22:13:20 GMT'}
+            assert _.validators(None ) == {}
+            assert _.lookup('GET', URL, {}, now=NOW + 59 ) == (entry, FRESH)
+            assert _.lookup('GET', URL, {}, now=NOW + 120) == (entry, EXPIRED)                                # stale, but kept for revalidation
+            _.purge(NOW + 120)
+            assert len(_.entries) == 1
+
+            refreshed = _.refresh(entry, {'Cache-Control': 'max-age=30', 'ETag': '"v1"', 'Content-Length': '0'}, max_size=MAX_SIZE, now=NOW + 120)
+            assert refreshed.content   == b'body'
+            assert refreshed.headers   == {'Cache-Control': 'max-age=30', 'ETag': '"v1"', 'Last-Modified': 'Tue, 14 Nov 2023 22:13:20 GMT'}
+            assert refreshed.stored_at == NOW + 120
+            assert refreshed.lifetime  == 30
+            assert _.size              == refreshed.size
+            assert _.lookup('GET', URL, {}, now=NOW + 149) == (refreshed, FRESH)
+
+            always = self.store({'Cache-Control': 'no-cache', 'ETag': '"v2"'}, now=NOW + 200)          # stored, but revalidated on every use
+            assert always.lifetime == 0
+            assert _.lookup('GET', URL, {}, now=NOW + 200) == (always, EXPIRED)
+
+    def test_refresh__weak_etag(self):                                        # Test the W/ we add when compressing survives a 304
+        with self.cache as _:
+            entry     = self.store({'Cache-Control': 'max-age=60', 'ETag': 'W/"v1"', 'Content-Encoding': 'gzip'})
+            refreshed = _.refresh(entry, {'etag': '"v1"', 'Date': formatdate(NOW + 100, usegmt=True)}, max_size=MAX_SIZE, now=NOW + 100)
+            assert refreshed.headers['ETag'            ] == 'W/"v1"'
+            assert refreshed.headers['Content-Encoding'] == 'gzip'
+            assert refreshed.lifetime                    == 60
+
+    def test_not_modified(self):                                              # Test client validators against a stored response
+        with self.cache as _:
+            entry = self.store({'Cache-Control': 'max-age=60', 'ETag': 'W/"v1"', 'Last-Modified': formatdate(NOW - 100, usegmt=True)})
+            assert _.not_modified(entry, {}                                            ) is False
+            assert _.not_modified(entry, {'If-None-Match': '"v1"'                      }) is True         # weak comparison
+            assert _.not_modified(entry, {'if-none-match': '"v0", W/"v1"'              }) is True
+            assert _.not_modified(entry, {'If-None-Match': '*'                         }) is True
+            assert _.not_modified(entry, {'If-None-Match': '"v2"'                      }) is False
+            assert _.not_modified(entry, {'If-Modified-Since': formatdate(NOW, usegmt=True)      }) is True
+            assert _.not_modified(entry, {'If-Modified-Since': formatdate(NOW - 200, usegmt=True)}) is False
+            assert _.not_modified(entry, {'If-None-Match': '"v2"', 'If-Modified-Since': formatdate(NOW, usegmt=True)}) is False  # If-None-Match wins
+
+    def test_stale_windows(self):                                             # Test stale-while-revalidate / stale-if-error keep (and serve) entries past their lifetime
+        with self.cache as _:
+            entry = self.store({'Cache-Control': 'max-age=60, stale-while-revalidate=30, stale-if-error=120'})
+            assert (entry.stale_while_revalidate, entry.stale_if_error) == (30, 120)
+            assert _.lookup('GET', URL, {}                          , now=NOW + 59 ) == (entry, FRESH  )
+            assert _.lookup('GET', URL, {}                          , now=NOW + 70 ) == (entry, STALE  )      # served now, refreshed in the background
+            assert _.lookup('GET', URL, {'Cache-Control': 'max-age=5'}, now=NOW + 70) == (entry, EXPIRED)    # client has its own limits
+            assert _.lookup('GET', URL, {}                          , now=NOW + 100) == (entry, EXPIRED)      # only good if upstream fails
+            assert _.stale_if_error(entry, now=NOW + 100) is True
+            assert _.stale_if_error(entry, now=NOW + 180) is False
+            assert _.lookup('GET', URL, {}                          , now=NOW + 180) == (None , MISS   )
+
+            strict = self.store({'Cache-Control': 'max-age=60, stale-if-error=120, must-revalidate'})
+            assert (strict.stale_while_revalidate, strict.stale_if_error) == (0, 0)
+
+            assert _.start_refresh(entry.key) is True
+            assert _.start_refresh(entry.key) is False                                                 # one refresh at a time
+            _.end_refresh(entry.key)
+            assert _.refreshing == set()
+
+    def test_disk(self):                                                      # Test bodies over the memory limits go to the disk tier, and survive a restart
+        path = temp_folder()
+        try:
+            with self.cache as _:
+                _.open_disk(path, MAX_SIZE, 100_000, now=NOW)
+                body  = b'x' * 5000                                                                    # over entry_limit
+                entry = self.store({'Cache-Control': 'max-age=60'}, content=body, disk_max_size=100_000)
+                assert entry.content                           == b''
+                assert entry.size                              == len('Cache-Control' 'max-age=60')
+                assert _.size                                  == entry.size
+                assert _.lookup('GET', URL, {}, now=NOW + 1)   == (entry, FRESH)
+                assert _.content(entry)                        == body
+                assert b''.join(_.chunks(entry, 2048))         == body
+                assert self.store({}, content=b'y' * 200_000, disk_max_size=100_000) is None        # over disk_max_size
+                assert os.path.isfile(os.path.join(path, 'index.json')) is False                       # (stores don't write the index: the flusher does, outside the lock)
+                _.flush_disk()
+                assert os.path.isfile(os.path.join(path, 'index.json')) is True
+                assert _.flusher.name                                    == 'proxy-cache-flusher'
+
+            with Service__Proxy__Cache() as _:                                                         # warm restart
+                _.open_disk(path, MAX_SIZE, 100_000, now=NOW + 1)
+                entry, state = _.lookup('GET', URL, {}, now=NOW + 1)
+                assert state             == FRESH
+                assert _.content(entry)  == body
+                _.clear()
+                assert _.disk.records    == {}
+        finally:
+            folder_delete_all(path)
+
+    def test_tee(self):                                                       # Test streamed bodies are stored once fully sent
+        with self.cache as _:
+            stored = []
+            assert list(_.tee((chunk for chunk in [b'ab', b'cd']), 10, stored.append)) == [b'ab', b'cd']
+            assert stored == [b'abcd']
+
+            assert list(_.tee((chunk for chunk in [b'ab', b'cd']), 3 , stored.append)) == [b'ab', b'cd']              # too big: streamed, not stored
+            assert stored == [b'abcd']
+
+            def chunks():
+                yield b'ab'
+                yield b'cd'
+            tee = _.tee(chunks(), 10, stored.append)
+            next(tee)
+            tee.close()                                                                                # client went away: not stored
+            assert stored == [b'abcd']
+
+    def test_tee__async(self):                                                # Test async version
+        with self.cache as _:
+            async def chunks():
+                yield b'ab'
+                yield b'cd'
+            async def read():
+                return [chunk async for chunk in _.tee__async(chunks(), 10, stored.append)]
+            stored = []
+            assert asyncio.run(read()) == [b'ab', b'cd']
+            assert stored == [b'abcd']
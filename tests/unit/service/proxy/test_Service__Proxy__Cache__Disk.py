@@ -0,0 +1,122 @@
+import asyncio
+import hashlib
+import os
+from unittest                                                           import TestCase
+from osbot_utils.type_safe.Type_Safe                                    import Type_Safe
+from osbot_utils.utils.Files                                            import temp_folder, folder_delete_all
+from osbot_utils.utils.Objects                                          import base_classes
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Cache__Entry        import Schema__Proxy__Cache__Entry
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Cache__Disk  import Service__Proxy__Cache__Disk, RETIRE__GRACE, TEMP__SUFFIX
+
+BODY = b'x' * 1000
+NOW  = 1_700_000_000.0
+
+
+class test_Service__Proxy__Cache__Disk(TestCase):
+
+    def setUp(self):
+        self.path = temp_folder()
+        self.disk = Service__Proxy__Cache__Disk()
+        self.disk.open(self.path)
+
+    def tearDown(self):
+        folder_delete_all(self.path)
+
+    def add(self, disk, key, content):                                        # write a body and track an entry using it
+        entry = Schema__Proxy__Cache__Entry(key=(key, ()), status_code=200, headers={'Content-Type': 'text/plain'}, lifetime=60)
+        entry.digest = disk.write_body(content)
+        assert disk.add(entry, (), len(content)) is True
+        return entry
+
+    def files(self):                                                          # every file under objects/
+        return sorted(name for folder, _, names in os.walk(os.path.join(self.path, 'objects')) for name in names)
+
+    def test__init__(self):                                                   # Test auto-initialization
+        with Service__Proxy__Cache__Disk() as _:
+            assert type(_)         is Service__Proxy__Cache__Disk
+            assert base_classes(_) == [Type_Safe, object]
+            assert _.path          == ''
+            assert _.size          == 0
+
+    def test_write_body(self):                                                # Test bodies are content-addressed, written once, with no temp files left
+        with self.disk as _:
+            digest = _.write_body(BODY)
+            assert digest                      == hashlib.sha256(BODY).hexdigest()
+            assert _.body_path(digest)         == os.path.join(self.path, 'objects', digest[:2], digest)
+            assert _.write_body(BODY)          == digest
+            assert self.files()                == [digest]
+            assert _.read(digest)              == BODY
+
+    def test_open__warm_restart(self):                                        # Test a new instance picks up the index and bodies left behind
+        with self.disk as _:
+            entry = self.add(_, 'GET https://example.com/a', BODY)
+            _.flush(NOW)
+
+        with Service__Proxy__Cache__Disk() as _:
+            loaded = _.open(self.path)
+            assert len(loaded)            == 1
+            restored, names = loaded[0]
+            assert names                  == ()
+            assert restored.json()        == entry.json()
+            assert _.size                 == len(BODY)
+            assert _.read(restored.digest) == BODY
+
+    def test_snapshot(self):                                                  # Test the index is copied (under the cache lock) and written later, newest copy winning
+        with self.disk as _:
+            assert _.snapshot(NOW)                                         is None       # nothing changed
+            first       = self.add(_, 'GET https://example.com/a', BODY)
+            old_copy    = _.snapshot(NOW)
+            self.add(_, 'GET https://example.com/b', b'y' * 10)
+            new_copy    = _.snapshot(NOW)
+            assert (old_copy[0], new_copy[0], _.dirty)                     == (1, 2, False)
+            assert os.path.isfile(_.index_path())                          is False      # (nothing written yet)
+            _.save_index(new_copy)
+            _.save_index(old_copy)                                                       # late: skipped
+            assert len(Service__Proxy__Cache__Disk().open(self.path))      == 2
+            assert first.digest                                            in _.bodies
+
+    def test_open__orphans(self):                                             # Test bodies missing from the index, and temp files from a crash, are deleted
+        with self.disk as _:
+            digest = _.write_body(BODY)                                       # never added: as if we crashed before saving the index
+            with open(_.body_path(digest) + TEMP__SUFFIX, 'wb') as file:
+                file.write(b'partial')
+            assert len(self.files()) == 2
+            assert _.open(self.path) == []
+            assert self.files()      == []
+
+    def test_open__bad_index(self):                                           # Test an unreadable index starts an empty cache
+        with open(os.path.join(self.path, 'index.json'), 'w') as file:
+            file.write('{not json')
+        assert self.disk.open(self.path) == []
+
+    def test_drop(self):                                                      # Test bodies of dropped entries stay readable for RETIRE__GRACE seconds
+        with self.disk as _:
+            entry = self.add(_, 'GET https://example.com/a', BODY)
+            _.drop(entry.key)
+            _.flush(NOW)
+            assert self.files()  == [entry.digest]
+            _.flush(NOW + RETIRE__GRACE)
+            assert self.files()  == []
+            assert _.size        == 0
+            assert _.records     == {}
+
+    def test_evict(self):                                                     # Test least recently used bodies go first once over max_size
+        with self.disk as _:
+            first  = self.add(_, 'GET https://example.com/a', b'a' * 100)
+            second = self.add(_, 'GET https://example.com/b', b'b' * 100)
+            _.touch(first.digest)
+            assert _.evict(150)          == [second.key]
+            assert list(_.bodies)        == [first.digest]
+            assert self.files()          == [first.digest]
+
+    def test_chunks(self):                                                    # Test bodies are streamed as slices of an mmap
+        with self.disk as _:
+            entry  = self.add(_, 'GET https://example.com/a', BODY)
+            chunks = list(_.chunks(entry.digest, 300))
+            assert [type(chunk) for chunk in chunks] == [memoryview] * 4
+            assert [len(chunk)  for chunk in chunks] == [300, 300, 300, 100]
+            assert b''.join(chunks)                  == BODY
+
+            async def read():
+                return [bytes(chunk) async for chunk in _.chunks__async(entry.digest, 600)]
+            assert asyncio.run(read()) == [BODY[:600], BODY[600:]]
@@ -0,0 +1,110 @@
+import asyncio
+import threading
+from unittest                                                       import TestCase
+from osbot_utils.type_safe.Type_Safe                                import Type_Safe
+from osbot_utils.utils.Objects                                      import base_classes
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Coalesce import Service__Proxy__Coalesce
+
+KEY = ('GET', 'https://example.com/api', ())
+
+
+class test_Service__Proxy__Coalesce(TestCase):
+
+    def setUp(self):
+        self.coalesce = Service__Proxy__Coalesce()
+
+    def run_threads(self, count, target):                                    # start count threads running target
+        threads = [threading.Thread(target=target) for index in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def test__init__(self):                                                   # Test auto-initialization
+        with Service__Proxy__Coalesce() as _:
+            assert type(_)         is Service__Proxy__Coalesce
+            assert base_classes(_) == [Type_Safe, object]
+            assert _.flights       == {}
+
+    def test_key(self):                                                       # Test headers that don't change the response are ignored
+        with self.coalesce as _:
+            key = _.key('GET', 'https://example.com', {'Accept': 'text/html', 'User-Agent': 'a', 'X-Request-Id': '1'})
+            assert key == ('GET', 'https://example.com', (('accept', 'text/html'),))
+            assert key == _.key('GET', 'https://example.com', {'accept': 'text/html', 'user-agent': 'b'})
+            assert key != _.key('GET', 'https://example.com', {'accept': 'text/html', 'Authorization': 'Bearer abc'})
+
+    def test_run(self):                                                       # Test concurrent callers share the leader's single fetch
+        with self.coalesce as _:
+            release, calls, results = threading.Event(), [], []
+            def fetch():
+                calls.append(1)
+                release.wait(5)
+                return {'status': 200}
+
+            leader    = self.run_threads(1, lambda: results.append(_.run(KEY, fetch, 5)))
+            while KEY not in _.flights:
+                pass
+            followers = self.run_threads(5, lambda: results.append(_.run(KEY, fetch, 5)))
+            while _.flights[KEY].waiters < 5:
+                pass
+            release.set()
+            for thread in leader + followers:
+                thread.join()
+
+            assert len(calls)                                     == 1
+            assert sorted(shared for response, shared in results) == [False] + [True] * 5
+            assert all(response is results[0][0] for response, shared in results)
+            assert _.flights                                      == {}
+
+    def test_run__error(self):                                                # Test the leader's error reaches every waiter
+        with self.coalesce as _:
+            release, errors = threading.Event(), []
+            def fetch():
+                release.wait(5)
+                raise ValueError('Bad gateway')
+            def call():
+                try:
+                    _.run(KEY, fetch, 5)
+                except ValueError as error:
+                    errors.append(str(error))
+
+            threads = self.run_threads(1, call)
+            while KEY not in _.flights:
+                pass
+            threads += self.run_threads(3, call)
+            while _.flights[KEY].waiters < 3:
+                pass
+            release.set()
+            for thread in threads:
+                thread.join()
+            assert errors == ['Bad gateway'] * 4
+
+    def test_run__timeout(self):                                              # Test waiters stop waiting for a slow leader
+        with self.coalesce as _:
+            release = threading.Event()
+            leader  = self.run_threads(1, lambda: _.run(KEY, lambda: release.wait(5), 5))
+            while KEY not in _.flights:
+                pass
+            assert _.run(KEY, lambda: 'own', 0.01) == ('own', False)
+            release.set()
+            leader[0].join()
+
+    def test_run__async(self):                                                # Test the async version (including the error fan-out)
+        with self.coalesce as _:
+            calls = []
+            async def fetch():
+                calls.append(1)
+                await asyncio.sleep(0.01)
+                return {'status': 200}
+            async def failing():
+                await asyncio.sleep(0.01)
+                raise ValueError('Gateway timeout')
+            async def execute():
+                results = await asyncio.gather(*[_.run__async(KEY, fetch, 5) for index in range(5)])
+                errors  = await asyncio.gather(*[_.run__async(KEY, failing, 5) for index in range(3)], return_exceptions=True)
+                return results, errors
+
+            results, errors = asyncio.run(execute())
+            assert len(calls)                               == 1
+            assert [shared for response, shared in results] == [False] + [True] * 4
+            assert [str(error) for error in errors]         == ['Gateway timeout'] * 3
+            assert _.flights__async                         == {}
@@ -0,0 +1,107 @@
+import asyncio
+import gzip
+import zlib
+from unittest                                                           import TestCase
+from osbot_utils.type_safe.Type_Safe                                    import Type_Safe
+from osbot_utils.utils.Objects                                          import base_classes
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Compression  import Service__Proxy__Compression, ENCODINGS__SUPPORTED
+
+
+class test_Service__Proxy__Compression(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.compression_service = Service__Proxy__Compression()
+        cls.json_headers        = {'Content-Type': 'application/json; charset=utf-8'}
+
+    def test__init__(self):                                                   # Test auto-initialization
+        with Service__Proxy__Compression() as _:
+            assert type(_)              is Service__Proxy__Compression
+            assert base_classes(_)      == [Type_Safe, object]
+            assert ENCODINGS__SUPPORTED[-1] == 'gzip'                          # always available (br and zstd only when installed)
+
+    def test_negotiate(self):                                                 # Test Accept-Encoding negotiation
+        with self.compression_service as _:
+            assert _.negotiate(None                     ) is None
+            assert _.negotiate(''                       ) is None
+            assert _.negotiate('identity'               ) is None
+            assert _.negotiate('deflate'                ) is None             # not supported
+            assert _.negotiate('gzip'                   ) == 'gzip'
+            assert _.negotiate('GZip ; q=0.5'           ) == 'gzip'
+            assert _.negotiate('x-gzip'                 ) == 'gzip'
+            assert _.negotiate('gzip;q=0'               ) is None             # q=0: not acceptable
+            assert _.negotiate('*;q=0.1, gzip;q=0'      ) != 'gzip'           # explicit q=0 wins over *
+            assert _.negotiate('*'                      ) == ENCODINGS__SUPPORTED[0]
+            assert _.negotiate('gzip;q=abc'             ) is None
+
+    def test_compressible(self):                                              # Test which responses are worth compressing
+        with self.compression_service as _:
+            assert _.compressible(200, self.json_headers                             , 2000, 1024) is True
+            assert _.compressible(200, self.json_headers                             , None, 1024) is True     # unknown size (streamed)
+            assert _.compressible(200, self.json_headers                             , 1000, 1024) is False    # tiny
+            assert _.compressible(304, self.json_headers                             , 2000, 1024) is False    # no body
+            assert _.compressible(200, {'content-type': 'text/html'                 }, 2000, 1024) is True
+            assert _.compressible(200, {'Content-Type': 'application/ld+json'       }, 2000, 1024) is True
+            assert _.compressible(200, {'Content-Type': 'image/svg+xml'             }, 2000, 1024) is True
+            assert _.compressible(200, {'Content-Type': 'image/png'                 }, 2000, 1024) is False    # already compressed
+            assert _.compressible(200, {'Content-Type': 'application/zip'           }, 2000, 1024) is False
+            assert _.compressible(200, {'Content-Type': 'text/event-stream'         }, 2000, 1024) is False
+            assert _.compressible(200, {}                                            , 2000, 1024) is False
+            assert _.compressible(200, {**self.json_headers, 'Content-Encoding': 'br'}, 2000, 1024) is False   # already encoded
+            assert _.compressible(206, self.json_headers                             , 2000, 1024) is False    # partial content
+            assert _.compressible(200, {**self.json_headers, 'Content-Range': 'bytes 0-1999/5000'}, 2000, 1024) is False
+            assert _.compressible(200, {**self.json_headers, 'Cache-Control': 'public, No-Transform'}, 2000, 1024) is False
+            assert _.compressible(200, {**self.json_headers, 'Cache-Control': 'public, max-age=60'  }, 2000, 1024) is True
+
+    def test_update_headers(self):                                            # Test headers describe the compressed body
+        with self.compression_service as _:
+            headers = {'Content-Type': 'text/html', 'Content-Length': '2000', 'ETag': '"abc"'}
+            assert _.update_headers(headers, 'gzip') == {'Content-Type'    : 'text/html'      ,
+                                                         'ETag'            : 'W/"abc"'        ,
+                                                         'Content-Encoding': 'gzip'           ,
+                                                         'Vary'            : 'Accept-Encoding'}
+            assert _.update_headers({'vary': 'Origin'         }, 'gzip') == {'vary': 'Origin, Accept-Encoding', 'Content-Encoding': 'gzip'}
+            assert _.update_headers({'Vary': 'Accept-Encoding'}, 'gzip') == {'Vary': 'Accept-Encoding'        , 'Content-Encoding': 'gzip'}
+            assert _.update_headers({'Vary': '*', 'etag': 'W/"a"'}, 'gzip') == {'Vary': '*', 'etag': 'W/"a"'  , 'Content-Encoding': 'gzip'}
+
+    def test_compress(self):                                                  # Test whole body compression
+        with self.compression_service as _:
+            content    = b'{"data": "' + b'x' * 10000 + b'"}'
+            compressed = _.compress(content, 'gzip', 6)
+            assert len(compressed)             < len(content) / 50
+            assert gzip.decompress(compressed) == content
+            assert gzip.decompress(_.compress(content, 'gzip', 100)) == content   # level is capped
+
+    def test_compress_chunks(self):                                           # Test streamed compression (each chunk can be decoded as it arrives)
+        with self.compression_service as _:
+            chunks       = (b'x' * 1000 for _ in range(3))
+            decompressor = zlib.decompressobj(31)
+            compressed   = _.compress_chunks(chunks, 'gzip', 6)
+            assert decompressor.decompress(next(compressed)) == b'x' * 1000   # flushed, not held back
+            assert decompressor.decompress(next(compressed)) == b'x' * 1000
+            rest = b''.join(compressed)
+            assert decompressor.decompress(rest) == b'x' * 1000
+            assert decompressor.eof is True
+
+    def test_compress_chunks__close(self):                                    # Test closing the compressed stream closes the upstream one
+        with self.compression_service as _:
+            closed = []
+            def chunks():
+                try:
+                    yield b'a'
+                    yield b'b'
+                finally:
+                    closed.append(True)
+            compressed = _.compress_chunks(chunks(), 'gzip', 6)
+            next(compressed)
+            compressed.close()
+            assert closed == [True]
+
+    def test_compress_chunks__async(self):                                    # Test async version
+        with self.compression_service as _:
+            async def chunks():
+                yield b'{"a": '
+                yield b'"' + b'b' * 5000 + b'"}'
+            async def compress():
+                return b''.join([chunk async for chunk in _.compress_chunks__async(chunks(), 'gzip', 6)])
+            assert gzip.decompress(asyncio.run(compress())) == b'{"a": "' + b'b' * 5000 + b'"}'
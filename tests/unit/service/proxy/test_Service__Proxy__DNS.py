@@ -0,0 +1,105 @@
+import socket
+import time
+import pytest
+from unittest                                                       import TestCase
+from osbot_utils.type_safe.Type_Safe                                import Type_Safe
+from osbot_utils.utils.Objects                                      import base_classes
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Config          import Schema__Proxy__Config
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__DNS      import Service__Proxy__DNS, DNS__HOSTS_LIMIT
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Pools    import Service__Proxy__Pools
+from mgraph_ai_service_proxy.utils.testing.Local_Upstream__Server   import Local_Upstream__Server
+
+
+class Stub__Resolver:                                                           # getaddrinfo stand-in: every '*.test' host is 127.0.0.1, the others don't exist
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, host, port, family=0, socket_type=0):
+        self.calls.append(host)
+        if host.endswith('.test') is False:
+            raise socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+        return [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', ('127.0.0.1', port))]
+
+
+class test_Service__Proxy__DNS(TestCase):
+
+    def setUp(self):
+        self.resolver = Stub__Resolver()
+        self.config   = Schema__Proxy__Config(dns_cache=True)
+        self.dns      = Service__Proxy__DNS(resolver=self.resolver)
+
+    def expire(self, seconds):                                                  # move every cached lookup 'seconds' closer to its expiry
+        for key, (expires, refresh_at, result) in list(self.dns.entries.items()):
+            self.dns.entries[key] = (expires - seconds, refresh_at - seconds, result)
+
+    def test__init__(self):                                                   # Test auto-initialization
+        with Service__Proxy__DNS() as _:
+            assert base_classes(_) == [Type_Safe, object]
+            assert _.resolver      is None
+            assert _.get_stats()   == dict(hits=0, misses=0, negative_hits=0, refreshes=0, errors=0, entries=0)
+            assert _.lookup('localhost', 80, socket.AF_INET)[0][4] == ('127.0.0.1', 80)              # (socket.getaddrinfo)
+
+    def test_resolve(self):                                                   # Test lookups are cached until their TTL runs out
+        addresses = self.dns.resolve(self.config, 'a.test', 80)
+        assert addresses                                    == [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', ('127.0.0.1', 80))]
+        assert self.dns.resolve(self.config, 'a.test', 80)  is addresses
+        assert self.resolver.calls                          == ['a.test']
+        self.expire(60)
+        self.dns.resolve(self.config, 'a.test', 80)
+        assert self.resolver.calls                          == ['a.test', 'a.test']
+        assert self.dns.get_stats()                         == dict(hits=1, misses=2, negative_hits=0, refreshes=0, errors=0, entries=1)
+
+    def test_resolve__negative(self):                                         # Test failed lookups are cached too (for dns_negative_ttl)
+        for _ in range(3):
+            with pytest.raises(socket.gaierror, match='Name or service not known'):
+                self.dns.resolve(self.config, 'missing.com', 80)
+        assert self.resolver.calls   == ['missing.com']
+        assert self.dns.get_stats()  == dict(hits=0, misses=1, negative_hits=2, refreshes=0, errors=1, entries=1)
+        self.expire(5)
+        with pytest.raises(socket.gaierror):
+            self.dns.resolve(self.config, 'missing.com', 80)
+        assert len(self.resolver.calls) == 2
+
+    def test_resolve__refresh_ahead(self):                                    # Test hits late in a lookup's TTL refresh it in the background (the hit is served from the cache)
+        self.dns.resolve(self.config, 'hot.test', 80)
+        self.expire(50)                                                       # (past DNS__REFRESH_AHEAD of the 60s TTL)
+        assert self.dns.resolve(self.config, 'hot.test', 80)[0][4] == ('127.0.0.1', 80)
+        for _ in range(100):
+            if self.dns.refreshing == set():
+                break
+            time.sleep(0.01)
+        expires, refresh_at, result = self.dns.entries[('hot.test', 80, 0)]
+        assert expires - time.monotonic()  >  55                              # (a new TTL)
+        assert self.resolver.calls         == ['hot.test', 'hot.test']
+        assert self.dns.get_stats()        == dict(hits=1, misses=1, negative_hits=0, refreshes=1, errors=0, entries=1)
+
+    def test_store__failed_refresh(self):                                     # Test a failed refresh keeps the addresses until they expire
+        self.dns.resolve(self.config, 'a.test', 80)
+        self.resolver.calls.clear()
+        self.dns.resolver = lambda *args: (_ for _ in ()).throw(socket.gaierror('temporary failure'))
+        assert self.dns.store(self.config, ('a.test', 80, 0))[0][4] == ('127.0.0.1', 80)
+        assert self.dns.resolve(self.config, 'a.test', 80)[0][4]    == ('127.0.0.1', 80)
+        assert self.dns.errors                                      == 1
+
+    def test_store__limit(self):                                              # Test the least recently used lookups go first
+        for index in range(DNS__HOSTS_LIMIT + 1):
+            self.dns.resolve(self.config, f'host-{index}.test', 80)
+        assert len(self.dns.entries)              == DNS__HOSTS_LIMIT
+        assert ('host-0.test', 80, 0) not in self.dns.entries
+
+    def test_create_connection(self):                                         # Test the pooled connections connect to the cached addresses (stub resolver, local upstream)
+        upstream = Local_Upstream__Server().start()
+        pools    = Service__Proxy__Pools(config=self.config, dns_service=self.dns)
+        try:
+            session = pools.session(self.config)
+            for _ in range(2):
+                response = session.get(f'http://upstream.test:{upstream.port}/echo')        # (upstream closes the connection: two lookups)
+                assert response.status_code == 200
+            assert self.resolver.calls      == ['upstream.test']
+            assert self.dns.get_stats()     == dict(hits=1, misses=1, negative_hits=0, refreshes=0, errors=0, entries=1)
+
+            with pytest.raises(Exception, match='Failed to resolve'):                          # (NameResolutionError, wrapped by requests)
+                session.get(f'http://missing.com:{upstream.port}/echo')
+        finally:
+            pools.close()
+            upstream.stop()
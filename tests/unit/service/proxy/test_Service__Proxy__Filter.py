@@ -1,6 +1,6 @@
 from unittest                                                       import TestCase
 from osbot_utils.utils.Objects                                      import base_classes, __
-from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Filter   import Service__Proxy__Filter
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Filter   import Service__Proxy__Filter, HEADER_NAMES__LIMIT
 from osbot_utils.type_safe.Type_Safe                                import Type_Safe
 
 class test_Service__Proxy__Filter(TestCase):
@@ -127,6 +127,20 @@ class test_Service__Proxy__Filter(TestCase):
                               'Vary'        : 'Accept-Encoding'              ,
                               'ETag'        : '"abc123"'                     }
 
+    def test_filter_response_headers__passthrough(self):                     # Test encoding headers are kept when the body is passed through undecoded
+        with Service__Proxy__Filter() as _:
+            input_headers = {
+                'Content-Type'     : 'application/json'           ,
+                'Content-Encoding' : 'gzip'                       ,           # Kept (body is still gzipped)
+                'Content-Length'   : '1234'                       ,           # Kept (body is byte for byte what upstream sent)
+                'Transfer-Encoding': 'chunked'                    ,           # Still removed (hop-by-hop)
+            }
+
+            assert _.filter_response_headers(input_headers, passthrough=True) == {'Content-Type'     : 'application/json',
+                                                                                  'Content-Encoding' : 'gzip'            ,
+                                                                                  'Content-Length'   : '1234'            }
+            assert _.filter_response_headers(input_headers                  ) == {'Content-Type'     : 'application/json'}
+
     def test__both_filters_different_rules(self):                            # Test that filters have different rules
         with Service__Proxy__Filter() as _:
             # Header that should be removed from requests but not responses
@@ -138,3 +152,74 @@ class test_Service__Proxy__Filter(TestCase):
             assert request_filtered == {}                                    # Removed from requests
             assert response_filtered == {'Host': 'example.com'}              # Kept in responses
 
+
+    def test_filter_headers__raw(self):                                       # Test raw (ASGI / httpx style) byte header lists, with repeated headers
+        with Service__Proxy__Filter() as _:
+            raw_headers = [(b'Content-Type'  , b'text/plain'),
+                           (b'Content-Length', b'10'        ),
+                           (b'Set-Cookie'    , b'a=1'       ),
+                           (b'Set-Cookie'    , b'b=2'       )]
+            assert _.filter_response_headers(raw_headers) == {'Content-Type': 'text/plain',
+                                                              'Set-Cookie'  : 'a=1, b=2'  }
+
+    def test_filter_incoming_headers(self):                                   # Test the client's headers are validated as they come in (hop-by-hop ones are only dropped when sent upstream)
+        with Service__Proxy__Filter() as _:
+            raw_headers = [(b'host'           , b'example.com'   ),
+                           (b'x-forwarded-for', b'1.2.3.4'       ),
+                           (b'connection'     , b'keep-alive'    ),
+                           (b'bad header'     , b'1'             ),
+                           (b'cookie'         , b'a=1\x00'       )]
+            assert _.filter_incoming_headers(raw_headers) == {'host'           : 'example.com',
+                                                              'x-forwarded-for': '1.2.3.4'    ,
+                                                              'cookie'         : 'a=1_'       }
+
+    def test_filter_headers__connection_tokens(self):                         # Test headers named in Connection are dropped as hop-by-hop (RFC 9110 7.6.1)
+        with Service__Proxy__Filter() as _:
+            raw_headers = [(b'X-Hop'     , b'1'                   ),
+                           (b'Server'    , b'nginx'               ),
+                           (b'Connection', b'keep-alive, X-Hop'   ),
+                           (b'X-Other'   , b'2'                   )]
+            assert _.filter_response_headers(raw_headers)             == {'Server': 'nginx', 'X-Other': '2'}
+            assert _.filter_response_headers([(b'X-Hop', b'1'),
+                                              (b'Connection', b'close')]) == {'X-Hop': '1'}
+
+    def test_filter_headers__sanitise(self):                                  # Test values lose control characters, and invalid names or oversized values are dropped
+        with Service__Proxy__Filter() as _:
+            raw_headers = [(b'X-Value'    , b' a\x00b\x1fc '    ),
+                           (b'Bad Name'   , b'x'                ),
+                           (b'X-Too-Long' , b'x' * 9000         ),
+                           (b'X-Unicode'  , 'caf\xe9'.encode('latin-1'))]
+            assert _.filter_response_headers(raw_headers) == {'X-Value'  : 'a_b_c'  ,
+                                                              'X-Unicode': 'caf\xe9'}
+
+    def test_filter_headers__extra_and_default(self):                         # Test added headers: extra ones always, default ones only when missing (any casing)
+        with Service__Proxy__Filter() as _:
+            headers  = {'accept-encoding': 'gzip', 'x-forwarded-for': '6.6.6.6', 'accept': '*/*'}
+            filtered = _.filter_headers(headers.items(), _.REQUEST_SKIP_HEADERS, {'X-Forwarded-For': '1.2.3.4'}, {'Accept-Encoding': 'identity'})
+            assert filtered == {'accept-encoding': 'gzip', 'accept': '*/*', 'X-Forwarded-For': '1.2.3.4'}
+            filtered = _.filter_headers({'ACCEPT': '*/*'}.items(), _.REQUEST_SKIP_HEADERS, None, {'Accept-Encoding': 'identity'})
+            assert filtered == {'ACCEPT': '*/*', 'Accept-Encoding': 'identity'}
+            revalidate = {'If-None-Match': '"old"', 'Accept': '*/*'}
+            assert _.filter_headers(revalidate.items(), _.REQUEST_SKIP_HEADERS__REVALIDATE, {'If-None-Match': '"new"'}) == {'Accept': '*/*', 'If-None-Match': '"new"'}
+
+    def test_filter_headers__lookup_limit(self):                              # Test the precompiled lookups stay bounded with many distinct names
+        with Service__Proxy__Filter() as _:
+            for index in range(HEADER_NAMES__LIMIT + 10):
+                _.filter_response_headers([(f'X-Header-{index}'.encode(), b'1')])
+            assert len(_.header_lookup(_.RESPONSE_SKIP_HEADERS)) <= HEADER_NAMES__LIMIT
+
+    def test_filter_headers__same_as_two_passes(self):                        # Test one pass over a raw header list gives what decoding it into a dict and then filtering did (timings: tests/benchmark/benchmark__hot_path.py)
+        raw_headers = [(b'Content-Type' , b'text/html; charset=utf-8'     ), (b'Content-Length', b'1234'            ),
+                       (b'Date'         , b'Mon, 01 Jan 2024 00:00:00 GMT'), (b'Server'        , b'nginx'           ),
+                       (b'Cache-Control', b'max-age=60'                   ), (b'ETag'          , b'"abc"'           ),
+                       (b'Connection'   , b'keep-alive'                   ), (b'Keep-Alive'    , b'timeout=5'       ),
+                       (b'Vary'         , b'Accept-Encoding'              ), (b'X-Request-Id'  , b'123-456'         ),
+                       (b'Set-Cookie'   , b'a=b'                          ), (b'Strict-Transport-Security', b'max-age=1')]
+        with Service__Proxy__Filter() as _:
+            def two_passes():
+                headers = {}
+                for raw_name, raw_value in raw_headers:
+                    name, value   = raw_name.decode('latin-1'), raw_value.decode('latin-1')
+                    headers[name] = f'{headers[name]}, {value}' if name in headers else value
+                return {name: value for name, value in headers.items() if name.lower() not in _.RESPONSE_SKIP_HEADERS}
+            assert _.filter_response_headers(raw_headers) == two_passes()
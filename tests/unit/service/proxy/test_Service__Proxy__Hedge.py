@@ -0,0 +1,162 @@
+import asyncio
+import threading
+import time
+import pytest
+from unittest                                                       import TestCase
+from osbot_utils.type_safe.Type_Safe                                import Type_Safe
+from osbot_utils.utils.Objects                                      import base_classes
+from mgraph_ai_service_proxy.schemas.Proxy__Request                 import Proxy__Request
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Config          import Schema__Proxy__Config
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Hedge    import Service__Proxy__Hedge, HEDGE__MIN_SAMPLES, HEDGE__DELAY_REFRESH, hedge_races
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Latency  import Service__Proxy__Latency
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Pools    import Service__Proxy__Pools
+from mgraph_ai_service_proxy.utils.testing.Local_Upstream__Server   import Local_Upstream__Server
+
+
+class Upstream__Calls:                                                        # Upstream calls answering after the given delays (one per call, in order), keeping the names of the responses closed
+    def __init__(self, *delays, errors=()):
+        self.delays = delays
+        self.errors = errors                                                  # calls (by index) that fail instead of answering
+        self.calls   = 0
+        self.closed  = []
+        self.threads = []                                                     # thread each call ran on
+        self.lock   = threading.Lock()
+
+    def next_call(self):
+        with self.lock:
+            index       = self.calls
+            self.calls += 1
+            self.threads.append(threading.current_thread().name)
+        return index, self.delays[index]
+
+    def response(self, index):
+        if index in self.errors:
+            raise ValueError(f'error {index}')
+        calls = self
+        class Response:
+            name = f'call-{index}'
+            def close(self):
+                calls.closed.append(self.name)
+            async def aclose(self):
+                calls.closed.append(self.name)
+        return Response()
+
+    def __call__(self):
+        index, delay = self.next_call()
+        time.sleep(delay)
+        return self.response(index)
+
+    async def call__async(self):
+        index, delay = self.next_call()
+        await asyncio.sleep(delay)
+        return self.response(index)
+
+
+class test_Service__Proxy__Hedge(TestCase):
+
+    def setUp(self):
+        self.config = Schema__Proxy__Config(hedge_requests=True)
+        self.hedge  = Service__Proxy__Hedge()
+
+    def race(self, calls, delay=0.05):
+        return self.hedge.race(self.config, 'a.com', delay, calls)
+
+    def race__async(self, calls, delay=0.05):
+        loop = asyncio.new_event_loop()
+        try:
+            async def race():
+                response = await self.hedge.race__async(self.config, 'a.com', delay, calls.call__async)
+                await asyncio.sleep(0.3)                                      # (let the loser finish being cancelled)
+                return response
+            return loop.run_until_complete(race())
+        finally:
+            loop.close()
+
+    def test__init__(self):                                                   # Test auto-initialization
+        with self.hedge as _:
+            assert base_classes(_) == [Type_Safe, object]
+            assert _.executor      is None
+            assert _.timer         is None
+            assert _.get_stats()   == dict(hedged=0, wins=0, losses=0, exhausted=0)
+
+    def test_hedgeable(self):                                                 # Test only safe methods without a streamed body, when enabled
+        with self.hedge as _:
+            assert _.hedgeable(self.config, Proxy__Request(method='GET' )                    ) is True
+            assert _.hedgeable(self.config, Proxy__Request(method='HEAD')                    ) is True
+            assert _.hedgeable(self.config, Proxy__Request(method='PUT' )                    ) is False
+            assert _.hedgeable(self.config, Proxy__Request(method='GET' , body_stream=iter(())) ) is False
+            self.config.hedge_requests = False
+            assert _.hedgeable(self.config, Proxy__Request(method='GET' )                    ) is False
+
+    def test_delay(self):                                                     # Test config.hedge_delay until the host has enough samples, then its p95 ttfb (kept for a second)
+        latency = Service__Proxy__Latency()
+        with self.hedge as _:
+            assert _.delay(self.config, latency, 'a.com', now=0) == 0.1
+            for index in range(HEDGE__MIN_SAMPLES):
+                latency.record('ttfb', 'a.com', 0.010 if index < 19 else 0.5)
+            assert _.delay(self.config, latency, 'a.com', now=0.5) == 0.1     # (kept)
+            assert 0.0095 <= _.delay(self.config, latency, 'a.com', now=HEDGE__DELAY_REFRESH) <= 0.0105
+
+    def test_schedule(self):                                                  # Test timers call back once due, soonest first, unless cancelled
+        called = []
+        with self.hedge as _:
+            _.schedule(0.10, lambda: called.append('b'))
+            _.schedule(0.05, lambda: called.append('a'))
+            _.cancel(_.schedule(0.01, lambda: called.append('cancelled')))
+            time.sleep(0.3)
+            assert called        == ['a', 'b']
+            assert _.timers      == []
+            assert _.timer.name  == 'proxy-hedge-timer'
+
+    def test_race__first_call_in_time(self):                                  # Test no hedge when the first call answers before the delay
+        calls = Upstream__Calls(0, 0)
+        assert self.race(calls).name == 'call-0'
+        assert self.hedge.get_stats() == dict(hedged=0, wins=0, losses=0, exhausted=0)
+
+    def test_race__hedge_wins(self):                                          # Test a slow first call is hedged, the hedge wins, and the first call's response is closed once it arrives
+        calls = Upstream__Calls(0.3, 0)
+        assert self.race(calls).name  == 'call-1'
+        assert self.hedge.get_stats() == dict(hedged=1, wins=1, losses=0, exhausted=0)
+        assert calls.closed           == ['call-0']
+        assert calls.threads          == [threading.current_thread().name, 'proxy-hedge_0']   # (the first call runs on the request's thread)
+
+    def test_race__first_call_aborted(self):                                  # Test a hedge that answers first unblocks the first call still waiting for its response headers (its connection is shut down)
+        upstream = Local_Upstream__Server().start()
+        pools    = Service__Proxy__Pools()
+        paths    = ['/delay/2000', '/delay/0']
+        call     = lambda: pools.session(self.config).get(f'http://localhost:{upstream.port}{paths.pop(0)}', stream=True, timeout=5)
+        try:
+            started  = time.monotonic()
+            response = self.race(call)
+            assert time.monotonic() - started  < 1.0
+            assert response.url                .endswith('/delay/0')
+            assert self.hedge.get_stats()      == dict(hedged=1, wins=1, losses=0, exhausted=0)
+            assert getattr(hedge_races, 'race') is None
+            response.close()
+        finally:
+            pools.close()
+            upstream.stop()
+
+    def test_race__hedge_loses(self):                                         # Test the first call can still win after the hedge was sent
+        calls = Upstream__Calls(0.1, 0.5)
+        assert self.race(calls).name  == 'call-0'
+        assert self.hedge.get_stats() == dict(hedged=1, wins=0, losses=1, exhausted=0)
+
+    def test_race__first_call_fails(self):                                    # Test a failed call doesn't win while the other one can still answer, and both failing raises the first error
+        assert self.race(Upstream__Calls(0.1, 0.2, errors=(0,))).name == 'call-1'
+        with pytest.raises(ValueError, match='error 0'):
+            self.race(Upstream__Calls(0.1, 0.2, errors=(0, 1)))
+
+    def test_race__budget(self):                                              # Test hedges stop once the host's hedge budget is spent
+        self.hedge.budget.tokens['a.com'] = 0
+        assert self.race(Upstream__Calls(0.1, 0)).name == 'call-0'
+        assert self.hedge.get_stats()                  == dict(hedged=0, wins=0, losses=0, exhausted=1)
+
+    def test_race__async(self):                                               # Test the asyncio version: the hedge wins and the first call is cancelled
+        calls = Upstream__Calls(0.3, 0)
+        assert self.race__async(calls).name == 'call-1'
+        assert self.hedge.get_stats()       == dict(hedged=1, wins=1, losses=0, exhausted=0)
+        assert calls.closed                 == []                             # (cancelled before it answered)
+        calls = Upstream__Calls(0, 0)
+        assert self.race__async(calls).name == 'call-0'
+        assert self.hedge.get_stats()['hedged'] == 1
@@ -0,0 +1,70 @@
+import threading
+import pytest
+from unittest                                                           import TestCase
+from osbot_utils.type_safe.Type_Safe                                    import Type_Safe
+from osbot_utils.utils.Objects                                          import base_classes
+from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Header_Name   import Safe_Str__Http__Header_Name
+from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Host          import Safe_Str__Http__Host
+from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Method        import Safe_Str__Http__Method
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Intern       import Service__Proxy__Intern, INTERN__LIMIT, safe_str_cache
+
+
+class test_Service__Proxy__Intern(TestCase):
+
+    def test__init__(self):                                                   # Test auto-initialization
+        with Service__Proxy__Intern() as _:
+            assert type(_)         is Service__Proxy__Intern
+            assert base_classes(_) == [Type_Safe, object]
+            assert _.limit         == INTERN__LIMIT
+            assert _.caches        == {}
+            assert _.get_stats()   == {}
+        assert type(safe_str_cache) is Service__Proxy__Intern
+
+    def test_safe_str(self):                                                  # Test the same validated instance comes back for the same raw string
+        with Service__Proxy__Intern() as _:
+            method = _.method('get')
+            assert type(method)                 is Safe_Str__Http__Method
+            assert method                       == 'GET'
+            assert _.method('get')              is method
+            assert type(_.host('example.com'))  is Safe_Str__Http__Host
+            assert type(_.header_name('Accept')) is Safe_Str__Http__Header_Name
+            assert _.header_name('bad name')    == 'bad_name'                 # sanitised like the type does
+            assert _.get_stats() == {'Safe_Str__Http__Method'      : {'hits': 1, 'misses': 1, 'size': 1},
+                                     'Safe_Str__Http__Host'        : {'hits': 0, 'misses': 1, 'size': 1},
+                                     'Safe_Str__Http__Header_Name' : {'hits': 0, 'misses': 2, 'size': 2}}
+            _.clear()
+            assert _.get_stats()['Safe_Str__Http__Method']['size'] == 0
+
+    def test_safe_str__invalid(self):                                         # Test invalid values raise every time (and are not held)
+        with Service__Proxy__Intern() as _:
+            for attempt in range(2):
+                with pytest.raises(ValueError):
+                    _.method('X' * 20)
+            assert _.get_stats()['Safe_Str__Http__Method'] == {'hits': 0, 'misses': 2, 'size': 0}
+
+    def test_safe_str__bounded(self):                                         # Test a flood of distinct values stays within the limit, without evicting the other types
+        with Service__Proxy__Intern(limit=16) as _:
+            accept = _.header_name('Accept')
+            for index in range(1000):
+                _.host(f'host-{index}.example.com')
+            stats = _.get_stats()
+            assert stats['Safe_Str__Http__Host']['size'] == 16
+            assert _.header_name('Accept')                 is accept
+            assert _.host('host-999.example.com')          is _.host('host-999.example.com')     # (most recent ones kept)
+
+    def test__threads(self):                                                  # Test concurrent use
+        with Service__Proxy__Intern(limit=8) as _:
+            errors = []
+            def run():
+                try:
+                    for index in range(2000):
+                        assert _.host(f'host-{index % 32}') == f'host-{index % 32}'
+                except Exception as error:
+                    errors.append(error)
+            threads = [threading.Thread(target=run) for index in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert errors == []
+            assert _.get_stats()['Safe_Str__Http__Host']['size'] == 8
@@ -0,0 +1,117 @@
+import asyncio
+import random
+import threading
+from unittest                                                       import TestCase
+from osbot_utils.type_safe.Type_Safe                                import Type_Safe
+from osbot_utils.utils.Objects                                      import base_classes
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Latency  import Service__Proxy__Latency, Service__Proxy__Latency__Histogram, BUCKETS, HOSTS__LIMIT
+
+
+class test_Service__Proxy__Latency__Histogram(TestCase):
+
+    def setUp(self):
+        self.histogram = Service__Proxy__Latency__Histogram().setup()
+
+    def test_setup(self):                                                     # Test the buckets are allocated once, up front
+        with self.histogram as _:
+            assert base_classes(_)  == [Type_Safe, object]
+            assert len(_.counts)    == BUCKETS == 1024
+            assert _.count()        == 0
+            assert _.percentile(99) == 0
+
+    def test_index(self):                                                     # Test every value lands in a bucket within 1/32 of it
+        with self.histogram as _:
+            assert [_.index(value) for value in (0, 1, 63, 64, 65, 66, 127, 128)] == [0, 1, 63, 64, 64, 65, 95, 96]
+            assert _.index(10 ** 12) == BUCKETS - 1                                                   # past the range: last bucket
+            for value in [random.randint(64, 2 ** 36) for index in range(1000)]:
+                high = _.value_at(_.index(value))
+                assert value <= high <= value * (1 + 1 / 32)
+
+    def test_record_and_percentile(self):                                     # Test percentiles of 1..1000ms
+        with self.histogram as _:
+            for value in range(1, 1001):
+                _.record(value * 1000)
+            assert _.count() == 1000
+            for percentile, expected in ((50, 500_000), (90, 900_000), (99, 990_000), (100, 1_000_000)):
+                assert expected <= _.percentile(percentile) <= expected * (1 + 1 / 32)
+            assert _.summary()['count'  ] == 1000
+            assert _.summary()['max_ms' ] == 1000.0
+            assert _.summary()['mean_ms'] == 500.5
+
+    def test_merge_and_reset(self):                                           # Test windows can be combined, and started again
+        with self.histogram as _:
+            other = Service__Proxy__Latency__Histogram().setup()
+            _    .record(100)
+            other.record(5000)
+            other.record(7000)
+            _.merge(other)
+            assert _.count()              == 3
+            assert _.summary()['max_ms']  == 7.0
+            assert other.count()          == 2
+            _.reset()
+            assert _.count()              == 0
+            assert _.summary()['max_ms']  == 0.0
+
+
+class test_Service__Proxy__Latency(TestCase):
+
+    def setUp(self):
+        self.latency = Service__Proxy__Latency()
+
+    def test_get_latency(self):                                               # Test summaries per host, plus every host merged
+        with self.latency as _:
+            _.record('ttfb' , 'a.com', 0.010)
+            _.record('total', 'a.com', 0.020)
+            _.record('ttfb' , 'b.com', 0.030)
+            latency = _.get_latency()
+            assert list(latency)                      == ['a.com', 'b.com', '*']
+            assert list(latency['a.com'])             == ['ttfb', 'total']
+            assert latency['b.com']['ttfb']['max_ms'] == 30.0
+            assert latency['*'    ]['ttfb']['count' ] == 2
+            assert latency['*'    ]['ttfb']['max_ms'] == 30.0
+
+    def test_hosts_limit(self):                                               # Test hosts past the limit share one histogram
+        with self.latency as _:
+            for index in range(HOSTS__LIMIT * 4 + 10):
+                _.record('ttfb', f'host-{index}', 0.001)
+            assert _.get_latency()['other']['ttfb']['count'] == 10
+            assert len(_.snapshot().histograms)            == HOSTS__LIMIT * 4 + 1
+
+    def test_record__per_thread(self):                                        # Test each thread records into its own histograms, added up when read
+        with self.latency as _:
+            _.record('ttfb', 'a.com', 0.001)
+            _.record('ttfb', 'a.com', 0.001)
+            def record():
+                _.record('ttfb', 'a.com', 0.002)
+            thread = threading.Thread(target=record)
+            thread.start()
+            thread.join()
+            assert len(_.shards)                                 == 2
+            assert _.histograms                                  == {}           # (nothing merged in)
+            assert _.shards[threading.get_ident()]['ttfb']['a.com'].count() == 2
+            assert _.percentile('ttfb', 'a.com', 100)            == 0.002       # (the other thread's recording is read too)
+            assert _.percentile('ttfb', 'a.com', 100, min_count=4) is None
+            assert _.percentile('ttfb', 'b.com', 100)            is None
+            assert _.get_latency()['a.com']['ttfb']['count']     == 3
+
+    def test_snapshot_merge_reset(self):                                      # Test a snapshot is unaffected by later recordings
+        with self.latency as _:
+            _.record('ttfb', 'a.com', 0.010)
+            snapshot = _.snapshot()
+            _.record('ttfb', 'a.com', 0.010)
+            assert snapshot.get_latency()['a.com']['ttfb']['count'] == 1
+            _.merge(snapshot)
+            assert _.get_latency()['a.com']['ttfb']['count']        == 3
+            _.reset()
+            assert _.get_latency()                                  == {}
+
+    def test_connect_trace(self):                                             # Test the httpx trace extension times TCP connect (plus TLS)
+        with self.latency as _:
+            timings = {}
+            trace   = _.connect_trace(timings)
+            async def connect():
+                await trace('connection.connect_tcp.started' , {})
+                await trace('connection.connect_tcp.complete', {})
+                await trace('http11.send_request_headers.started', {})
+            asyncio.run(connect())
+            assert 0 <= timings['connect'] < 1
@@ -0,0 +1,73 @@
+import asyncio
+import pytest
+import types
+from unittest                                                       import TestCase
+from osbot_utils.type_safe.Type_Safe                                import Type_Safe
+from osbot_utils.utils.Objects                                      import base_classes
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Limits   import Service__Proxy__Limits, Proxy_Error__Content_Too_Large
+
+
+async def async_chunks(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+class test_Service__Proxy__Limits(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.limits_service = Service__Proxy__Limits()
+
+    def test__init__(self):                                                   # Test auto-initialization
+        with Service__Proxy__Limits() as _:
+            assert type(_)         is Service__Proxy__Limits
+            assert base_classes(_) == [Type_Safe, object]
+
+    def test_errors(self):                                                    # Test the 413 (client) vs 502 (upstream) errors
+        with self.limits_service as _:
+            error = _.error__request_too_large(10)
+            assert isinstance(error, ValueError)
+            assert error.status_code == 413
+            assert str(error)        == 'Payload too large - request body is over the 10 bytes limit'
+
+            error = _.error__response_too_large(10, 'http://a.com/b')
+            assert error.status_code == 502
+            assert str(error)        == 'Bad gateway - response from http://a.com/b is over the 10 bytes limit'
+
+    def test_exceeds(self):                                                   # Test limit comparison
+        with self.limits_service as _:
+            assert _.exceeds(10, 11  ) is True
+            assert _.exceeds(10, 10  ) is False
+            assert _.exceeds(10, None) is False                               # unknown size (checked while reading instead)
+            assert _.exceeds(0 , 11  ) is False                               # 0 disables the limit
+
+    def test_limit_chunks(self):                                              # Test chunks are passed through until the limit is crossed
+        with self.limits_service as _:
+            error  = _.error__request_too_large(10)
+            chunks = _.limit_chunks(iter([b'12345', b'67890']), 10, error)
+            assert type(chunks) is types.GeneratorType
+            assert list(chunks) == [b'12345', b'67890']
+
+            chunks = _.limit_chunks(iter([b'12345', b'67890', b'1', b'never read']), 10, error)
+            assert next(chunks) == b'12345'
+            assert next(chunks) == b'67890'
+            with pytest.raises(Proxy_Error__Content_Too_Large) as raised:
+                next(chunks)
+            assert raised.value is error
+
+    def test_limit_chunks__async(self):                                       # Test async version
+        with self.limits_service as _:
+            async def read(max_size):
+                chunks = _.limit_chunks__async(async_chunks([b'12345', b'67890']), max_size, _.error__response_too_large(max_size, 'http://a.com'))
+                return [chunk async for chunk in chunks]
+
+            assert asyncio.run(read(10)) == [b'12345', b'67890']
+            with pytest.raises(Proxy_Error__Content_Too_Large, match='Bad gateway'):
+                asyncio.run(read(9))
+
+    def test_read_body__async(self):                                          # Test bounded body read
+        with self.limits_service as _:
+            assert asyncio.run(_.read_body__async(async_chunks([b'ab', b'cd']), 4)) == b'abcd'
+            assert asyncio.run(_.read_body__async(async_chunks([]           ), 4)) == b''
+            with pytest.raises(Proxy_Error__Content_Too_Large, match='Payload too large'):
+                asyncio.run(_.read_body__async(async_chunks([b'ab', b'cde']), 4))
@@ -0,0 +1,154 @@
+import re
+import timeit
+from unittest                                                       import TestCase
+from osbot_utils.type_safe.Type_Safe                                import Type_Safe
+from osbot_utils.utils.Objects                                      import base_classes
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Request         import Schema__Proxy__Request
+from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Host      import Safe_Str__Http__Host
+from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Method    import Safe_Str__Http__Method
+from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Path      import Safe_Str__Http__Path
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Cache    import Service__Proxy__Cache
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Metrics  import Service__Proxy__Metrics, METRICS__LATENCY_BOUNDS, METRICS__BUCKET_ENDS, METRICS__HOSTS_LIMIT, METRICS__LABELS_LIMIT
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Stats    import Service__Proxy__Stats
+
+POOLS = {'idle': 2, 'in_use': 1}
+
+
+class test_Service__Proxy__Metrics(TestCase):
+
+    def setUp(self):
+        self.metrics = Service__Proxy__Metrics()
+        self.stats   = Service__Proxy__Stats()
+        self.cache   = Service__Proxy__Cache()
+        self.request = Schema__Proxy__Request(method = Safe_Str__Http__Method("GET"        ),
+                                              path   = Safe_Str__Http__Path  ("/test"      ),
+                                              host   = Safe_Str__Http__Host  ("example.com"))
+
+    def render(self):
+        return self.metrics.render(self.stats, self.cache, POOLS)
+
+    def test__init__(self):                                                   # Test auto-initialization
+        with self.metrics as _:
+            assert base_classes(_) == [Type_Safe, object]
+            assert _.labels        == {}
+
+    def test_bucket_ends(self):                                               # Test each le bound maps to the histogram buckets at or below it
+        assert len(METRICS__BUCKET_ENDS)           == len(METRICS__LATENCY_BOUNDS)
+        assert list(METRICS__BUCKET_ENDS)          == sorted(METRICS__BUCKET_ENDS)
+        assert METRICS__BUCKET_ENDS[0]             >  64                                         # 1ms is past the exact (linear) buckets
+
+    def test_label(self):                                                     # Test label values are escaped (and cached)
+        with self.metrics as _:
+            assert _.label('host', 'a"b\\c\nd') == 'host="a\\"b\\\\c\\nd"'
+            assert list(_.labels)               == [('host', 'a"b\\c\nd')]
+
+    def test_label__limit(self):                                              # Test the cache of label pairs stays bounded (oldest dropped first)
+        with self.metrics as _:
+            for index in range(METRICS__LABELS_LIMIT + 10):
+                _.label('host', f'host-{index}')
+            assert len(_.labels)                == METRICS__LABELS_LIMIT
+            assert ('host', 'host-0')           not in _.labels
+            assert _.label('host', 'host-0')    == 'host="host-0"'
+
+    def test_render__hosts_limit(self):                                       # Test only the busiest hosts get a by_host series (the others are summed into 'other')
+        shard = self.stats.shard()
+        for index in range(METRICS__HOSTS_LIMIT + 5):
+            shard[('by_host', f'host-{index:03}')] = 1
+        shard[('by_host', 'busy.com')] = 100
+        lines = [line for line in self.render().splitlines() if line.startswith('proxy_upstream_responses_by_host_total')]
+        assert len(lines)                                                        == METRICS__HOSTS_LIMIT + 1
+        assert 'proxy_upstream_responses_by_host_total{host="busy.com"} 100'     in lines
+        assert 'proxy_upstream_responses_by_host_total{host="other"} 6'          in lines
+
+    def test_render(self):                                                    # Test counters, gauges and histograms in the OpenMetrics text format
+        self.stats.record_request(self.request, 200)
+        self.stats.record_cache_hit(self.request)
+        self.stats.record_bytes('total_bytes_out', 1234)
+        self.stats.record_in_flight(1)
+        self.stats.record_latency('ttfb', 'example.com', 0.003)
+        self.stats.record_latency('ttfb', 'example.com', 0.200)
+        text  = self.render()
+        lines = text.splitlines()
+        assert text.endswith('# EOF\n')
+        assert 'proxy_upstream_responses_total 1'                                   in lines
+        assert 'proxy_upstream_responses_by_status_total{status_class="2xx"} 1'     in lines
+        assert 'proxy_upstream_responses_by_host_total{host="example.com"} 1'       in lines
+        assert 'proxy_sent_bytes_total 1234'                                        in lines
+        assert '# UNIT proxy_sent_bytes bytes'                                      in lines
+        assert 'proxy_in_flight_requests 1'                                         in lines
+        assert 'proxy_cache_hit_ratio 0.5'                                          in lines
+        assert 'proxy_upstream_connections{state="idle"} 2'                         in lines
+        assert 'proxy_upstream_ttfb_seconds_bucket{host="example.com",le="0.001"} 0' in lines
+        assert 'proxy_upstream_ttfb_seconds_bucket{host="example.com",le="0.005"} 1' in lines
+        assert 'proxy_upstream_ttfb_seconds_bucket{host="example.com",le="0.25"} 2'  in lines
+        assert 'proxy_upstream_ttfb_seconds_bucket{host="example.com",le="+Inf"} 2'  in lines
+        assert 'proxy_upstream_ttfb_seconds_count{host="example.com"} 2'             in lines
+        assert 'proxy_upstream_ttfb_seconds_sum{host="example.com"} 0.203'           in lines
+        for line in lines:                                                    # every sample belongs to the family declared before it
+            if line.startswith('#') is False:
+                assert re.match(r'^[a-z_]+(\{[^}]*\})? \S+$', line)
+
+    def test_render__cached_histograms(self):                                 # Test histograms are only formatted again after new recordings (and forgotten after a reset)
+        self.stats.record_latency('total', 'a.com', 0.01)
+        self.render()
+        samples = self.metrics.rendered[('total', 'a.com')]
+        self.render()
+        assert self.metrics.rendered[('total', 'a.com')] is samples
+        self.stats.record_latency('total', 'a.com', 0.01)
+        assert 'proxy_request_seconds_count{host="a.com"} 2' in self.render().splitlines()
+        self.stats.reset()
+        self.render()
+        assert self.metrics.rendered == {}
+
+    def test_render__cost(self):                                              # Test a scrape is cheap (no Type_Safe objects built, no locks held while formatting)
+        for index in range(20):
+            self.stats.record_request(self.request, 200)
+            self.stats.record_latency('total', f'host-{index}', 0.01)
+        seconds = min(timeit.repeat(self.render, number=10, repeat=3)) / 10
+        assert seconds < 0.01
+
+    def test_render__pools(self):                                             # Test each upstream pool's usage, by pool
+        hosts = {'http://a.com:80': dict(idle=1, active=2, waiting=3, created=4, discarded=5)}
+        lines = self.metrics.render(self.stats, self.cache, POOLS, hosts).splitlines()
+        assert '# TYPE proxy_upstream_pool_created counter'                          in lines
+        assert 'proxy_upstream_pool_idle{pool="http://a.com:80"} 1'                   in lines
+        assert 'proxy_upstream_pool_waiting{pool="http://a.com:80"} 3'                in lines
+        assert 'proxy_upstream_pool_created_total{pool="http://a.com:80"} 4'          in lines
+        assert 'proxy_upstream_pool_discarded_total{pool="http://a.com:80"} 5'        in lines
+        assert 'proxy_upstream_pool_idle{pool="http://a.com:80"} 1' not in self.render().splitlines()
+
+    def test_render__dns(self):                                               # Test the DNS cache's counters and entries
+        dns   = dict(hits=5, misses=2, negative_hits=1, refreshes=1, errors=1, entries=3)
+        lines = self.metrics.render(self.stats, self.cache, POOLS, None, dns).splitlines()
+        assert '# TYPE proxy_dns_hits counter' in lines
+        assert 'proxy_dns_hits_total 5'        in lines
+        assert 'proxy_dns_errors_total 1'      in lines
+        assert 'proxy_dns_entries 3'           in lines
+
+    def test_render__hedges(self):                                            # Test the hedged calls' counters
+        hedges = dict(hedged=3, wins=2, losses=1, exhausted=4)
+        lines  = self.metrics.render(self.stats, self.cache, POOLS, None, None, None, hedges).splitlines()
+        assert '# TYPE proxy_upstream_hedges counter'  in lines
+        assert 'proxy_upstream_hedges_total 3'         in lines
+        assert 'proxy_upstream_hedge_wins_total 2'     in lines
+        assert 'proxy_upstream_hedge_losses_total 1'   in lines
+        assert 'proxy_upstream_hedges_denied_total 4'  in lines
+
+    def test_render__backends(self):                                          # Test each upstream group backend's calls and health, labelled by group and backend
+        groups = {'api': {'a:80': dict(outstanding=2, calls=7, failures=3, ewma_ms=1.5, ejected=True , ejections=1),
+                          'b:80': dict(outstanding=0, calls=5, failures=0, ewma_ms=0.8, ejected=False, ejections=0)}}
+        lines  = self.metrics.render(self.stats, self.cache, POOLS, None, None, None, None, groups).splitlines()
+        assert '# TYPE proxy_upstream_backend_outstanding gauge'                        in lines
+        assert 'proxy_upstream_backend_outstanding{group="api",backend="a:80"} 2'       in lines
+        assert 'proxy_upstream_backend_calls_total{group="api",backend="b:80"} 5'       in lines
+        assert 'proxy_upstream_backend_failures_total{group="api",backend="a:80"} 3'    in lines
+        assert 'proxy_upstream_backend_ejected{group="api",backend="a:80"} 1'           in lines
+        assert 'proxy_upstream_backend_ejected{group="api",backend="b:80"} 0'           in lines
+        assert 'proxy_upstream_backend_ejections_total{group="api",backend="a:80"} 1'   in lines
+
+    def test_render__breakers(self):                                          # Test each host's breaker state, one sample per state
+        breakers = {'a.com': dict(state='open', opened=1, error_rate=1.0)}
+        lines    = self.metrics.render(self.stats, self.cache, POOLS, None, None, breakers).splitlines()
+        assert 'proxy_upstream_breaker_state{host="a.com",state="open"} 1'      in lines
+        assert 'proxy_upstream_breaker_state{host="a.com",state="closed"} 0'    in lines
+        assert 'proxy_upstream_breaker_state{host="a.com",state="half_open"} 0' in lines
@@ -0,0 +1,131 @@
+import threading
+import time
+import pytest
+from unittest                                                       import TestCase
+from urllib3.exceptions                                             import ConnectTimeoutError
+from osbot_utils.type_safe.Type_Safe                                import Type_Safe
+from osbot_utils.utils.Objects                                      import base_classes
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Config          import Schema__Proxy__Config
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Pools    import Service__Proxy__Pools, Pooled__HTTP_Adapter, Pooled__HTTP_Connection_Pool, POOL__STATES
+from mgraph_ai_service_proxy.utils.testing.Local_Upstream__Server   import Local_Upstream__Server
+
+
+class test_Service__Proxy__Pools(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.upstream   = Local_Upstream__Server().start()
+        cls.upstream_2 = Local_Upstream__Server().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.upstream  .stop()
+        cls.upstream_2.stop()
+
+    def setUp(self):
+        self.config = Schema__Proxy__Config()
+        self.pools  = Service__Proxy__Pools(config=self.config)
+
+    def tearDown(self):
+        self.pools.close()
+
+    def get(self, upstream, path='/keep-alive'):
+        response = self.pools.session(self.config).get(str(upstream.url(path)))
+        assert response.status_code == 200
+        return response
+
+    def pool(self, upstream) -> dict:
+        return self.pools.get_pools()[f'http://localhost:{upstream.port}']
+
+    def test__init__(self):                                                   # Test auto-initialization
+        with self.pools as _:
+            assert base_classes(_) == [Type_Safe, object]
+            assert _.sockets       == 0
+            assert _.pools         == []
+            assert _.adapters      == {}
+
+    def test_session(self):                                                   # Test each thread gets its own session, on adapters (i.e. pools) shared by every thread
+        sessions = []
+        def get_session():
+            sessions.append(self.pools.session(self.config))
+        thread = threading.Thread(target=get_session)
+        thread.start()
+        thread.join()
+        session = self.pools.session(self.config)
+        assert session                                  is self.pools.session(self.config)
+        assert session                                  is not sessions[0]
+        assert session.get_adapter('http://a.com')      is sessions[0].get_adapter('https://a.com')
+        assert type(session.get_adapter('http://a.com')) is Pooled__HTTP_Adapter
+        assert self.pools.session(self.config, retries=False).get_adapter('http://a.com').max_retries.total == 0
+
+    def test_host_max_size(self):                                             # Test per-host overrides, by 'host:port' then 'host'
+        self.config.pool_host_max_size['a.com:8080'] = 2
+        self.config.pool_host_max_size['a.com'     ] = 5
+        assert self.pools.host_max_size('a.com', 8080) == 2
+        assert self.pools.host_max_size('a.com', 443 ) == 5
+        assert self.pools.host_max_size('b.com', 443 ) == 100                 # config.pool_max_size
+
+    def test_get_pools(self):                                                 # Test one pool per host, shared by every thread, with its usage
+        self.get(self.upstream)
+        thread = threading.Thread(target=self.get, args=(self.upstream,))
+        thread.start()
+        thread.join()
+        assert list(self.pool(self.upstream))      == list(POOL__STATES)
+        assert self.pool(self.upstream)            == dict(idle=1, active=0, waiting=0, created=1, discarded=0)   # (the second thread reused the connection)
+        assert type(self.pools.pools[0])           is Pooled__HTTP_Connection_Pool
+        assert self.pools.sockets                  == 1
+
+    def test_get_pools__retries(self):                                        # Test requests with and without retries share the host's pool (retries are applied per request)
+        self.get(self.upstream)
+        assert self.pools.session(self.config, retries=False).get(str(self.upstream.url('/keep-alive'))).status_code == 200
+        assert self.pools.adapter(True).poolmanager is self.pools.adapter(False).poolmanager
+        assert self.pools.adapter(True).poolmanager.pools._maxsize == 1024                  # config.pool_max_hosts
+        assert self.pool(self.upstream) == dict(idle=1, active=0, waiting=0, created=1, discarded=0)
+        assert len(self.pools.pools)    == 1
+
+    def test_get_pools__per_host_limit(self):                                 # Test concurrent requests to a host wait for one of its connections (instead of opening, then discarding, more)
+        self.config.pool_host_max_size[f'localhost:{self.upstream.port}'] = 2
+        threads = [threading.Thread(target=self.get, args=(self.upstream, '/keep-alive/100')) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert self.pool(self.upstream) == dict(idle=2, active=0, waiting=0, created=2, discarded=0)
+
+    def test_sweep(self):                                                     # Test connections idle for longer than config.pool_idle_timeout are closed
+        self.get(self.upstream)
+        assert self.pools.sweep()                       == 0                  # (not idle for long enough)
+        assert self.pools.sweep(time.monotonic() + 10)  == 0                  # (once per POOLS__SWEEP_INTERVAL)
+        self.config.pool_idle_timeout = 0
+        assert self.pools.sweep(time.monotonic() + 20)  == 1
+        assert self.pool(self.upstream)                 == dict(idle=0, active=0, waiting=0, created=1, discarded=1)
+        assert self.pools.sockets                       == 0
+        self.get(self.upstream)
+        assert self.pool(self.upstream)['created']      == 2
+
+    def test_get_conn__idle_timeout(self):                                    # Test a connection idle for too long is reopened before being used
+        self.get(self.upstream)
+        self.config.pool_idle_timeout = 0
+        self.pools.last_sweep         = time.monotonic() + 10                 # (no sweep)
+        time.sleep(0.01)
+        self.get(self.upstream)
+        assert self.pool(self.upstream) == dict(idle=1, active=0, waiting=0, created=2, discarded=1)
+
+    def test_open_socket__cap(self):                                          # Test the socket cap closes other hosts' idle connections to make room
+        self.config.pool_max_sockets = 1
+        self.get(self.upstream  )
+        self.get(self.upstream_2)
+        assert self.pools.sockets          == 1
+        assert self.pool(self.upstream  )  == dict(idle=0, active=0, waiting=0, created=1, discarded=1)
+        assert self.pool(self.upstream_2)  == dict(idle=1, active=0, waiting=0, created=1, discarded=0)
+
+    def test_open_socket__timeout(self):                                      # Test a full cap with no idle connections waits for a socket, then gives up
+        self.config.pool_max_sockets = 1
+        self.config.connect_timeout  = 1
+        self.pools.open_socket()
+        threading.Timer(0.1, self.pools.close_socket).start()
+        self.pools.open_socket()                                              # (woken up by the close)
+        assert self.pools.sockets == 1
+        self.config.connect_timeout = 0
+        with pytest.raises(ConnectTimeoutError, match='Upstream socket limit reached'):
+            self.pools.open_socket()
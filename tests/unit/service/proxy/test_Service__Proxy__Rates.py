@@ -0,0 +1,81 @@
+import threading
+from unittest                                                       import TestCase
+from osbot_utils.type_safe.Type_Safe                                import Type_Safe
+from osbot_utils.utils.Objects                                      import base_classes
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Rates    import Service__Proxy__Rates, Service__Proxy__Rates__Ring, RATES__SECONDS
+
+NOW = 1_000_000
+
+
+class test_Service__Proxy__Rates__Ring(TestCase):
+
+    def setUp(self):
+        self.ring = Service__Proxy__Rates__Ring().setup()
+
+    def test_setup(self):                                                     # Test the slots are allocated once, up front
+        with self.ring as _:
+            assert base_classes(_)     == [Type_Safe, object]
+            assert len(_.counts)       == len(_.seconds) == RATES__SECONDS
+            assert _.total(NOW, 60)    == 0
+
+    def test_add_and_total(self):                                             # Test windows only sum the seconds they cover, and slots are reused a round later
+        with self.ring as _:
+            _.add(NOW - 5 , 2)
+            _.add(NOW - 5 , 3)
+            _.add(NOW - 30, 10)
+            _.add(NOW     , 100)                                              # current second: not complete yet
+            assert _.total(NOW, 10)               == 5
+            assert _.total(NOW, 60)               == 15
+            assert _.total(NOW + 1, 10)           == 105
+            _.add(NOW - 5 + RATES__SECONDS, 1)                                # same slot, one round later
+            assert _.total(NOW + RATES__SECONDS, RATES__SECONDS) == 101       # (NOW's 100 and the new 1, the rest expired)
+
+
+class test_Service__Proxy__Rates(TestCase):
+
+    def setUp(self):
+        self.rates = Service__Proxy__Rates()
+
+    def test_rate(self):                                                      # Test per-second rates over different windows
+        with self.rates as _:
+            for second in range(NOW - 60, NOW):
+                _.record('requests', 10, second)
+            _.record('bytes_out', 5000, NOW - 1)
+            assert _.rate('requests' , 10 , NOW) == 10.0
+            assert _.rate('requests' , 300, NOW) == 2.0
+            assert _.rate('bytes_out', 10 , NOW) == 500.0
+            assert _.rate('errors'   , 10 , NOW) == 0.0                       # nothing recorded yet
+
+    def test_error_rate(self):                                                # Test errors and timeouts over all upstream calls
+        with self.rates as _:
+            _.record('requests', 6, NOW - 1 )
+            _.record('errors'  , 1, NOW - 2 )
+            _.record('timeouts', 1, NOW - 20)
+            assert _.error_rate(10, NOW)  == 1 / 7
+            assert _.error_rate(60, NOW)  == 2 / 8
+            assert _.error_rate(10, NOW + 100) == 0.0
+
+    def test__threads(self):                                                  # Test each thread records in its own rings, summed when read
+        with self.rates as _:
+            def record():
+                for index in range(100):
+                    _.record('requests', 1, NOW - 1)
+            threads = [threading.Thread(target=record) for index in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            _.record('requests', 1, NOW - 1)
+            assert _.total('requests', 10, NOW) == 401
+            assert 2 <= len(_.shards)           <= 5                           # (a finished thread's id can be reused)
+
+    def test_get_rates_and_reset(self):                                       # Test the summary for each window, and starting again
+        with self.rates as _:
+            _.record('requests', 100, NOW - 1)
+            rates = _.get_rates(NOW)
+            assert list(rates)                           == ['10s', '60s', '300s']
+            assert rates['10s' ]['requests_per_second']  == 10.0
+            assert rates['300s']['requests_per_second']  == 0.333
+            _.reset()
+            assert _.get_rates(NOW)['10s']['requests_per_second'] == 0.0
+            assert len(_.shards)                         == 0
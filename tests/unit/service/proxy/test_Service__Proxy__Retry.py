@@ -0,0 +1,106 @@
+import threading
+from email.utils                                                    import formatdate
+from time                                                           import time
+from unittest                                                       import TestCase
+from osbot_utils.type_safe.Type_Safe                                import Type_Safe
+from osbot_utils.utils.Objects                                      import base_classes
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Config          import Schema__Proxy__Config
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Pools    import Service__Proxy__Pools
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Budget   import Service__Proxy__Budget
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Retry    import Service__Proxy__Retry, Proxy__Retry, RETRY__BACKOFF_MAX
+from mgraph_ai_service_proxy.utils.testing.Local_Upstream__Handler  import Local_Upstream__Handler
+from mgraph_ai_service_proxy.utils.testing.Local_Upstream__Server   import Local_Upstream__Server
+
+
+class test_Service__Proxy__Retry(TestCase):
+
+    def setUp(self):
+        self.config = Schema__Proxy__Config()
+        self.retry  = Service__Proxy__Retry()
+
+    def test__init__(self):                                                   # Test auto-initialization
+        with self.retry as _:
+            assert base_classes(_)  == [Type_Safe, object]
+            assert type(_.budget)   is Service__Proxy__Budget
+            assert _.retries()      == 0
+
+    def test_retryable(self):                                                 # Test idempotent methods, or requests with an Idempotency-Key
+        with self.retry as _:
+            assert _.retryable('GET'   , {}                         ) is True
+            assert _.retryable('PUT'   , {}                         ) is True
+            assert _.retryable('DELETE', {}                         ) is True
+            assert _.retryable('POST'  , {}                         ) is False
+            assert _.retryable('PATCH' , {'Content-Type': 'a/b'}    ) is False
+            assert _.retryable('POST'  , {'Idempotency-Key': 'a1'}  ) is True
+            assert _.retryable('PATCH' , {'idempotency-key': 'a1'}  ) is True
+
+    def test_deposit(self):                                                   # Test each first attempt adds config.retry_budget tokens
+        with self.retry as _:
+            _.budget.tokens['a.com'] = 0
+            _.deposit(self.config, 'a.com')
+            _.deposit(self.config, 'a.com')
+            assert _.budget.get_budgets() == {'a.com': 0.2}
+
+    def test_retry_after(self):                                               # Test seconds, HTTP-dates and invalid values
+        with self.retry as _:
+            assert _.retry_after(None                       ) is None
+            assert _.retry_after(''                         ) is None
+            assert _.retry_after(' 5 '                      ) == 5.0
+            assert _.retry_after('soon'                     ) is None
+            assert _.retry_after(formatdate(time() - 60, usegmt=True)) == 0.0   # (in the past)
+            assert 8 <= _.retry_after(formatdate(time() + 10, usegmt=True)) <= 10
+
+    def test_backoff(self):                                                   # Test decorrelated jitter: between the base and 3x the previous wait, capped
+        with self.retry as _:
+            self.config.retry_backoff = 0.5
+            assert _.backoff(self.config, 0) == 0.5
+            for _i in range(100):
+                assert 0.5 <= _.backoff(self.config, 2  ) <= 6
+                assert         _.backoff(self.config, 100) <= RETRY__BACKOFF_MAX
+
+    def test_delay(self):                                                     # Test retries stop at config.retry_count, on a long Retry-After and on an empty budget
+        with self.retry as _:
+            self.config.retry_backoff = 0
+            assert _.delay(self.config, 'a.com', 0, 0       ) == 0
+            assert _.delay(self.config, 'a.com', 2, 0, 1.5  ) == 1.5           # (Retry-After instead of the backoff)
+            assert _.delay(self.config, 'a.com', 3, 0       ) is None          # config.retry_count
+            assert _.delay(self.config, 'a.com', 0, 0, 11   ) is None          # over config.retry_after_max
+            _.budget.tokens['a.com'] = 0
+            assert _.delay(self.config, 'a.com', 0, 0       ) is None
+            assert _.budget.exhausted                          == 1
+
+    def test_retries(self):                                                   # Test each thread counts the retries of its own request
+        with self.retry as _:
+            _.start('a.com')
+            _.retried()
+            _.retried()
+            thread = threading.Thread(target=lambda: (_.start('b.com'), _.retried()))
+            thread.start()
+            thread.join()
+            assert _.retries()       == 2
+            assert _.attempts.host   == 'a.com'
+            _.start('a.com')
+            assert _.retries()       == 0
+
+    def test_urllib3_retry(self):                                             # Test the sync engine's Retry, with a budget shared by its copies
+        upstream = Local_Upstream__Server().start()
+        pools    = Service__Proxy__Pools(config=self.config, retry_service=self.retry)
+        try:
+            self.config.retry_backoff = 0
+            retry = self.retry.urllib3_retry(self.config)
+            assert type(retry)                                              is Proxy__Retry
+            assert retry.total                                              == 3
+            assert self.retry.urllib3_retry(self.config, retries=False).total == 0
+            assert type(retry.new()) is Proxy__Retry
+            assert retry.new().retry_service                                is self.retry
+
+            self.retry.budget.tokens[f'localhost:{upstream.port}'] = 2      # (no start(): budget by the pool's host)
+            before   = Local_Upstream__Handler.error_calls
+            response = pools.session(self.config).get(str(upstream.url('/error/503')))
+            assert response.status_code                      == 503         # (upstream's answer, instead of a RetryError)
+            assert Local_Upstream__Handler.error_calls - before == 3          # two retries: then the budget ran out
+            assert self.retry.retries()                      == 2
+            assert self.retry.budget.exhausted               == 1
+        finally:
+            pools.close()
+            upstream.stop()
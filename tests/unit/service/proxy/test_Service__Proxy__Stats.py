@@ -1,13 +1,14 @@
+import asyncio
+import threading
 from unittest                                                            import TestCase
-from osbot_utils.utils.Objects                                          import base_classes, __
+from osbot_utils.utils.Objects                                          import base_classes
 
 from mgraph_ai_service_proxy.schemas.Schema__Proxy__Request import Schema__Proxy__Request
 from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Host import Safe_Str__Http__Host
 from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Method import Safe_Str__Http__Method
 from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Path import Safe_Str__Http__Path
-from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Stats        import Service__Proxy__Stats
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Stats        import Service__Proxy__Stats, SHARD__KEYS_LIMIT
 from osbot_utils.type_safe.Type_Safe                                   import Type_Safe
-from osbot_utils.type_safe.primitives.safe_uint.Safe_UInt              import Safe_UInt
 
 class test_Service__Proxy__Stats(TestCase):
 
@@ -22,15 +23,15 @@ class test_Service__Proxy__Stats(TestCase):
             assert type(_)         is Service__Proxy__Stats
             assert base_classes(_) == [Type_Safe, object]
 
-            # Verify all counters start at zero
-            assert _.obj() == __(total_requests = 0                          ,
-                                total_errors   = 0                            ,
-                                total_timeouts = 0                            )
+            # Verify nothing is held until something is counted
+            assert _.shards             == {}
+            assert _.latency.histograms == {}
 
             # Verify types
-            assert type(_.total_requests) is Safe_UInt
-            assert type(_.total_errors)   is Safe_UInt
-            assert type(_.total_timeouts) is Safe_UInt
+            assert type(_.total_requests)  is int
+            assert type(_.total_errors)    is int
+            assert type(_.total_timeouts)  is int
+            assert type(_.total_oversized) is int
 
     def test_record_request(self):                                           # Test request counting
         with Service__Proxy__Stats() as _:
@@ -49,7 +50,7 @@ class test_Service__Proxy__Stats(TestCase):
                 _.record_request(self.test_request, 200)
 
             assert _.total_requests == 10
-            assert type(_.total_requests) is Safe_UInt                       # Type preserved
+            assert type(_.total_requests) is int
 
     def test_record_error(self):                                             # Test error counting
         with Service__Proxy__Stats() as _:
@@ -73,13 +74,80 @@ class test_Service__Proxy__Stats(TestCase):
 
             assert _.total_timeouts == 6
 
+    def test_record_oversized(self):                                         # Test oversized body counting
+        with Service__Proxy__Stats() as _:
+            assert _.total_oversized == 0
+
+            _.record_oversized(self.test_request)
+            _.record_oversized(None)                                         # request side rejections happen before there is a proxy request
+            assert _.total_oversized == 2
+
+    def test_record_cache_hit(self):                                         # Test cache hit counting
+        with Service__Proxy__Stats() as _:
+            _.record_cache_hit(self.test_request)
+            assert _.total_cache_hits == 1
+            assert _.total_requests   == 0                                   # hits don't go upstream
+
+    def test_record_cache_revalidated(self):                                 # Test 304 revalidation counting
+        with Service__Proxy__Stats() as _:
+            _.record_cache_revalidated(self.test_request)
+            assert _.total_revalidated == 1
+            assert _.total_cache_hits  == 0
+
+    def test_record_cache_stale(self):                                       # Test stale serving counting
+        with Service__Proxy__Stats() as _:
+            _.record_cache_stale(self.test_request)
+            assert _.total_stale_hits == 1
+
+    def test_record_coalesced(self):                                         # Test coalesced request counting
+        with Service__Proxy__Stats() as _:
+            _.record_coalesced(self.test_request)
+            assert _.total_coalesced == 1
+
+    def test_record_bytes_and_in_flight(self):                               # Test byte counters (buffered and streamed bodies) and the in-flight gauge
+        with Service__Proxy__Stats() as _:
+            _.record_bytes('total_bytes_in', 100)
+            assert list(_.count_bytes(iter([b'abc', b'de']), 'total_bytes_out')) == [b'abc', b'de']
+            async def read():
+                async def chunks():
+                    yield b'fgh'
+                return [chunk async for chunk in _.count_bytes__async(chunks(), 'total_bytes_out')]
+            assert asyncio.run(read()) == [b'fgh']
+            assert _.total_bytes_in    == 100
+            assert _.total_bytes_out   == 8
+            assert _.rates.total('bytes_out', 10, _.rates.now() + 1) == 8     # (rates count complete seconds)
+
+            _.record_in_flight(1)
+            thread = threading.Thread(target=_.record_in_flight, args=(-1,))  # finished on another thread
+            _.record_in_flight(1)
+            thread.start()
+            thread.join()
+            assert _.in_flight         == 1
+
     def test_get_stats(self):                                                # Test stats retrieval as dict
         with Service__Proxy__Stats() as _:
             # Initial state
             stats = _.get_stats()
-            assert stats == {'total_requests' : 0                            ,
-                           'total_errors'   : 0                              ,
-                           'total_timeouts' : 0                              }
+            assert stats == {'total_requests'    : 0                             ,
+                             'total_errors'      : 0                             ,
+                             'total_timeouts'    : 0                             ,
+                             'total_oversized'   : 0                             ,
+                             'total_cache_hits'  : 0                             ,
+                             'total_revalidated' : 0                             ,
+                             'total_stale_hits'  : 0                             ,
+                             'total_coalesced'   : 0                             ,
+                             'total_rejected'    : 0                             ,
+                             'total_retries'     : 0                             ,
+                             'total_bytes_in'    : 0                             ,
+                             'total_bytes_out'   : 0                             ,
+                             'in_flight'         : 0                             ,
+                             'by_status'         : {}                            ,
+                             'by_method'         : {}                            ,
+                             'by_host'           : {}                            ,
+                             'latency'           : {}                            ,
+                             'rates'             : _.rates.get_rates()           }
+            assert stats['rates']['60s'] == {'requests_per_second' : 0.0, 'errors_per_second'   : 0.0, 'timeouts_per_second': 0.0,
+                                             'bytes_in_per_second' : 0.0, 'bytes_out_per_second': 0.0, 'error_rate'         : 0.0}
 
             # Record various events
             _.record_request(self.test_request, 200)
@@ -89,9 +157,24 @@ class test_Service__Proxy__Stats(TestCase):
 
             # Verify updated stats
             stats = _.get_stats()
-            assert stats == {'total_requests' : 2                            ,
-                           'total_errors'   : 1                              ,
-                           'total_timeouts' : 1                              }
+            assert list(stats.pop('rates')) == ['10s', '60s', '300s']                 # (values depend on the clock: see test_Service__Proxy__Rates)
+            assert stats == {'total_requests'    : 2                             ,
+                             'total_errors'      : 1                             ,
+                             'total_timeouts'    : 1                             ,
+                             'total_oversized'   : 0                             ,
+                             'total_cache_hits'  : 0                             ,
+                             'total_revalidated' : 0                             ,
+                             'total_stale_hits'  : 0                             ,
+                             'total_coalesced'   : 0                             ,
+                             'total_rejected'    : 0                             ,
+                             'total_retries'     : 0                             ,
+                             'total_bytes_in'    : 0                             ,
+                             'total_bytes_out'   : 0                             ,
+                             'in_flight'         : 0                             ,
+                             'by_status'         : {'2xx': 1, '5xx': 1}          ,
+                             'by_method'         : {'GET': 2}                    ,
+                             'by_host'           : {'example.com': 2}            ,
+                             'latency'           : {}                            }
 
     def test__mixed_operations(self):                                        # Test mixed stat operations
         with Service__Proxy__Stats() as _:
@@ -104,6 +187,71 @@ class test_Service__Proxy__Stats(TestCase):
             _.record_request(self.test_request, 404)                         # Not found
             _.record_request(self.test_request, 500)                         # Server error
 
-            assert _.obj() == __(total_requests = 5                          ,
-                                total_errors   = 1                            ,
-                                total_timeouts = 1                            )
+            stats = _.get_stats()
+            assert list(stats.pop('rates')) == ['10s', '60s', '300s']
+            assert stats         == {'total_requests'    : 5                             ,
+                                     'total_errors'      : 1                             ,
+                                     'total_timeouts'    : 1                             ,
+                                     'total_oversized'   : 0                             ,
+                                     'total_cache_hits'  : 0                             ,
+                                     'total_revalidated' : 0                             ,
+                                     'total_stale_hits'  : 0                             ,
+                                     'total_coalesced'   : 0                             ,
+                                     'total_rejected'    : 0                             ,
+                                     'total_retries'     : 0                             ,
+                                     'total_bytes_in'    : 0                             ,
+                                     'total_bytes_out'   : 0                             ,
+                                     'in_flight'         : 0                             ,
+                                     'by_status'         : {'2xx': 3, '4xx': 1, '5xx': 1},
+                                     'by_method'         : {'GET': 5}                    ,
+                                     'by_host'           : {'example.com': 5}            ,
+                                     'latency'           : {}                            }
+
+    def test_record_request__breakdowns(self):                               # Test requests are counted by status class, method and host
+        with Service__Proxy__Stats() as _:
+            post = Schema__Proxy__Request(method = Safe_Str__Http__Method("POST"       ),
+                                          path   = Safe_Str__Http__Path  ("/test"      ),
+                                          host   = Safe_Str__Http__Host  ("api.example"))
+            _.record_request(self.test_request, 200)
+            _.record_request(post             , 201)
+            _.record_request(post             , 302)
+            _.record_request(post             , 0  )                         # not an HTTP status
+            stats = _.get_stats()
+            assert stats['by_status'] == {'2xx': 2, '3xx': 1, 'other': 1}
+            assert stats['by_method'] == {'GET': 1, 'POST': 3}
+            assert stats['by_host'  ] == {'api.example': 3, 'example.com': 1}
+
+    def test_record_request__keys_limit(self):                               # Test hosts past the shard's limit are counted as 'other', while the totals keep counting
+        with Service__Proxy__Stats() as _:
+            _.shard().update({('by_host', str(index)): 1 for index in range(SHARD__KEYS_LIMIT)})
+            _.record_request(self.test_request, 200)
+            _.record_error  (self.test_request)
+            _.record_coalesced(self.test_request)
+            assert _.get_stats()['by_host']['other'] == 1
+            assert 'example.com' not in _.get_stats()['by_host']
+            assert _.total_requests                  == 1
+            assert _.total_errors                    == 1
+            assert _.total_coalesced                 == 1
+            assert ('t', 'other') not in _.totals()
+
+    def test_reset(self):                                                    # Test counters start again from zero
+        with Service__Proxy__Stats() as _:
+            _.record_request(self.test_request, 200)
+            _.record_error  (self.test_request)
+            _.reset()
+            assert _.total_requests         == 0
+            assert _.get_stats()['by_host'] == {}
+
+    def test__threads(self):                                                 # Test each thread counts in its own shard, summed when read
+        with Service__Proxy__Stats() as _:
+            def record():
+                for index in range(1000):
+                    _.record_request(self.test_request, 200)
+            threads = [threading.Thread(target=record) for index in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert len(_.shards)                  == len({thread.ident for thread in threads})
+            assert _.total_requests               == 8000
+            assert _.get_stats()['by_status']     == {'2xx': 8000}
@@ -0,0 +1,63 @@
+import types
+from unittest                                                       import TestCase
+from osbot_utils.type_safe.Type_Safe                                import Type_Safe
+from osbot_utils.utils.Objects                                      import base_classes
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Config          import Schema__Proxy__Config
+from mgraph_ai_service_proxy.schemas.Schema__Proxy__Request         import Schema__Proxy__Request
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy__Upload   import Service__Proxy__Upload, Service__Proxy__Upload__Stream, BODY_METHODS
+
+
+class test_Service__Proxy__Upload(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.upload_service = Service__Proxy__Upload()
+        cls.config         = Schema__Proxy__Config(stream_uploads=True, upload_buffer_size=1024)
+
+    def test__init__(self):                                                   # Test auto-initialization
+        with Service__Proxy__Upload() as _:
+            assert type(_)         is Service__Proxy__Upload
+            assert base_classes(_) == [Type_Safe, object]
+            assert BODY_METHODS    == ('POST', 'PUT', 'PATCH')
+
+    def test_content_length(self):                                           # Test Content-Length parsing
+        with self.upload_service as _:
+            assert _.content_length({'Content-Length': '42'   }) == 42
+            assert _.content_length({'content-length': '0'    }) == 0
+            assert _.content_length({'Content-Length': 'abc'  }) is None
+            assert _.content_length({'Content-Type'  : 'a/b'  }) is None
+            assert _.content_length({}                         ) is None
+
+    def test_buffer_body(self):                                              # Test which bodies are buffered
+        with self.upload_service as _:
+            assert _.buffer_body(self.config, 'GET' , {'Content-Length': '10'  }) is False   # no body to forward
+            assert _.buffer_body(self.config, 'PUT' , {'Content-Length': '10'  }) is True    # small: buffered so retries can replay it
+            assert _.buffer_body(self.config, 'PUT' , {'Content-Length': '1024'}) is True
+            assert _.buffer_body(self.config, 'POST', {'Content-Length': '10'  }) is False   # never retried: streamed
+            assert _.buffer_body(self.config, 'PATCH',{'Content-Length': '10'  }) is False
+            assert _.buffer_body(self.config, 'POST', {'Content-Length': '10', 'Idempotency-Key': 'a1'}) is True     # marked safe to send again
+            assert _.buffer_body(self.config, 'PUT' , {'Content-Length': '1025'}) is False   # large: streamed
+            assert _.buffer_body(self.config, 'POST', {}                        ) is False   # unknown size: streamed
+
+            no_retries = Schema__Proxy__Config(stream_uploads=True, retry_count=0)
+            assert _.buffer_body(no_retries , 'PUT' , {'Content-Length': '10'  }) is False   # nothing needs a replayable body
+
+            not_streaming = Schema__Proxy__Config()
+            assert _.buffer_body(not_streaming, 'POST', {}                      ) is True    # original behaviour
+            assert _.buffer_body(not_streaming, 'GET' , {}                      ) is False
+
+    def test_upstream_body(self):                                            # Test what is handed to requests
+        def chunks():
+            yield b'abc'
+            yield b'def'
+
+        with self.upload_service as _:
+            assert _.upstream_body(Schema__Proxy__Request(body=b'buffered')) == b'buffered'
+
+            chunked = _.upstream_body(Schema__Proxy__Request(body_stream=chunks()))
+            assert type(chunked) is types.GeneratorType                                       # unknown size: requests uses chunked encoding
+
+            sized = _.upstream_body(Schema__Proxy__Request(body_stream=chunks(), headers={'Content-Length': '6'}))
+            assert type(sized) is Service__Proxy__Upload__Stream
+            assert len(sized)  == 6                                                           # requests sends this as Content-Length
+            assert list(sized) == [b'abc', b'def']
@@ -1,16 +1,22 @@
+import asyncio
+import gzip
 import json
 import time
+import pytest
+import threading
 from unittest                                                               import TestCase
 from osbot_utils.type_safe.primitives.safe_str.identifiers.Random_Guid      import Random_Guid
 from osbot_utils.type_safe.primitives.safe_str.web.Safe_Str__IP_Address     import Safe_Str__IP_Address
 from osbot_utils.type_safe.primitives.safe_uint.Safe_UInt                   import Safe_UInt
 from osbot_utils.utils.Env                                                  import in_github_action
+from osbot_utils.utils.Files                                                import temp_folder, folder_delete_all
 from mgraph_ai_service_proxy.schemas.Schema__Proxy__Request                 import Schema__Proxy__Request
 from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Header_Name       import Safe_Str__Http__Header_Name
 from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Host              import Safe_Str__Http__Host
 from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Method            import Safe_Str__Http__Method
 from mgraph_ai_service_proxy.schemas.http.Safe_Str__Http__Path              import Safe_Str__Http__Path
-from mgraph_ai_service_proxy.service.proxy.Service__Proxy                   import Service__Proxy
+from mgraph_ai_service_proxy.service.proxy.Service__Proxy                   import Service__Proxy, refresh_tasks
+from mgraph_ai_service_proxy.utils.testing.Local_Upstream__Handler          import Local_Upstream__Handler
 from mgraph_ai_service_proxy.utils.testing.Local_Upstream__Server           import Local_Upstream__Server
 
 
@@ -155,8 +161,8 @@ class test_Service__Proxy__local_upstream_server(TestCase):
         response = self.proxy_service.execute_request(request)
 
         assert response.status_code == 204                                            # No Content
-        assert Safe_Str__Http__Header_Name('X-Deleted-Resource')     in response.headers
-        assert                             'X-Deleted-Resource'  not in response.headers            # BUG: this should be equal (issue is OSBot-Utils type safe conversion)
+        assert                             'X-Deleted-Resource'      in response.headers            # plain str names on the hot path ...
+        assert Safe_Str__Http__Header_Name('X-Deleted-Resource')     in response.schema().headers   # ... and the safe type once converted
         assert response.headers['X-Deleted-Resource'] == 'resource-123'
 
     def test_proxy_404_response(self):                                                # Test 404 error handling
@@ -224,6 +230,25 @@ class test_Service__Proxy__local_upstream_server(TestCase):
         content = json.loads(response.content.decode())
         assert len(content['data']) == 1024 * 1024                                    # 1MB of data
 
+    def test_proxy_large_response__stream(self):                                      # Test large response is streamed in fixed size chunks
+        request = Schema__Proxy__Request(method       = Safe_Str__Http__Method("GET")                          ,
+                                         path         = Safe_Str__Http__Path("/large")                         ,
+                                         host         = Safe_Str__Http__Host(f"localhost:{self.upstream.port}"),
+                                         client_ip    = Safe_Str__IP_Address("192.168.1.1")                    ,
+                                         use_https    = False                                                  ,
+                                         request_id   = Random_Guid()                                          )
+
+        response = self.proxy_service.execute_request__stream(request)
+
+        assert response.status_code == 200
+
+        chunks = list(response.content)
+        assert len(chunks) > 1                                                          # body arrived in several pieces
+        assert max(len(chunk) for chunk in chunks) <= self.proxy_service.config.stream_chunk_size
+
+        content = json.loads(b''.join(chunks).decode())
+        assert len(content['data']) == 1024 * 1024
+
     def test_proxy_redirect_no_follow(self):                                          # Test redirect without following
         request = Schema__Proxy__Request(method       = Safe_Str__Http__Method("GET")              ,
                                         path         = Safe_Str__Http__Path("/redirect")          ,
@@ -237,6 +262,362 @@ class test_Service__Proxy__local_upstream_server(TestCase):
         assert response.status_code         == 302                                    # Redirect not followed
         assert response.headers['Location'] == '/echo'
 
+    def test_proxy_get_echo__async(self):                                             # Test GET request via the asyncio engine
+        request = Schema__Proxy__Request(method       = Safe_Str__Http__Method("GET")                          ,
+                                         path         = Safe_Str__Http__Path("/echo")                          ,
+                                         host         = Safe_Str__Http__Host(f"localhost:{self.upstream.port}"),
+                                         client_ip    = Safe_Str__IP_Address("192.168.1.100")                  ,
+                                         use_https    = False                                                  ,
+                                         request_id   = Random_Guid()                                          )
+
+        async def execute():
+            try:
+                return await self.proxy_service.execute_request__async(request)
+            finally:
+                await self.proxy_service.close_async_client()
+
+        response = asyncio.run(execute())
+
+        assert response.status_code              == 200
+        assert response.target_url               == f"http://localhost:{self.upstream.port}/echo"
+        assert response.headers['X-Test-Header'] == 'test-value'                           # upstream header casing preserved
+        assert json.loads(response.content)      == {'client': '127.0.0.1', 'method': 'GET', 'path': '/echo', 'query': ''}
+
+    def test_proxy_post_with_body__async(self):                                       # Test POST body via the asyncio engine
+        request = Schema__Proxy__Request(method       = Safe_Str__Http__Method("POST")                         ,
+                                         path         = Safe_Str__Http__Path("/echo/post")                     ,
+                                         host         = Safe_Str__Http__Host(f"localhost:{self.upstream.port}"),
+                                         headers      = {"Content-Type": "application/json"}                   ,
+                                         body         = b'{"key": "value"}'                                    ,
+                                         use_https    = False                                                  )
+
+        async def execute():
+            try:
+                return await self.proxy_service.execute_request__async(request)
+            finally:
+                await self.proxy_service.close_async_client()
+
+        response = asyncio.run(execute())
+        assert response.status_code == 201
+        assert json.loads(response.content) == {'body': '{"key": "value"}', 'content_type': 'application/json', 'length': 16, 'method': 'POST'}
+
+    def test_proxy_concurrent__async(self):                                           # Test many in-flight requests share one event loop (and one client)
+        requests_count = 20
+        request = Schema__Proxy__Request(method       = Safe_Str__Http__Method("GET")                          ,
+                                         path         = Safe_Str__Http__Path("/delay/200")                     ,
+                                         host         = Safe_Str__Http__Host(f"localhost:{self.upstream.port}"),
+                                         use_https    = False                                                  )
+
+        async def execute():
+            try:
+                clients   = set()
+                responses = await asyncio.gather(*[self.proxy_service.execute_request__async(request) for _ in range(requests_count)])
+                clients.add(id(self.proxy_service.get_async_client()))
+                return responses, clients
+            finally:
+                await self.proxy_service.close_async_client()
+
+        start_time         = time.time()
+        responses, clients = asyncio.run(execute())
+        duration           = time.time() - start_time
+
+        assert len(clients)                                      == 1
+        assert [response.status_code for response in responses] == [200] * requests_count
+        assert duration                                          < 0.2 * requests_count / 4             # requests overlapped (sequential would take 4s)
+
+    def test_proxy_large_response__async_stream(self):                                # Test streaming via the asyncio engine
+        request = Schema__Proxy__Request(method       = Safe_Str__Http__Method("GET")                          ,
+                                         path         = Safe_Str__Http__Path("/large")                         ,
+                                         host         = Safe_Str__Http__Host(f"localhost:{self.upstream.port}"),
+                                         use_https    = False                                                  )
+
+        async def execute():
+            try:
+                response = await self.proxy_service.execute_request__async_stream(request)
+                chunks   = [chunk async for chunk in response.content]
+                return response, chunks
+            finally:
+                await self.proxy_service.close_async_client()
+
+        response, chunks = asyncio.run(execute())
+        assert response.status_code == 200
+        assert len(chunks)          >  1
+        assert len(json.loads(b''.join(chunks))['data']) == 1024 * 1024
+
+    def test_proxy_connection_error__async(self):                                     # Test connection errors are mapped like in the sync engine
+        request = Schema__Proxy__Request(method       = Safe_Str__Http__Method("GET")      ,
+                                         path         = Safe_Str__Http__Path("/echo")      ,
+                                         host         = Safe_Str__Http__Host("localhost:1"),
+                                         use_https    = False                              )
+
+        async def execute():
+            try:
+                return await self.proxy_service.execute_request__async(request)
+            finally:
+                await self.proxy_service.close_async_client()
+
+        errors_before = self.proxy_service.stats_service.total_errors
+        with pytest.raises(ValueError, match="Bad gateway - cannot connect to http://localhost:1/echo"):
+            asyncio.run(execute())
+        assert self.proxy_service.stats_service.total_errors == errors_before + 1
+
+    def test_proxy_gzip(self):                                                        # Test compressed upstream bodies are decoded by default (and the encoding headers dropped)
+        request = Schema__Proxy__Request(method       = Safe_Str__Http__Method("GET")                          ,
+                                         path         = Safe_Str__Http__Path("/gzip")                          ,
+                                         host         = Safe_Str__Http__Host(f"localhost:{self.upstream.port}"),
+                                         use_https    = False                                                  )
+
+        response = self.proxy_service.execute_request(request)
+        assert json.loads(response.content)['gzipped'] is True
+        assert 'Content-Encoding' not in response.headers
+        assert 'Content-Length'   not in response.headers
+
+    def test_proxy_gzip__passthrough(self):                                           # Test decode_content=False forwards the compressed bytes untouched (both engines, buffered and streamed)
+        proxy_service = Service__Proxy().setup()
+        proxy_service.config.decode_content = False
+        request = Schema__Proxy__Request(method       = Safe_Str__Http__Method("GET")                          ,
+                                         path         = Safe_Str__Http__Path("/gzip")                          ,
+                                         host         = Safe_Str__Http__Host(f"localhost:{self.upstream.port}"),
+                                         use_https    = False                                                  )
+
+        def assert_passthrough(headers, content):
+            assert headers['Content-Encoding']   == 'gzip'
+            assert headers['Content-Length']     == str(len(content))
+            assert content[:2]                   == b'\x1f\x8b'                                # gzip magic bytes
+            assert json.loads(gzip.decompress(content))['gzipped'] is True
+
+        response = proxy_service.execute_request(request)
+        assert_passthrough(response.headers, response.content)
+
+        response = proxy_service.execute_request__stream(request)
+        assert_passthrough(response.headers, b''.join(response.content))
+
+        async def execute():
+            try:
+                buffered = await proxy_service.execute_request__async(request)
+                streamed = await proxy_service.execute_request__async_stream(request)
+                return buffered, streamed, b''.join([chunk async for chunk in streamed.content])
+            finally:
+                await proxy_service.close_async_client()
+
+        buffered, streamed, streamed_content = asyncio.run(execute())
+        assert_passthrough(buffered.headers, buffered.content)
+        assert_passthrough(streamed.headers, streamed_content)
+
+    def test_proxy_gzip__passthrough__cache(self):                                    # Test bodies the cache may keep are still decoded (a stored encoding can't suit every client)
+        proxy_service = Service__Proxy().setup()
+        proxy_service.config.decode_content  = False
+        proxy_service.config.cache_responses = True
+        request = Schema__Proxy__Request(method       = Safe_Str__Http__Method("GET")                          ,
+                                         path         = Safe_Str__Http__Path("/gzip")                          ,
+                                         host         = Safe_Str__Http__Host(f"localhost:{self.upstream.port}"),
+                                         use_https    = False                                                  )
+        assert proxy_service.decode_content(request) is True
+        response = proxy_service.execute_request(request)
+        assert json.loads(response.content)['gzipped'] is True
+        assert 'Content-Encoding' not in response.headers
+
+        request.method = Safe_Str__Http__Method("POST")                                   # (never cached)
+        assert proxy_service.decode_content(request) is False
+
+    def test_proxy_gzip__passthrough__accept_encoding(self):                          # Test upstream is only asked for encodings the client accepts
+        proxy_service = Service__Proxy().setup()
+        proxy_service.config.decode_content = False
+        request = Schema__Proxy__Request(method       = Safe_Str__Http__Method("GET")                          ,
+                                         path         = Safe_Str__Http__Path("/echo/headers")                  ,
+                                         host         = Safe_Str__Http__Host(f"localhost:{self.upstream.port}"),
+                                         use_https    = False                                                  )
+
+        assert json.loads(proxy_service.execute_request(request).content)['headers_received']['Accept-Encoding'] == 'identity'      # not requests' default 'gzip, deflate'
+
+        request.headers = {'accept-encoding': 'br'}
+        assert json.loads(proxy_service.execute_request(request).content)['headers_received']['accept-encoding'] == 'br'
+
+    def test_proxy_cache(self):                                                       # Test cacheable responses are served without going upstream (both engines, buffered and streamed)
+        proxy_service = Service__Proxy().setup()
+        proxy_service.config.cache_responses = True
+
+        def cached_request(query, headers=None):
+            return Schema__Proxy__Request(method       = Safe_Str__Http__Method("GET")                          ,
+                                          path         = Safe_Str__Http__Path("/cached")                        ,
+                                          host         = Safe_Str__Http__Host(f"localhost:{self.upstream.port}"),
+                                          headers      = headers or {}                                          ,
+                                          query_string = query                                                  ,
+                                          use_https    = False                                                  )
+
+        request  = cached_request('cache-control=max-age%3D60')
+        first    = proxy_service.execute_request(request)
+        second   = proxy_service.execute_request(request)
+        assert second.content            == first.content                                           # same upstream call
+        assert second.headers['Age']     == '0'
+        assert proxy_service.stats_service.total_cache_hits == 1
+        assert proxy_service.stats_service.total_requests   == 1
+
+        assert b''.join(proxy_service.execute_request__stream(request).content) == first.content
+
+        async def execute():
+            try:
+                buffered = await proxy_service.execute_request__async(request)
+                streamed = await proxy_service.execute_request__async_stream(request)
+                return buffered.content, b''.join([chunk async for chunk in streamed.content])
+            finally:
+                await proxy_service.close_async_client()
+        assert asyncio.run(execute()) == (first.content, first.content)
+        assert proxy_service.stats_service.total_cache_hits == 4
+
+        no_store = cached_request('cache-control=no-store')                                       # not cacheable: always upstream
+        assert proxy_service.execute_request(no_store).content != proxy_service.execute_request(no_store).content
+
+        reload = cached_request('cache-control=max-age%3D60', {'Cache-Control': 'no-cache'})       # client asked for a reload
+        assert proxy_service.execute_request(reload).content != first.content
+
+    def test_proxy_cache__stream_and_vary(self):                                      # Test streamed responses are cached, per value of the Vary headers
+        proxy_service = Service__Proxy().setup()
+        proxy_service.config.cache_responses = True
+
+        def cached_request(language):
+            return Schema__Proxy__Request(method       = Safe_Str__Http__Method("GET")                          ,
+                                          path         = Safe_Str__Http__Path("/cached")                        ,
+                                          host         = Safe_Str__Http__Host(f"localhost:{self.upstream.port}"),
+                                          headers      = {'Accept-Language': language}                          ,
+                                          query_string = 'cache-control=max-age%3D60&vary=Accept-Language'     ,
+                                          use_https    = False                                                  )
+
+        english = b''.join(proxy_service.execute_request__stream(cached_request('en')).content)
+        french  = b''.join(proxy_service.execute_request__stream(cached_request('fr')).content)
+        assert json.loads(english)['accept-language'] == 'en'
+        assert json.loads(french )['accept-language'] == 'fr'
+        assert proxy_service.execute_request(cached_request('en')).content == english
+        assert proxy_service.execute_request(cached_request('fr')).content == french
+        assert proxy_service.stats_service.total_cache_hits == 2
+
+    def test_proxy_cache__disk(self):                                                 # Test bodies over cache_entry_limit are served from the disk tier (buffered, streamed and after a restart)
+        path          = temp_folder()
+        proxy_service = Service__Proxy().setup()
+        proxy_service.config.cache_responses   = True
+        proxy_service.config.cache_entry_limit = Safe_UInt(10)
+        proxy_service.config.cache_disk        = True
+        proxy_service.config.cache_disk_path   = path
+        request = Schema__Proxy__Request(method       = Safe_Str__Http__Method("GET")                          ,
+                                         path         = Safe_Str__Http__Path("/cached")                        ,
+                                         host         = Safe_Str__Http__Host(f"localhost:{self.upstream.port}"),
+                                         query_string = 'cache-control=max-age%3D60'                           ,
+                                         use_https    = False                                                  )
+        try:
+            first = b''.join(proxy_service.execute_request__stream(request).content)
+            assert proxy_service.execute_request(request).content                        == first
+            assert b''.join(proxy_service.execute_request__stream(request).content)      == first
+            assert proxy_service.stats_service.total_cache_hits == 2
+            assert len(proxy_service.cache_service.disk.records) == 1
+            proxy_service.cache_service.flush_disk()                                  # (what its flusher thread does every DISK__FLUSH_INTERVAL)
+
+            restarted = Service__Proxy().setup()
+            restarted.config = proxy_service.config
+            assert restarted.execute_request(request).content == first
+            assert restarted.stats_service.total_cache_hits   == 1
+            assert restarted.stats_service.total_requests     == 0
+        finally:
+            folder_delete_all(path)
+
+    def test_proxy_cache__revalidation(self):                                        # Test stale entries are revalidated with their ETag (304: body not sent again), and client validators get a 304
+        proxy_service = Service__Proxy().setup()
+        proxy_service.config.cache_responses = True
+
+        def cached_request(headers=None):
+            return Schema__Proxy__Request(method       = Safe_Str__Http__Method("GET")                          ,
+                                          path         = Safe_Str__Http__Path("/cached")                        ,
+                                          host         = Safe_Str__Http__Host(f"localhost:{self.upstream.port}"),
+                                          headers      = headers or {}                                          ,
+                                          query_string = 'cache-control=no-cache&etag=%22v1%22'                 ,
+                                          use_https    = False                                                  )
+
+        calls  = Local_Upstream__Handler.cached_calls
+        first  = proxy_service.execute_request(cached_request())
+        second = proxy_service.execute_request(cached_request())                                  # no-cache: revalidated on every use
+        assert Local_Upstream__Handler.cached_calls                == calls + 2
+        assert second.status_code                                  == 200
+        assert second.content                                      == first.content                # upstream sent a 304, body came from the cache
+        assert proxy_service.stats_service.total_revalidated       == 1
+        assert b''.join(proxy_service.execute_request__stream(cached_request()).content) == first.content
+
+        not_modified = proxy_service.execute_request(cached_request({'If-None-Match': '"v1"'}))    # client already has it
+        assert not_modified.status_code == 304
+        assert not_modified.content     == b''
+        assert sorted(map(str, not_modified.headers)) == ['Age', 'Cache-Control', 'Date', 'Etag']
+
+        async def execute():
+            try:
+                buffered = await proxy_service.execute_request__async(cached_request())
+                streamed = await proxy_service.execute_request__async_stream(cached_request({'If-None-Match': 'W/"v1"'}))
+                return buffered.content, streamed.status_code, b''.join([chunk async for chunk in streamed.content])
+            finally:
+                await proxy_service.close_async_client()
+        assert asyncio.run(execute()) == (first.content, 304, b'')
+        assert proxy_service.stats_service.total_revalidated == 5
+        assert proxy_service.stats_service.total_cache_hits  == 0
+
+    def test_proxy_cache__stale_while_revalidate(self):                             # Test stale entries are served at once while they are refreshed in the background (both engines)
+        proxy_service = Service__Proxy().setup()
+        proxy_service.config.cache_responses = True
+        request = Schema__Proxy__Request(method       = Safe_Str__Http__Method("GET")                                ,
+                                         path         = Safe_Str__Http__Path("/cached")                              ,
+                                         host         = Safe_Str__Http__Host(f"localhost:{self.upstream.port}")      ,
+                                         query_string = 'cache-control=max-age%3D60%2C+stale-while-revalidate%3D600&age=61',     # arrives already stale
+                                         use_https    = False                                                        )
+
+        def wait_for_refresh():
+            for _ in range(100):
+                if not proxy_service.cache_service.refreshing:
+                    return
+                time.sleep(0.01)
+
+        first  = json.loads(proxy_service.execute_request(request).content)['call']
+        second = json.loads(proxy_service.execute_request(request).content)['call']             # stale copy, refresh started
+        wait_for_refresh()
+        third  = json.loads(proxy_service.execute_request(request).content)['call']             # the refreshed copy
+        wait_for_refresh()
+        assert second == first
+        assert third  == first + 1
+        assert proxy_service.stats_service.total_stale_hits == 2
+
+        async def execute():
+            try:
+                response = await proxy_service.execute_request__async(request)
+                await asyncio.gather(*refresh_tasks)
+                return json.loads(response.content)['call']
+            finally:
+                await proxy_service.close_async_client()
+        assert asyncio.run(execute()) == first + 2
+        assert proxy_service.stats_service.total_stale_hits == 3
+        assert Local_Upstream__Handler.cached_calls         >= first + 3
+
+    def test_proxy_coalesce(self):                                                   # Test identical GETs in flight together share one upstream call (both engines)
+        proxy_service = Service__Proxy().setup()
+        proxy_service.config.coalesce_requests = True
+        request = Schema__Proxy__Request(method       = Safe_Str__Http__Method("GET")                          ,
+                                         path         = Safe_Str__Http__Path("/cached")                        ,
+                                         host         = Safe_Str__Http__Host(f"localhost:{self.upstream.port}"),
+                                         query_string = 'cache-control=no-store&delay=0.3'                     ,   # not cacheable: only coalescing saves upstream calls
+                                         use_https    = False                                                  )
+        calls   = []
+        threads = [threading.Thread(target=lambda: calls.append(json.loads(proxy_service.execute_request(request).content)['call'])) for index in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(set(calls))                              == 1
+        assert proxy_service.stats_service.total_coalesced  == 4
+        assert proxy_service.stats_service.total_requests   == 1
+
+        async def execute():
+            try:
+                responses = await asyncio.gather(*[proxy_service.execute_request__async(request) for index in range(5)])
+                return [json.loads(response.content)['call'] for response in responses]
+            finally:
+                await proxy_service.close_async_client()
+        assert asyncio.run(execute())                       == [calls[0] + 1] * 5
+        assert proxy_service.stats_service.total_coalesced  == 8
+
     def test_proxy_stats_tracking(self):                                              # Test statistics tracking
         initial_requests = self.proxy_service.stats_service.total_requests
 